@@ -0,0 +1,153 @@
+"""
+Benchmark of the Alert Engine
+
+Evaluates --rules threshold and rate-of-change rules (random thresholds on
+the PM2.5, temperature, humidity and wind metrics) on a simulated burn
+(see bench_rollups.py) and reports:
+- time of AlertEngine.evaluate() per packet (p50/p99/p99.9/max) against
+  the per-packet budget, and how many packets ran into the budget (no rule
+  starts after the deadline; the max also holds garbage collection and
+  the scheduler, which no budget inside evaluate() can bound)
+- that a tight budget only defers evaluations: after drain(), the same
+  alerts fire as with no budget at all
+- the previous approach for comparison: keep each node's recent values
+  and rescan the rule's window on every packet
+
+Command: python scripts/bench_alerts.py [--rules 300] [--nodes 20] [--hours 3] [--budget-us 1000]
+from snode directory
+"""
+
+import argparse
+import random
+import time
+from collections import defaultdict, deque
+
+from alerts import AlertEngine, ThresholdRule, RateRule
+from bench_rollups import burn_packets
+
+METRICS = ('pm25Standard', 'pm25Environmental', 'pm10Standard', 'temperature', 'relativeHumidity', 'windSpeed')
+# Ranges of 'above' thresholds (the upper tail of the simulated values);
+# 'below' thresholds come from the lower tail
+ABOVE = {'pm25Standard': (40, 120), 'pm25Environmental': (35, 110), 'pm10Standard': (30, 90),
+         'temperature': (45, 60), 'relativeHumidity': (60, 80), 'windSpeed': (8, 12)}
+BELOW = {'pm25Standard': (0, 5), 'pm25Environmental': (0, 5), 'pm10Standard': (0, 5),
+         'temperature': (15, 20), 'relativeHumidity': (10, 20), 'windSpeed': (0, 1)}
+
+
+def make_rules(n_rules, seed=0):
+    rng = random.Random(seed)
+    rules = []
+    for i in range(n_rules):
+        metric = METRICS[i % len(METRICS)]
+        above = rng.random() < 0.8
+        if i % 2:
+            rules.append(ThresholdRule(f'rule-{i}', metric, rng.uniform(*(ABOVE if above else BELOW)[metric]), above,
+                                       rng.choice((0, 60, 300, 600))))
+        else:
+            rules.append(RateRule(f'rule-{i}', metric, rng.uniform(2, 20), above, rng.choice((120, 300, 600))))
+    return rules
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_engine(arrivals, rules, budget_us):
+    engine = AlertEngine(rules, budget_us)
+    timings = []
+    fired = []
+    for now, packet in arrivals:
+        from_node = hex(packet['from'])
+        begin = time.perf_counter()
+        fired.extend(engine.evaluate(from_node, packet['decoded']['telemetry'], packet, now))
+        timings.append(time.perf_counter() - begin)
+    fired.extend(engine.drain())
+    return timings, fired, engine.stats()
+
+
+################################################
+# Previous Implementation
+################################################
+
+def run_rescan(arrivals, rules):
+    """
+    Every rule re-reads the node's values in its window on every packet.
+    """
+    history = defaultdict(deque)  # (node, metric) -> (time, value)
+    longest = max(max(getattr(rule, 'window', 0), getattr(rule, 'duration', 0)) for rule in rules)
+    by_metric = defaultdict(list)
+    for rule in rules:
+        by_metric[rule.metric].append(rule)
+    timings = []
+    for now, packet in arrivals:
+        from_node = hex(packet['from'])
+        telemetry = packet['decoded']['telemetry']
+        measured = telemetry['time']
+        begin = time.perf_counter()
+        for section in telemetry.values():
+            if not isinstance(section, dict):
+                continue
+            for metric, value in section.items():
+                if metric not in by_metric:
+                    continue
+                values = history[(from_node, metric)]
+                values.append((measured, value))
+                while measured - values[0][0] > longest:
+                    values.popleft()
+                for rule in by_metric[metric]:
+                    if isinstance(rule, ThresholdRule):
+                        window = [v for t, v in values if measured - t <= rule.duration]
+                        all(v > rule.threshold if rule.above else v < rule.threshold for v in window)
+                    else:
+                        window = [(t, v) for t, v in values if measured - t <= rule.window]
+                        n = len(window)
+                        if n >= 3:
+                            mean_t = sum(t for t, _ in window) / n
+                            mean_v = sum(v for _, v in window) / n
+                            denominator = sum((t - mean_t) ** 2 for t, _ in window)
+                            if denominator:
+                                sum((t - mean_t) * (v - mean_v) for t, v in window) / denominator
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def summarize(timings):
+    return {'p50_us': percentile(timings, 0.5) * 1e6, 'p99_us': percentile(timings, 0.99) * 1e6,
+            'p999_us': percentile(timings, 0.999) * 1e6, 'max_us': max(timings) * 1e6}
+
+
+def timing_text(result):
+    return (f"p50 {result['p50_us']:.0f} us, p99 {result['p99_us']:.0f} us, p99.9 {result['p999_us']:.0f} us, "
+            f"max {result['max_us']:.0f} us")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark alert rule evaluation on a simulated burn.")
+    parser.add_argument("--rules", type=int, default=300, help="rules, spread over the metrics")
+    parser.add_argument("--nodes", type=int, default=20, help="sensor nodes")
+    parser.add_argument("--hours", type=float, default=3, help="length of the burn")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between telemetry of a node")
+    parser.add_argument("--budget-us", type=float, default=1000, help="per-packet budget")
+    parser.add_argument("--tight-budget-us", type=float, default=300,
+                        help="budget for the deferral check (below the peaks, above the average packet)")
+    args = parser.parse_args()
+
+    arrivals = burn_packets(args.nodes, args.hours, args.interval, 0.05)
+    print(f"{len(arrivals)} packets, {args.rules} rules")
+
+    timings, fired, stats = run_engine(arrivals, make_rules(args.rules), args.budget_us)
+    print(f"AlertEngine, budget {args.budget_us:g} us: {timing_text(summarize(timings))}")
+    print(f"  {stats['over_budget_packets']} packets over budget, {stats['evaluations']} evaluations, "
+          f"{len(fired)} alerts")
+
+    unlimited = run_engine(arrivals, make_rules(args.rules), float('inf'))[1]
+    timings, tight, stats = run_engine(arrivals, make_rules(args.rules), args.tight_budget_us)
+    key = lambda alert: (alert['fromNode'], alert['rule'], alert['datetime'])  # noqa: E731
+    same = sorted(map(key, unlimited)) == sorted(map(key, tight))
+    print(f"AlertEngine, budget {args.tight_budget_us:g} us: {timing_text(summarize(timings))}")
+    print(f"  {stats['over_budget_packets']} packets over budget, {stats['deferred']} values deferred, "
+          f"{stats['deferred_dropped']} dropped; alerts {'identical to' if same else 'DIFFER from'} "
+          f"no budget ({len(tight)} vs {len(unlimited)})")
+
+    print(f"Previous (rescan window): {timing_text(summarize(run_rescan(arrivals, make_rules(args.rules))))}")
@@ -0,0 +1,137 @@
+"""
+Benchmark of the Shard Compaction
+
+Writes a season of synthetic hourly csv shards in the logger's layout
+(data-<dt>/<node>/<telemetry>_<YYYY-MM-DD_HH-MM-SS>.csv, rows from the
+telemetry encoders) and reports:
+- how long loading every shard of each telemetry type takes the way
+  analyses did it (one pandas.read_csv per file, then concat)
+- how long compact_shards.py takes, first run and an unchanged re-run
+- how long loading the compacted files takes
+- bytes on disk (and so to upload) of the shards against the compacted files
+
+Command: python scripts/bench_compaction.py [--nodes 3] [--days 30] [--rows-per-hour 60]
+from snode directory
+"""
+
+import argparse
+import csv
+import glob
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from compact_shards import compact, load_compacted, PARQUET, FORMATS
+from telemetry_schema import SchemaRegistry
+
+
+def write_shards(data_dir, n_nodes, n_days, rows_per_hour, seed=0):
+    """
+    Writes the hourly shards of n_nodes logger nodes over n_days days.
+
+    Returns:
+    - (number of shards, total bytes)
+    """
+    rng = random.Random(seed)
+    registry = SchemaRegistry()
+    start = datetime(2024, 12, 1)
+    n_shards = 0
+    for node in range(n_nodes):
+        node_dir = os.path.join(data_dir, f'{0xa000 + node:x}')
+        os.makedirs(node_dir)
+        senders = [f'0x{rng.getrandbits(32):08x}' for _ in range(5)]
+        for hour in range(n_days * 24):
+            hour_start = start + timedelta(hours=hour)
+            name_dt = hour_start.strftime("%Y-%m-%d_%H-%M-%S")
+            for key, encoder in registry.encoders.items():
+                with open(os.path.join(node_dir, f'{key}_{name_dt}.csv'), 'w', newline='') as file:
+                    writer = csv.writer(file)
+                    writer.writerow(encoder.headers)
+                    for i in range(rows_per_hour):
+                        timestamp = str(hour_start + timedelta(seconds=i * 3600 / rows_per_hour + rng.random()))
+                        metrics = {field: round(rng.uniform(0, 100), 2) for field in encoder.fields}
+                        packet = {'rxSnr': round(rng.uniform(-20, 10), 2), 'rxRssi': rng.randrange(-120, -30),
+                                  'rxTime': int(hour_start.timestamp()) + i, 'hopStart': 3, 'hopLimit': rng.randrange(4)}
+                        writer.writerow(encoder.row(timestamp, rng.choice(senders), metrics, packet))
+                n_shards += 1
+    return n_shards, directory_bytes(data_dir)
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+################################################
+# Previous Implementation
+################################################
+
+def load_shards(data_dir, telemetry_key):
+    """
+    One read_csv per hourly shard, as the analysis notebooks did.
+    """
+    paths = sorted(glob.glob(os.path.join(data_dir, '*', f'{telemetry_key}_*.csv')))
+    return pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(n_nodes, n_days, rows_per_hour, fmt):
+    work_dir = tempfile.mkdtemp(prefix='bench_compaction_')
+    try:
+        data_dir = os.path.join(work_dir, 'data-2024-12-01_00-00-00')
+        output_dir = os.path.join(work_dir, 'compacted')
+        n_shards, shard_bytes = write_shards(data_dir, n_nodes, n_days, rows_per_hour)
+        keys = list(SchemaRegistry().encoders)
+
+        rows, csv_load = 0, 0.0
+        for key in keys:
+            frame, seconds = timed(load_shards, data_dir, key)
+            rows += len(frame)
+            csv_load += seconds
+
+        result, first_run = timed(compact, [data_dir], output_dir, fmt, 'zstd', 0)
+        rerun, second_run = timed(compact, [data_dir], output_dir, fmt, 'zstd', 0)
+
+        compacted_rows, compacted_load = 0, 0.0
+        for key in keys:
+            frame, seconds = timed(load_compacted, output_dir, key, fmt)
+            compacted_rows += len(frame)
+            compacted_load += seconds
+        assert compacted_rows == rows, (compacted_rows, rows)
+
+        return {
+            'shards': n_shards, 'rows': rows, 'files': result['written'],
+            'csv_load_s': csv_load, 'compacted_load_s': compacted_load,
+            'compact_s': first_run, 'recompact_s': second_run, 'unchanged': rerun['unchanged'],
+            'shard_bytes': shard_bytes, 'compacted_bytes': result['output_bytes'],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark loading hourly csv shards against compacted files.")
+    parser.add_argument("--nodes", type=int, default=3, help="logger node directories")
+    parser.add_argument("--days", type=int, default=30, help="days of hourly shards per node")
+    parser.add_argument("--rows-per-hour", type=int, default=60, help="rows per shard")
+    parser.add_argument("--format", choices=FORMATS, default=PARQUET, help="compacted file format")
+    args = parser.parse_args()
+
+    result = run(args.nodes, args.days, args.rows_per_hour, args.format)
+    print(f"Shards:        {result['shards']} files, {result['rows']} rows -> {result['files']} {args.format} files")
+    print(f"Load csv:      {result['csv_load_s']:.2f} s (read_csv per shard)")
+    print(f"Load {args.format}: {result['compacted_load_s']:.2f} s "
+          f"({result['csv_load_s'] / result['compacted_load_s']:.0f}x faster)")
+    print(f"Compaction:    {result['compact_s']:.2f} s, re-run {result['recompact_s']:.2f} s "
+          f"({result['unchanged']} files unchanged)")
+    print(f"Bytes:         {result['shard_bytes']} csv -> {result['compacted_bytes']} {args.format} "
+          f"({result['compacted_bytes'] / result['shard_bytes']:.0%})")
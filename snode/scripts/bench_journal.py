@@ -0,0 +1,83 @@
+"""
+Cost of the Write-Ahead Journal
+
+Rows per second and time per batch through a BatchedWriter with the
+journal, with fsync of every file per batch (the same loss window without
+a journal), and with the previous default (fsync every 30 s). The power
+cut simulation lives in tests/test_journal.py.
+
+Command: python scripts/bench_journal.py [--rows 20000] [--files 12] [--batch-size 64]
+from snode directory
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from journal import JournaledSink, JOURNAL_SUFFIX
+from log_writer import BatchedWriter, FileSink, CSV_RECORD, FSYNC_BATCH, FSYNC_INTERVAL
+
+HEADERS = ['datetime', 'fromNode', 'pm25Standard', 'temperature']
+
+
+def make_batches(file_paths, n_batches, batch_size, rng, first=0):
+    batches = []
+    for b in range(n_batches):
+        batch = []
+        for i in range(batch_size):
+            n = first + b * batch_size + i
+            row = [f'2024-12-01 00:{n // 60 % 60:02d}:{n % 60:02d}', f'0x{rng.getrandbits(32):08x}',
+                   round(rng.uniform(0, 300), 1), round(rng.uniform(-10, 45), 2)]
+            batch.append((CSV_RECORD, rng.choice(file_paths), HEADERS, row))
+        batches.append(batch)
+    return batches
+
+
+def time_writer(work_dir, mode, n_rows, n_files, batch_size):
+    """
+    Rows per second and mean ms per batch through a BatchedWriter.
+    mode: 'journal' (fsync the journal per batch, files every 30 s),
+    'fsync-batch' (fsync every file per batch) or 'fsync-interval' (files
+    every 30 s, the previous default).
+    """
+    rng = random.Random(0)
+    data_dir = os.path.join(work_dir, mode)
+    os.makedirs(data_dir)
+    paths = [os.path.join(data_dir, f'telemetry_{i}.csv') for i in range(n_files)]
+    if mode == 'journal':
+        sink = JournaledSink(FileSink(), os.path.join(work_dir, f'{mode}{JOURNAL_SUFFIX}'))
+        policy = FSYNC_INTERVAL
+    else:
+        sink = FileSink()
+        policy = FSYNC_BATCH if mode == 'fsync-batch' else FSYNC_INTERVAL
+    writer = BatchedWriter(sink, max_queue=n_rows + 1, batch_size=batch_size, flush_interval=2.0,
+                           fsync_policy=policy, fsync_interval=30.0, name=mode).start()
+    batches = make_batches(paths, n_rows // batch_size, batch_size, rng)
+    start = time.perf_counter()
+    for batch in batches:
+        for record in batch:
+            writer.submit(record)
+    writer.flush()
+    seconds = time.perf_counter() - start
+    stats = writer.stats()
+    writer.close()
+    return stats['written'] / seconds, stats['avg_flush_ms']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the writer with and without the journal.")
+    parser.add_argument("--rows", type=int, default=20000, help="rows written")
+    parser.add_argument("--files", type=int, default=12, help="csv files written")
+    parser.add_argument("--batch-size", type=int, default=64, help="rows per batch")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='smesh_journal_')
+    try:
+        for mode in ('journal', 'fsync-batch', 'fsync-interval'):
+            rate, batch_ms = time_writer(work_dir, mode, args.rows, args.files, args.batch_size)
+            print(f"{mode}: {rate:.0f} rows/s, {batch_ms:.2f} ms per batch of {args.batch_size}")
+    finally:
+        shutil.rmtree(work_dir)
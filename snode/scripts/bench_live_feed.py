@@ -0,0 +1,233 @@
+"""
+Load Test of the Live Feed
+
+Connects --clients phones (SSE streams, from a separate process so the
+clients do not share the logger's CPU) plus one stalled client that stops
+reading, then publishes telemetry at --rate packets per second for
+--seconds seconds, the way on_receive does. Reports:
+- time of each publish() call, i.e. what on_receive waits for
+- delivery latency from publish() to a client parsing the event
+- CPU of the logger process (server and publisher) while streaming
+- events skipped for clients that fell behind, and clients dropped
+
+The server side of every connection gets a --sndbuf byte send buffer (the
+Linux initial size; a phone that left the Wi-Fi stops acknowledging long
+before the buffer autotunes to megabytes), so the stalled client fills it
+within the run.
+
+and the same for the previous implementation, where on_receive itself
+wrote every event to every client socket.
+
+Command: python scripts/bench_live_feed.py [--clients 50] [--rate 20] [--seconds 20]
+from snode directory
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import selectors
+import socket
+import threading
+import time
+
+from live_feed import LiveFeed, SEND_TIMEOUT_SECONDS
+
+SNDBUF = 16384
+
+
+################################################
+# Clients
+################################################
+
+def run_clients(port, n_clients, seconds, results):
+    """
+    Streams /events on n_clients sockets (and one that never reads) and
+    puts (delivery latencies in seconds, events received) on results.
+    """
+    stalled = socket.socket()
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stalled.connect(('127.0.0.1', port))
+    stalled.sendall(b'GET /events HTTP/1.1\r\nHost: bench\r\n\r\n')
+
+    selector = selectors.DefaultSelector()
+    for _ in range(n_clients):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b'GET /events HTTP/1.1\r\nHost: bench\r\n\r\n')
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, bytearray())
+    latencies = []
+    received = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for key, _ in selector.select(timeout=0.5):
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                selector.unregister(key.fileobj)
+                continue
+            now = time.time()
+            buffer = key.data
+            buffer += data
+            *blocks, rest = bytes(buffer).split(b'\n\n')
+            buffer[:] = rest
+            for block in blocks:
+                for line in block.split(b'\n'):
+                    if line.startswith(b'data: '):
+                        event = json.loads(line[6:])
+                        latencies.append(now - event['sections']['bench']['sent'])
+                        received += 1
+    results.put((latencies, received))
+    stalled.close()
+
+
+class BenchFeed(LiveFeed):
+    """
+    LiveFeed with the send buffer of each stream set to SNDBUF.
+    """
+
+    def stream(self, handler):
+        handler.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+        super().stream(handler)
+
+
+################################################
+# Previous Implementation
+################################################
+
+class SynchronousFeed:
+    """
+    on_receive writes each event to every client socket before returning.
+    """
+
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.clients = []
+        self.lock = threading.Lock()
+        self.dropped = 0
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            sock.recv(4096)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+            sock.settimeout(SEND_TIMEOUT_SECONDS)
+            sock.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n\r\n')
+            with self.lock:
+                self.clients.append(sock)
+
+    def publish(self, from_node, sections, seq):
+        data = f'id: {seq}\nevent: telemetry\ndata: {json.dumps({"fromNode": from_node, "sections": sections})}\n\n'
+        with self.lock:
+            for sock in list(self.clients):
+                try:
+                    sock.sendall(data.encode())
+                except OSError:
+                    self.clients.remove(sock)
+                    self.dropped += 1
+
+    def stats(self):
+        return {'clients': len(self.clients), 'skipped': 0, 'dropped': self.dropped}
+
+    def close(self):
+        self.server.close()
+        for sock in self.clients:
+            sock.close()
+
+
+################################################
+# Benchmark
+################################################
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(feed, port, clients_ready, n_clients, rate, seconds):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_clients, args=(port, n_clients, seconds + 3, results))
+    process.start()
+    while not clients_ready():
+        time.sleep(0.05)
+
+    publish_seconds = []
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    begin = time.perf_counter()
+    for seq in range(1, int(rate * seconds) + 1):
+        next_time = begin + seq / rate
+        node = f'0x{0x10000000 + seq % 20:08x}'
+        sections = {'bench': {'sent': time.time()},
+                    'airQualityMetrics': {'pm25Standard': seq % 300, 'pm25Environmental': seq % 250,
+                                          'pm10Standard': seq % 200},
+                    'environmentMetrics': {'temperature': 25.5, 'relativeHumidity': 40.25}}
+        start = time.perf_counter()
+        if isinstance(feed, LiveFeed):
+            feed.publish(node, sections, packet={'rxSnr': 6.25, 'rxRssi': -80, 'hopStart': 3, 'hopLimit': 3})
+        else:
+            feed.publish(node, sections, seq)
+        publish_seconds.append(time.perf_counter() - start)
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+    wall = time.perf_counter() - begin
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+
+    latencies, received = results.get()
+    process.join()
+    stats = feed.stats()
+    return {'published': len(publish_seconds), 'expected': len(publish_seconds) * n_clients, 'received': received,
+            'publish_p50_us': percentile(publish_seconds, 0.5) * 1e6,
+            'publish_p99_us': percentile(publish_seconds, 0.99) * 1e6,
+            'publish_max_ms': max(publish_seconds) * 1e3,
+            'latency_p50_ms': percentile(latencies, 0.5) * 1e3, 'latency_p99_ms': percentile(latencies, 0.99) * 1e3,
+            'latency_max_ms': max(latencies, default=float('nan')) * 1e3,
+            'achieved_rate': rate * seconds / wall, 'cpu': cpu / wall, 'skipped': stats['skipped'],
+            'dropped': stats['dropped']}
+
+
+def report(name, result):
+    print(f"{name}")
+    print(f"  publish():   p50 {result['publish_p50_us']:.0f} us, p99 {result['publish_p99_us']:.0f} us, "
+          f"max {result['publish_max_ms']:.1f} ms ({result['published']} packets at {result['achieved_rate']:.1f}/s)")
+    print(f"  delivery:    p50 {result['latency_p50_ms']:.1f} ms, p99 {result['latency_p99_ms']:.1f} ms, "
+          f"max {result['latency_max_ms']:.1f} ms ({result['received']} of {result['expected']} events)")
+    print(f"  logger CPU:  {result['cpu']:.1%} of one core, {result['skipped']} events skipped, "
+          f"{result['dropped']} clients dropped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the live feed with many SSE clients.")
+    parser.add_argument("--clients", type=int, default=50, help="streaming clients (plus one stalled client)")
+    parser.add_argument("--rate", type=float, default=20, help="packets published per second")
+    parser.add_argument("--seconds", type=float, default=20, help="length of the run")
+    parser.add_argument("--buffer", type=int, default=256, help="events kept in the feed's ring")
+    parser.add_argument("--sndbuf", type=int, default=SNDBUF, help="server send buffer per client, bytes")
+    parser.add_argument("--skip-previous", action='store_true', help="only run the current implementation")
+    args = parser.parse_args()
+    SNDBUF = args.sndbuf
+
+    feed = BenchFeed(args.buffer, max_clients=args.clients + 1).start('127.0.0.1', 0)
+    try:
+        result = run(feed, feed.port, lambda: feed.stats()['clients'] == args.clients + 1,
+                     args.clients, args.rate, args.seconds)
+    finally:
+        feed.close()
+    report(f"LiveFeed, {args.clients} clients + 1 stalled", result)
+
+    if not args.skip_previous:
+        feed = SynchronousFeed()
+        try:
+            result = run(feed, feed.port, lambda: feed.stats()['clients'] == args.clients + 1,
+                         args.clients, args.rate, args.seconds)
+        finally:
+            feed.close()
+        report(f"Previous (writes in on_receive), {args.clients} clients + 1 stalled", result)
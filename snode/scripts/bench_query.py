@@ -0,0 +1,109 @@
+"""
+Benchmark of the Telemetry Query API
+
+Writes a multi-week set of synthetic hourly shards (see bench_compaction.py)
+and asks for one metric of one node over a few days:
+- the way analyses did it: read_csv every airQualityMetrics_*.csv shard,
+  then filter by node and time
+- snode.query cold: no shard index yet (first query builds it)
+- snode.query with the saved index (a new process), nothing cached
+- snode.query warm: the same store again, columns cached
+and the same over the files of compact_shards.py.
+
+Command: python scripts/bench_query.py [--nodes 3] [--days 28] [--window-days 2]
+from snode directory
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from bench_compaction import write_shards
+from compact_shards import compact
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from snode.query import TelemetryStore, INDEX_NAME  # noqa: E402
+
+METRIC = 'pm25Standard'
+TELEMETRY_KEY = 'airQualityMetrics'
+
+
+################################################
+# Previous Implementation
+################################################
+
+def grep_query(data_dir, node, start, end):
+    """
+    Every shard of the telemetry type read in full, then filtered.
+    """
+    frames = [pd.read_csv(path) for path in sorted(glob.glob(os.path.join(data_dir, '*', f'{TELEMETRY_KEY}_*.csv')))]
+    frame = pd.concat(frames, ignore_index=True)
+    times = pd.to_datetime(frame['datetime'], format='ISO8601')
+    frame = frame[(frame['fromNode'] == node) & (times >= start) & (times <= end)]
+    return frame[METRIC].to_numpy()
+
+
+def timed(function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+
+def store_query(data_dir, node, start, end, store=None):
+    store = store or TelemetryStore(data_dir)
+    _, values = store.query(METRIC, node, start, end).to_numpy()
+    return store, values
+
+
+def run(n_nodes, n_days, window_days, rows_per_hour):
+    work_dir = tempfile.mkdtemp(prefix='bench_query_')
+    try:
+        data_dir = os.path.join(work_dir, 'data-2024-12-01_00-00-00')
+        n_shards, _ = write_shards(data_dir, n_nodes, n_days, rows_per_hour)
+        compacted_dir = os.path.join(work_dir, 'compacted')
+        compact([data_dir], compacted_dir, min_age=0)
+
+        store = TelemetryStore(data_dir, persist_index=False)
+        node = store.nodes(METRIC)[0]
+        start = pd.Timestamp('2024-12-01') + pd.Timedelta(days=n_days // 2)
+        end = start + pd.Timedelta(days=window_days)
+
+        results = {'shards': n_shards}
+        expected, results['grep_s'] = timed(grep_query, data_dir, node, start, end)
+        for name, directory in (('csv', data_dir), ('compacted', compacted_dir)):
+            index_path = os.path.join(directory, INDEX_NAME)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            (_, values), results[f'{name}_cold_s'] = timed(store_query, directory, node, start, end)
+            (store, values), results[f'{name}_indexed_s'] = timed(store_query, directory, node, start, end)
+            (_, values), results[f'{name}_warm_s'] = timed(store_query, directory, node, start, end, store)
+            assert len(values) == len(expected), (name, len(values), len(expected))
+            results[f'{name}_files_read'] = store.files_read
+            results[f'{name}_files'] = store.stats()['files_indexed']
+        results['rows'] = len(expected)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark metric/node/time queries over stored telemetry.")
+    parser.add_argument("--nodes", type=int, default=3, help="logger node directories")
+    parser.add_argument("--days", type=int, default=28, help="days of hourly shards per node")
+    parser.add_argument("--window-days", type=float, default=2, help="length of the queried time range")
+    parser.add_argument("--rows-per-hour", type=int, default=60, help="rows per shard")
+    args = parser.parse_args()
+
+    result = run(args.nodes, args.days, args.window_days, args.rows_per_hour)
+    print(f"Dataset:          {result['shards']} shards, query matches {result['rows']} rows")
+    print(f"read_csv + filter: {result['grep_s']:.2f} s")
+    for name in ('csv', 'compacted'):
+        print(f"query {name:9s}   cold {result[f'{name}_cold_s']:.2f} s | saved index "
+              f"{result[f'{name}_indexed_s']:.3f} s | warm {result[f'{name}_warm_s']:.4f} s "
+              f"({result[f'{name}_files_read']} of {result[f'{name}_files']} files read)")
@@ -0,0 +1,199 @@
+"""
+Benchmark of the Radio Watchdog and Reconnect
+
+Unplugs and replugs a fake serial device (a file in a temporary directory)
+and measures, for the polling loop of v5 and for ReconnectManager:
+- recovery time: device unplugged -> interface open again, with the device
+  back after --outage seconds
+- replug latency: device back -> interface open again
+- wakeups per hour while idle: packets keep arriving, nothing goes wrong
+
+The polling loop wakes every second and only notices a lost radio through
+its watchdog; the manager is woken by the connection-lost event (which
+meshtastic publishes when the serial read fails) and by inotify when the
+device reappears. --timeout scales the watchdog down so the run is short.
+
+Command: python scripts/bench_reconnect.py [--trials 3] [--timeout 5] [--outage 8]
+from snode directory
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from reconnect import ReconnectManager, CONNECTED
+
+# v5 polling loop
+LEGACY_TICK_SECONDS = 1.0
+LEGACY_PORT_POLL_SECONDS = 10.0
+
+
+class FakeSerialInterface:
+    """
+    Opens like SerialInterface: fails if the device file does not exist.
+    """
+
+    def __init__(self, serial_port):
+        if not os.path.exists(serial_port):
+            raise FileNotFoundError(serial_port)
+        self.serial_port = serial_port
+        self.myInfo = SimpleNamespace(my_node_num=0xABCD1234)
+
+    def close(self):
+        pass
+
+
+################################################
+# Previous Implementation
+################################################
+
+class LegacyLoop:
+    """
+    The v5 main loop: wake every second, compare the time with the
+    watchdog, and on timeout close the interface and poll os.path.exists()
+    every 10 seconds until the port is back.
+    """
+
+    def __init__(self, serial_port, timeout, release_seconds):
+        self.serial_port = serial_port
+        self.timeout = timeout
+        self.release_seconds = release_seconds
+        self.interface = FakeSerialInterface(serial_port)
+        self.last_rx = time.monotonic()
+        self.wakeups = 0
+        self.connected = threading.Event()
+        self.connected.set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="LegacyLoop", daemon=True)
+
+    def feed(self):
+        self.last_rx = time.monotonic()
+
+    def _run(self):
+        while not self._stop.wait(LEGACY_TICK_SECONDS):
+            self.wakeups += 1
+            if time.monotonic() >= self.last_rx + self.timeout:
+                self.connected.clear()
+                self.interface.close()
+                time.sleep(self.release_seconds)
+                while not os.path.exists(self.serial_port):
+                    time.sleep(LEGACY_PORT_POLL_SECONDS)
+                    self.wakeups += 1
+                self.interface = FakeSerialInterface(self.serial_port)
+                self.last_rx = time.monotonic()
+                self.connected.set()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+################################################
+# Scenarios
+################################################
+
+def unplug_trial(state, serial_port, timeout, outage, release_seconds):
+    """
+    Removes the device, puts it back after outage seconds, and returns
+    (recovery seconds, replug latency seconds).
+
+    Parameters:
+    - state: dict, 'manager' and 'radio', or 'loop' for the polling loop
+    """
+    os.remove(serial_port)
+    unplugged = time.monotonic()
+    if 'manager' in state:
+        # meshtastic publishes meshtastic.connection.lost when the read fails
+        state['manager'].connection_lost(state['radio'].interface)
+    time.sleep(outage)
+    open(serial_port, 'w').close()
+    replugged = time.monotonic()
+
+    deadline = replugged + timeout + outage + LEGACY_PORT_POLL_SECONDS + release_seconds + 5
+    if 'manager' in state:
+        radio = state['radio']
+        while radio.state != CONNECTED or radio.interface is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError("manager did not reconnect")
+            time.sleep(0.001)
+    else:
+        loop = state['loop']
+        while loop.connected.is_set():  # wait for the watchdog to notice
+            time.sleep(0.001)
+        if not loop.connected.wait(deadline - time.monotonic()):
+            raise RuntimeError("polling loop did not reconnect")
+    done = time.monotonic()
+    return done - unplugged, done - replugged
+
+
+def run(design, trials, timeout, outage, idle_seconds, release_seconds):
+    device_dir = tempfile.mkdtemp(prefix='bench_reconnect_')
+    serial_port = os.path.join(device_dir, 'ttyFAKE0')
+    open(serial_port, 'w').close()
+    try:
+        if design == 'manager':
+            manager = ReconnectManager(FakeSerialInterface, timeout=timeout, release_seconds=release_seconds)
+            radio = manager.add(serial_port)
+            manager.start()
+            while radio.state != CONNECTED:
+                time.sleep(0.001)
+            state = {'manager': manager, 'radio': radio}
+            feed = radio.feed
+
+            def wakeups():
+                return manager.wakeups + manager.watcher.wakeups
+        else:
+            loop = LegacyLoop(serial_port, timeout, release_seconds).start()
+            state = {'loop': loop}
+            feed = loop.feed
+
+            def wakeups():
+                return loop.wakeups
+
+        # Idle: a packet every timeout / 4 seconds
+        start_wakeups, start = wakeups(), time.monotonic()
+        while time.monotonic() - start < idle_seconds:
+            feed()
+            time.sleep(timeout / 4)
+        idle_rate = (wakeups() - start_wakeups) / (time.monotonic() - start) * 3600
+
+        results = [unplug_trial(state, serial_port, timeout, outage, release_seconds) for _ in range(trials)]
+        if design == 'manager':
+            manager.stop()
+        else:
+            loop.stop()
+        return {
+            'design': design,
+            'idle_wakeups_per_hour': idle_rate,
+            'recovery_s': statistics.mean(r[0] for r in results),
+            'recovery_max_s': max(r[0] for r in results),
+            'replug_latency_s': statistics.mean(r[1] for r in results),
+        }
+    finally:
+        shutil.rmtree(device_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark radio watchdog and reconnect designs.")
+    parser.add_argument("--trials", type=int, default=3, help="unplug/replug cycles per design")
+    parser.add_argument("--timeout", type=float, default=5.0, help="watchdog timeout in seconds (logger: 70)")
+    parser.add_argument("--outage", type=float, default=8.0, help="seconds the device stays unplugged")
+    parser.add_argument("--idle", type=float, default=20.0, help="seconds of normal traffic to count wakeups")
+    parser.add_argument("--release", type=float, default=0.5, help="pause between closing and reopening the port")
+    parser.add_argument("--designs", nargs='+', choices=('polling', 'manager'), default=['polling', 'manager'])
+    args = parser.parse_args()
+
+    for name in args.designs:
+        result = run(name, args.trials, args.timeout, args.outage, args.idle, args.release)
+        print(f"{name:8s} idle wakeups {result['idle_wakeups_per_hour']:.0f}/h | "
+              f"recovery {result['recovery_s']:.2f} s (max {result['recovery_max_s']:.2f}), "
+              f"replug -> open {result['replug_latency_s']:.3f} s")
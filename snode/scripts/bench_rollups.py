@@ -0,0 +1,160 @@
+"""
+Benchmark of the Streaming Rollups
+
+Simulates a burn: --nodes sensor nodes sending environment and air quality
+telemetry every --interval seconds for --hours hours, with a share of the
+packets delivered minutes late (store-and-forward, a node out of range).
+The clock is simulated, so hours run in seconds. Reports:
+- cost of RollupEngine.add() per packet, and the most windows held open
+- bytes of rollups.db against the raw rows in hourly csv shards, both
+  written through the logger's sinks, per window length (each in a
+  database of its own)
+- that every stored window (late packets included) equals the summary
+  computed from all rows at once
+
+Command: python scripts/bench_rollups.py [--nodes 20] [--hours 3] [--interval 30] [--late 0.05]
+from snode directory
+"""
+
+import argparse
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from log_writer import FileSink, CSV_RECORD
+from rollups import RollupEngine, RollupSink, read_rollups, CIRCULAR_METRICS
+from telemetry_schema import SchemaRegistry
+
+START = 1734440400  # 2024-12-17 13:00 UTC
+
+
+def burn_packets(n_nodes, hours, interval, late_fraction, seed=0):
+    """
+    Returns (receive time, packet) pairs in receive order.
+    """
+    rng = random.Random(seed)
+    arrivals = []
+    for node in range(n_nodes):
+        from_node = 0x10000000 + node
+        pm = rng.uniform(5, 50)
+        offset = rng.uniform(0, interval)
+        t = START + offset
+        while t < START + hours * 3600:
+            pm = max(0.0, pm + rng.gauss(0, 8))
+            for telemetry_key, metrics in (
+                    ('environmentMetrics', {'temperature': round(rng.uniform(15, 60), 2),
+                                            'relativeHumidity': round(rng.uniform(10, 80), 2),
+                                            'windSpeed': round(rng.uniform(0, 12), 2),
+                                            'windDirection': rng.randrange(360)}),
+                    ('airQualityMetrics', {'pm25Standard': int(pm), 'pm25Environmental': int(pm * 0.9),
+                                           'pm10Standard': int(pm * 0.7)})):
+                delay = rng.uniform(180, 900) if rng.random() < late_fraction else rng.uniform(0.2, 3)
+                packet = {'from': from_node, 'rxTime': int(t + delay), 'rxSnr': 1.0, 'rxRssi': -90,
+                          'decoded': {'portnum': 'TELEMETRY_APP',
+                                      'telemetry': {'time': int(t), telemetry_key: metrics}}}
+                arrivals.append((t + delay, packet))
+            t += interval
+    arrivals.sort(key=lambda item: item[0])
+    return arrivals
+
+
+def batch_rollups(arrivals, engine):
+    """
+    The expected windows, computed from all rows at once.
+    """
+    values = defaultdict(list)
+    for _, packet in arrivals:
+        telemetry = packet['decoded']['telemetry']
+        for section in telemetry.values():
+            if not isinstance(section, dict):
+                continue
+            for metric, value in section.items():
+                if metric in engine.metrics:
+                    for window in engine.windows:
+                        start = telemetry['time'] // window * window
+                        values[(hex(packet['from']), metric, window, start)].append(value)
+    expected = {}
+    for key, series in values.items():
+        if key[1] in CIRCULAR_METRICS:
+            angles = [math.radians(value) for value in series]
+            mean = math.degrees(math.atan2(sum(map(math.sin, angles)), sum(map(math.cos, angles)))) % 360
+        else:
+            mean = sum(series) / len(series)
+        expected[key] = (len(series), min(series), max(series), mean)
+    return expected
+
+
+def run(n_nodes, hours, interval, late_fraction, finalize_every=15.0):
+    arrivals = burn_packets(n_nodes, hours, interval, late_fraction)
+    engine = RollupEngine()
+    registry = SchemaRegistry()
+    work_dir = tempfile.mkdtemp(prefix='bench_rollups_')
+    try:
+        db_paths = {window: os.path.join(work_dir, f'rollups_{window}.db') for window in engine.windows}
+        rollup_sink = RollupSink()
+        file_sink = FileSink()
+        rows = []
+        add_seconds = 0.0
+        max_open = 0
+        next_finalize = START + finalize_every
+        for now, packet in arrivals:
+            while now >= next_finalize:
+                windows = engine.finalize(next_finalize)
+                if windows:
+                    rollup_sink.write_batch([(db_paths[window[2]],) + window for window in windows])
+                next_finalize += finalize_every
+            from_node = hex(packet['from'])
+            telemetry = packet['decoded']['telemetry']
+            begin = time.perf_counter()
+            engine.add(from_node, telemetry, packet, now)
+            add_seconds += time.perf_counter() - begin
+            max_open = max(max_open, engine.stats()['open_windows'])
+
+            # The raw rows the logger writes for the same packet
+            for telemetry_key, encoder, metrics in registry.sections(telemetry):
+                hour = time.strftime('%Y-%m-%d_%H-00-00', time.gmtime(now))
+                rows.append((CSV_RECORD, os.path.join(work_dir, f'{telemetry_key}_{hour}.csv'), encoder.headers,
+                             encoder.row(str(now), from_node, metrics, packet)))
+        rollup_sink.write_batch([(db_paths[window[2]],) + window for window in engine.finalize(everything=True)])
+        rollup_sink.close()
+        file_sink.write_batch(rows)
+        file_sink.close()
+
+        stored = {(row['fromNode'], row['metric'], row['window'], row['start']):
+                  (row['count'], row['min'], row['max'], row['mean'])
+                  for db_path in db_paths.values() for row in read_rollups(db_path)}
+        expected = batch_rollups(arrivals, engine)
+        mismatched = [key for key, summary in expected.items()
+                      if key not in stored or stored[key][:3] != summary[:3]
+                      or not math.isclose(stored[key][3], summary[3], rel_tol=1e-9, abs_tol=1e-6)]
+        csv_bytes = sum(os.path.getsize(os.path.join(work_dir, name))
+                        for name in os.listdir(work_dir) if name.endswith('.csv'))
+        return {'packets': len(arrivals), 'add_us': add_seconds / len(arrivals) * 1e6, 'max_open': max_open,
+                'windows': len(stored), 'expected_windows': len(expected), 'mismatched': len(mismatched),
+                'late_windows': engine.stats()['late_windows'],
+                'rollup_bytes': {window: os.path.getsize(path) for window, path in db_paths.items()},
+                'csv_bytes': csv_bytes}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the streaming rollups on a simulated burn.")
+    parser.add_argument("--nodes", type=int, default=20, help="sensor nodes")
+    parser.add_argument("--hours", type=float, default=3, help="length of the burn")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between telemetry of a node")
+    parser.add_argument("--late", type=float, default=0.05, help="fraction of packets delivered 3-15 minutes late")
+    args = parser.parse_args()
+
+    result = run(args.nodes, args.hours, args.interval, args.late)
+    print(f"Packets:      {result['packets']}, add() {result['add_us']:.1f} us/packet, "
+          f"at most {result['max_open']} windows open")
+    print(f"Windows:      {result['windows']} stored ({result['late_windows']} reopened by late packets), "
+          f"{result['mismatched']} of {result['expected_windows']} differ from a batch computation")
+    print(f"Bytes:        raw csv {result['csv_bytes']}")
+    for window, size in result['rollup_bytes'].items():
+        print(f"              {window:4d} s windows {size} ({size / result['csv_bytes']:.1%} of csv)")
@@ -0,0 +1,193 @@
+"""
+Simulation of the Storage Governor
+
+Plays back a long deployment hour by hour on a small simulated SD card:
+every hour each logger node writes its csv shards (rows from the telemetry
+encoders) and its raw packet archive, the uploader syncs the data root to
+a local directory (LocalDirTransport) every few hours except during
+outages, and StorageGovernor.run_once() runs with the simulated clock.
+Reports:
+- free space and storage level over the deployment, and when the raw
+  archive was paused and resumed
+- bytes saved by compressing cold shards, and bytes deleted by retention,
+  for low space and as raw archives
+- that no telemetry was lost: every csv shard written is still on the card
+  (as .csv or .csv.gz) or was uploaded in full
+- time per governor pass
+- the previous behaviour for comparison: nothing is ever deleted, so the
+  day the card fills up, logging stops
+
+Command: python scripts/bench_storage_governor.py [--nodes 1] [--days 60] [--capacity-mb 16]
+from snode directory
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench_compaction import directory_bytes
+from storage_governor import StorageGovernor, LEVEL_OK
+from telemetry_schema import SchemaRegistry
+from upload_queue import LocalDirTransport, sync
+
+MB = 1024 * 1024
+
+
+def write_hour(session_dir, node_ids, hour_start, rows_per_hour, registry, rng):
+    """
+    Writes one hour of csv shards and raw archives for every logger node,
+    with the hour's end as mtime.
+
+    Returns:
+    - list of the csv shards written, relative to session_dir
+    """
+    name_dt = hour_start.strftime("%Y-%m-%d_%H-%M-%S")
+    mtime = (hour_start + timedelta(hours=1)).timestamp()
+    shards = []
+    for node_id in node_ids:
+        node_dir = os.path.join(session_dir, node_id)
+        os.makedirs(node_dir, exist_ok=True)
+        packets = []
+        for key, encoder in registry.encoders.items():
+            path = os.path.join(node_dir, f'{key}_{name_dt}.csv')
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(encoder.headers)
+                for i in range(rows_per_hour):
+                    timestamp = str(hour_start + timedelta(seconds=i * 3600 / rows_per_hour + rng.random()))
+                    metrics = {field: round(rng.uniform(0, 100), 2) for field in encoder.fields}
+                    packet = {'from': rng.getrandbits(32), 'id': rng.getrandbits(32),
+                              'rxSnr': round(rng.uniform(-20, 10), 2), 'rxRssi': rng.randrange(-120, -30),
+                              'rxTime': int(hour_start.timestamp()) + i, 'hopStart': 3, 'hopLimit': rng.randrange(4),
+                              'decoded': {'portnum': 'TELEMETRY_APP', 'telemetry': {key: metrics}}}
+                    writer.writerow(encoder.row(timestamp, hex(packet['from']), metrics, packet))
+                    packets.append(packet)
+            os.utime(path, (mtime, mtime))
+            shards.append(os.path.relpath(path, session_dir))
+        path = os.path.join(node_dir, f'packets_{name_dt}.jsonl.gz')
+        with gzip.open(path, 'wt') as file:
+            for packet in packets:
+                file.write(json.dumps({'datetime': str(hour_start), 'logger': node_id, 'packet': packet}) + '\n')
+        os.utime(path, (mtime, mtime))
+    return shards
+
+
+def telemetry_lost(data_root, dest_dir, session, shards):
+    """
+    Returns the csv shards neither on the card (plain or gzipped) nor uploaded.
+    """
+    lost = []
+    for shard in shards:
+        local = os.path.join(data_root, session, shard)
+        uploaded = os.path.join(dest_dir, session, shard)
+        if not any(os.path.exists(path) for path in (local, local + '.gz', uploaded, uploaded + '.gz')):
+            lost.append(shard)
+    return lost
+
+
+def simulate(args, work_dir, governed=True):
+    """
+    Returns a dict of results; with governed=False nothing is deleted and
+    the run stops when the card is full.
+    """
+    rng = random.Random(0)
+    registry = SchemaRegistry()
+    data_root = os.path.join(work_dir, 'snode')
+    dest_dir = os.path.join(work_dir, 'upload')
+    os.makedirs(data_root)
+    start = datetime(2024, 12, 1)
+    session = f'data-{start.strftime("%Y-%m-%d_%H-%M-%S")}'
+    session_dir = os.path.join(data_root, session)
+    node_ids = [f'{0xa000 + node:x}' for node in range(args.nodes)]
+    capacity = args.capacity_mb * MB
+    outages = [(day, day + args.outage_days) for day in args.outages]
+
+    def disk_usage(path):
+        used = directory_bytes(data_root)
+        return capacity, used, capacity - used
+
+    governor = StorageGovernor(data_root, retention_days=args.retention_days, low_free_mb=args.low_mb,
+                               critical_free_mb=args.critical_mb, disk_usage=disk_usage)
+    shards = []
+    pass_times = []
+    transitions = []
+    min_free = capacity
+    level = LEVEL_OK
+    raw_allowed = True
+    full_at = None
+    for hour in range(args.days * 24):
+        hour_start = start + timedelta(hours=hour)
+        day = hour / 24
+        shards.extend(write_hour(session_dir, node_ids, hour_start, args.rows_per_hour, registry, rng))
+        free = capacity - directory_bytes(data_root)
+        min_free = min(min_free, free)
+        if free < 0:
+            full_at = day
+            break
+        # The destination is offline (unmounted) during outages, keeping
+        # what it received
+        online = not any(begin <= day < end for begin, end in outages)
+        if online != os.path.isdir(dest_dir) and hour:
+            os.rename(*((dest_dir + '.offline', dest_dir) if online else (dest_dir, dest_dir + '.offline')))
+        if online and hour % args.upload_every == 0:
+            os.makedirs(dest_dir, exist_ok=True)
+            sync(data_root, LocalDirTransport(dest_dir))
+        if not governed:
+            continue
+        now = (hour_start + timedelta(hours=1)).timestamp()
+        begin = time.perf_counter()
+        governor.run_once(now)
+        pass_times.append(time.perf_counter() - begin)
+        if (governor.level, governor.raw_allowed) != (level, raw_allowed):
+            level, raw_allowed = governor.level, governor.raw_allowed
+            transitions.append((round(day, 1), level, raw_allowed, (capacity - directory_bytes(data_root)) // MB))
+    if os.path.isdir(dest_dir + '.offline'):
+        os.rename(dest_dir + '.offline', dest_dir)
+    return {'hours': hour + 1, 'full_at_day': full_at, 'min_free_mb': min_free / MB,
+            'written_shards': len(shards), 'lost': telemetry_lost(data_root, dest_dir, session, shards),
+            'transitions': transitions, 'pass_times': sorted(pass_times), 'stats': governor.stats()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate a long deployment on a small SD card.")
+    parser.add_argument("--nodes", type=int, default=1, help="logger nodes")
+    parser.add_argument("--days", type=int, default=60, help="length of the deployment")
+    parser.add_argument("--rows-per-hour", type=int, default=60, help="rows per shard")
+    parser.add_argument("--capacity-mb", type=float, default=16, help="space of the data on the simulated card")
+    parser.add_argument("--low-mb", type=float, default=5, help="governor low mark")
+    parser.add_argument("--critical-mb", type=float, default=2, help="governor critical mark")
+    parser.add_argument("--retention-days", type=float, default=10, help="days uploaded files are kept")
+    parser.add_argument("--upload-every", type=int, default=6, help="hours between uploads")
+    parser.add_argument("--outages", type=int, nargs='*', default=[20], help="days the uploads stop")
+    parser.add_argument("--outage-days", type=int, default=40, help="length of each outage")
+    args = parser.parse_args()
+    # The transitions are printed below
+    logging.basicConfig(level=logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp(prefix='smesh_storage_')
+    try:
+        result = simulate(args, os.path.join(work_dir, 'governed'))
+        stats = result['stats']
+        pass_times = result['pass_times']
+        print(f"StorageGovernor: {result['hours'] / 24:.0f} days logged on {args.capacity_mb:g} MB, "
+              f"lowest free space {result['min_free_mb']:.1f} MB")
+        for day, level, raw_allowed, free_mb in result['transitions']:
+            print(f"  day {day:5.1f}: {level:8s} raw archive {'on ' if raw_allowed else 'off'} ({free_mb} MB free)")
+        print(f"  compressed {stats['compressed']} shards, saving {stats['compressed_saved_bytes'] / MB:.1f} MB")
+        print(f"  deleted {stats['deleted']} files, {stats['deleted_bytes'] / MB:.1f} MB")
+        print(f"  telemetry shards lost: {len(result['lost'])} of {result['written_shards']}")
+        print(f"  pass p50 {pass_times[len(pass_times) // 2] * 1000:.0f} ms, max {pass_times[-1] * 1000:.0f} ms")
+
+        result = simulate(args, os.path.join(work_dir, 'previous'), governed=False)
+        print(f"Previous (nothing deleted): card full on day {result['full_at_day']:.1f}"
+              if result['full_at_day'] is not None else "Previous (nothing deleted): card never full")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,137 @@
+"""
+Micro-Benchmark of the Telemetry Row Encoders
+
+Times building one telemetry row per packet the way on_receive did before the
+schema registry (rebuild the expected key list, merge the metrics with the
+signal dict, test keys one at a time) against the per-type encoders of
+telemetry_schema.py, and checks that both produce the same rows. For
+reference it also times serializing a row to a csv line, the work the writer
+thread does after on_receive.
+
+Only needs the standard library, so it runs on the Pi itself.
+
+Command: python scripts/bench_telemetry_encoders.py [--packets 20000] [--repeat 5]
+from snode directory
+"""
+
+import argparse
+import csv
+import io
+import random
+import timeit
+
+from telemetry_schema import SchemaRegistry, DEFAULT_SCHEMAS, DEFAULT_SIGNAL_KEYS
+
+CURR_DATE_TIME = '2024-12-17 13:07:56.123456'
+
+
+################################################
+# Previous Implementation
+################################################
+
+def legacy_row(curr_date_time, from_node, packet):
+    """
+    Row building as done by on_receive and format_telemetry_row before the
+    schema registry, kept here as the baseline.
+    """
+    telemetry_data = packet['decoded']['telemetry']
+    telemetry_list = ['environmentMetrics', 'airQualityMetrics', 'powerMetrics', 'deviceMetrics']
+    signal_keys = ['rxSnr', 'rxRssi', 'rxTime', 'hopLimit', 'hopStart']
+    signal_strength_data = {key: packet[key] for key in signal_keys if key in packet}
+    for telemetry_key in telemetry_list:
+        if telemetry_key in telemetry_data:
+            data_dict = telemetry_data[telemetry_key] | signal_strength_data
+            expected_keys = DEFAULT_SCHEMAS[telemetry_key] + DEFAULT_SIGNAL_KEYS
+            data_to_log = [curr_date_time, from_node]
+            for key in expected_keys:
+                if key in data_dict:
+                    data_to_log.append(data_dict[key])
+                else:
+                    data_to_log.append(None)
+            headers = ['datetime', 'fromNode'] + expected_keys
+            return headers, data_to_log
+    return None
+
+
+def encoder_row(registry, curr_date_time, from_node, packet):
+    """
+    Row building as done by on_receive now: every section is routed, so this
+    returns the first row for comparison with the baseline.
+    """
+    rows = [(encoder.headers, encoder.row(curr_date_time, from_node, metrics, packet))
+            for _, encoder, metrics in registry.sections(packet['decoded']['telemetry'])
+            if encoder is not None]
+    return rows[0] if rows else None
+
+
+################################################
+# Sample Packets
+################################################
+
+def sample_packets(n_packets, seed=0):
+    """
+    Telemetry packets with every built-in type, some fields missing, and the
+    'time' entry real telemetry carries next to the metrics.
+    """
+    rng = random.Random(seed)
+    packets = []
+    for i in range(n_packets):
+        telemetry_key = rng.choice(list(DEFAULT_SCHEMAS))
+        metrics = {field: round(rng.uniform(0, 100), 2) for field in DEFAULT_SCHEMAS[telemetry_key]
+                   if rng.random() > 0.1}
+        packet = {
+            'from': 0x10000000 + rng.randrange(20), 'id': i,
+            'decoded': {'portnum': 'TELEMETRY_APP', 'telemetry': {'time': 1734469676 + i, telemetry_key: metrics}},
+            'rxTime': 1734469676 + i, 'rxSnr': rng.uniform(-20, 10), 'rxRssi': rng.randrange(-120, -40),
+            'hopLimit': 3, 'hopStart': 3,
+        }
+        if rng.random() < 0.2:
+            del packet['hopStart']  # old firmware
+        packets.append(packet)
+    return packets
+
+
+def serialize(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for _, row in rows:
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+def run(n_packets, repeat):
+    packets = sample_packets(n_packets)
+    nodes = [hex(packet['from']) for packet in packets]
+    registry = SchemaRegistry()
+
+    legacy = [legacy_row(CURR_DATE_TIME, node, packet) for node, packet in zip(nodes, packets)]
+    encoded = [encoder_row(registry, CURR_DATE_TIME, node, packet) for node, packet in zip(nodes, packets)]
+    assert legacy == encoded, "encoders produce different rows than the previous implementation"
+
+    def time_per_packet(fn):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        return best / n_packets * 1e6
+
+    results = {
+        'legacy_us': time_per_packet(lambda: [legacy_row(CURR_DATE_TIME, node, packet)
+                                              for node, packet in zip(nodes, packets)]),
+        'encoder_us': time_per_packet(lambda: [encoder_row(registry, CURR_DATE_TIME, node, packet)
+                                               for node, packet in zip(nodes, packets)]),
+        'csv_line_us': time_per_packet(lambda: serialize(encoded)),
+    }
+    results['saved_us'] = results['legacy_us'] - results['encoder_us']
+    results['speedup'] = results['legacy_us'] / results['encoder_us']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark telemetry row encoders.")
+    parser.add_argument("--packets", type=int, default=20000, help="packets per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs (the best one is reported)")
+    args = parser.parse_args()
+
+    timings = run(args.packets, args.repeat)
+    print(f"previous row building: {timings['legacy_us']:.2f} us/packet")
+    print(f"schema encoders:       {timings['encoder_us']:.2f} us/packet "
+          f"({timings['saved_us']:.2f} us saved, {timings['speedup']:.1f}x)")
+    print(f"csv serialization:     {timings['csv_line_us']:.2f} us/packet (writer thread)")
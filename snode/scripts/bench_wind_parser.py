@@ -0,0 +1,136 @@
+"""
+Benchmark of the Wind Sensor Line Parser
+
+Generates wind sensor lines (key=value and NMEA MWV, with a share of
+malformed ones) and reports:
+- how many lines per second parse_line() handles, and the full parsing
+  stage (rows built and queued) as serial_log.py runs it
+- bytes per line of the "<timestamp> - <line>" text log against the parsed
+  rows in an hourly csv shard and in SQLite, all written through the same
+  sinks as on the Pi
+
+Command: python scripts/bench_wind_parser.py [--lines 100000] [--bad 0.02]
+from snode directory
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from log_writer import FileSink, TXT_RECORD
+from sqlite_store import SQLiteSink
+from wind_parser import WindParserStage, parse_line, ParseError
+
+TIMESTAMP = '2026-10-18 12:00:00'
+
+
+def nmea(sentence):
+    checksum = 0
+    for char in sentence.encode('ascii'):
+        checksum ^= char
+    return f'${sentence}*{checksum:02X}'
+
+
+def sample_lines(n_lines, bad_fraction, seed=0):
+    """
+    Wind sensor lines: 60% key=value, 40% NMEA MWV, bad_fraction garbled.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        direction = rng.randrange(360)
+        speed = round(rng.uniform(0, 12), 1)
+        if rng.random() < 0.6:
+            line = (f'0R1,Dn={max(direction - 20, 0):03d}D,Dm={direction:03d}D,Dx={min(direction + 20, 359):03d}D,'
+                    f'Sn={max(speed - 1, 0):.1f}M,Sm={speed:.1f}M,Sx={speed + 1.5:.1f}M')
+        else:
+            line = nmea(f'WIMWV,{direction:.1f},R,{speed:.1f},M,A')
+        if rng.random() < bad_fraction:
+            cut = rng.randrange(1, len(line))
+            line = line[:cut] + rng.choice(['', '\x00', 'x=']) + line[cut + 3:]
+        lines.append(line)
+    return lines
+
+
+class ListWriter:
+    """
+    Collects submitted records, standing in for a writer thread.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+        return True
+
+
+def write_through(sink, records):
+    sink.write_batch(records)
+    sink.flush()
+    sink.close()
+
+
+def run(n_lines, bad_fraction):
+    lines = sample_lines(n_lines, bad_fraction)
+
+    start = time.perf_counter()
+    rejected = 0
+    for line in lines:
+        try:
+            parse_line(line)
+        except ParseError:
+            rejected += 1
+    parse_seconds = time.perf_counter() - start
+
+    output_dir = tempfile.mkdtemp(prefix='bench_wind_')
+    try:
+        db_path = os.path.join(output_dir, 'telemetry.db')
+        files, store = ListWriter(), ListWriter()
+        stage = WindParserStage(files, output_dir, os.path.join(output_dir, 'rejects.txt'), store, db_path)
+        reader = SimpleNamespace(port='/dev/ttyUSB0')
+        start = time.perf_counter()
+        for i in range(0, n_lines, 64):  # about one serial read
+            stage(reader, TIMESTAMP, lines[i:i + 64])
+        stage_seconds = time.perf_counter() - start
+
+        text_path = os.path.join(output_dir, 'logfile.txt')
+        write_through(FileSink(), [(TXT_RECORD, text_path, None, f'{TIMESTAMP} - {line}') for line in lines])
+        write_through(FileSink(), files.records)
+        write_through(SQLiteSink(), store.records)
+        csv_bytes = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+                        if name.endswith('.csv'))
+        text_bytes = os.path.getsize(text_path)
+        sqlite_bytes = os.path.getsize(db_path)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        'lines': n_lines,
+        'rejected': rejected,
+        'parse_lines_per_s': n_lines / parse_seconds,
+        'stage_lines_per_s': n_lines / stage_seconds,
+        'text_bytes_per_line': text_bytes / n_lines,
+        'csv_bytes_per_line': csv_bytes / n_lines,
+        'sqlite_bytes_per_line': sqlite_bytes / n_lines,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the wind sensor line parser.")
+    parser.add_argument("--lines", type=int, default=100000, help="lines to parse")
+    parser.add_argument("--bad", type=float, default=0.02, help="fraction of garbled lines")
+    args = parser.parse_args()
+
+    result = run(args.lines, args.bad)
+    text = result['text_bytes_per_line']
+    print(f"Lines:        {result['lines']} ({result['rejected']} rejected)")
+    print(f"parse_line(): {result['parse_lines_per_s']:.0f} lines/s")
+    print(f"Stage:        {result['stage_lines_per_s']:.0f} lines/s (rows built and queued for csv and SQLite)")
+    print(f"Text log:     {text:.1f} bytes/line")
+    print(f"csv shard:    {result['csv_bytes_per_line']:.1f} bytes/line ({result['csv_bytes_per_line'] / text:.0%} of text)")
+    print(f"SQLite:       {result['sqlite_bytes_per_line']:.1f} bytes/line ({result['sqlite_bytes_per_line'] / text:.0%} of text)")
@@ -0,0 +1,424 @@
+"""
+Compaction of Hourly CSV Shards into Parquet
+
+rpi_log_script.py (and serial_log.py for the wind sensor) start a new csv
+file per telemetry type every hour, so a season of data is thousands of
+small '<telemetry>_<YYYY-MM-DD_HH-MM-SS>.csv' files that pandas has to open
+one by one. This job merges the shards of each node directory, telemetry
+type and day into one typed, compressed file:
+
+    data-<dt>/<node>/environmentMetrics_2024-12-17_13-00-00.csv, ...
+    -> <output_dir>/data-<dt>/<node>/environmentMetrics_2024-12-17.parquet
+
+- columns are typed like the SQLite store (sqlite_store.column_type):
+  datetime as timestamps, INTEGER columns as nullable integers, REAL
+  columns as floats, text as strings. Values that do not parse (e.g. a
+  garbled line) become null instead of turning the column into text.
+- files are zstd compressed Parquet (or Feather with --format feather),
+  which needs the pyarrow package (poetry install -E parquet)
+- it is idempotent and incremental: a manifest in the output directory
+  records the size and mtime of the shards behind every output file, and a
+  day is only rebuilt when one of its shards changed or a new one appeared.
+  Once shards of a day are gone (the storage governor deletes uploaded
+  ones), the compacted file holds the only copy of their rows, so new and
+  changed shards are appended to it instead. A shard gzipped by the
+  governor (x.csv.gz) is the same shard as x.csv. Shards modified in the
+  last --min-age seconds (the hour being logged) are left for the next run.
+- summary statistics (rows, time range, nodes, and count/min/max/mean of
+  every numeric column) are kept per output file in the manifest and
+  written to <output_dir>/summary.csv
+
+Uploading the output directory (upload_to_gdrive.py --folder <output_dir>)
+ships the compressed files instead of the raw shards.
+
+Command: python scripts/compact_shards.py <data_dir>... [--output-dir compacted] [--format parquet]
+from snode directory
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+from sqlite_store import column_type, TEXT_COLUMNS
+from telemetry_schema import OTHER_TELEMETRY_KEY
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.compact_manifest.json'
+MANIFEST_VERSION = 1
+SUMMARY_NAME = 'summary.csv'
+SUMMARY_HEADERS = ['file', 'telemetry', 'date', 'rows', 'first', 'last', 'nodes',
+                   'column', 'count', 'min', 'max', 'mean']
+
+PARQUET = 'parquet'
+FEATHER = 'feather'
+FORMATS = (PARQUET, FEATHER)
+DEFAULT_COMPRESSION = 'zstd'
+
+# Shards still being appended to by the logger are left alone
+DEFAULT_MIN_AGE_SECONDS = 120
+
+# The manifest is saved at most this often during a run (and at the end)
+MANIFEST_SAVE_SECONDS = 5.0
+
+# '<telemetry>_<YYYY-MM-DD>_<HH-MM-SS>.csv', optionally gzipped
+SHARD_PATTERN = re.compile(r'^(?P<key>.+)_(?P<date>\d{4}-\d{2}-\d{2})_\d{2}-\d{2}-\d{2}\.csv(\.gz)?$')
+
+# Numeric columns where more than this fraction of the values do not parse
+# are text after all (e.g. node_stats' lastSeen timestamps)
+MAX_UNPARSED_FRACTION = 0.5
+
+
+def require_engine(fmt):
+    """
+    Checks that the package needed to write fmt files is installed, so the
+    job fails with a clear message before reading anything.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError(f"Writing {fmt} files needs the pyarrow package (pip install pyarrow)") from None
+
+
+def find_groups(data_dirs, min_age=DEFAULT_MIN_AGE_SECONDS, now=None):
+    """
+    Groups the shards under data_dirs by node directory, telemetry type and day.
+
+    Parameters:
+    - data_dirs: list of str, logging directories (e.g. data-2024-12-17_13-07-56)
+    - min_age: float, skip shards modified less than min_age seconds ago
+    - now: float, current time.time()
+
+    Returns:
+    - dict, output path relative to the output directory (without extension)
+      -> dict of shard name (without .gz) -> (path, os.stat_result)
+    """
+    now = time.time() if now is None else now
+    groups = defaultdict(dict)
+    for data_dir in data_dirs:
+        data_dir = os.path.normpath(data_dir)
+        base = os.path.basename(data_dir)
+        for root, _, files in os.walk(data_dir):
+            rel_dir = os.path.normpath(os.path.join(base, os.path.relpath(root, data_dir)))
+            for filename in files:
+                match = SHARD_PATTERN.match(filename)
+                if match is None:
+                    continue
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                if now - stat.st_mtime < min_age:
+                    continue
+                group = os.path.join(rel_dir, f"{match['key']}_{match['date']}")
+                name = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+                # While the governor compresses a shard both files exist
+                if name in groups[group] and filename.endswith('.gz'):
+                    continue
+                groups[group][name] = (path, stat)
+    return groups
+
+
+def data_size(path, stat):
+    """
+    Returns the size of a shard's csv data. A gzip trailer holds it (modulo
+    4 GiB), so compressing a shard, which keeps its mtime, does not change
+    its signature.
+    """
+    if not path.endswith('.gz'):
+        return stat.st_size
+    with open(path, 'rb') as file:
+        file.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', file.read(4))[0]
+
+
+def shard_signature(shards):
+    """
+    Returns the manifest form of a group's shards: name -> [size, mtime].
+    """
+    return {name: [data_size(path, stat), stat.st_mtime] for name, (path, stat) in shards.items()}
+
+
+################################################
+# Typed Frames
+################################################
+
+def _typed_column(telemetry_key, name, values):
+    if name == 'datetime':
+        # str(datetime.now()) drops the fraction when it is 0, hence ISO8601
+        return pd.to_datetime(values, format='ISO8601', errors='coerce')
+    sql_type = column_type(name)
+    if sql_type == 'TEXT' or (telemetry_key == OTHER_TELEMETRY_KEY and name == 'value'):
+        return values.astype('string')
+    if pd.api.types.is_numeric_dtype(values):
+        numbers = values
+    else:
+        numbers = pd.to_numeric(values, errors='coerce')
+    unparsed = int((numbers.isna() & values.notna()).sum())
+    if unparsed and unparsed > MAX_UNPARSED_FRACTION * int(values.notna().sum()):
+        return values.astype('string')
+    if sql_type == 'INTEGER':
+        try:
+            return numbers.astype('Int64')
+        except (TypeError, ValueError):
+            pass  # fractional values, keep floats
+    return numbers.astype('float64')
+
+
+def read_shards(telemetry_key, paths):
+    """
+    Reads the csv shards of one group into a typed DataFrame sorted by datetime.
+
+    Parameters:
+    - telemetry_key: str, e.g. 'environmentMetrics'
+    - paths: list of str, shard files
+
+    Returns:
+    - pandas.DataFrame
+    """
+    # Text columns stay text (node ids like '0x0a1b' are not numbers); the
+    # others are parsed by the C reader and only fixed up by _typed_column
+    # when a garbled value made a column text. A short last line (power
+    # cut) only yields missing values.
+    text = dict.fromkeys(TEXT_COLUMNS | {'value'} if telemetry_key == OTHER_TELEMETRY_KEY else TEXT_COLUMNS, str)
+    frames = []
+    for path in paths:
+        try:
+            frames.append(pd.read_csv(path, dtype=text, on_bad_lines='skip'))
+        except pd.errors.EmptyDataError:
+            continue
+    if not frames:
+        return pd.DataFrame()
+    raw = pd.concat(frames, ignore_index=True)
+    frame = pd.DataFrame({name: _typed_column(telemetry_key, name, raw[name]) for name in raw.columns})
+    if 'datetime' in frame.columns:
+        frame = frame.sort_values('datetime', kind='stable', ignore_index=True)
+    return frame
+
+
+def summarize(frame):
+    """
+    Returns the summary statistics of a compacted frame.
+    """
+    summary = {'rows': len(frame), 'first': None, 'last': None, 'nodes': [], 'columns': {}}
+    if 'datetime' in frame.columns and frame['datetime'].notna().any():
+        summary['first'] = str(frame['datetime'].min())
+        summary['last'] = str(frame['datetime'].max())
+    if 'fromNode' in frame.columns:
+        summary['nodes'] = sorted(str(node) for node in frame['fromNode'].dropna().unique())
+    for name in frame.columns:
+        column = frame[name]
+        if name == 'datetime' or not pd.api.types.is_numeric_dtype(column):
+            continue
+        count = int(column.count())
+        summary['columns'][name] = {
+            'count': count,
+            'min': float(column.min()) if count else None,
+            'max': float(column.max()) if count else None,
+            'mean': round(float(column.mean()), 6) if count else None,
+        }
+    return summary
+
+
+def read_frame(path, fmt=PARQUET):
+    """
+    Reads a compacted file back.
+    """
+    return pd.read_feather(path) if fmt == FEATHER else pd.read_parquet(path)
+
+
+def merge_frames(old, new):
+    """
+    Appends the rows of new shards to a compacted frame, sorted by datetime.
+    Rows already in it (a shard that grew since it was compacted) are only
+    kept once.
+    """
+    if old.empty:
+        return new
+    if new.empty:
+        return old
+    frame = pd.concat([old, new], ignore_index=True).drop_duplicates(ignore_index=True)
+    if 'datetime' in frame.columns:
+        frame = frame.sort_values('datetime', kind='stable', ignore_index=True)
+    return frame
+
+
+def write_frame(frame, path, fmt=PARQUET, compression=DEFAULT_COMPRESSION):
+    """
+    Writes a frame atomically (temporary file + rename), so an interrupted
+    run never leaves a half written output behind.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    if fmt == FEATHER:
+        frame.to_feather(tmp_path, compression=compression)
+    else:
+        frame.to_parquet(tmp_path, engine='pyarrow', compression=compression, index=False)
+    os.replace(tmp_path, path)
+
+
+################################################
+# Manifest and Compaction
+################################################
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(path) as file:
+            return json.load(file).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        # A broken manifest only costs a full rebuild, never data
+        logger.warning("Ignoring unreadable manifest %s: %s", path, e)
+        return {}
+
+
+def save_manifest(output_dir, files):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, file, indent=1, sort_keys=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_summary(output_dir, files):
+    """
+    Writes the per-file statistics of the manifest to summary.csv, one row
+    per numeric column (or one row for files without numeric columns).
+    """
+    path = os.path.join(output_dir, SUMMARY_NAME)
+    with open(f'{path}.tmp', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(SUMMARY_HEADERS)
+        for rel_path in sorted(files):
+            entry = files[rel_path]
+            summary = entry['summary']
+            prefix = [rel_path, entry['telemetry'], entry['date'], summary['rows'],
+                      summary['first'], summary['last'], ' '.join(summary['nodes'])]
+            columns = summary['columns'] or {'': {'count': None, 'min': None, 'max': None, 'mean': None}}
+            for name, stats in columns.items():
+                writer.writerow(prefix + [name, stats['count'], stats['min'], stats['max'], stats['mean']])
+    os.replace(f'{path}.tmp', path)
+
+
+def compact(data_dirs, output_dir, fmt=PARQUET, compression=DEFAULT_COMPRESSION,
+            min_age=DEFAULT_MIN_AGE_SECONDS, force=False):
+    """
+    Compacts the hourly shards under data_dirs into one file per node
+    directory, telemetry type and day.
+
+    Parameters:
+    - data_dirs: list of str, logging directories
+    - output_dir: str, where the compacted files, manifest and summary go
+    - fmt: str, PARQUET or FEATHER
+    - compression: str, codec passed to pyarrow (zstd, lz4, snappy, ...)
+    - min_age: float, skip shards modified less than min_age seconds ago
+    - force: bool, rebuild every group, even unchanged ones
+
+    Returns:
+    - dict, counts of 'written', 'unchanged', 'merged' (new shards appended
+      to a day whose other shards were removed) and 'kept' (shards removed,
+      none added) groups, and the 'shards', 'rows', 'input_bytes' and
+      'output_bytes' of the written ones
+    """
+    require_engine(fmt)
+    os.makedirs(output_dir, exist_ok=True)
+    files = load_manifest(output_dir)
+    result = {'written': 0, 'unchanged': 0, 'merged': 0, 'kept': 0, 'shards': 0, 'rows': 0,
+              'input_bytes': 0, 'output_bytes': 0}
+    saved = time.monotonic()
+
+    for group, shards in sorted(find_groups(data_dirs, min_age).items()):
+        rel_path = f'{group}.{fmt}'
+        path = os.path.join(output_dir, rel_path)
+        signature = shard_signature(shards)
+        entry = files.get(rel_path)
+        previous = None
+        if entry is not None and not force and os.path.exists(path):
+            if entry['shards'] == signature:
+                result['unchanged'] += 1
+                continue
+            if set(entry['shards']) - set(signature):
+                # Rebuilding would lose the rows of the shards that are gone
+                # (e.g. deleted after upload); the compacted file has them
+                shards = {name: shard for name, shard in shards.items()
+                          if entry['shards'].get(name) != signature[name]}
+                if not shards:
+                    result['kept'] += 1
+                    continue
+                previous = entry['shards']
+
+        telemetry_key, _, date = os.path.basename(group).rpartition('_')
+        frame = read_shards(telemetry_key, [shard_path for shard_path, _ in
+                                            sorted(shards.values(), key=lambda item: item[0])])
+        if previous is not None:
+            logger.info("Appending %d shards to %s, whose other shards were removed", len(shards), rel_path)
+            frame = merge_frames(read_frame(path, fmt), frame)
+            # The removed shards stay in the signature: their rows are in the file
+            signature = dict(previous, **signature)
+            result['merged'] += 1
+        write_frame(frame, path, fmt, compression)
+        files[rel_path] = {'telemetry': telemetry_key, 'date': date, 'shards': signature,
+                           'summary': summarize(frame)}
+        # Saved along the way, so an interrupted run keeps most of what it did
+        if time.monotonic() - saved >= MANIFEST_SAVE_SECONDS:
+            save_manifest(output_dir, files)
+            saved = time.monotonic()
+
+        result['written'] += 1
+        result['shards'] += len(shards)
+        result['rows'] += len(frame)
+        result['input_bytes'] += sum(stat.st_size for _, stat in shards.values())
+        result['output_bytes'] += os.path.getsize(path)
+
+    if result['written']:
+        save_manifest(output_dir, files)
+    write_summary(output_dir, files)
+    return result
+
+
+def load_compacted(output_dir, telemetry_key, fmt=PARQUET):
+    """
+    Loads every compacted file of a telemetry type into one DataFrame.
+    """
+    suffix = f'.{fmt}'
+    frames = []
+    for root, _, filenames in os.walk(output_dir):
+        for filename in sorted(filenames):
+            if filename.endswith(suffix) and filename[:-len(suffix)].rpartition('_')[0] == telemetry_key:
+                frames.append(read_frame(os.path.join(root, filename), fmt))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    parser = argparse.ArgumentParser(description="Compact hourly csv shards into daily Parquet/Feather files.")
+    parser.add_argument("data_dirs", nargs='+', help="logging directories, e.g. data-*")
+    parser.add_argument("--output-dir", default='compacted', help="directory for the compacted files")
+    parser.add_argument("--format", choices=FORMATS, default=PARQUET, help="output file format")
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION, help="compression codec (zstd, lz4, snappy)")
+    parser.add_argument("--min-age", type=float, default=DEFAULT_MIN_AGE_SECONDS,
+                        help="skip shards modified less than this many seconds ago")
+    parser.add_argument("--force", action="store_true", help="rebuild unchanged days too")
+    args = parser.parse_args()
+
+    start = time.time()
+    try:
+        result = compact(args.data_dirs, args.output_dir, args.format, args.compression, args.min_age, args.force)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    ratio = result['output_bytes'] / result['input_bytes'] if result['input_bytes'] else 0
+    print(f"Compacted {result['shards']} shards ({result['rows']} rows) into {result['written']} files "
+          f"in {time.time() - start:.1f} s, {result['input_bytes']} -> {result['output_bytes']} bytes "
+          f"({ratio:.0%}); {result['unchanged']} unchanged, {result['merged']} merged, {result['kept']} kept")
@@ -0,0 +1,108 @@
+"""
+Duplicate Packet Suppression
+
+Meshtastic floods packets through the mesh, so the logger node can hear the
+same packet several times (the original and rebroadcasts, or the same
+packet through two radios). A packet is identified by its sender and packet
+id; DedupCache remembers the ids seen within a time window, in a fixed
+number of entries, so on_receive can drop copies before doing any
+formatting or I/O.
+
+Memory is bounded: at most max_entries ids are kept (oldest evicted first)
+and ids older than the window are expired as new ones arrive. Duplicates are
+counted per sender.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+DEFAULT_WINDOW_SECONDS = 600.0
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class DedupCache:
+    """
+    Time-windowed LRU set of (sender, packet id). Entries are kept in arrival
+    order and never refreshed by a duplicate, so the oldest entry is always
+    first and expiry only looks at the front.
+    """
+
+    def __init__(self, window_seconds=DEFAULT_WINDOW_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Parameters:
+        - window_seconds: float, how long a packet id is remembered
+        - max_entries: int, ids remembered at most (bounds memory)
+        """
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.evicted = 0
+        self.duplicates_by_node = Counter()
+
+    def is_duplicate(self, sender, packet_id, now=None):
+        """
+        Records a packet and tells whether it was already seen within the window.
+        Packets without an id (id 0 or missing) are never treated as duplicates.
+
+        Parameters:
+        - sender: int, packet['from']
+        - packet_id: int, packet['id']
+        - now: float, monotonic time (default: time.monotonic())
+
+        Returns:
+        - bool, True if the packet is a duplicate and should be dropped
+        """
+        if not packet_id or sender is None:
+            return False
+        now = now if now is not None else time.monotonic()
+        key = (sender, packet_id)
+        seen = self._seen
+        with self._lock:
+            self.checked += 1
+            first_seen = seen.get(key)
+            if first_seen is not None and now - first_seen <= self.window_seconds:
+                self.duplicates += 1
+                self.duplicates_by_node[sender] += 1
+                return True
+
+            # New packet, or the same id reused after the window
+            seen.pop(key, None)
+            seen[key] = now
+            cutoff = now - self.window_seconds
+            while seen:
+                oldest_key, oldest_time = next(iter(seen.items()))
+                if oldest_time >= cutoff and len(seen) <= self.max_entries:
+                    break
+                if oldest_time >= cutoff:
+                    self.evicted += 1
+                del seen[oldest_key]
+            return False
+
+    def __len__(self):
+        return len(self._seen)
+
+    def duplicate_counts(self):
+        """
+        Returns {node id as hex string: duplicates dropped}.
+        """
+        with self._lock:
+            return {hex(node): count for node, count in self.duplicates_by_node.items()}
+
+    def stats(self):
+        """
+        Returns a dictionary snapshot of the cache statistics. 'evicted'
+        counts ids pushed out by max_entries before their window ended; if it
+        grows, copies arriving late may slip through and the cache should be
+        larger.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._seen),
+                'checked': self.checked,
+                'duplicates': self.duplicates,
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,504 @@
+"""
+Write-Ahead Journal for the Logger's csv/txt Files
+
+Snodes run on battery packs and a GPIO pin shuts them down, so a hard power
+cut is a normal event. Without a journal, the rows a writer thread holds
+since its last fsync (up to --fsync-interval seconds) can be lost, and a
+file can end in a half-written row. JournaledSink wraps a sink (FileSink):
+- every batch is appended to the journal as length-prefixed records with a
+  crc32 checksum, and the journal is fsynced once per batch (group commit)
+  before the rows go to their files. A committed row survives a power cut
+  whatever state its file is left in
+- the first time a file is written after a checkpoint, its size is
+  journaled first (a mark)
+- a checkpoint (the writer's fsync, every --fsync-interval seconds) fsyncs
+  the files written since the last one and empties the journal, so the
+  journal only ever holds the rows of one interval
+- a file the sink could not write, flush or fsync is not checkpointed: it
+  is cut back to its mark and its rows are written again, and if that fails
+  too, its mark and rows stay in the journal until a later checkpoint (or
+  recover()) gets them into the file
+
+recover() runs at startup, before the writers. It cuts every marked file
+back to its size at the mark, which also drops any half-written row, and
+then writes the journal's rows again. Doing that twice gives the same
+files, so a power cut during recovery is fine too. A torn record at the end
+of the journal (the batch being committed at the power cut) fails its
+checksum and is ignored, along with anything after it. Rows whose file
+cannot be cut back or written (e.g. its directory was deleted) are skipped
+and counted, so one bad file does not keep the others from being recovered.
+
+The journal files live in a hidden directory (.journal/ in the snode
+directory), which the uploader and the storage governor skip.
+
+Command: python scripts/journal.py [<journal dir>] [--recover]
+from snode directory (lists what the journals hold, or replays them into their files)
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import zlib
+from itertools import count
+
+from log_writer import FileSink, TXT_RECORD
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = '.journal'
+JOURNAL_SUFFIX = '.journal'
+
+# Journal record: payload length and crc32 of the payload, then the payload
+# (JSON of the entry)
+_HEADER = struct.Struct('<II')
+# Anything longer is a corrupt header, not a record
+MAX_RECORD_BYTES = 1 << 24
+
+# Journal entries: [ENTRY_MARK, output, size before the first write since the
+# checkpoint (-1 = did not exist)] or [ENTRY_RECORD, record]
+ENTRY_MARK = 'm'
+ENTRY_RECORD = 'r'
+
+# Records of a file that keeps failing are kept in the journal up to this
+# many, then given up on (the file stays as the sink left it)
+MAX_CARRIED_RECORDS = 10000
+
+
+def encode_entry(entry):
+    """
+    Returns the bytes of a journal record holding entry (a JSON-serializable list).
+    """
+    payload = json.dumps(entry, separators=(',', ':'), default=str).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_entries(path):
+    """
+    Reads the journal up to its first incomplete or corrupt record.
+
+    Returns:
+    - (list of entries, bytes of valid records)
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    entries = []
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start:start + length]
+        if length > MAX_RECORD_BYTES or len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        try:
+            entries.append(json.loads(payload))
+        except ValueError:
+            break
+        offset = start + length
+    return entries, offset
+
+
+def _journaled(record):
+    """
+    Returns the record as journaled. txt data is written as str() anyway,
+    and packets may hold objects JSON cannot restore.
+    """
+    kind, filename, headers, data = record
+    return [kind, filename, headers, str(data) if kind == TXT_RECORD else data]
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _cut_back(output, size):
+    """
+    Cuts a file back to its size at a mark, or removes it if it did not
+    exist then. Never extends a file: a shorter one lost unsynced rows,
+    which the journal's records put back.
+
+    Returns:
+    - int, bytes cut, or None if the file was left as it is
+    """
+    try:
+        current = os.path.getsize(output)
+    except FileNotFoundError:
+        return None
+    if current <= size:
+        return None
+    if size < 0:
+        os.remove(output)
+    else:
+        os.truncate(output, size)
+    return current - max(size, 0)
+
+
+################################################
+# Sink
+################################################
+
+class JournaledSink:
+    """
+    Wraps a sink whose records are written to the files given by its
+    record_key(), journaling every batch before it is written. Same
+    interface as the wrapped sink; flush(fsync=True) is the checkpoint.
+    Only the writer thread should call into a sink.
+    """
+
+    def __init__(self, sink, path):
+        """
+        Parameters:
+        - sink: FileSink (or a sink with the same records and close_file())
+        - path: str, journal file of this sink (emptied if it exists; run
+          recover() first)
+        """
+        self.sink = sink
+        self.path = path
+        self.record_key = sink.record_key
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # O_APPEND: writes after a checkpoint's truncation start at offset 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._size = 0
+        # Outputs written since the last checkpoint -> size at their mark
+        self._marks = {}
+        # Journaled records of those outputs, written again if they fail
+        self._records = {}
+        # Outputs the sink could not write, flush or fsync since their mark
+        self._failed = set()
+        self.committed = 0
+        self.commits = 0
+        self.checkpoints = 0
+        self.journal_errors = 0
+        self.repaired = 0
+        self.abandoned = 0
+        self.max_journal_bytes = 0
+
+    def write_batch(self, records):
+        """
+        Journals the batch (one write and one fsync), then hands it to the
+        wrapped sink. If the journal cannot be written (e.g. the SD card is
+        full), the files are checkpointed instead and the batch is written
+        without the journal.
+
+        Returns:
+        - list of the records the wrapped sink could not write (they stay
+          in the journal until their file is written again)
+        """
+        chunks = []
+        marks = {}
+        journaled = []
+        for record in records:
+            output = self.record_key(record)
+            if output not in self._marks and output not in marks:
+                try:
+                    size = os.path.getsize(output)
+                except FileNotFoundError:
+                    size = -1
+                chunks.append(encode_entry([ENTRY_MARK, output, size]))
+                marks[output] = size
+            entry = _journaled(record)
+            chunks.append(encode_entry([ENTRY_RECORD, entry]))
+            journaled.append((output, entry))
+        data = b''.join(chunks)
+        try:
+            _write_all(self._fd, data)
+            os.fsync(self._fd)
+        except OSError as e:
+            self.journal_errors += 1
+            logger.error("Could not write the journal %s, writing %d records without it: %s",
+                         self.path, len(records), e)
+            # Cut off the partial record, and make what the journal covers
+            # durable, since its marks no longer describe the files
+            try:
+                os.ftruncate(self._fd, self._size)
+                self.flush(fsync=True)
+            except OSError as e:
+                logger.error("Could not checkpoint the journal %s: %s", self.path, e)
+            # Files still failing are cut back to their mark when written
+            # again, so their rows of this batch must be written with them
+            journaled = [(output, entry) for output, entry in journaled if output in self._marks]
+        else:
+            self._size += len(data)
+            self._marks.update(marks)
+            self.committed += len(records)
+            self.commits += 1
+            self.max_journal_bytes = max(self.max_journal_bytes, self._size)
+        for output, entry in journaled:
+            self._records.setdefault(output, []).append(entry)
+        failed = list(self.sink.write_batch(records) or ())
+        self._failed.update(output for output in map(self.record_key, failed) if output in self._marks)
+        return failed
+
+    def flush(self, fsync=False):
+        """
+        Hands the written records to the OS. With fsync, also checkpoints:
+        fsyncs every file written since the last checkpoint and empties the
+        journal, keeping only the files the sink could not write.
+
+        Returns:
+        - set of the files that could not be flushed or fsynced
+        """
+        failed = set(self.sink.flush(fsync=False) or ())
+        self._failed.update(output for output in failed if output in self._marks)
+        if fsync:
+            failed |= self._checkpoint()
+        return failed
+
+    def _repair(self, output):
+        """
+        Cuts a file that failed back to its mark and writes its journaled
+        records again.
+
+        Returns:
+        - bool, whether the file now holds all of them, fsynced
+        """
+        records = [tuple(entry) for entry in self._records.get(output, [])]
+        try:
+            self.sink.close_file(output)
+            _cut_back(output, self._marks[output])
+            if self.sink.write_batch(records) or output in self.sink.flush(fsync=False):
+                return False
+            _fsync_path(output)
+        except OSError as e:
+            logger.error("Could not write %s again from the journal: %s", output, e)
+            return False
+        self._failed.discard(output)
+        self.repaired += len(records)
+        logger.info("Wrote %d journaled records of %s again", len(records), output)
+        return True
+
+    def _replace_journal(self, data):
+        """
+        Atomically replaces the journal with data, so a power cut leaves
+        either the old journal or the new one.
+        """
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _write_all(fd, data)
+            os.fsync(fd)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.close(fd)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.close(self._fd)
+        self._fd = fd
+        _fsync_path(os.path.dirname(self.path) or '.')
+
+    def _checkpoint(self):
+        """
+        Fsyncs the files written since the last checkpoint and writes again
+        the ones that failed. The journal is emptied but for the files that
+        still fail, which keep their mark and records.
+
+        Returns:
+        - set of the files that could not be fsynced
+        """
+        failed = set()
+        # Files closed by the sink since the last checkpoint are fsynced too
+        for output in self._marks:
+            if output in self._failed:
+                continue
+            try:
+                _fsync_path(output)
+            except OSError as e:
+                logger.error("Could not fsync %s: %s", output, e)
+                failed.add(output)
+        self._failed |= failed
+
+        marks = {}
+        chunks = []
+        for output, size in self._marks.items():
+            if output not in self._failed or self._repair(output):
+                continue
+            records = self._records.get(output, [])
+            if len(records) > MAX_CARRIED_RECORDS:
+                self.abandoned += len(records)
+                logger.error("Giving up on %d journaled records of %s, which keeps failing", len(records), output)
+                continue
+            marks[output] = size
+            chunks.append(encode_entry([ENTRY_MARK, output, size]))
+            chunks.extend(encode_entry([ENTRY_RECORD, entry]) for entry in records)
+        data = b''.join(chunks)
+        if data:
+            try:
+                self._replace_journal(data)
+            except OSError as e:
+                # The old journal still covers every file written since its
+                # marks, so it is kept as it is until the next checkpoint
+                self.journal_errors += 1
+                logger.error("Could not rewrite the journal %s: %s", self.path, e)
+                return failed
+        else:
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+        self._size = len(data)
+        self._marks = marks
+        self._records = {output: self._records.get(output, []) for output in marks}
+        self._failed = set(marks)
+        self.max_journal_bytes = max(self.max_journal_bytes, self._size)
+        self.checkpoints += 1
+        return failed
+
+    def close(self):
+        """
+        Checkpoints and closes the wrapped sink. The journal is removed,
+        unless it still holds records of files that failed (recover()
+        writes them at the next start).
+        """
+        self.flush(fsync=True)
+        self.sink.close()
+        os.close(self._fd)
+        if self._marks:
+            logger.warning("Keeping the journal %s: %d files could not be written", self.path, len(self._marks))
+        else:
+            os.remove(self.path)
+
+    def stats(self):
+        return {'committed': self.committed, 'commits': self.commits, 'checkpoints': self.checkpoints,
+                'journal_errors': self.journal_errors, 'repaired': self.repaired, 'abandoned': self.abandoned,
+                'failed_files': len(self._failed), 'journal_bytes': self._size,
+                'max_journal_bytes': self.max_journal_bytes}
+
+
+class JournaledSinkFactory:
+    """
+    Sink factory for ShardedWriter: each shard's sink gets a journal of its
+    own in journal_dir.
+    """
+
+    def __init__(self, sink_factory=FileSink, journal_dir=JOURNAL_DIR, prefix='files'):
+        self.sink_factory = sink_factory
+        self.journal_dir = journal_dir
+        self.prefix = prefix
+        self.sinks = []
+        self._index = count()
+
+    def __call__(self):
+        path = os.path.join(self.journal_dir, f'{self.prefix}-{next(self._index)}{JOURNAL_SUFFIX}')
+        sink = JournaledSink(self.sink_factory(), path)
+        self.sinks.append(sink)
+        return sink
+
+    def stats(self):
+        """
+        Returns the statistics of all journals combined.
+        """
+        combined = {}
+        for sink in self.sinks:
+            for key, value in sink.stats().items():
+                if key.startswith('max_'):
+                    combined[key] = max(combined.get(key, 0), value)
+                else:
+                    combined[key] = combined.get(key, 0) + value
+        return combined
+
+
+################################################
+# Recovery
+################################################
+
+def recover(journal_dir=JOURNAL_DIR, sink_factory=FileSink):
+    """
+    Replays every journal in journal_dir into its files (see the module
+    docstring) and removes it. Run before the writers start. Records whose
+    file cannot be cut back or written are skipped and counted.
+
+    Parameters:
+    - journal_dir: str, directory of the journals
+    - sink_factory: callable returning the sink that writes the records
+
+    Returns:
+    - dict summarizing the recovery
+    """
+    summary = {'journals': 0, 'records': 0, 'skipped': 0, 'files_cut': 0, 'bytes_cut': 0, 'torn_bytes': 0}
+    if not os.path.isdir(journal_dir):
+        return summary
+    for name in sorted(os.listdir(journal_dir)):
+        if not name.endswith(JOURNAL_SUFFIX):
+            continue
+        path = os.path.join(journal_dir, name)
+        entries, valid_bytes = read_entries(path)
+        summary['journals'] += 1
+        summary['torn_bytes'] += os.path.getsize(path) - valid_bytes
+        records = []
+        # Files that could not be cut back: replaying them would duplicate rows
+        uncut = set()
+        for entry in entries:
+            if entry[0] == ENTRY_MARK:
+                _, output, size = entry
+                try:
+                    cut = _cut_back(output, size)
+                except OSError as e:
+                    logger.error("Could not cut %s back to %d bytes, skipping its records: %s", output, size, e)
+                    uncut.add(output)
+                    continue
+                if cut is not None:
+                    summary['files_cut'] += 1
+                    summary['bytes_cut'] += cut
+            else:
+                records.append(tuple(entry[1]))
+        sink = sink_factory()
+        replay = [record for record in records if sink.record_key(record) not in uncut]
+        written = 0
+        if replay:
+            failed_ids = {id(record) for record in sink.write_batch(replay) or ()}
+            failed_outputs = set(sink.flush(fsync=True) or ())
+            sink.close()
+            outputs = set()
+            for record in replay:
+                if id(record) not in failed_ids and sink.record_key(record) not in failed_outputs:
+                    outputs.add(sink.record_key(record))
+                    written += 1
+            for output in outputs:
+                try:
+                    _fsync_path(output)
+                except OSError as e:
+                    logger.error("Could not fsync %s: %s", output, e)
+        summary['records'] += written
+        summary['skipped'] += len(records) - written
+        os.remove(path)
+        if written < len(records):
+            logger.error("Skipped %d of the %d records in %s: their files could not be written",
+                         len(records) - written, len(records), path)
+        logger.info("Recovered %d records from %s", written, path)
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    parser = argparse.ArgumentParser(description="List or replay the logger's write-ahead journals.")
+    parser.add_argument("journal_dir", nargs='?', default=JOURNAL_DIR, help="directory of the journals")
+    parser.add_argument("--recover", action="store_true", help="replay the journals into their files")
+    args = parser.parse_args()
+
+    if args.recover:
+        print(recover(args.journal_dir))
+    elif os.path.isdir(args.journal_dir):
+        for name in sorted(os.listdir(args.journal_dir)):
+            path = os.path.join(args.journal_dir, name)
+            entries, valid_bytes = read_entries(path)
+            marks = [entry for entry in entries if entry[0] == ENTRY_MARK]
+            print(f"{name}: {len(entries) - len(marks)} records, {len(marks)} files, "
+                  f"{os.path.getsize(path) - valid_bytes} torn bytes")
@@ -0,0 +1,450 @@
+"""
+Real-Time Telemetry Feed over HTTP
+
+Serves newly decoded telemetry from the logger process to phones on the
+Pi's access point (ini_accesspoint.sh), instead of minutes later through
+the Drive upload:
+- GET /events  Server-Sent Events stream, one 'telemetry' event per packet
+               (EventSource in any browser; reconnects resume from the
+               Last-Event-ID the browser sends)
+- GET /latest  latest values per node (and telemetry type) as JSON, from memory
+- GET /rollups newest open rollup window per node and metric, if rollups run
+- GET /stats   feed statistics
+- GET /        a small page that shows the latest values live
+
+SSE rather than WebSocket: the feed only goes one way, works through plain
+HTTP with the standard library, and browsers reconnect by themselves.
+
+publish() is called from on_receive and never touches a socket: it stores
+the event in a ring buffer of the last --http-buffer events and wakes one
+sender thread. The sender writes to every stream from a selector loop over
+non-blocking sockets, so a publish costs the same with one phone or fifty,
+and an event is encoded once for all clients. A client that falls further
+behind than the ring is skipped ahead and the skipped events are counted,
+so a stalled phone holds no more than the ring in memory and never slows
+down on_receive or the other clients. The HTTP server threads only parse
+requests and answer the JSON endpoints.
+
+Command: python scripts/live_feed.py [--port 8080] [--rate 5]
+from snode directory (serves synthetic telemetry, for trying out clients)
+"""
+
+import argparse
+import json
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8080
+DEFAULT_BUFFER_EVENTS = 1024
+DEFAULT_MAX_CLIENTS = 64
+
+# Comment lines sent to idle streams, so dead clients are noticed and
+# proxies do not time out
+HEARTBEAT_SECONDS = 15.0
+# A client that does not accept data for this long is disconnected
+SEND_TIMEOUT_SECONDS = 10.0
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>smesh live</title>
+<style>body{font-family:sans-serif;margin:1em}table{border-collapse:collapse}
+td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}</style></head>
+<body><h3>smesh live telemetry</h3><p id="status">connecting...</p><table id="t"></table>
+<script>
+const latest = {};
+// Node ids, keys and values come from the mesh: set as text, never as HTML
+function cell(tag, text) {
+  const element = document.createElement(tag);
+  element.textContent = text;
+  return element;
+}
+function render() {
+  const rows = [];
+  for (const node of Object.keys(latest).sort()) {
+    for (const [key, values] of Object.entries(latest[node])) {
+      const fields = Object.entries(values).map(([k, v]) => k + '=' + v).join(' ');
+      const row = document.createElement('tr');
+      row.append(cell('th', node), cell('td', key), cell('td', fields));
+      row.lastChild.style.textAlign = 'left';
+      rows.push(row);
+    }
+  }
+  document.getElementById('t').replaceChildren(...rows);
+}
+fetch('/latest').then(r => r.json()).then(j => { Object.assign(latest, j.nodes); render(); });
+const source = new EventSource('/events');
+source.onopen = () => document.getElementById('status').textContent = 'live';
+source.onerror = () => document.getElementById('status').textContent = 'reconnecting...';
+source.addEventListener('telemetry', e => {
+  const event = JSON.parse(e.data);
+  latest[event.fromNode] = Object.assign(latest[event.fromNode] || {}, event.sections);
+  render();
+});
+</script></body></html>
+"""
+
+
+class _Stream:
+    """
+    One /events client, owned by the sender thread.
+    """
+
+    __slots__ = ('sock', 'seq', 'pending', 'last_progress', 'last_sent', 'registered', 'done')
+
+    def __init__(self, sock, seq):
+        now = time.monotonic()
+        self.sock = sock
+        self.seq = seq
+        self.pending = b''
+        self.last_progress = now
+        self.last_sent = now
+        self.registered = False
+        # Set when the sender is done with the client; its handler thread
+        # waits on it and then closes the connection
+        self.done = threading.Event()
+
+
+class LiveFeed:
+    """
+    Latest values per node, a ring buffer of recent events, the sender
+    thread that streams them, and the HTTP server.
+    """
+
+    def __init__(self, buffer_events=DEFAULT_BUFFER_EVENTS, max_clients=DEFAULT_MAX_CLIENTS, rollups=None):
+        """
+        Parameters:
+        - buffer_events: int, events kept for clients that are behind or reconnect
+        - max_clients: int, concurrent /events streams; more get 503
+        - rollups: rollups.RollupEngine, served on /rollups, or None
+        """
+        self.buffer_events = buffer_events
+        self.max_clients = max_clients
+        self.rollups = rollups
+        # (seq, event dict, [encoded bytes or None]); encoded by the sender
+        # the first time a client needs it
+        self._events = deque(maxlen=buffer_events)
+        self._seq = 0
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._server = None
+        self._thread = None
+        self._sender = None
+        self._selector = None
+        self._wakeup_r = self._wakeup_w = None
+        self._wakeup_pending = False
+        self._new_streams = []
+        self._streams = []
+        self.clients = 0
+        self.published = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.max_publish_us = 0.0
+
+    ################################################
+    # Receive path
+    ################################################
+
+    def publish(self, from_node, sections, curr_date_time=None, via=None, packet=None):
+        """
+        Adds the telemetry of one packet. Only updates memory (and wakes the
+        sender); safe to call from any radio's reader thread.
+
+        Parameters:
+        - from_node: str, node id
+        - sections: dict, telemetry type -> metrics dict
+        - curr_date_time: str, receive time (default: now)
+        - via: str, logger node that received it
+        - packet: dict, for the signal fields (rxSnr, rxRssi, hops)
+        """
+        start = time.perf_counter()
+        event = {'datetime': curr_date_time or str(datetime.now()), 'fromNode': from_node, 'via': via,
+                 'sections': sections}
+        if packet is not None:
+            event.update(rxSnr=packet.get('rxSnr'), rxRssi=packet.get('rxRssi'),
+                         hopStart=packet.get('hopStart'), hopLimit=packet.get('hopLimit'))
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, event, [None]))
+            latest = self._latest.setdefault(from_node, {})
+            for telemetry_key, metrics in sections.items():
+                latest[telemetry_key] = dict(metrics, datetime=event['datetime'])
+            self.published += 1
+            wake = self._streams and not self._wakeup_pending
+            if wake:
+                self._wakeup_pending = True
+        if wake:
+            self._wake()
+        elapsed = (time.perf_counter() - start) * 1e6
+        if elapsed > self.max_publish_us:
+            self.max_publish_us = elapsed
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError, AttributeError):
+            pass  # already has a wakeup waiting, or not started/closed
+
+    ################################################
+    # Client side
+    ################################################
+
+    def latest(self):
+        with self._lock:
+            return {node: {key: dict(values) for key, values in sections.items()}
+                    for node, sections in self._latest.items()}
+
+    def stats(self):
+        return {'clients': self.clients, 'published': self.published, 'skipped': self.skipped,
+                'rejected': self.rejected, 'dropped': self.dropped, 'buffered': len(self._events),
+                'max_publish_us': round(self.max_publish_us, 1)}
+
+    def _events_after(self, seq):
+        """
+        Returns (events after seq, number skipped because they left the ring).
+        """
+        with self._lock:
+            events = self._events
+            if not events or self._seq <= seq:
+                return [], 0
+            # Sequence numbers are contiguous, so the position follows from
+            # seq; clients are normally near the end, where indexing is cheap
+            first = events[0][0]
+            skipped = max(0, first - seq - 1)
+            return [events[i] for i in range(max(0, seq + 1 - first), len(events))], skipped
+
+    @staticmethod
+    def encode(entry):
+        seq, event, encoded = entry
+        if encoded[0] is None:
+            encoded[0] = f'id: {seq}\nevent: telemetry\ndata: {json.dumps(event, default=str)}\n\n'.encode()
+        return encoded[0]
+
+    def stream(self, handler):
+        """
+        Sends the headers to one /events client, hands its socket to the
+        sender thread and waits until the client is gone.
+        """
+        last_id = handler.headers.get('Last-Event-ID')
+        with self._lock:
+            full = self.clients >= self.max_clients or self._closed
+            if full:
+                self.rejected += 1
+            else:
+                self.clients += 1
+            # New clients start with the next event; reconnects catch up
+            seq = int(last_id) if last_id and last_id.isdigit() and int(last_id) <= self._seq else self._seq
+        if full:
+            handler.send_error(503, "Too many clients")
+            return
+        try:
+            handler.connection.settimeout(SEND_TIMEOUT_SECONDS)
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'text/event-stream')
+            handler.send_header('Cache-Control', 'no-cache')
+            handler.send_header('Access-Control-Allow-Origin', '*')
+            handler.end_headers()
+            handler.wfile.write(b'retry: 3000\n\n')
+            handler.wfile.flush()
+            handler.connection.setblocking(False)
+            stream = _Stream(handler.connection, seq)
+            with self._lock:
+                self._new_streams.append(stream)
+                self._wakeup_pending = True
+            self._wake()
+            stream.done.wait()
+        except (OSError, ValueError):
+            pass  # client went away (or timed out)
+        finally:
+            with self._lock:
+                self.clients -= 1
+
+    ################################################
+    # Sender
+    ################################################
+
+    def _drop(self, stream):
+        if stream.registered:
+            self._selector.unregister(stream.sock)
+        self._streams.remove(stream)
+        stream.done.set()
+
+    def _send(self, stream, now):
+        """
+        Writes as much of the stream's pending bytes as the socket takes
+        without blocking. Returns False if the client was dropped.
+        """
+        try:
+            sent = stream.sock.send(stream.pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(stream)
+            return False
+        if sent:
+            stream.pending = stream.pending[sent:]
+            stream.last_progress = stream.last_sent = now
+        if stream.pending and now - stream.last_progress > SEND_TIMEOUT_SECONDS:
+            self.dropped += 1
+            self._drop(stream)
+            return False
+        # Only streams with a full socket buffer are watched for writability
+        if stream.pending and not stream.registered:
+            self._selector.register(stream.sock, selectors.EVENT_WRITE, stream)
+            stream.registered = True
+        elif not stream.pending and stream.registered:
+            self._selector.unregister(stream.sock)
+            stream.registered = False
+        return True
+
+    def _run(self):
+        while not self._closed:
+            self._selector.select(timeout=1.0)
+            try:
+                while self._wakeup_r.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+            with self._lock:
+                self._wakeup_pending = False
+                self._streams.extend(self._new_streams)
+                self._new_streams.clear()
+            now = time.monotonic()
+            for stream in list(self._streams):
+                # New events are only taken once the previous ones are out,
+                # so a slow client holds at most the ring
+                if not stream.pending:
+                    events, skipped = self._events_after(stream.seq)
+                    if skipped:
+                        self.skipped += skipped
+                    if events:
+                        stream.pending = b''.join(self.encode(entry) for entry in events)
+                        stream.seq = events[-1][0]
+                    elif now - stream.last_sent >= HEARTBEAT_SECONDS:
+                        stream.pending = b': keepalive\n\n'
+                if stream.pending:
+                    self._send(stream, now)
+        with self._lock:
+            self._streams.extend(self._new_streams)
+            self._new_streams.clear()
+        for stream in list(self._streams):
+            self._drop(stream)
+
+    ################################################
+    # Server
+    ################################################
+
+    def start(self, host='0.0.0.0', port=DEFAULT_PORT):
+        """
+        Starts the HTTP server and the sender, each on a thread of its own.
+
+        Raises:
+        - OSError if the port cannot be bound
+        """
+        handler = type('Handler', (FeedRequestHandler,), {'feed': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._sender = threading.Thread(target=self._run, name="LiveFeedSender", daemon=True)
+        self._sender.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="LiveFeed", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server is not None else None
+
+    def close(self):
+        self._closed = True
+        if self._sender is not None:
+            self._wake()
+            self._sender.join()
+            self._selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes the feed's endpoints; LiveFeed.start() sets feed.
+    """
+
+    feed = None
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, value):
+        body = json.dumps(value, default=str).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/events':
+            self.close_connection = True
+            self.feed.stream(self)
+        elif url.path == '/latest':
+            self._send_json({'time': time.time(), 'nodes': self.feed.latest()})
+        elif url.path == '/rollups':
+            node = parse_qs(url.query).get('node', [None])[0]
+            self._send_json(self.feed.rollups.latest(node) if self.feed.rollups is not None else [])
+        elif url.path == '/stats':
+            self._send_json(self.feed.stats())
+        elif url.path == '/':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        # Requests go to the logger at DEBUG, not to stderr
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    parser = argparse.ArgumentParser(description="Serve a live feed of synthetic telemetry.")
+    parser.add_argument("--host", default='0.0.0.0', help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--rate", type=float, default=5.0, help="synthetic packets per second")
+    parser.add_argument("--nodes", type=int, default=5, help="synthetic sensor nodes")
+    args = parser.parse_args()
+
+    feed = LiveFeed().start(args.host, args.port)
+    logger.info("Serving on http://%s:%d/", args.host, feed.port)
+    rng = random.Random(0)
+    try:
+        while True:
+            node = f'0x{0x10000000 + rng.randrange(args.nodes):08x}'
+            feed.publish(node, {'airQualityMetrics': {'pm25Standard': rng.randrange(300)},
+                                'environmentMetrics': {'temperature': round(rng.uniform(15, 40), 1)}})
+            time.sleep(1 / args.rate)
+    except KeyboardInterrupt:
+        feed.close()
+        logger.info("Feed stats %s", feed.stats())
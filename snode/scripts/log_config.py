@@ -0,0 +1,123 @@
+"""
+Structured, Level-Gated Logging for the Logger Scripts
+
+Replaces the print statements on the packet path. Messages use %-style
+arguments, so anything below the configured level (e.g. full packet dumps at
+DEBUG) is never formatted. Output is one compact line per message:
+
+    2024-12-17 13:07:56,123 INFO rpi_log: rx from=0x12345678 id=42 ...
+
+A rate limiter keeps repeated messages (e.g. the same error on every packet)
+from flooding rpi_stdouterr.txt, and thread dumps moved behind --debug-threads
+or a SIGUSR1 signal (kill -USR1 <pid>).
+"""
+
+import logging
+import signal
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records with the same logger, level and message
+    template through per `interval` seconds. Once a window ends, the next
+    record that gets through notes how many were suppressed.
+
+    Only records at min_level and above are limited, so the per-packet INFO
+    line is never dropped, while an error repeated on every packet is.
+    """
+
+    def __init__(self, burst=10, interval=60.0, min_level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.min_level = min_level
+        # (name, levelno, msg) -> [window start, count in window, suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [suppressed {suppressed} similar messages]"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def setup_logging(level='INFO', stream=None, burst=10, interval=60.0):
+    """
+    Configures the root logger with one compact handler.
+
+    Parameters:
+    - level: str or int, minimum level to emit
+    - stream: file-like object to write to (default: sys.stdout, which the
+      start scripts redirect to a log file)
+    - burst: int, identical messages allowed per interval before suppression
+    - interval: float, rate limiting window in seconds
+    """
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter(burst=burst, interval=interval))
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def log_active_threads(logger, level=logging.INFO):
+    """
+    Logs every active thread, with the main and current thread marked.
+    Formatting walks threading.enumerate(), so keep this off the packet path.
+
+    Parameters:
+    - logger: logging.Logger to write to
+    - level: int, level to log at
+    """
+    main = threading.main_thread()
+    current = threading.current_thread()
+    threads = '; '.join(f"name={thread.name} id={thread.ident} daemon={thread.daemon}"
+                        f"{' [main]' if thread is main else ''}" for thread in threading.enumerate())
+    # One record for the whole dump, so the rate limiter treats it as one message
+    logger.log(level, "%d active threads (current: %s): %s", threading.active_count(), current.name, threads)
+
+
+def install_thread_dump_handler(logger, extra=None, signum=None):
+    """
+    Dumps threads (and optionally extra status) to the log on a signal,
+    e.g. `kill -USR1 <pid>`. Does nothing where the signal does not exist.
+
+    Parameters:
+    - logger: logging.Logger to write to
+    - extra: callable returning a value to log with the dump (e.g. writer stats)
+    - signum: signal number, defaults to SIGUSR1
+    """
+    signum = signum if signum is not None else getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return
+
+    def handler(received_signum, frame):
+        log_active_threads(logger, logging.WARNING)
+        if extra is not None:
+            logger.warning("status %s", extra())
+
+    signal.signal(signum, handler)
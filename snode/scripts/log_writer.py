@@ -0,0 +1,506 @@
+"""
+Batched Writer Thread for the Raspberry Pi Logging Script
+
+on_receive runs on the meshtastic reader thread, so any time it spends on the
+SD card is time the serial port is not being read. This module moves the disk
+work onto a dedicated writer thread:
+- on_receive only enqueues records onto a bounded queue (never blocks; if the
+  queue is full the record is dropped and counted)
+- the writer thread keeps the output files open and writes records in batches
+- a batch is flushed once it reaches batch_size records or once its oldest
+  record is flush_interval seconds old
+- fsync is controlled by a policy ('never', 'batch' or 'interval')
+
+The writer reports queue depth, batch size and flush latency through stats()
+so we can check that the receive path never waits on the disk. Records that
+are dropped (queue full) or lost (failed write) are also counted per output
+file, for sinks that implement record_key().
+
+ShardedWriter runs several writer threads, each owning its own sink and a
+fixed subset of the output files, so there is no lock shared between files
+and a slow fsync on one file does not hold up writes to the others.
+"""
+
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Record kinds understood by FileSink
+CSV_RECORD = 'csv'
+TXT_RECORD = 'txt'
+
+# fsync policies
+FSYNC_NEVER = 'never'        # leave it to the OS (fastest, least durable)
+FSYNC_BATCH = 'batch'        # fsync after every flushed batch
+FSYNC_INTERVAL = 'interval'  # fsync at most once every fsync_interval seconds
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL)
+
+# Sentinels placed on the queue to control the writer thread
+_STOP = object()
+
+
+class _FlushRequest:
+    """Asks the writer thread to flush everything queued before it."""
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+################################################
+# Sinks
+################################################
+
+class FileSink:
+    """
+    Writes csv and txt records to files that are kept open between batches.
+
+    Records are tuples of (kind, filename, headers, data):
+    - kind: CSV_RECORD or TXT_RECORD
+    - filename: str, path to the output file
+    - headers: list, csv headers written when the file is created (csv only)
+    - data: list for csv records, any object for txt records (written as str)
+
+    Only the writer thread should call into a sink.
+    """
+
+    def __init__(self, max_open_files=16, idle_close_seconds=300):
+        """
+        Parameters:
+        - max_open_files: int, least recently used files are closed past this
+        - idle_close_seconds: float, files not written for this long are closed
+          (e.g., last hour's shards once the logger has rotated)
+        """
+        self.max_open_files = max_open_files
+        self.idle_close_seconds = idle_close_seconds
+        # filename -> [file, csv writer, last write time]
+        self._files = OrderedDict()
+        self._dirty = set()
+
+    @staticmethod
+    def record_key(record):
+        """
+        Returns the output file of a record, for per-file statistics and sharding.
+        """
+        return record[1]
+
+    def _open(self, filename, headers):
+        entry = self._files.get(filename)
+        if entry is not None:
+            self._files.move_to_end(filename)
+            return entry
+
+        # Write headers for new file
+        is_new = not os.path.exists(filename)
+        file = open(filename, 'a', newline='')
+        writer = csv.writer(file)
+        if is_new and headers is not None:
+            writer.writerow(headers)
+
+        entry = [file, writer, time.monotonic()]
+        self._files[filename] = entry
+        while len(self._files) > self.max_open_files:
+            old_name, old_entry = self._files.popitem(last=False)
+            self._close_entry(old_name, old_entry)
+        return entry
+
+    def _close_entry(self, filename, entry):
+        self._dirty.discard(filename)
+        try:
+            entry[0].close()
+        except OSError as e:
+            logger.error("Could not close %s: %s", filename, e)
+
+    def _drop(self, filename, error):
+        """
+        Closes a file that failed, so the next record reopens it.
+        """
+        logger.error("Could not write %s: %s", filename, error)
+        entry = self._files.pop(filename, None)
+        if entry is not None:
+            self._close_entry(filename, entry)
+
+    def close_file(self, filename):
+        """
+        Flushes and closes one file if it is open (e.g. before it is cut back
+        to a known size), so the next record reopens it.
+        """
+        entry = self._files.pop(filename, None)
+        if entry is not None:
+            self._close_entry(filename, entry)
+
+    def write_batch(self, records):
+        """
+        Writes a batch of records. Data is only guaranteed to reach the OS
+        after flush() is called. A record that cannot be written (e.g. its
+        directory is missing) does not stop the others.
+
+        Returns:
+        - list of the records that could not be written
+        """
+        now = time.monotonic()
+        failed = []
+        failed_files = set()
+        for record in records:
+            kind, filename, headers, data = record
+            try:
+                entry = self._open(filename, headers)
+                if kind == CSV_RECORD:
+                    entry[1].writerow(data)
+                else:
+                    entry[0].write(f"{data}\n")
+            except Exception as e:
+                failed.append(record)
+                if filename not in failed_files:
+                    failed_files.add(filename)
+                    self._drop(filename, e)
+                continue
+            entry[2] = now
+            self._dirty.add(filename)
+        return failed
+
+    def flush(self, fsync=False):
+        """
+        Flushes every file written since the last flush.
+
+        Parameters:
+        - fsync: bool, also ask the OS to write the data to the SD card
+
+        Returns:
+        - set of the files that could not be flushed (their unflushed
+          records are lost)
+        """
+        failed = set()
+        for filename in list(self._dirty):
+            file = self._files[filename][0]
+            try:
+                file.flush()
+                if fsync:
+                    os.fsync(file.fileno())
+            except OSError as e:
+                failed.add(filename)
+                self._drop(filename, e)
+        self._dirty.clear()
+
+        # Close files that have not been written to in a while
+        cutoff = time.monotonic() - self.idle_close_seconds
+        for filename in [name for name, entry in self._files.items() if entry[2] < cutoff]:
+            self._close_entry(filename, self._files.pop(filename))
+        return failed
+
+    def close(self):
+        """
+        Flushes and closes every open file.
+        """
+        self.flush(fsync=True)
+        for filename, entry in self._files.items():
+            self._close_entry(filename, entry)
+        self._files.clear()
+
+
+################################################
+# Writer Thread
+################################################
+
+class BatchedWriter:
+    """
+    Owns a sink and a writer thread. Producers call submit(), which never
+    blocks; the writer thread batches records and hands them to the sink.
+    """
+
+    def __init__(self, sink, max_queue=10000, batch_size=64, flush_interval=2.0,
+                 fsync_policy=FSYNC_INTERVAL, fsync_interval=30.0, name="BatchedWriter"):
+        """
+        Parameters:
+        - sink: object with write_batch(records), flush(fsync) and close().
+          write_batch may return the records it could not write and flush
+          the outputs it could not flush; the rest count as written
+        - max_queue: int, records held in memory before submit() drops them
+        - batch_size: int, flush once this many records are waiting
+        - flush_interval: float, flush once the oldest waiting record is this old (s)
+        - fsync_policy: str, one of FSYNC_POLICIES
+        - fsync_interval: float, minimum seconds between fsyncs for FSYNC_INTERVAL
+        - name: str, name of the writer thread
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}', expected one of {FSYNC_POLICIES}")
+
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._last_fsync = time.monotonic()
+        # Output of a record (e.g. its file), if the sink can tell
+        self._record_key = getattr(sink, 'record_key', None)
+
+        # Statistics, read with stats(). Producer-side counters are updated
+        # under a lock since several reader threads may submit at once;
+        # writer-side counters are only written by the writer thread.
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.dropped_by_output = Counter()
+        self.write_errors_by_output = Counter()
+        self.written = 0
+        self.write_errors = 0
+        self.max_queue_depth = 0
+        self.max_submit_seconds = 0.0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, record):
+        """
+        Enqueues a record for the writer thread without blocking.
+
+        Returns:
+        - bool, False if the queue was full and the record was dropped
+        """
+        start = time.perf_counter()
+        try:
+            self._queue.put_nowait(record)
+            accepted = True
+        except queue.Full:
+            accepted = False
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            if elapsed > self.max_submit_seconds:
+                self.max_submit_seconds = elapsed
+            if not accepted:
+                self.dropped += 1
+                self.dropped_by_output[self._output_of(record)] += 1
+                return False
+            self.submitted += 1
+            depth = self._queue.qsize()
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+        return True
+
+    def _output_of(self, record):
+        if self._record_key is None:
+            return 'unknown'
+        try:
+            return self._record_key(record)
+        except Exception:
+            return 'unknown'
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything submitted before this call has been written.
+        Intended for shutdown and benchmarks, not for the receive path; with
+        timeout=0 it only asks for a flush and never waits, even on a full queue.
+
+        Parameters:
+        - timeout: float, seconds to wait in all, None to wait until flushed
+
+        Returns:
+        - bool, True if the writer finished flushing within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        request = _FlushRequest()
+        try:
+            self._queue.put(request, timeout=timeout)
+        except queue.Full:
+            return False
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        return request.done.wait(remaining)
+
+    def close(self, timeout=10):
+        """
+        Writes any queued records, closes the sink and stops the thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        else:
+            self.sink.close()
+
+    def stats(self):
+        """
+        Returns a dictionary snapshot of the writer statistics.
+        """
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'written': self.written,
+            'write_errors': self.write_errors,
+            'max_submit_ms': self.max_submit_seconds * 1000,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'last_flush_ms': self.last_flush_seconds * 1000,
+            'max_flush_ms': self.max_flush_seconds * 1000,
+            'avg_flush_ms': (self.total_flush_seconds / self.batches * 1000) if self.batches else 0.0,
+            'dropped_by_output': dict(self.dropped_by_output),
+            'write_errors_by_output': dict(self.write_errors_by_output),
+        }
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        now = time.monotonic()
+        fsync = (self.fsync_policy == FSYNC_BATCH or
+                 (self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval))
+        try:
+            failed = list(self.sink.write_batch(batch) or ())
+            failed_outputs = self.sink.flush(fsync=fsync)
+            if failed_outputs:
+                # Records of this batch still buffered for those outputs
+                failed_ids = {id(record) for record in failed}
+                failed += [record for record in batch
+                           if id(record) not in failed_ids and self._output_of(record) in failed_outputs]
+        except Exception as e:
+            # Never let a bad record or a full disk kill the writer thread
+            failed = batch
+            logger.error("Writer could not write batch of %d records: %s", len(batch), e)
+        self.written += len(batch) - len(failed)
+        self.write_errors += len(failed)
+        for record in failed:
+            self.write_errors_by_output[self._output_of(record)] += 1
+        if fsync:
+            self._last_fsync = now
+
+        elapsed = time.perf_counter() - start
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            # Sleep until a record arrives; once a batch is open, only until its deadline
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or isinstance(item, _FlushRequest):
+                if batch:
+                    self._write(batch)
+                    batch, deadline = [], None
+                if item is _STOP:
+                    self.sink.close()
+                    return
+                try:
+                    self.sink.flush(fsync=self.fsync_policy != FSYNC_NEVER)
+                except Exception as e:
+                    logger.error("Writer could not flush: %s", e)
+                item.done.set()
+                continue
+
+            if item is not None:
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+
+
+################################################
+# Sharded Writer
+################################################
+
+class ShardedWriter:
+    """
+    Spreads records over several BatchedWriters, each with its own sink and
+    writer thread. All records of one output (as given by the sink's
+    record_key()) go to the same shard, so each file has exactly one owner
+    and the order of its records is kept. Same interface as BatchedWriter.
+    """
+
+    def __init__(self, sink_factory, shards=2, name="ShardedWriter", **writer_options):
+        """
+        Parameters:
+        - sink_factory: callable returning a new sink; the sink must
+          implement record_key(record)
+        - shards: int, number of writer threads
+        - name: str, prefix of the writer thread names
+        - writer_options: passed to every BatchedWriter; max_queue is the
+          total, split evenly across the shards
+        """
+        if shards < 1:
+            raise ValueError("ShardedWriter needs at least one shard")
+        if 'max_queue' in writer_options:
+            writer_options['max_queue'] = max(1, writer_options['max_queue'] // shards)
+        self.writers = [BatchedWriter(sink_factory(), name=f"{name}-{i}", **writer_options)
+                        for i in range(shards)]
+        self._record_key = self.writers[0].sink.record_key
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+        return self
+
+    def shard_of(self, record):
+        """
+        Returns the writer that owns the output of a record.
+        """
+        return self.writers[hash(self._record_key(record)) % len(self.writers)]
+
+    def submit(self, record):
+        """
+        Enqueues a record on the shard owning its output, without blocking.
+
+        Returns:
+        - bool, False if that shard's queue was full and the record was dropped
+        """
+        return self.shard_of(record).submit(record)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every shard has written everything submitted before this call.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = True
+        for writer in self.writers:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done = writer.flush(remaining) and done
+        return done
+
+    def close(self, timeout=10):
+        for writer in self.writers:
+            writer.close(timeout)
+
+    def stats(self):
+        """
+        Returns the statistics of all shards combined, plus the queue depth
+        of each shard.
+        """
+        shard_stats = [writer.stats() for writer in self.writers]
+        combined = {}
+        for key in ('queue_depth', 'submitted', 'dropped', 'written', 'write_errors', 'batches'):
+            combined[key] = sum(stats[key] for stats in shard_stats)
+        for key in ('max_queue_depth', 'max_submit_ms', 'max_batch_size', 'max_flush_ms'):
+            combined[key] = max(stats[key] for stats in shard_stats)
+        combined['avg_flush_ms'] = (sum(stats['avg_flush_ms'] * stats['batches'] for stats in shard_stats)
+                                    / combined['batches']) if combined['batches'] else 0.0
+        for key in ('dropped_by_output', 'write_errors_by_output'):
+            combined[key] = {output: count for stats in shard_stats for output, count in stats[key].items()}
+        combined['shard_queue_depths'] = [stats['queue_depth'] for stats in shard_stats]
+        return combined
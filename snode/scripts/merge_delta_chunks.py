@@ -0,0 +1,98 @@
+"""
+Merge Delta Upload Parts Back into Full Files
+
+upload_to_gdrive.py --delta ships only the bytes appended to each shard since
+the last run, as '<name>.g<generation>.<offset>.part' files. After downloading
+a Drive folder, this script concatenates the parts of each file (latest
+generation only) back into '<name>', checking that the parts are contiguous.
+
+Command: python scripts/merge_delta_chunks.py <downloaded_dir> [--output-dir <dir>]
+from snode directory
+"""
+
+import argparse
+import os
+import re
+import shutil
+from collections import defaultdict
+
+PART_PATTERN = re.compile(r'^(?P<name>.+)\.g(?P<generation>\d+)\.(?P<offset>\d+)\.part$')
+
+
+def find_parts(folder_path):
+    """
+    Groups the part files of a folder by the file they belong to.
+
+    Returns:
+    - dict, name -> list of (offset, path) for the latest generation, sorted by offset
+    """
+    generations = defaultdict(lambda: defaultdict(list))
+    for root, _, files in os.walk(folder_path):
+        for filename in files:
+            match = PART_PATTERN.match(filename)
+            if match is None:
+                continue
+            rel_dir = os.path.relpath(root, folder_path)
+            name = os.path.normpath(os.path.join(rel_dir, match['name']))
+            generations[name][int(match['generation'])].append(
+                (int(match['offset']), os.path.join(root, filename)))
+
+    return {name: sorted(by_generation[max(by_generation)]) for name, by_generation in generations.items()}
+
+
+def merge_parts(parts, output_path):
+    """
+    Concatenates parts into output_path, stopping at the first gap.
+
+    Parameters:
+    - parts: list of (offset, path), sorted by offset
+    - output_path: str, file to write
+
+    Returns:
+    - (bytes written, True if every part was contiguous)
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    expected = 0
+    complete = True
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as output:
+        for offset, path in parts:
+            if offset != expected:
+                print(f"WARNING: {output_path} has a gap at byte {expected} (next part starts at {offset})")
+                complete = False
+                break
+            with open(path, 'rb') as part:
+                shutil.copyfileobj(part, output)
+            expected += os.path.getsize(path)
+    os.replace(tmp_path, output_path)
+    return expected, complete
+
+
+def merge_folder(folder_path, output_dir=None):
+    """
+    Rebuilds every file with parts under folder_path.
+
+    Parameters:
+    - folder_path: str, downloaded Drive folder
+    - output_dir: str, where to write merged files (default: next to the parts)
+
+    Returns:
+    - dict, name -> (bytes written, complete)
+    """
+    output_dir = output_dir or folder_path
+    results = {}
+    for name, parts in sorted(find_parts(folder_path).items()):
+        results[name] = merge_parts(parts, os.path.join(output_dir, name))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge delta upload parts back into full files.")
+    parser.add_argument("folder", help="folder with downloaded .part files (searched recursively)")
+    parser.add_argument("--output-dir", default=None, help="where to write merged files (default: same folder)")
+    args = parser.parse_args()
+
+    merged = merge_folder(args.folder, args.output_dir)
+    for merged_name, (size, contiguous) in merged.items():
+        print(f"{merged_name}: {size} bytes{'' if contiguous else ' (INCOMPLETE)'}")
+    print(f"Merged {len(merged)} files.")
@@ -0,0 +1,301 @@
+"""
+In-Memory Per-Node Link Statistics
+
+Replaces the heard-from counter dict, which the logger appended in full to
+heard_from_node_counter_<hour>.txt on every packet. For every node heard,
+NodeStatsEngine keeps in compact __slots__ objects:
+- packet count, first and last time heard
+- RSSI and SNR: min/max, mean and variance over the whole run, and an
+  exponentially weighted mean and variance over the last packets (link
+  health right now)
+- hops taken (hopStart - hopLimit)
+- gaps between packets (mean, variance, longest)
+
+Updating a node is a handful of float operations; nothing is written per
+packet. The logger snapshots the engine on a timer instead: the latest state
+to node_stats.json (atomically replaced, so it can be read at any time) and
+one row per node to an hourly node_stats_<hour>.csv for the history.
+
+Command: python scripts/node_stats.py <node_stats.json> [--stale <seconds>]
+from snode directory (prints the link health table of a snapshot)
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Weight of the newest sample in the recent mean/variance; 0.1 follows
+# roughly the last 20 packets of a node
+RECENT_ALPHA = 0.1
+
+# Columns of the node_stats_<hour>.csv history (see NodeStats.as_dict)
+SNAPSHOT_HEADERS = ['datetime', 'fromNode', 'packets', 'lastSeen', 'secondsSinceSeen',
+                    'rssiMean', 'rssiStd', 'rssiRecent', 'rssiMin', 'rssiMax',
+                    'snrMean', 'snrStd', 'snrRecent', 'snrMin', 'snrMax',
+                    'hopsMean', 'hopsMax', 'gapMean', 'gapStd', 'gapMax']
+
+
+class RunningStat:
+    """
+    Count, min/max, mean and variance (Welford) of a stream of values, plus an
+    exponentially weighted mean and variance of the recent values.
+    """
+
+    __slots__ = ('count', 'min', 'max', 'mean', '_m2', 'recent_mean', 'recent_var')
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.recent_mean = None
+        self.recent_var = 0.0
+
+    def add(self, value, alpha=RECENT_ALPHA):
+        self.count += 1
+        if self.count == 1:
+            self.min = self.max = value
+            self.recent_mean = float(value)
+        else:
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+            diff = value - self.recent_mean
+            increment = alpha * diff
+            self.recent_mean += increment
+            self.recent_var = (1 - alpha) * (self.recent_var + diff * increment)
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def as_dict(self):
+        if not self.count:
+            return None
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.mean, 'std': self.std,
+                'recent_mean': self.recent_mean, 'recent_std': math.sqrt(self.recent_var)}
+
+
+class NodeStats:
+    """
+    Statistics of one node.
+    """
+
+    __slots__ = ('node', 'packets', 'first_seen', 'last_seen', 'rssi', 'snr', 'hops', 'gap')
+
+    def __init__(self, node):
+        self.node = node
+        self.packets = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.rssi = RunningStat()
+        self.snr = RunningStat()
+        self.hops = RunningStat()
+        self.gap = RunningStat()
+
+    def add(self, packet, now):
+        if self.last_seen is not None:
+            self.gap.add(now - self.last_seen)
+        else:
+            self.first_seen = now
+        self.last_seen = now
+        self.packets += 1
+
+        rssi = packet.get('rxRssi')
+        if rssi is not None:
+            self.rssi.add(rssi)
+        snr = packet.get('rxSnr')
+        if snr is not None:
+            self.snr.add(snr)
+        hop_start = packet.get('hopStart')
+        hop_limit = packet.get('hopLimit')
+        if hop_start is not None and hop_limit is not None:
+            self.hops.add(hop_start - hop_limit)
+
+    def as_dict(self, now=None):
+        now = now if now is not None else time.time()
+        return {
+            'node': self.node,
+            'packets': self.packets,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'seconds_since_seen': now - self.last_seen if self.last_seen is not None else None,
+            'rssi': self.rssi.as_dict(),
+            'snr': self.snr.as_dict(),
+            'hops': self.hops.as_dict(),
+            'gap': self.gap.as_dict(),
+        }
+
+    def csv_row(self, curr_date_time, now):
+        """
+        Returns the node's row of the node_stats_<hour>.csv history (SNAPSHOT_HEADERS).
+        """
+        def stat(running, *names):
+            return [getattr(running, name) if running.count else None for name in names]
+
+        return ([curr_date_time, self.node, self.packets,
+                 datetime.fromtimestamp(self.last_seen).isoformat(sep=' ', timespec='seconds'),
+                 round(now - self.last_seen, 1)]
+                + stat(self.rssi, 'mean', 'std', 'recent_mean', 'min', 'max')
+                + stat(self.snr, 'mean', 'std', 'recent_mean', 'min', 'max')
+                + stat(self.hops, 'mean', 'max')
+                + stat(self.gap, 'mean', 'std', 'max'))
+
+
+class NodeStatsEngine:
+    """
+    Statistics of every node heard, plus counters of logger events (e.g.
+    watchdog resets). record() is called from the receive path; snapshots and
+    queries may come from other threads, so all access goes through a lock.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self.events = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, from_node, packet, now=None):
+        """
+        Adds a received packet to the statistics of its node.
+
+        Parameters:
+        - from_node: str, node id
+        - packet: dict, packet as published by meshtastic (for rxRssi, rxSnr, hopStart, hopLimit)
+        - now: float, receive time (default: time.time())
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            stats = self._nodes.get(from_node)
+            if stats is None:
+                stats = self._nodes[from_node] = NodeStats(from_node)
+            stats.add(packet, now)
+
+    def record_event(self, name):
+        """
+        Counts a logger event, e.g. 'WDT ERROR'.
+        """
+        with self._lock:
+            self.events[name] += 1
+
+    ################################################
+    # Query API
+    ################################################
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def node(self, from_node, now=None):
+        """
+        Returns the statistics of one node as a dict, or None if never heard.
+        """
+        with self._lock:
+            stats = self._nodes.get(from_node)
+            return stats.as_dict(now) if stats is not None else None
+
+    def nodes(self, now=None):
+        """
+        Returns the statistics of every node, most recently heard first.
+        """
+        with self._lock:
+            result = [stats.as_dict(now) for stats in self._nodes.values()]
+        return sorted(result, key=lambda entry: -entry['last_seen'])
+
+    def packet_counts(self):
+        """
+        Returns {node: packets heard}, the old heard-from counter.
+        """
+        with self._lock:
+            return {node: stats.packets for node, stats in self._nodes.items()}
+
+    def stale(self, max_age, now=None):
+        """
+        Returns the nodes not heard for more than max_age seconds, oldest first.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            silent = [(stats.last_seen, node) for node, stats in self._nodes.items()
+                      if now - stats.last_seen > max_age]
+        return [node for _, node in sorted(silent)]
+
+    def snapshot(self, now=None, extra=None):
+        """
+        Returns the whole state as a JSON-ready dict.
+
+        Parameters:
+        - now: float, snapshot time (default: time.time())
+        - extra: dict, more JSON-ready entries to include (e.g. duplicate counts)
+        """
+        now = now if now is not None else time.time()
+        nodes = self.nodes(now)
+        with self._lock:
+            events = dict(self.events)
+        snapshot = {'time': now, 'nodes': nodes, 'events': events}
+        snapshot.update(extra or {})
+        return snapshot
+
+    def csv_rows(self, curr_date_time, now=None):
+        """
+        Returns one node_stats_<hour>.csv row per node.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            return [stats.csv_row(curr_date_time, now) for stats in self._nodes.values()]
+
+    def write_snapshot(self, path, now=None, extra=None):
+        """
+        Writes snapshot() to path atomically (temporary file + rename), so
+        readers never see a half-written file.
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.snapshot(now, extra), file, indent=1)
+        os.replace(tmp_path, path)
+
+
+def _fmt(value, digits=1):
+    return '-' if value is None else f'{value:.{digits}f}'
+
+
+def print_snapshot(snapshot, stale_after=None):
+    """
+    Prints the link health table of a snapshot read back from node_stats.json.
+    """
+    taken = snapshot['time']
+    duplicates = snapshot.get('duplicates', {})
+    print(f"Snapshot of {datetime.fromtimestamp(taken)}: {len(snapshot['nodes'])} nodes, events {snapshot['events']}")
+    print(f"{'node':12s} {'packets':>7s} {'ago(s)':>8s} {'rssi':>7s} {'recent':>7s} {'snr':>6s} {'recent':>7s} "
+          f"{'hops':>5s} {'gap(s)':>7s} {'maxgap':>7s} {'dups':>5s}")
+    for entry in snapshot['nodes']:
+        rssi, snr = entry['rssi'] or {}, entry['snr'] or {}
+        hops, gap = entry['hops'] or {}, entry['gap'] or {}
+        flag = ' STALE' if stale_after is not None and entry['seconds_since_seen'] > stale_after else ''
+        print(f"{entry['node']:12s} {entry['packets']:7d} {_fmt(entry['seconds_since_seen'], 0):>8s} "
+              f"{_fmt(rssi.get('mean')):>7s} {_fmt(rssi.get('recent_mean')):>7s} "
+              f"{_fmt(snr.get('mean')):>6s} {_fmt(snr.get('recent_mean')):>7s} "
+              f"{_fmt(hops.get('mean')):>5s} {_fmt(gap.get('mean'), 0):>7s} {_fmt(gap.get('max'), 0):>7s} "
+              f"{duplicates.get(entry['node'], 0):5d}{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print the per-node link statistics of a logger snapshot.")
+    parser.add_argument("snapshot", help="node_stats.json written by rpi_log_script")
+    parser.add_argument("--stale", type=float, default=None, help="flag nodes not heard for this many seconds")
+    args = parser.parse_args()
+
+    with open(args.snapshot) as snapshot_file:
+        print_snapshot(json.load(snapshot_file), args.stale)
@@ -0,0 +1,328 @@
+"""
+Compressed Raw Packet Archive
+
+Replaces the repr() text logs (logs_<hour>.txt) with line-delimited JSON,
+compressed as a stream with gzip (or zstd when the zstandard package is
+installed) and rotated hourly by the logger through the file name.
+
+Each line is one received packet:
+
+    {"t": "2024-12-17 13:07:56.123", "logger": "c3d4", "packet": {...}}
+
+Redundant representations are dropped before encoding: meshtastic attaches
+the protobuf object ('raw') next to the decoded dict, and the serialized
+payload bytes next to the parsed content (e.g. 'telemetry'). Other bytes are
+stored as {"__bytes__": "<base64>"} so they round-trip.
+
+ArchiveSink plugs into log_writer.BatchedWriter. iter_archive() reads an
+archive back lazily, one packet at a time, and tolerates a truncated tail
+(e.g. after a power cut).
+
+Command: python scripts/packet_archive.py <archive>...
+from snode directory (prints the archived records as JSON lines)
+"""
+
+import base64
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSIONS = (GZIP, ZSTD) if zstandard is not None else (GZIP,)
+EXTENSIONS = {GZIP: '.jsonl.gz', ZSTD: '.jsonl.zst'}
+
+_BYTES_KEY = '__bytes__'
+
+
+################################################
+# Encoding
+################################################
+
+def _compact(value):
+    """
+    Returns a JSON-ready copy of a packet value without the duplicated
+    protobuf and payload representations.
+    """
+    if isinstance(value, dict):
+        has_parsed_content = any(isinstance(v, dict) for v in value.values())
+        out = {}
+        for key, item in value.items():
+            if key == 'raw':
+                continue
+            if key == 'payload' and has_parsed_content and isinstance(item, (bytes, bytearray)):
+                continue
+            out[key] = _compact(item)
+        return out
+    if isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {_BYTES_KEY: base64.b64encode(value).decode('ascii')}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # Unknown objects (e.g. protobuf messages under another key)
+    return str(value)
+
+
+def encode_record(received_at, logger_node, packet):
+    """
+    Encodes one archive line.
+
+    Parameters:
+    - received_at: str, time the logger received the packet
+    - logger_node: str, logger node id
+    - packet: dict, packet as published by meshtastic
+
+    Returns:
+    - bytes, one JSON line including the newline
+    """
+    record = {'t': received_at, 'logger': logger_node, 'packet': _compact(packet)}
+    return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _restore_bytes(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and _BYTES_KEY in value:
+            return base64.b64decode(value[_BYTES_KEY])
+        return {key: _restore_bytes(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore_bytes(item) for item in value]
+    return value
+
+
+def decode_record(line):
+    """
+    Decodes one archive line back into a dict with 't', 'logger' and 'packet'.
+    """
+    return _restore_bytes(json.loads(line))
+
+
+################################################
+# Writing
+################################################
+
+class ArchiveSink:
+    """
+    log_writer sink that appends packets to compressed archives.
+
+    Records are tuples of (path, received_at, logger_node, packet). Encoding
+    happens here, on the writer thread, not on the receive path. Each flush
+    ends in a compressor sync point, so everything flushed can be read back
+    even if the process dies before the file is closed.
+
+    Only the writer thread should call into a sink.
+    """
+
+    def __init__(self, compression=GZIP, level=6, idle_close_seconds=300):
+        """
+        Parameters:
+        - compression: str, GZIP or ZSTD (needs the zstandard package)
+        - level: int, compression level
+        - idle_close_seconds: float, archives not written for this long are closed
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Compression '{compression}' is not available, expected one of {COMPRESSIONS}")
+        self.compression = compression
+        self.level = level
+        self.idle_close_seconds = idle_close_seconds
+        # path -> [raw file, compressed stream, last write time]
+        self._streams = {}
+        self._dirty = set()
+        self.raw_bytes = 0
+
+    @staticmethod
+    def record_key(record):
+        """
+        Returns the archive a record goes to, for per-file statistics.
+        """
+        return record[0]
+
+    def _open(self, path):
+        entry = self._streams.get(path)
+        if entry is not None:
+            return entry
+        # Appending starts a new gzip member / zstd frame; readers continue across them
+        raw = open(path, 'ab')
+        if self.compression == ZSTD:
+            stream = zstandard.ZstdCompressor(level=self.level).stream_writer(raw, closefd=False)
+        else:
+            stream = gzip.GzipFile(fileobj=raw, mode='ab', compresslevel=self.level)
+        entry = [raw, stream, time.monotonic()]
+        self._streams[path] = entry
+        return entry
+
+    def _close_entry(self, path, entry):
+        self._dirty.discard(path)
+        try:
+            entry[1].close()
+            entry[0].close()
+        except OSError as e:
+            logger.error("Could not close archive %s: %s", path, e)
+
+    def _drop(self, path, error):
+        """
+        Closes an archive that failed, so the next record reopens it.
+        """
+        logger.error("Could not write archive %s: %s", path, error)
+        entry = self._streams.pop(path, None)
+        if entry is not None:
+            self._close_entry(path, entry)
+
+    def write_batch(self, records):
+        """
+        Writes a batch of records. An archive that cannot be written does
+        not stop the others.
+
+        Returns:
+        - list of the records that could not be written
+        """
+        now = time.monotonic()
+        failed = []
+        failed_paths = set()
+        for record in records:
+            path, received_at, logger_node, packet = record
+            try:
+                line = encode_record(received_at, logger_node, packet)
+                entry = self._open(path)
+                entry[1].write(line)
+            except Exception as e:
+                failed.append(record)
+                if path not in failed_paths:
+                    failed_paths.add(path)
+                    self._drop(path, e)
+                continue
+            entry[2] = now
+            self.raw_bytes += len(line)
+            self._dirty.add(path)
+        return failed
+
+    def flush(self, fsync=False):
+        """
+        Returns:
+        - set of the archives that could not be flushed
+        """
+        failed = set()
+        for path in list(self._dirty):
+            raw, stream, _ = self._streams[path]
+            try:
+                if self.compression == ZSTD:
+                    stream.flush(zstandard.FLUSH_BLOCK)
+                else:
+                    stream.flush(zlib.Z_SYNC_FLUSH)
+                raw.flush()
+                if fsync:
+                    os.fsync(raw.fileno())
+            except OSError as e:
+                failed.add(path)
+                self._drop(path, e)
+        self._dirty.clear()
+
+        cutoff = time.monotonic() - self.idle_close_seconds
+        for path in [path for path, entry in self._streams.items() if entry[2] < cutoff]:
+            self._close_entry(path, self._streams.pop(path))
+        return failed
+
+    def close(self):
+        self.flush(fsync=True)
+        for path, entry in self._streams.items():
+            self._close_entry(path, entry)
+        self._streams.clear()
+
+
+################################################
+# Reading
+################################################
+
+def _iter_chunks(path):
+    """
+    Yields decompressed chunks of an archive. Decompression is done by hand so
+    a truncated last gzip member still gives back everything before the cut.
+    """
+    with open(path, 'rb') as raw:
+        if path.endswith(EXTENSIONS[ZSTD]):
+            if zstandard is None:
+                raise RuntimeError(f"Reading {path} needs the zstandard package")
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            while True:
+                try:
+                    chunk = reader.read(1 << 16)
+                except zstandard.ZstdError as e:
+                    logger.warning("Archive %s ends early: %s", path, e)
+                    return
+                if not chunk:
+                    return
+                yield chunk
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            data = raw.read(1 << 16)
+            if not data:
+                return
+            while data:
+                try:
+                    yield decompressor.decompress(data)
+                except zlib.error as e:
+                    logger.warning("Archive %s is corrupt: %s", path, e)
+                    return
+                if decompressor.eof:
+                    # Next gzip member (the file was appended to after a reopen)
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    data = b''
+
+
+def iter_archive(path):
+    """
+    Lazily iterates over the records of one archive. A truncated tail (the
+    last, partially written block) ends the iteration instead of raising.
+
+    Parameters:
+    - path: str, path to a .jsonl.gz or .jsonl.zst archive
+
+    Yields:
+    - dict with 't' (receive time), 'logger' (logger node id) and 'packet'
+    """
+    pending = b''
+    for chunk in _iter_chunks(path):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield decode_record(line)
+    # A final line without newline was cut off mid-write; skip it
+
+
+def iter_packets(paths):
+    """
+    Lazily iterates over the packets of several archives, in the given order.
+
+    Parameters:
+    - paths: list of archive paths
+
+    Yields:
+    - dict, packet
+    """
+    for path in paths:
+        for record in iter_archive(path):
+            yield record['packet']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python scripts/packet_archive.py <archive>...")
+        sys.exit(1)
+    for archive_path in sys.argv[1:]:
+        for archived in iter_archive(archive_path):
+            print(json.dumps(archived, default=lambda b: base64.b64encode(b).decode('ascii')))
@@ -0,0 +1,367 @@
+"""
+Event-Driven Radio Watchdog and Reconnect
+
+The logger's main loop used to wake every second to compare the time with
+the watchdog, and on timeout tore down the pubsub subscription and polled
+os.path.exists() on the serial port every 10 seconds. ReconnectManager
+replaces that:
+- one watchdog thread sleeps on a condition variable until the earliest
+  radio deadline (last packet + timeout), or until woken by a
+  meshtastic.connection.lost event. With packets flowing it wakes about
+  once per timeout, not once per second.
+- a lost radio is reconnected on a thread of its own, so the other radios,
+  the subscription and the writers carry on
+- the serial device is watched with inotify (Linux, through ctypes, no
+  extra package) instead of polled; where inotify is not available, or the
+  device directory does not exist yet, it is polled on the backoff schedule
+- failed attempts back off exponentially with jitter, so radios (or Pis on
+  one hub) do not retry in lockstep
+
+Recovery times (loss detected -> interface open again) and wakeups per hour
+are kept in stats() and status(); bench_reconnect.py measures both against
+the polling loop.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import random
+import select
+import threading
+import time
+
+from node_stats import RunningStat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 70.0
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 60.0
+
+# Time given to the OS to release the tty after closing it
+RELEASE_SECONDS = 2.0
+
+# inotify flags (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events passed to on_event
+WATCHDOG_EVENT = 'WDT ERROR'
+LOST_EVENT = 'CONNECTION LOST'
+
+# Radio states
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_CAP, rng=random):
+    """
+    Returns the delay before retry number attempt (0-based): base * 2^attempt
+    capped at cap, of which the upper half is random.
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None  # not Linux
+    return libc
+
+
+class DeviceWatcher:
+    """
+    Waits for a device path (e.g. /dev/ttyUSB0) to appear.
+    """
+
+    def __init__(self, poll_base=DEFAULT_BACKOFF_BASE, poll_cap=DEFAULT_BACKOFF_CAP):
+        self._libc = _load_inotify()
+        self.poll_base = poll_base
+        self.poll_cap = poll_cap
+        self.wakeups = 0
+
+    @property
+    def mode(self):
+        return 'inotify' if self._libc is not None else 'poll'
+
+    def wait_for(self, path, timeout):
+        """
+        Returns True as soon as path exists, False if it did not appear
+        within timeout seconds.
+        """
+        if os.path.exists(path):
+            return True
+        if self._libc is not None:
+            appeared = self._wait_inotify(path, timeout)
+            if appeared is not None:
+                return appeared
+        return self._wait_poll(path, timeout)
+
+    def _wait_inotify(self, path, timeout):
+        """
+        Sleeps on inotify events of the device's directory. Returns None if
+        the directory cannot be watched (e.g. /dev/serial/by-id/ before the
+        first USB serial device is plugged in).
+        """
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            if self._libc.inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_MOVED_TO | IN_ATTRIB) < 0:
+                return None
+            deadline = time.monotonic() + timeout
+            # Checked after adding the watch, so a device created in between is not missed
+            while not os.path.exists(path):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                readable, _, _ = select.select([fd], [], [], remaining)
+                self.wakeups += 1
+                if readable:
+                    try:
+                        os.read(fd, 4096)
+                    except BlockingIOError:
+                        pass
+            return True
+        finally:
+            os.close(fd)
+
+    def _wait_poll(self, path, timeout):
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while not os.path.exists(path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, backoff_delay(attempt, self.poll_base, self.poll_cap)))
+            self.wakeups += 1
+            attempt += 1
+        return True
+
+
+class Radio:
+    """
+    One logger node on a serial port: its interface, the logger node id
+    that tags its records (from interface.myInfo), and its watchdog and
+    reconnect counters.
+    """
+
+    def __init__(self, serial_port):
+        self.serial_port = serial_port
+        self.interface = None
+        self.node_id = None
+        self.state = CONNECTING
+        self.last_rx = time.monotonic()
+        self.lost_at = None
+        self.received = 0
+        self.duplicates = 0
+        self.resets = 0
+        self.lost = 0
+        self.attempts = 0
+        self.recovery = RunningStat()
+
+    def feed(self):
+        """
+        Feeds the watchdog; called for every packet the radio receives.
+        """
+        self.last_rx = time.monotonic()
+        self.received += 1
+
+    def status(self):
+        recovery = self.recovery.as_dict()
+        return {'serial_port': self.serial_port, 'node_id': self.node_id, 'state': self.state,
+                'received': self.received, 'duplicates': self.duplicates,
+                'seconds_since_rx': round(time.monotonic() - self.last_rx, 1),
+                'watchdog_resets': self.resets, 'connection_lost': self.lost, 'open_attempts': self.attempts,
+                'recovery_seconds': {key: round(recovery[key], 3) for key in ('count', 'mean', 'max')}
+                if recovery else None}
+
+
+class ReconnectManager:
+    """
+    Owns the radios: connects them, watches their deadlines and reconnects
+    them with backoff, each on its own thread.
+    """
+
+    def __init__(self, open_interface, timeout=DEFAULT_TIMEOUT_SECONDS, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_cap=DEFAULT_BACKOFF_CAP, watcher=None, release_seconds=RELEASE_SECONDS, on_event=None):
+        """
+        Parameters:
+        - open_interface: callable, serial port -> interface (e.g. SerialInterface)
+        - timeout: float, seconds without a packet before a radio is reconnected
+        - backoff_base: float, delay before the first retry of a failed open
+        - backoff_cap: float, longest delay between retries
+        - watcher: DeviceWatcher, defaults to a new one
+        - release_seconds: float, pause between closing and reopening a port
+        - on_event: callable, called with WATCHDOG_EVENT or LOST_EVENT (e.g. NodeStatsEngine.record_event)
+        """
+        self.open_interface = open_interface
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.watcher = watcher or DeviceWatcher(backoff_base, backoff_cap)
+        self.release_seconds = release_seconds
+        self.on_event = on_event
+        self.radios = []
+        self.wakeups = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def add(self, serial_port):
+        """
+        Adds a radio and starts connecting it in the background.
+
+        Returns:
+        - Radio
+        """
+        radio = Radio(serial_port)
+        with self._condition:
+            self.radios.append(radio)
+            self._reconnect(radio, close=False)
+        return radio
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="RadioWatchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the watchdog and any pending reconnects, and closes the interfaces.
+        """
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for radio in self.radios:
+            self._close(radio)
+
+    def radio_for(self, interface):
+        """
+        Returns the Radio an interface belongs to, or None.
+        """
+        for radio in self.radios:
+            if radio.interface is interface:
+                return radio
+        return None
+
+    def connection_lost(self, interface):
+        """
+        Reconnects the radio of interface right away, without waiting for
+        its watchdog. Meant for the meshtastic.connection.lost topic.
+        Interfaces closed by the manager itself are no longer attached to a
+        radio, so their own lost event is ignored.
+        """
+        with self._condition:
+            radio = self.radio_for(interface)
+            if radio is None or radio.state != CONNECTED:
+                return
+            logger.error("Connection lost on %s, reconnecting", radio.serial_port)
+            radio.lost += 1
+            self._event(LOST_EVENT)
+            self._reconnect(radio)
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {'wakeups': self.wakeups, 'device_wakeups': self.watcher.wakeups,
+                'wakeups_per_hour': round(self.wakeups / elapsed * 3600, 1) if elapsed else None,
+                'device_watch': self.watcher.mode}
+
+    ################################################
+    # Watchdog and reconnect threads
+    ################################################
+
+    def _run(self):
+        with self._condition:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                deadline = None
+                for radio in self.radios:
+                    if radio.state != CONNECTED:
+                        continue
+                    due = radio.last_rx + self.timeout
+                    if due <= now:
+                        logger.error("Watchdog Timer Reset: nothing received on %s for %d seconds, reconnecting",
+                                     radio.serial_port, self.timeout)
+                        radio.resets += 1
+                        self._event(WATCHDOG_EVENT)
+                        self._reconnect(radio)
+                    elif deadline is None or due < deadline:
+                        deadline = due
+                # Packets only move last_rx forward, so nothing is due before
+                # the earliest deadline unless a radio is lost or (re)connected
+                self._condition.wait(None if deadline is None else deadline - now)
+                self.wakeups += 1
+
+    def _event(self, name):
+        if self.on_event is not None:
+            self.on_event(name)
+
+    def _reconnect(self, radio, close=True):
+        # Called with the condition held
+        radio.state = CONNECTING
+        radio.lost_at = time.monotonic() if close else None
+        name = f"Reconnect-{os.path.basename(radio.serial_port)}"
+        threading.Thread(target=self._connect_loop, args=(radio, close), name=name, daemon=True).start()
+
+    def _close(self, radio):
+        interface, radio.interface = radio.interface, None
+        if interface is None:
+            return
+        try:
+            interface.close()
+            logger.info("closed old %s connection", radio.serial_port)
+        except Exception as e:
+            logger.info("Ignored close() error: %s", e)
+
+    def _connect_loop(self, radio, close):
+        if close:
+            self._close(radio)
+            self._stop.wait(self.release_seconds)  # Give OS time to release dev tty port
+        attempt = 0
+        while not self._stop.is_set():
+            if not self.watcher.wait_for(radio.serial_port, self.backoff_cap):
+                logger.error("The path '%s' does not exist. Waiting for the device", radio.serial_port)
+                continue
+            radio.attempts += 1
+            try:
+                interface = self.open_interface(radio.serial_port)
+            except Exception as e:
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                attempt += 1
+                logger.error("Could not open %s (%s), retrying in %.1f seconds", radio.serial_port, e, delay)
+                self._stop.wait(delay)
+                continue
+            self._connected(radio, interface)
+            return
+
+    def _connected(self, radio, interface):
+        try:
+            node_id = hex(interface.myInfo.my_node_num)[-4:]
+        except AttributeError:
+            node_id = None  # myInfo not there yet; on_receive reads it from the interface
+        with self._condition:
+            radio.interface = interface
+            radio.node_id = node_id
+            radio.last_rx = time.monotonic()
+            radio.state = CONNECTED
+            if radio.lost_at is not None:
+                radio.recovery.add(radio.last_rx - radio.lost_at)
+                logger.info("Radio on %s is logger node %s, recovered in %.1f seconds",
+                            radio.serial_port, node_id, radio.last_rx - radio.lost_at)
+            else:
+                logger.info("Radio on %s is logger node %s", radio.serial_port, node_id)
+            self._condition.notify_all()
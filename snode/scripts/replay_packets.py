@@ -0,0 +1,413 @@
+"""
+Packet Replay Harness and Throughput Benchmark for the Logger
+
+Feeds packet dicts through the real rpi_log_script.on_receive and logging path
+(including the writer thread), with a fake interface standing in for
+SerialInterface. Packets come from the packet archives or logs_*.txt files the
+logger writes, or from a synthetic generator that models N nodes reporting at a given rate.
+
+Reports per-packet latency (p50/p99/max), the receive-path rate, the sustained
+rate once the writer has drained, CPU time, and bytes written per packet
+(data files and log output), so hot-path regressions show up before deployment.
+The size of rollups.db (rollups.py) is reported next to the raw data, and
+the alert rules (alerts.py) are evaluated with their per-packet budget.
+
+Command: poetry run python scripts/replay_packets.py --synthetic --nodes 20 --packets 5000
+         poetry run python scripts/replay_packets.py --archives data-*/*/packets_*.jsonl.gz
+         poetry run python scripts/replay_packets.py --logs data-*/*/logs_*.txt
+from snode directory
+"""
+
+import argparse
+import ast
+import glob
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import rpi_log_script
+from log_writer import BatchedWriter, ShardedWriter, FileSink
+from log_config import setup_logging, LOG_LEVELS
+from packet_archive import ArchiveSink, iter_packets
+from dedup import DedupCache
+from rollups import RollupEngine, RollupSink
+from alerts import AlertEngine, AlertSink, LogAlertSink
+
+# Logger node used when a packet source does not say which node logged it
+DEFAULT_LOGGER_NODE_NUM = 0xA1B2C3D4
+
+TELEMETRY_TYPES = ['environmentMetrics', 'airQualityMetrics', 'powerMetrics', 'deviceMetrics']
+
+
+################################################
+# Fake Interface
+################################################
+
+class FakeInterface:
+    """
+    Stands in for meshtastic's SerialInterface. on_receive only reads
+    interface.myInfo.my_node_num.
+    """
+
+    def __init__(self, node_num=DEFAULT_LOGGER_NODE_NUM):
+        self.myInfo = SimpleNamespace(my_node_num=node_num)
+        self.sent_text = []
+
+    def sendText(self, text, *args, **kwargs):
+        self.sent_text.append(text)
+
+    def close(self):
+        pass
+
+
+class CountingStream(io.TextIOBase):
+    """
+    Discards everything written to it, but counts the characters. Used in
+    place of stdout, which the start script redirects to a file on the Pi.
+    """
+
+    def __init__(self):
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+        return len(text)
+
+
+################################################
+# Packet Sources
+################################################
+
+def _strip_protobuf_values(text):
+    """
+    Replaces non-literal values (protobuf messages printed with their text
+    format, e.g. 'raw': from: 123 ...) with None so the rest of the repr can be
+    parsed with ast.literal_eval.
+    """
+    out = []
+    i = 0
+    marker = "'raw': "
+    while True:
+        j = text.find(marker, i)
+        if j < 0:
+            out.append(text[i:])
+            return ''.join(out)
+        j += len(marker)
+        out.append(text[i:j])
+        if text[j] in "'\"{[-0123456789" or text.startswith(("b'", 'b"', 'None', 'True', 'False'), j):
+            i = j
+            continue
+
+        # Skip the protobuf text until the enclosing dict continues or closes
+        depth, k, in_string = 0, j, False
+        while k < len(text):
+            c = text[k]
+            if in_string:
+                if c == '\\':
+                    k += 1
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c == '{':
+                depth += 1
+            elif c == '}':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and text.startswith(", '", k):
+                break
+            k += 1
+        out.append('None')
+        i = k
+
+
+def load_text_log(path):
+    """
+    Lazily reads packets back from a logs_<hour>.txt file written by the logger.
+    Each record is the repr of [datetime, from_node, packet] and may span
+    several lines. Records that cannot be parsed are counted and skipped.
+
+    Parameters:
+    - path: str, path to the txt log
+
+    Yields:
+    - dict, packet
+    """
+    skipped = 0
+
+    def parse(lines):
+        nonlocal skipped
+        text = ''.join(lines)
+        for candidate in (text, _strip_protobuf_values(text)):
+            try:
+                record = ast.literal_eval(candidate)
+                return record[2]
+            except (ValueError, SyntaxError, IndexError, TypeError, MemoryError, RecursionError):
+                continue
+        skipped += 1
+        return None
+
+    lines = []
+    with open(path, errors='replace') as file:
+        for line in file:
+            if line.startswith("['") and lines:
+                packet = parse(lines)
+                if packet is not None:
+                    yield packet
+                lines = []
+            lines.append(line)
+    if lines:
+        packet = parse(lines)
+        if packet is not None:
+            yield packet
+    if skipped:
+        print(f"Skipped {skipped} unparseable records in {path}", file=sys.stderr)
+
+
+def synthetic_packets(n_nodes=10, n_packets=1000, seed=0, duplicates=0.0):
+    """
+    Generates telemetry packets shaped like the ones meshtastic publishes,
+    round-robin across n_nodes with a random telemetry type per packet.
+
+    Parameters:
+    - n_nodes: int, number of sensor nodes
+    - n_packets: int, number of packets to generate
+    - seed: int, random seed so runs are comparable
+    - duplicates: float, fraction of packets heard again as a rebroadcast
+      (same from and id, one hop more), as flooding does
+
+    Yields:
+    - dict, packet
+    """
+    rng = random.Random(seed)
+    nodes = [0x10000000 + rng.randrange(0x0FFFFFFF) for _ in range(n_nodes)]
+    packet_id = rng.randrange(1 << 31)
+    for i in range(n_packets):
+        node = nodes[i % n_nodes]
+        packet_id = (packet_id + 1) & 0xFFFFFFFF
+        telemetry_key = rng.choice(TELEMETRY_TYPES)
+        if telemetry_key == 'environmentMetrics':
+            metrics = {'temperature': rng.uniform(10, 40), 'relativeHumidity': rng.uniform(10, 90),
+                       'barometricPressure': rng.uniform(990, 1030), 'gasResistance': rng.uniform(1, 300),
+                       'iaq': rng.randrange(500), 'windDirection': rng.randrange(360),
+                       'windSpeed': rng.uniform(0, 15)}
+        elif telemetry_key == 'airQualityMetrics':
+            metrics = {key: rng.randrange(300) for key in
+                       ['pm10Standard', 'pm25Standard', 'pm100Standard',
+                        'pm10Environmental', 'pm25Environmental', 'pm100Environmental']}
+        elif telemetry_key == 'powerMetrics':
+            metrics = {'ch3Voltage': rng.uniform(3.3, 4.2), 'ch3Current': rng.uniform(10, 200)}
+        else:
+            metrics = {'batteryLevel': rng.randrange(101), 'voltage': rng.uniform(3.3, 4.2),
+                       'channelUtilization': rng.uniform(0, 30), 'airUtilTx': rng.uniform(0, 5)}
+        hop_start = rng.choice([3, 5, 7])
+        packet = {
+            'from': node,
+            'to': 0xFFFFFFFF,
+            'fromId': f'!{node:08x}',
+            'toId': '^all',
+            'id': packet_id,
+            'rxTime': int(time.time()),
+            'rxSnr': rng.uniform(-15, 10),
+            'rxRssi': rng.randrange(-130, -40),
+            'hopLimit': rng.randrange(hop_start + 1),
+            'hopStart': hop_start,
+            'decoded': {
+                'portnum': 'TELEMETRY_APP',
+                'bitfield': 0,
+                'telemetry': {'time': int(time.time()), telemetry_key: metrics},
+            },
+        }
+        yield packet
+        if duplicates and rng.random() < duplicates:
+            yield dict(packet, hopLimit=max(packet['hopLimit'] - 1, 0), rxRssi=rng.randrange(-130, -40))
+
+
+################################################
+# Replay
+################################################
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def replay(packets, output_dir, rate=None, interface=None, log_level='INFO', writer_shards=2, dedup=True,
+           rollups=True, alerts=True):
+    """
+    Runs packets through rpi_log_script.on_receive with a fresh writer and
+    returns the benchmark results.
+
+    Parameters:
+    - packets: iterable of packet dicts
+    - output_dir: str, directory the logger writes its data-*/ folders into
+    - rate: float, packets per second to pace the replay at (None = as fast as possible)
+    - interface: FakeInterface, defaults to a new one
+    - log_level: str, level for the logger output (counted, then discarded)
+    - writer_shards: int, csv/txt writer threads, as --writer-shards of the logger
+    - dedup: bool, drop duplicate packets as the logger does (False = --dedup-window 0)
+    - rollups: bool, keep the rollups as the logger does (False = --rollup-windows 0)
+    - alerts: bool, evaluate the default alert rules as the logger does (False = --no-alerts)
+
+    Returns:
+    - dict of results
+    """
+    interface = interface or FakeInterface()
+    previous_dir = os.getcwd()
+    os.makedirs(output_dir, exist_ok=True)
+    os.chdir(output_dir)
+
+    # Start from a clean logger state
+    rpi_log_script.DATA_ROOT = '.'
+    rpi_log_script.LOG_DIR = ""
+    rpi_log_script.LOG_FILE_PREFIXES.clear()
+    rpi_log_script.DEDUP = DedupCache() if dedup else None
+    rpi_log_script.WRITER = ShardedWriter(FileSink, shards=writer_shards, name="FileWriter").start()
+    rpi_log_script.ARCHIVE_WRITER = BatchedWriter(ArchiveSink(rpi_log_script.ARCHIVE_COMPRESSION),
+                                                  name="ArchiveWriter").start()
+    rpi_log_script.ROLLUPS = RollupEngine() if rollups else None
+    rpi_log_script.ROLLUP_WRITER = BatchedWriter(RollupSink(), name="RollupWriter").start() if rollups else None
+    rpi_log_script.ALERT_WRITER = BatchedWriter(AlertSink([LogAlertSink()]), batch_size=1, flush_interval=0.0,
+                                                name="AlertWriter").start() if alerts else None
+    rpi_log_script.ALERTS = AlertEngine(on_alert=rpi_log_script.ALERT_WRITER.submit) if alerts else None
+
+    stdout = CountingStream()
+    setup_logging(log_level, stream=stdout)
+    latencies = []
+    try:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        with redirect_stdout(stdout):
+            for i, packet in enumerate(packets):
+                if rate:
+                    delay = start + i / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                t0 = time.perf_counter()
+                rpi_log_script.on_receive(packet, interface)
+                latencies.append(time.perf_counter() - t0)
+            receive_elapsed = time.perf_counter() - start
+            rpi_log_script.WRITER.flush()
+            rpi_log_script.ARCHIVE_WRITER.flush()
+        total_elapsed = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        # Windows still open at the end are written as at logger shutdown
+        rpi_log_script.write_rollups(everything=True)
+        writer_stats = rpi_log_script.writer_status()
+        rollup_stats = rpi_log_script.ROLLUPS.stats() if rollups else None
+        alert_stats = rpi_log_script.ALERTS.stats() if alerts else None
+        rpi_log_script.WRITER.close()
+        rpi_log_script.ARCHIVE_WRITER.close()
+        rollup_bytes = 0
+        if rollups:
+            rpi_log_script.ROLLUP_WRITER.close()
+            rollup_bytes = sum(os.path.getsize(path) for path in glob.glob('data-*/rollups.db*'))
+        data_bytes = _directory_bytes('.') - rollup_bytes
+        if alerts:
+            rpi_log_script.ALERT_WRITER.close()
+    finally:
+        rpi_log_script.WRITER = None
+        rpi_log_script.ARCHIVE_WRITER = None
+        rpi_log_script.ROLLUPS = None
+        rpi_log_script.ROLLUP_WRITER = None
+        rpi_log_script.ALERTS = None
+        rpi_log_script.ALERT_WRITER = None
+        os.chdir(previous_dir)
+
+    n = len(latencies)
+    latencies.sort()
+    return {
+        'packets': n,
+        'p50_ms': _percentile(latencies, 0.50) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'max_ms': (latencies[-1] * 1000) if latencies else 0.0,
+        'receive_rate_pps': n / receive_elapsed if receive_elapsed else 0.0,
+        'sustained_rate_pps': n / total_elapsed if total_elapsed else 0.0,
+        'cpu_ms_per_packet': cpu_seconds / n * 1000 if n else 0.0,
+        'data_bytes_per_packet': data_bytes / n if n else 0.0,
+        'stdout_bytes_per_packet': stdout.chars / n if n else 0.0,
+        'writer': writer_stats,
+        'dedup': rpi_log_script.DEDUP.stats() if rpi_log_script.DEDUP is not None else None,
+        'rollups': rollup_stats,
+        'rollup_bytes': rollup_bytes,
+        'data_bytes': data_bytes,
+        'alerts': alert_stats,
+    }
+
+
+def print_results(results):
+    print(f"Packets:                 {results['packets']}")
+    print(f"Latency p50 / p99 / max: {results['p50_ms']:.3f} / {results['p99_ms']:.3f} / {results['max_ms']:.3f} ms")
+    print(f"Receive-path rate:       {results['receive_rate_pps']:.0f} packets/s")
+    print(f"Sustained rate:          {results['sustained_rate_pps']:.0f} packets/s (including writer drain)")
+    print(f"CPU per packet:          {results['cpu_ms_per_packet']:.3f} ms")
+    print(f"Data bytes per packet:   {results['data_bytes_per_packet']:.0f}")
+    print(f"Stdout bytes per packet: {results['stdout_bytes_per_packet']:.0f}")
+    print(f"Writer:                  {results['writer']}")
+    if results['dedup'] is not None:
+        print(f"Duplicates:              {results['dedup']}")
+    if results['rollups'] is not None:
+        print(f"Rollups:                 {results['rollup_bytes']} bytes for {results['data_bytes']} bytes of data, "
+              f"{results['rollups']}")
+    if results['alerts'] is not None:
+        print(f"Alerts:                  {results['alerts']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay packets through the logger and report throughput.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archives", nargs='+', help="packets_*.jsonl.gz archives written by rpi_log_script")
+    source.add_argument("--logs", nargs='+', help="logs_*.txt files written by rpi_log_script (globs allowed)")
+    source.add_argument("--synthetic", action="store_true", help="generate synthetic telemetry packets")
+    parser.add_argument("--nodes", type=int, default=10, help="synthetic: number of sensor nodes")
+    parser.add_argument("--packets", type=int, default=5000, help="synthetic: number of packets")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic: random seed")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="synthetic: fraction of packets heard twice (rebroadcasts)")
+    parser.add_argument("--no-dedup", action="store_true", help="log duplicate packets instead of dropping them")
+    parser.add_argument("--no-rollups", action="store_true", help="do not keep the rollups")
+    parser.add_argument("--no-alerts", action="store_true", help="do not evaluate the alert rules")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="pace the replay at this many packets/s (default: as fast as possible)")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default='INFO',
+                        help="logger level to benchmark with")
+    parser.add_argument("--output-dir", default=None,
+                        help="where the logger writes (default: a temporary directory)")
+    parser.add_argument("--writer-shards", type=int, default=2, help="csv/txt writer threads of the logger")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        packet_source = list(synthetic_packets(args.nodes, args.packets, args.seed, args.duplicates))
+    elif args.archives:
+        paths = sorted(path for pattern in args.archives for path in glob.glob(pattern))
+        packet_source = list(iter_packets(paths))
+    else:
+        paths = sorted(path for pattern in args.logs for path in glob.glob(pattern))
+        # Parse up front so file parsing is not counted as logger latency
+        packet_source = [packet for path in paths for packet in load_text_log(path)]
+
+    if args.output_dir:
+        print_results(replay(packet_source, args.output_dir, rate=args.rate, log_level=args.log_level,
+                             writer_shards=args.writer_shards, dedup=not args.no_dedup,
+                             rollups=not args.no_rollups, alerts=not args.no_alerts))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            print_results(replay(packet_source, tmp_dir, rate=args.rate, log_level=args.log_level,
+                                 writer_shards=args.writer_shards, dedup=not args.no_dedup,
+                                 rollups=not args.no_rollups, alerts=not args.no_alerts))
@@ -0,0 +1,393 @@
+"""
+Streaming Rollups of Telemetry per Node, Metric and Window
+
+During a burn, dashboards need per-minute and per-10-minute summaries of
+PM2.5, temperature and wind per node, not raw rows spread over hourly csv
+files. RollupEngine is fed every telemetry packet by the logger's
+on_receive and keeps, per (node, metric, window length, window start), one
+running aggregate of constant size: count, min, max, sum (for the mean),
+last value and, for wind direction, the sums of the unit vectors (so the
+mean of 350 and 10 degrees is 0, not 180).
+
+Windows follow event time: the 'time' the sensor node stamped on the
+telemetry, falling back to rxTime and then the receive time when a node
+has no clock (time 0) or its clock is far off. A window is finalized
+--lateness seconds after it ends and written to rollups.db in the session
+directory. A packet that arrives later still is not lost: it opens the
+window again and the next finalize merges it into the stored row
+(RollupSink reads the row back and writes the merged aggregate), so each
+window is always the summary of every packet received for it.
+
+Command: python scripts/rollups.py <rollups.db> [--node <id>] [--metric pm25Standard] [--window 60]
+from snode directory (prints the stored windows)
+"""
+
+import argparse
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from sqlite_store import connect
+
+logger = logging.getLogger(__name__)
+
+# Metrics rolled up by default (PM2.5, temperature and wind)
+DEFAULT_METRICS = ('pm25Standard', 'pm25Environmental', 'temperature', 'relativeHumidity',
+                   'windSpeed', 'windGust', 'windDirection')
+# Metrics in degrees, averaged as angles
+CIRCULAR_METRICS = {'windDirection'}
+
+DEFAULT_WINDOWS = (60, 600)
+DEFAULT_LATENESS_SECONDS = 120.0
+
+# Sensor clocks further than this from the receive time are not trusted
+MAX_CLOCK_SKEW_SECONDS = 3600.0
+
+ROLLUP_TABLE = 'rollups'
+ROLLUP_HEADERS = ['fromNode', 'metric', 'window', 'start', 'count', 'min', 'max', 'mean',
+                  'sum', 'last', 'lastTime', 'sinSum', 'cosSum']
+
+
+class Aggregate:
+    """
+    Running summary of the values of one window.
+    """
+
+    __slots__ = ('count', 'min', 'max', 'sum', 'last', 'last_time', 'sin_sum', 'cos_sum')
+
+    def __init__(self, circular=False):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.last = None
+        self.last_time = None
+        self.sin_sum = 0.0 if circular else None
+        self.cos_sum = 0.0 if circular else None
+
+    def add(self, value, event_time):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        # last is the newest by event time, so a late packet does not replace it
+        if self.last_time is None or event_time >= self.last_time:
+            self.last = value
+            self.last_time = event_time
+        if self.sin_sum is not None:
+            angle = math.radians(value)
+            self.sin_sum += math.sin(angle)
+            self.cos_sum += math.cos(angle)
+
+    def merge(self, other):
+        """
+        Adds the values summarized by other (e.g. the stored row of a window
+        that received a late packet).
+        """
+        if not other.count:
+            return self
+        if not self.count:
+            for name in Aggregate.__slots__:
+                setattr(self, name, getattr(other, name))
+            return self
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.last_time is not None and (self.last_time is None or other.last_time > self.last_time):
+            self.last = other.last
+            self.last_time = other.last_time
+        if self.sin_sum is not None and other.sin_sum is not None:
+            self.sin_sum += other.sin_sum
+            self.cos_sum += other.cos_sum
+        return self
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        if self.sin_sum is not None:
+            return math.degrees(math.atan2(self.sin_sum, self.cos_sum)) % 360
+        return self.sum / self.count
+
+    def as_dict(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean,
+                'last': self.last, 'last_time': self.last_time}
+
+
+def event_time(telemetry_data, packet, now):
+    """
+    Returns (time the values were measured, True if the receive time had
+    to be used).
+    """
+    for candidate in (telemetry_data.get('time'), packet.get('rxTime')):
+        if isinstance(candidate, (int, float)) and candidate > 0 and abs(candidate - now) <= MAX_CLOCK_SKEW_SECONDS:
+            return float(candidate), False
+    return now, True
+
+
+class RollupEngine:
+    """
+    Open windows of every (node, metric, window length). add() is called
+    from the receive path (one thread per radio); finalize() from the
+    logger's main loop, so all access goes through a lock.
+    """
+
+    def __init__(self, metrics=DEFAULT_METRICS, windows=DEFAULT_WINDOWS, lateness=DEFAULT_LATENESS_SECONDS,
+                 circular=CIRCULAR_METRICS):
+        """
+        Parameters:
+        - metrics: list of str, metric fields to roll up (from any telemetry section)
+        - windows: list of int, window lengths in seconds
+        - lateness: float, seconds after its end a window waits for late packets
+        - circular: set of str, metrics in degrees, averaged as angles
+        """
+        self.metrics = frozenset(metrics)
+        self.windows = tuple(sorted(int(window) for window in windows))
+        self.lateness = lateness
+        self.circular = frozenset(circular)
+        # (fromNode, metric, window, start) -> Aggregate
+        self._open = {}
+        self._lock = threading.Lock()
+        self.values = 0
+        self.finalized = 0
+        self.late = 0
+        self.clock_fallbacks = 0
+
+    def add(self, from_node, telemetry_data, packet, now=None):
+        """
+        Adds the rolled-up metrics of a telemetry packet.
+
+        Parameters:
+        - from_node: str, node id
+        - telemetry_data: dict, packet['decoded']['telemetry']
+        - packet: dict, the packet (for rxTime)
+        - now: float, receive time (default: time.time())
+        """
+        now = now if now is not None else time.time()
+        measured, fallback = event_time(telemetry_data, packet, now)
+        metrics = self.metrics
+        with self._lock:
+            if fallback:
+                self.clock_fallbacks += 1
+            for section in telemetry_data.values():
+                if not isinstance(section, dict):
+                    continue
+                for metric, value in section.items():
+                    if metric not in metrics or not isinstance(value, (int, float)) or isinstance(value, bool):
+                        continue
+                    self.values += 1
+                    for window in self.windows:
+                        start = int(measured // window * window)
+                        key = (from_node, metric, window, start)
+                        aggregate = self._open.get(key)
+                        if aggregate is None:
+                            aggregate = self._open[key] = Aggregate(metric in self.circular)
+                            if start + window + self.lateness <= now:
+                                self.late += 1  # finalized already; merged when written
+                        aggregate.add(value, measured)
+
+    def finalize(self, now=None, everything=False):
+        """
+        Removes and returns the windows that are done.
+
+        Parameters:
+        - now: float, current time (default: time.time())
+        - everything: bool, also the open ones (at shutdown)
+
+        Returns:
+        - list of (fromNode, metric, window, start, Aggregate)
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            done = [key for key in self._open
+                    if everything or key[3] + key[2] + self.lateness <= now]
+            result = [key + (self._open.pop(key),) for key in done]
+            self.finalized += len(result)
+        return result
+
+    def latest(self, from_node=None):
+        """
+        Returns the newest open window of every (node, metric, window length)
+        as JSON-ready dicts, for dashboards.
+        """
+        newest = {}
+        with self._lock:
+            for (node, metric, window, start), aggregate in self._open.items():
+                if from_node is not None and node != from_node:
+                    continue
+                key = (node, metric, window)
+                if key not in newest or start > newest[key][0]:
+                    newest[key] = (start, aggregate.as_dict())
+        return [dict(node=node, metric=metric, window=window, start=start, **values)
+                for (node, metric, window), (start, values) in sorted(newest.items())]
+
+    def stats(self):
+        with self._lock:
+            return {'open_windows': len(self._open), 'values': self.values, 'finalized': self.finalized,
+                    'late_windows': self.late, 'clock_fallbacks': self.clock_fallbacks}
+
+
+def rollup_row(from_node, metric, window, start, aggregate):
+    """
+    Returns the ROLLUP_HEADERS row of a window.
+    """
+    return [from_node, metric, window, start, aggregate.count,
+            aggregate.min, aggregate.max, aggregate.mean, aggregate.sum, aggregate.last, aggregate.last_time,
+            aggregate.sin_sum, aggregate.cos_sum]
+
+
+def _aggregate_from_row(row):
+    # row: count, min, max, sum, last, lastTime, sinSum, cosSum
+    aggregate = Aggregate(circular=row[6] is not None)
+    (aggregate.count, aggregate.min, aggregate.max, aggregate.sum,
+     aggregate.last, aggregate.last_time) = row[:6]
+    if row[6] is not None:
+        aggregate.sin_sum, aggregate.cos_sum = row[6], row[7]
+    return aggregate
+
+
+################################################
+# Storage
+################################################
+
+class RollupSink:
+    """
+    log_writer sink that upserts finalized windows into a rollups table.
+
+    Records are tuples of (db_path, fromNode, metric, window, start,
+    Aggregate). A window already stored (late packets) is read back and
+    merged, so the stored row always covers every packet of the window.
+
+    Only the writer thread should call into a sink.
+    """
+
+    def __init__(self):
+        # db_path -> sqlite3.Connection
+        self._connections = {}
+
+    @staticmethod
+    def record_key(record):
+        return record[0]
+
+    def _connection(self, db_path):
+        conn = self._connections.get(db_path)
+        if conn is None:
+            conn = connect(db_path)
+            # Clustered on the key: no rowid and no second copy of the key in an index
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS "{ROLLUP_TABLE}" (
+                "fromNode" TEXT, "metric" TEXT, "window" INTEGER, "start" INTEGER,
+                "count" INTEGER, "min" REAL, "max" REAL, "mean" REAL, "sum" REAL,
+                "last" REAL, "lastTime" REAL, "sinSum" REAL, "cosSum" REAL,
+                PRIMARY KEY ("fromNode", "metric", "window", "start")) WITHOUT ROWID''')
+            self._connections[db_path] = conn
+        return conn
+
+    def write_batch(self, records):
+        """
+        Upserts a batch of windows, one transaction per database. A database
+        that fails does not stop the others.
+
+        Returns:
+        - list of the records that could not be written
+        """
+        grouped = {}
+        by_db = {}
+        for record in records:
+            db_path, *window = record
+            grouped.setdefault(db_path, []).append(window)
+            by_db.setdefault(db_path, []).append(record)
+
+        names = ', '.join(f'"{name}"' for name in ROLLUP_HEADERS)
+        placeholders = ', '.join('?' for _ in ROLLUP_HEADERS)
+        failed = []
+        for db_path, windows in grouped.items():
+            conn = None
+            try:
+                conn = self._connection(db_path)
+                conn.execute('BEGIN')
+                for from_node, metric, window, start, aggregate in windows:
+                    stored = conn.execute(
+                        f'SELECT "count", "min", "max", "sum", "last", "lastTime", "sinSum", "cosSum" '
+                        f'FROM "{ROLLUP_TABLE}" WHERE "fromNode" = ? AND "metric" = ? AND "window" = ? AND "start" = ?',
+                        (from_node, metric, window, start)).fetchone()
+                    if stored is not None:
+                        aggregate = _aggregate_from_row(stored).merge(aggregate)
+                    conn.execute(f'INSERT OR REPLACE INTO "{ROLLUP_TABLE}" ({names}) VALUES ({placeholders})',
+                                 rollup_row(from_node, metric, window, start, aggregate))
+                conn.execute('COMMIT')
+            except Exception as e:
+                logger.error("Could not write rollups to %s: %s", db_path, e)
+                failed.extend(by_db[db_path])
+                # Reconnect with the next batch
+                self._connections.pop(db_path, None)
+                if conn is not None:
+                    try:
+                        if conn.in_transaction:
+                            conn.execute('ROLLBACK')
+                        conn.close()
+                    except Exception:
+                        pass
+        return failed
+
+    def flush(self, fsync=False):
+        if fsync:
+            for conn in self._connections.values():
+                conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+        self._connections.clear()
+
+
+def read_rollups(db_path, node=None, metric=None, window=None, since=None):
+    """
+    Returns stored windows as dicts, oldest first, with the window start
+    also as 'datetime' (local time, like the telemetry rows).
+
+    Parameters:
+    - db_path: str, rollups.db
+    - node, metric, window: filters, or None
+    - since: float, only windows starting at or after this epoch time
+    """
+    clauses, params = [], []
+    for column, value in (('fromNode', node), ('metric', metric), ('window', window)):
+        if value is not None:
+            clauses.append(f'"{column}" = ?')
+            params.append(value)
+    if since is not None:
+        clauses.append('"start" >= ?')
+        params.append(since)
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(f'SELECT * FROM "{ROLLUP_TABLE}" {where} ORDER BY "start", "fromNode", "metric"', params)
+        names = [column[0] for column in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor]
+    finally:
+        conn.close()
+    for row in rows:
+        row['datetime'] = str(datetime.fromtimestamp(row['start']))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print the stored telemetry rollups.")
+    parser.add_argument("db_path", help="rollups.db in a logging directory")
+    parser.add_argument("--node", default=None, help="fromNode, e.g. 0x1234abcd")
+    parser.add_argument("--metric", default=None, help="metric, e.g. pm25Standard")
+    parser.add_argument("--window", type=int, default=None, help="window length in seconds")
+    args = parser.parse_args()
+
+    print(f"{'window start':19s} {'node':12s} {'metric':18s} {'win':>4s} {'count':>5s} "
+          f"{'min':>8s} {'mean':>8s} {'max':>8s} {'last':>8s}")
+    for row in read_rollups(args.db_path, args.node, args.metric, args.window):
+        print(f"{row['datetime']:19s} {row['fromNode']:12s} {row['metric']:18s} {row['window']:4d} {row['count']:5d} "
+              f"{row['min']:8.2f} {row['mean']:8.2f} {row['max']:8.2f} {row['last']:8.2f}")
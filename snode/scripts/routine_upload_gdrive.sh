@@ -3,6 +3,10 @@
 # Navigate to the project directory (Neccessary)
 cd ~/smesh/snode
 
-# Run the Python script
-/usr/bin/python3 ~/smesh/snode/scripts/upload_to_gdrive.py >> ~/smesh/snode/data/upload_gdrive_stdouterr_log.txt 2>&1
+# Run the Python script at low CPU and I/O priority so a long backlog drains
+# without slowing down the logger. Files that cannot be sent (no uplink) stay
+# queued in data/.upload_queue.db for the next run. data/ is where
+# start_rpi_log.sh writes the logger's sessions. The *_stdouterr_log.txt files
+# there change on every run and are never uploaded (upload_queue.SKIP_SUFFIXES).
+nice -n 10 ionice -c 3 /usr/bin/python3 ~/smesh/snode/scripts/upload_to_gdrive.py --folder ~/smesh/snode/data >> ~/smesh/snode/data/upload_gdrive_stdouterr_log.txt 2>&1
 
@@ -7,40 +7,183 @@ Changes in v4:
 - Watch dog timer (WDT) and recovery by unsubscribing and subscribing to pub
 - Counting number of times heard from each node
 
+Changes in v5:
+- Disk writes moved off the meshtastic reader thread onto a batched writer
+  thread (log_writer.py); on_receive only enqueues records
+- Optional SQLite storage backend (--storage sqlite|both, sqlite_store.py)
+- Level-gated logging (log_config.py) instead of per-packet prints; thread
+  dumps moved behind --debug-threads or SIGUSR1
+- Raw packets go to a compressed JSON-lines archive (packet_archive.py)
+  instead of repr() text logs (--raw-log text|both keeps the old logs)
+- Telemetry rows built by per-type encoders from a schema registry
+  (telemetry_schema.py); extra fields and types can come from a JSON file
+  (--schemas)
+- Every telemetry section of a packet is logged, not just the first;
+  sections without a schema go to schemaless otherTelemetry rows instead
+  of being dropped
+- csv/txt writes spread over --writer-shards writer threads, each owning its
+  own files; dropped rows are counted per file in the writer stats
+- Heard-from counter replaced by per-node link statistics (node_stats.py),
+  snapshotted every --node-stats-interval seconds to node_stats.json and
+  node_stats_<hour>.csv instead of dumping the counter on every packet
+- Duplicate packets (same sender and packet id, e.g. rebroadcasts) dropped
+  before any processing by a bounded cache (dedup.py), counted per node
+- Several serial ports served by one process (one radio per port), each
+  with its own watchdog; dedup, node statistics and writers are shared, and
+  each radio logs to its own logger node directory in one data-<datetime>/
+- Event-driven watchdog and reconnect (reconnect.py): the main loop sleeps
+  until its next timer instead of waking every second, lost radios are
+  reconnected with jittered backoff when their device appears (inotify),
+  and the subscription and writers stay up across reconnects
+- Streaming rollups (rollups.py): per-node count/min/max/mean/last of PM2.5,
+  temperature and wind over 1 and 10 minute windows of event time, written
+  to rollups.db when a window closes; late packets are merged into their
+  window
+- Live feed for phones on the access point (live_feed.py, --http-port):
+  Server-Sent Events of every telemetry packet and the latest values per
+  node over HTTP, served from memory without blocking on_receive
+- Alerts (alerts.py): threshold and rate-of-change rules (e.g. PM2.5 over
+  150 for 5 minutes, temperature rising 2 degrees a minute) evaluated per
+  node on every packet within --alert-budget-us, sent to the log, an HTTP
+  hook (--alert-hook) and/or the mesh (--alert-mesh-channel)
+- Storage governor (storage_governor.py): cold shards gzipped, uploaded
+  files deleted after --retention-days or when the SD card runs low, and
+  the raw packet archive paused and dropped first when space is critical
+- Write-ahead journal (journal.py): csv/txt batches are journaled with one
+  fsync per batch before they reach their files, and replayed at startup
+  after a power cut, so committed rows are never lost or half-written;
+  the files themselves are only fsynced every --fsync-interval seconds
+- Sessions are written to snode/data/data-<datetime>/ (--data-dir), the
+  folder upload_to_gdrive.py syncs by default, instead of the snode
+  directory next to the code and credentials
+
 Future Improvements:
-- Use SQLite for logging data
 - Add keyboard node logging
 
 Authors: Lisa, Kirby, Rohan, Pete, Daniel
 Previous Authors: Joshua
-Last Updated: 12/29/2024
+Last Updated: 10/18/2026
 """
 
 import time
-import sys
 import os
-import csv
+import argparse
+import logging
 import threading
 from datetime import datetime, timedelta
 from pubsub import pub
 from meshtastic.serial_interface import SerialInterface
+from log_writer import BatchedWriter, ShardedWriter, FileSink, CSV_RECORD, TXT_RECORD, FSYNC_POLICIES, FSYNC_INTERVAL, FSYNC_NEVER
+from sqlite_store import SQLiteSink
+from packet_archive import ArchiveSink, COMPRESSIONS, EXTENSIONS, GZIP
+from log_config import setup_logging, log_active_threads, install_thread_dump_handler, LOG_LEVELS
+from dedup import DedupCache, DEFAULT_WINDOW_SECONDS, DEFAULT_MAX_ENTRIES
+from reconnect import ReconnectManager, DEFAULT_TIMEOUT_SECONDS, DEFAULT_BACKOFF_CAP
+from node_stats import NodeStatsEngine, SNAPSHOT_HEADERS
+from rollups import RollupEngine, RollupSink, DEFAULT_METRICS, DEFAULT_WINDOWS, DEFAULT_LATENESS_SECONDS
+from live_feed import LiveFeed, DEFAULT_BUFFER_EVENTS, DEFAULT_MAX_CLIENTS
+from alerts import (AlertEngine, AlertSink, LogAlertSink, HttpAlertSink, MeshAlertSink, load_rules,
+                    DEFAULT_BUDGET_US)
+from journal import JournaledSinkFactory, JOURNAL_DIR, recover as recover_journal
+from upload_queue import DATA_FOLDER
+from storage_governor import (StorageGovernor, DEFAULT_RETENTION_DAYS, DEFAULT_LOW_FREE_MB,
+                              DEFAULT_CRITICAL_FREE_MB)
+from telemetry_schema import SchemaRegistry, OTHER_TELEMETRY_KEY, OTHER_TELEMETRY_HEADERS, other_telemetry_rows
 # from meshtastic import portnums_pb2
 
-# Create new folder for each type of telemetry
-LOG_FILE_PREFIX = ""
+logger = logging.getLogger("rpi_log")
+
+# Log every thread on every csv row (the v4 behaviour), set by --debug-threads
+DEBUG_THREADS = False
+
+# Data folder the sessions are written to, shared with the uploader and the
+# storage governor (--data-dir)
+DATA_ROOT = DATA_FOLDER
+# Session directory <data root>/data-<datetime>/ shared by all radios, and the
+# directory of each logger node in it (logger node id -> '.../data-.../a1b2/')
+LOG_DIR = ""
+LOG_FILE_PREFIXES = {}
+# Radios receive on their own threads, so directory creation is serialized
+LOG_DIR_LOCK = threading.Lock()
 # Global variable for unique datetime identifier in log file name
 # Creates new log file every time script is run and once every 1 hour
 ON_RECEIVE_DT = datetime.now()
 
-# Global variable for file lock to ensure thread safety
-# in the file writing operations when multiple packets arrive
-# at similar times.
-FILE_LOCK = threading.Lock()
-
-# Dictionary to keep track of the number of times a node has been heard
-HEARD_FROM_NODE_COUNTER = {}
-
-WDT = datetime.now()
+# Global writer that owns all csv/txt file handles. on_receive only enqueues
+# records; the writer threads (one per shard of files) batch them to disk.
+# Created in main().
+WRITER = None
+
+# Journals of the csv/txt writer shards (see journal.py). Created in main()
+# unless --no-journal.
+JOURNAL = None
+
+# Writer for the SQLite store, only created when --storage includes sqlite
+STORE_WRITER = None
+
+# Writer for the raw packet archive, created in main()
+ARCHIVE_WRITER = None
+
+# Where raw packets go: the compressed archive, the v4 repr() text logs, or
+# both. Set from the command line in main().
+RAW_LOG_ARCHIVE = 'archive'
+RAW_LOG_TEXT = 'text'
+RAW_LOG_BOTH = 'both'
+RAW_LOG = RAW_LOG_ARCHIVE
+ARCHIVE_COMPRESSION = GZIP
+
+# Where telemetry rows go: hourly csv shards, a telemetry.db per logging
+# directory, or both. Set from the command line in main().
+STORAGE_CSV = 'csv'
+STORAGE_SQLITE = 'sqlite'
+STORAGE_BOTH = 'both'
+STORAGE = STORAGE_CSV
+
+# Row encoder per expected telemetry type (metric fields followed by the
+# signal keys copied from the packet itself). Replaced in main() when
+# --schemas points to a JSON file.
+SCHEMAS = SchemaRegistry()
+
+# How often main() logs the writer statistics
+WRITER_STATS_INTERVAL = timedelta(minutes=10)
+
+# Per-node packet counts, last seen time, RSSI/SNR, hops and packet gaps.
+# Snapshotted to disk by main() every NODE_STATS_INTERVAL.
+NODE_STATS = NodeStatsEngine()
+NODE_STATS_INTERVAL = timedelta(seconds=60)
+
+# Recently seen (sender, packet id) pairs, to drop flooded copies of a
+# packet. Shared by all radios, so a packet heard by two of them is logged
+# once. Replaced in main() from the command line; None disables it.
+DEDUP = DedupCache()
+
+# Per-minute (and longer) summaries of selected metrics per node, and the
+# writer of their rollups.db. Created in main(); None disables them.
+ROLLUPS = None
+ROLLUP_WRITER = None
+ROLLUP_INTERVAL = timedelta(seconds=15)
+
+# HTTP feed of live telemetry and latest values per node. Created in main()
+# when --http-port is given.
+LIVE_FEED = None
+
+# Alert rules evaluated on every telemetry packet, and the writer thread
+# that hands fired alerts to their sinks. Created in main().
+ALERTS = None
+ALERT_WRITER = None
+
+# Keeps the SD card from filling up: compresses, expires and (when space is
+# low) deletes old data, and pauses the raw archive when space is critical.
+# Created in main(); None disables it.
+STORAGE_GOVERNOR = None
+
+# Radios (serial ports) the logger listens to, and the manager that
+# connects them and runs their watchdogs. Created in main().
+RADIOS = []
+RECONNECT = None
+
+# Times the main loop woke up, to report wakeups per hour
+MAIN_WAKEUPS = 0
 
 def create_new_logging_dir(node_id):
 
@@ -48,43 +191,88 @@ def create_new_logging_dir(node_id):
     Ensures that a directory is created prior to running any logging functions
     Parameters: 
     - node_id: the logger node ID
-    """
-    global LOG_FILE_PREFIX 
-    # create new directory if the current one doesn't exist including the nodeid
-    if not os.path.exists(LOG_FILE_PREFIX) or LOG_FILE_PREFIX == "":
-        format_dt_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        LOG_FILE_PREFIX = f'./data-{format_dt_str}/{node_id}/'
-        print(f'Created new logging directory {LOG_FILE_PREFIX}')
-        # update the directory because either the block was corrupted for the provided directory OR
-        # we have not yet defined and created the desired directory
 
+    Returns:
+    - str, directory of the logger node, e.g. '<data root>/data-2024-12-17_13-07-56/a1b2/'
+
+    Raises:
+    - SystemError if the directory cannot be created (e.g. on a full SD
+      card). LOG_DIR only changes once the new session directory exists,
+      so the node statistics and rollups never point at a missing one.
+    """
+    global LOG_DIR
+    with LOG_DIR_LOCK:
+        log_file_prefix = LOG_FILE_PREFIXES.get(node_id)
+        if log_file_prefix is not None and os.path.exists(log_file_prefix):
+            return log_file_prefix
+
+        # start a new session directory if the current one doesn't exist
+        log_dir = LOG_DIR
+        if log_dir == "" or not os.path.exists(log_dir):
+            format_dt_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            log_dir = os.path.join(DATA_ROOT, f'data-{format_dt_str}', '')
+
+        # create the directory of the logger node: either the block was
+        # corrupted for the provided directory OR we have not yet defined
+        # and created the desired directory
+        log_file_prefix = f'{log_dir}{node_id}/'
         try:
-            os.makedirs(LOG_FILE_PREFIX, exist_ok=False) # also creates any relevant parent directories
+            os.makedirs(log_file_prefix, exist_ok=True) # also creates any relevant parent directories
         except OSError as e:
+            # Let the storage governor free some space for the next packet
+            if STORAGE_GOVERNOR is not None:
+                STORAGE_GOVERNOR.wake()
             # fail LOUDLY! if we can no longer write data over :-)
-            raise SystemError(f"Could not create directory path at '{LOG_FILE_PREFIX}'. Threw error {e}")
+            raise SystemError(f"Could not create directory path at '{log_file_prefix}'. Threw error {e}")
+        logger.info("Created new logging directory %s", log_file_prefix)
+        if log_dir != LOG_DIR:
+            LOG_DIR = log_dir
+            LOG_FILE_PREFIXES.clear()
+        LOG_FILE_PREFIXES[node_id] = log_file_prefix
+        return log_file_prefix
 
 
 ################################################
-# Printing Helper Functions
+# Status Helper Functions
 ################################################
 
-def print_active_threads():
+def writer_status():
+    """
+    Returns the statistics of the running writers, for logs and thread dumps.
     """
-    Prints all active threads.
+    status = {}
+    if WRITER is not None:
+        status['writer'] = WRITER.stats()
+    if JOURNAL is not None:
+        status['journal'] = JOURNAL.stats()
+    if STORE_WRITER is not None:
+        status['store_writer'] = STORE_WRITER.stats()
+    if ARCHIVE_WRITER is not None:
+        status['archive_writer'] = ARCHIVE_WRITER.stats()
+    if ROLLUP_WRITER is not None:
+        status['rollup_writer'] = ROLLUP_WRITER.stats()
+    if ALERT_WRITER is not None:
+        status['alert_writer'] = ALERT_WRITER.stats()
+    return status
+
+def radio_status():
     """
-    print(f"[{datetime.now()}] Main thread (should be the main python script):")
-    print(f"Main thread name: {threading.main_thread().name}, " + 
-          f"Main thread ID: {threading.main_thread().ident}, " + 
-          f"Is daemon: {threading.main_thread().daemon}")
-    print(f"[{datetime.now()}] There are {threading.active_count()} active threads:")
-    for thread in threading.enumerate():
-        print(f"Thread name: {thread.name}, Thread ID: {thread.ident}, Is daemon: {thread.daemon}")
-    print("Of which, current thread is:")
-    print(f"Current thread name: {threading.current_thread().name}, " +
-          f"Current thread ID: {threading.current_thread().ident}, " +
-          f"Is daemon: {threading.current_thread().daemon}")
-    print(f"Lock status of {FILE_LOCK}: {FILE_LOCK.locked()}")
+    Returns the receive counters and watchdog state of every radio.
+    """
+    return [radio.status() for radio in RADIOS]
+
+def wakeup_status(started):
+    """
+    Returns how often the main loop and the radio watchdog woke up, per hour.
+
+    Parameters:
+    - started: datetime, start of the main loop
+    """
+    hours = max((datetime.now() - started).total_seconds(), 1) / 3600
+    status = {'main_wakeups_per_hour': round(MAIN_WAKEUPS / hours, 1)}
+    if RECONNECT is not None:
+        status['watchdog'] = RECONNECT.stats()
+    return status
 
 
 ################################################
@@ -93,11 +281,10 @@ def print_active_threads():
 
 def log_to_csv(filename, data, headers):
     """
-    Writes logs to csv file. Closes file after each write, which writes to disk.
-    The file lock ensures thread safety when multiple packets arrive at similar 
-    times.
+    Queues a row for the csv file. The writer thread keeps the file open and
+    writes rows in batches, so this never waits on the SD card.
 
-    If the file does not exist, it creates a new file and writes the headers.
+    If the file does not exist, the writer creates it and writes the headers.
     Technically, headers can be None thereafter.
 
     Parameters:
@@ -105,104 +292,136 @@ def log_to_csv(filename, data, headers):
     - data: list, data to log
     - headers: list, headers for the csv file
     """
-    print_active_threads()
-    print("----")
+    if DEBUG_THREADS:
+        log_active_threads(logger)
 
-    # global FILE_LOCK
-    if FILE_LOCK.acquire(timeout=5):  # Timeout set to 5 seconds
-        try:
-            print(f"Current thread (with lock) at log_to_csv for {filename}: " +
-                f"{threading.current_thread().name} at {threading.current_thread().ident}")
-            print(f"Lock is: {FILE_LOCK} (locked: {FILE_LOCK.locked()})")
-    
-            # Write headers for new file
-            if not os.path.exists(filename):
-                with open(filename, 'w', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(headers)
-
-            # Append data
-            with open(filename, 'a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(data)
-        finally:
-                FILE_LOCK.release()
-    else:
-        print(f"ERROR: Could not acquire file lock for {filename} within timeout period.")
+    if not WRITER.submit((CSV_RECORD, filename, headers, data)):
+        logger.error("Writer queue full, dropped row for %s", filename)
 
 def log_to_txt(filename, data):
     """
-    Writes logs to txt file. Closes file after each write, which writes to disk.
-    The file lock ensures thread safety when multiple packets arrive at similar
-    times.
+    Queues a line for the txt file. The writer thread keeps the file open and
+    writes lines in batches, so this never waits on the SD card.
 
     Parameters:
     - filename: str, path to the txt file
     - data: list, data to log
     """
+    if not WRITER.submit((TXT_RECORD, filename, None, data)):
+        logger.error("Writer queue full, dropped line for %s", filename)
 
-    # global FILE_LOCK
-    if FILE_LOCK.acquire(timeout=5):  # Timeout set to 5 seconds
-        try:
-            print(f"Current thread (with lock) at log_to_txt for {filename}: " +
-             f"{threading.current_thread().name} at {threading.current_thread().ident}")
-            print(f"Lock is: {FILE_LOCK} (locked: {FILE_LOCK.locked()})")
 
-            with open(filename, 'a') as file:
-                file.write(f"{data}\n")
-        finally:
-            FILE_LOCK.release()
-    else:
-        print(f"ERROR: Could not acquire file lock for {filename} within timeout period.")
+def log_telemetry_to_csv(filename, headers, row):
+    """
+    Queues a telemetry row for the hourly csv file of its telemetry type.
 
+    Parameters:
+    - filename: str, path to the csv file
+    - headers: list, column names (TelemetryEncoder.headers)
+    - row: list, data to log (TelemetryEncoder.row())
+    """
+    log_to_csv(filename, row, headers)
 
-def log_telemetry_to_csv(filename, curr_date_time, from_node, data_dict, telemetry_key):
+def log_telemetry_to_sqlite(db_path, telemetry_key, headers, row):
     """
-    Use a set of expected preset telemetry data to log to csv file while accounting for missing data.
+    Queues a telemetry row for the SQLite store (one table per telemetry type).
 
     Parameters:
-    - filename: str, path to the csv file
-    - curr_date_time: str, current date and time
-    - from_node: str, node id
-    - data_dict: Dict, dictionary of data keys and values
+    - db_path: str, path to the database file
     - telemetry_key, str, telemetry type
+    - headers: list, column names (TelemetryEncoder.headers)
+    - row: list, data to log (TelemetryEncoder.row())
+    """
+    if not STORE_WRITER.submit((db_path, telemetry_key, headers, row)):
+        logger.error("Store queue full, dropped %s row for %s", telemetry_key, db_path)
 
-    Private variables:
-    - data_to_log: list, data to log
+def log_other_telemetry(log_file_prefix, curr_date_time, from_node, telemetry_key, section, format_dt_str):
     """
+    Queues a telemetry section without a schema as long-format rows (one per
+    field), to the otherTelemetry csv and/or table per the storage setting.
 
-    expected_keys_dict = {
-        'environmentMetrics' : ['temperature', 'relativeHumidity', 'barometricPressure', 'gasResistance', 'iaq', 'windDirection', 'windSpeed'],
-        'airQualityMetrics' : ['pm10Standard', 'pm25Standard', 'pm100Standard', 'pm10Environmental', 'pm25Environmental', 'pm100Environmental'],
-        'powerMetrics' : ['ch3Voltage', 'ch3Current'],
-        'deviceMetrics' : ['batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx']
-    }
+    Parameters:
+    - log_file_prefix: str, directory of the logger node
+    - curr_date_time: str, current date and time
+    - from_node: str, node id
+    - telemetry_key: str, section name
+    - section: dict, the section
+    - format_dt_str: str, hour identifier of the csv file
+    """
+    for row in other_telemetry_rows(curr_date_time, from_node, telemetry_key, section):
+        if STORAGE in (STORAGE_CSV, STORAGE_BOTH):
+            log_telemetry_to_csv(f'{log_file_prefix}{OTHER_TELEMETRY_KEY}_{format_dt_str}.csv',
+                                 OTHER_TELEMETRY_HEADERS, row)
+        if STORAGE in (STORAGE_SQLITE, STORAGE_BOTH):
+            log_telemetry_to_sqlite(f'{log_file_prefix}telemetry.db', OTHER_TELEMETRY_KEY,
+                                    OTHER_TELEMETRY_HEADERS, row)
+
+def log_packet_to_archive(path, curr_date_time, logger_node_id, packet):
+    """
+    Queues a raw packet for the compressed archive. Encoding and compression
+    happen on the archive writer thread.
 
-    expected_keys = expected_keys_dict[telemetry_key] + ['rxSnr', 'rxRssi', 'rxTime', 'hopStart', 'hopLimit']
+    Parameters:
+    - path: str, path to the hourly archive file
+    - curr_date_time: str, current date and time
+    - logger_node_id: str, logger node id
+    - packet: dict, packet as published by meshtastic
+    """
+    if not ARCHIVE_WRITER.submit((path, curr_date_time, logger_node_id, packet)):
+        logger.error("Archive queue full, dropped packet for %s", path)
 
-    data_to_log = [curr_date_time, from_node]
-    for key in expected_keys:
-        if key in data_dict:
-            data_to_log.append(data_dict[key])
-        else:
-            data_to_log.append(None)
+################################################
+# Node Statistics Functions
+################################################
 
-    headers = ['datetime', 'fromNode'] + expected_keys
-    log_to_csv(filename, data_to_log, headers)
+def snapshot_node_stats():
+    """
+    Writes the per-node statistics: the latest state to node_stats.json and
+    one row per node to the hourly node_stats csv, in the session directory
+    (the statistics cover every radio). Runs on the main thread on a timer,
+    never on the receive path.
+    """
+    if LOG_DIR == "" or not len(NODE_STATS):
+        return  # nothing heard yet, so no logging directory either
+    format_dt_str = ON_RECEIVE_DT.strftime("%Y-%m-%d_%H-%M-%S")
+    now = time.time()
+    for row in NODE_STATS.csv_rows(str(datetime.now()), now):
+        log_to_csv(f'{LOG_DIR}node_stats_{format_dt_str}.csv', row, SNAPSHOT_HEADERS)
+    extra = {'radios': radio_status()}
+    if DEDUP is not None:
+        extra.update(duplicates=DEDUP.duplicate_counts(), dedup=DEDUP.stats())
+    try:
+        NODE_STATS.write_snapshot(f'{LOG_DIR}node_stats.json', now, extra)
+    except OSError as e:
+        logger.error("Could not write node statistics snapshot: %s", e)
 
 ################################################
-# Counter Functions
+# Rollup Functions
 ################################################
 
-def increment_heard_from_node_counter(from_node):
+def write_rollups(everything=False):
+    """
+    Queues the finalized rollup windows for rollups.db in the session
+    directory. Runs on the main thread on a timer, and with everything at
+    shutdown to keep the windows still open.
+    """
+    if ROLLUPS is None or LOG_DIR == "":
+        return
+    for window in ROLLUPS.finalize(everything=everything):
+        if not ROLLUP_WRITER.submit((f'{LOG_DIR}rollups.db',) + window):
+            logger.error("Rollup queue full, dropped %s window of %s", window[1], window[0])
+
+def check_alerts():
     """
-    Increment the counter for the number of times a node has been heard.
+    Evaluates rule values still deferred after a burst of packets, and
+    lets the alert writer send combined mesh messages whose interval has
+    passed. Runs on the main thread on the rollup timer.
     """
-    global HEARD_FROM_NODE_COUNTER
-    if from_node in HEARD_FROM_NODE_COUNTER:
-        HEARD_FROM_NODE_COUNTER[from_node] += 1
-    else:
-        HEARD_FROM_NODE_COUNTER[from_node] = 1
+    if ALERTS is None:
+        return
+    ALERTS.drain()
+    # Only asks the writer for a flush: never waits, even on a full queue
+    ALERT_WRITER.flush(timeout=0)
 
 ################################################
 # Callback Functions
@@ -211,10 +430,20 @@ def increment_heard_from_node_counter(from_node):
 def on_receive(packet, interface):
     """
     Callback reads BME688 and PMSA003I data packets over the e.g. serial interface.
+    Called on the reader thread of the radio that received the packet.
     """
-    #Feed the watchdog timer
-    global WDT
-    WDT = datetime.now()
+    #Feed the watchdog timer of the radio
+    radio = find_radio(interface)
+    if radio is not None:
+        radio.feed()
+
+    # Drop flooded copies of a packet we already logged (possibly heard by
+    # another radio), before any work
+    if DEDUP is not None and DEDUP.is_duplicate(packet.get('from'), packet.get('id')):
+        if radio is not None:
+            radio.duplicates += 1
+        logger.debug("duplicate from=%s id=%s", packet.get('fromId'), packet.get('id'))
+        return
 
     # Datetime unique identifier for log filename
     global ON_RECEIVE_DT
@@ -222,14 +451,17 @@ def on_receive(packet, interface):
     if (datetime.now() >= ON_RECEIVE_DT + timedelta(hours=1)):
         ON_RECEIVE_DT = datetime.now()
 
+    logged_sections = []
+    logger_node_id = None
     try:
         # nodeid is the last 4 hex digits of node connected via serial port
-        # (i.e., the node that is logging)
-        logger_node_id = hex(interface.myInfo.my_node_num)[-4:]
+        # (i.e., the node that is logging); it tags everything this radio logs
+        if radio is not None and radio.node_id is not None:
+            logger_node_id = radio.node_id
+        else:
+            logger_node_id = hex(interface.myInfo.my_node_num)[-4:]
         from_node = hex(packet['from'])
 
-        print("\nFrom node:", from_node)
-
         # Note any situation where the from_node and fromId are different
         # Note that from is printed as 0x12345678, while fromId is printed 
         # as !12345678. So, we only need the last 8 characters.
@@ -237,171 +469,361 @@ def on_receive(packet, interface):
         check_from_node = str(from_node)[-8:]
         check_fromid_node = str(packet['fromId'])[-8:]
         if check_from_node != check_fromid_node:
-            print("WARNING: from_node and fromId are different:" + \
-                    f"{check_from_node} != {check_fromid_node}")
+            logger.warning("from_node and fromId are different: %s != %s",
+                           check_from_node, check_fromid_node)
         
-        # Increment the counter for the number of times a node has been heard
-        increment_heard_from_node_counter(from_node)                   
+        # Update the link statistics of the node (in memory only)
+        NODE_STATS.record(from_node, packet)
         
         if packet['decoded']['portnum'] == 'TELEMETRY_APP':
             telemetry_data = packet['decoded']['telemetry']
-            print(f"[{str(datetime.now())}] Packet from {from_node} (fromId: {packet['fromId']})")
-
-            # Expected telemetry
-            telemetry_list = ['environmentMetrics', 'airQualityMetrics', 'powerMetrics', 'deviceMetrics']
-            # expected_telemetry = False  # True if expected sensor telemetry received, else False
-
-            signal_keys = ['rxSnr', 'rxRssi', 'rxTime', 'hopLimit', 'hopStart']
-            signal_strength_data = {key: packet[key] for key in signal_keys if key in packet}
+            curr_date_time = str(datetime.now())
 
             # Format datetime for filename
             # Format as 'YYYY-MM-DD_HH-MM-SS', such as '2024-12-17_13-07-56'
             format_dt_str = ON_RECEIVE_DT.strftime("%Y-%m-%d_%H-%M-%S")    
 
             # create new directories if necessary to log data
-            create_new_logging_dir(logger_node_id)
-
-            for telemetry_key in telemetry_list:
-                if telemetry_key in telemetry_data:
-                    print(f"Telemetry key: {telemetry_key}")
-
-                    metrics = telemetry_data[telemetry_key]
-                    print(f"Metrics: {metrics}")
-
-                    log_telemetry_to_csv(f'{LOG_FILE_PREFIX}{telemetry_key}_{format_dt_str}.csv', str(datetime.now()), 
-                                        from_node, metrics | signal_strength_data, telemetry_key)
-                    
-                    # expected_telemetry = True
-                    break
-                
-
-            # Commented! Needs to be tested-- last issues documented at burnbot
-            # if not expected_telemetry:
-            #     print("Other packet")
-            #     print(f"Telemetry data: {telemetry_data}")
-            #     # Empty headers for other data, since we don't know what it is a priori
-            #     other_headers = [''] * len(telemetry_data) 
-            #     log_to_csv(f'{LOG_FILE_PREFIX}_other_{format_dt_str}.csv', 
-            #                [str(datetime.now()), from_node, telemetry_data], other_headers, logger_node_id)
-
-            # log telemetry data to txt file
-            log_to_txt(f'{LOG_FILE_PREFIX}logs_{format_dt_str}.txt', 
-                       [str(datetime.now()), from_node, packet])
-
-            # Log the incremented counter dictionary to a text file
-            log_to_txt(f'{LOG_FILE_PREFIX}heard_from_node_counter_{format_dt_str}.txt', 
-                       [str(datetime.now()), HEARD_FROM_NODE_COUNTER])
-
-    except KeyError:
-        print("ERROR: KeyError")
+            log_file_prefix = create_new_logging_dir(logger_node_id)
+
+            # Route every metrics section to its encoder (the schema registry
+            # is the dispatch table); sections without a schema are kept too
+            sections = {}
+            for telemetry_key, encoder, metrics in SCHEMAS.sections(telemetry_data):
+                logger.debug("%s from %s: %s", telemetry_key, from_node, metrics)
+                logged_sections.append(telemetry_key)
+                sections[telemetry_key] = metrics
+                if encoder is None:
+                    log_other_telemetry(log_file_prefix, curr_date_time, from_node, telemetry_key, metrics, format_dt_str)
+                    continue
+
+                # Signal fields are read from the packet directly, no merged dict
+                row = encoder.row(curr_date_time, from_node, metrics, packet)
+                if STORAGE in (STORAGE_CSV, STORAGE_BOTH):
+                    log_telemetry_to_csv(f'{log_file_prefix}{telemetry_key}_{format_dt_str}.csv', encoder.headers, row)
+                if STORAGE in (STORAGE_SQLITE, STORAGE_BOTH):
+                    log_telemetry_to_sqlite(f'{log_file_prefix}telemetry.db', telemetry_key, encoder.headers, row)
+
+            # Update the running window summaries (in memory only)
+            if ROLLUPS is not None:
+                ROLLUPS.add(from_node, telemetry_data, packet)
+
+            # Check the alert rules (in memory; alerts are sent by the alert
+            # writer thread)
+            if ALERTS is not None:
+                ALERTS.evaluate(from_node, telemetry_data, packet)
+
+            # Hand the packet to the live feed (memory only; the HTTP client
+            # threads do the sending)
+            if LIVE_FEED is not None:
+                LIVE_FEED.publish(from_node, sections, curr_date_time, logger_node_id, packet)
+
+            # log the raw packet to the compressed archive and/or txt file,
+            # unless the SD card is nearly full and space is kept for telemetry
+            raw_allowed = STORAGE_GOVERNOR is None or STORAGE_GOVERNOR.raw_allowed
+            if raw_allowed and RAW_LOG in (RAW_LOG_ARCHIVE, RAW_LOG_BOTH):
+                log_packet_to_archive(f'{log_file_prefix}packets_{format_dt_str}{EXTENSIONS[ARCHIVE_COMPRESSION]}',
+                                      curr_date_time, logger_node_id, packet)
+            if raw_allowed and RAW_LOG in (RAW_LOG_TEXT, RAW_LOG_BOTH):
+                log_to_txt(f'{log_file_prefix}logs_{format_dt_str}.txt', 
+                           [curr_date_time, from_node, packet])
+
+    except KeyError as e:
+        logger.error("KeyError %s", e)
         pass  # Ignore KeyError silently
     except UnicodeDecodeError:
-        print("ERROR: UnicodeDecodeError")
+        logger.error("UnicodeDecodeError")
         pass  # Ignore UnicodeDecodeError silently
     except Exception as e:
-        print(f"ERROR: Unexpected error: {e}")
+        logger.exception("Unexpected error: %s", e)
         pass  # Ignore unexpected errors silently
 
-    print(f"\nReceived Packet: {packet}")
-    print("-"*30, "\n")     # Separate packets more visibly
+    # One compact line per packet; the full packet only at DEBUG
+    logger.info("rx via=%s from=%s id=%s port=%s logged=%s snr=%s rssi=%s hops=%s/%s",
+                logger_node_id, packet.get('fromId'), packet.get('id'), packet.get('decoded', {}).get('portnum'),
+                ','.join(logged_sections) or '-', packet.get('rxSnr'), packet.get('rxRssi'),
+                packet.get('hopLimit'), packet.get('hopStart'))
+    logger.debug("packet %s", packet)
 
 
-# Retry every 10 seconds to make connection to Meshtastic if it fails
-# Checks for the TTYUSB availability from pi <> meshtastic
-def setup_meshtastic_connection(serial_port):
-    while (True):
-        if os.path.exists(serial_port):
-            print(f"Serial port set to: {serial_port}")
-            break
-        else:
-            print(f"Error: The path '{serial_port}' does not exist. Retrying connection")
-            time.sleep(10)
-    
-    local = SerialInterface(serial_port)
-    print("SerialInterface setup for listening.")
-    return local
+def on_connection_lost(interface):
+    """
+    Callback for meshtastic.connection.lost: reconnects the radio right away
+    instead of waiting for its watchdog.
+    """
+    if RECONNECT is not None:
+        RECONNECT.connection_lost(interface)
+
+def find_radio(interface):
+    """
+    Returns the Radio an interface belongs to, or None (e.g. in a replay).
+    """
+    for radio in RADIOS:
+        if radio.interface is interface:
+            return radio
+    return None
 
 ################################################
 # Main Function
 ################################################
 
-# Runs every time script is started
-def main():
-    global WDT
-    ON_RECEIVE_DT = datetime.now()
-    print(f"{ON_RECEIVE_DT} Raspberry Pi Logging Script started")
-
-    # Print the current active threads before starting
-    print("----\nBefore starting the script, the thread information is as follows:")
-    print_active_threads()
-    print("----")
+def parse_args(argv=None):
+    """
+    Parses the command line. The serial port stays the first positional
+    argument so existing start scripts keep working; more ports can follow.
+    """
+    parser = argparse.ArgumentParser(description="Log Meshtastic telemetry received over one or more serial ports.")
+    parser.add_argument("serial_ports", nargs='+',
+                        help="serial port of each logger node, e.g. /dev/ttyUSB0 /dev/ttyUSB1")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="records written per batch by the writer thread")
+    parser.add_argument("--flush-interval", type=float, default=2.0,
+                        help="maximum seconds a record waits in memory before being written")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=FSYNC_INTERVAL,
+                        help="when the writer asks the OS to sync files to the SD card")
+    parser.add_argument("--fsync-interval", type=float, default=30.0,
+                        help="minimum seconds between fsyncs with --fsync interval (journal checkpoints)")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="write csv/txt rows without the write-ahead journal")
+    parser.add_argument("--max-queue", type=int, default=10000,
+                        help="records held in memory before new ones are dropped")
+    parser.add_argument("--writer-shards", type=int, default=2,
+                        help="csv/txt writer threads; each file is always written by the same thread")
+    parser.add_argument("--raw-log", choices=(RAW_LOG_ARCHIVE, RAW_LOG_TEXT, RAW_LOG_BOTH), default=RAW_LOG_ARCHIVE,
+                        help="store raw packets in a compressed archive, the old repr() text logs, or both")
+    parser.add_argument("--archive-compression", choices=COMPRESSIONS, default=GZIP,
+                        help="compression of the raw packet archive (zstd needs the zstandard package)")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default='INFO',
+                        help="INFO logs one line per packet, DEBUG adds full packets and metrics")
+    parser.add_argument("--debug-threads", action="store_true",
+                        help="log all active threads on every csv row (also available via SIGUSR1)")
+    parser.add_argument("--storage", choices=(STORAGE_CSV, STORAGE_SQLITE, STORAGE_BOTH), default=STORAGE_CSV,
+                        help="write telemetry to hourly csv files, a SQLite telemetry.db, or both")
+    parser.add_argument("--watchdog-timeout", type=float, default=DEFAULT_TIMEOUT_SECONDS,
+                        help="seconds without a packet before a radio is reconnected")
+    parser.add_argument("--reconnect-backoff-cap", type=float, default=DEFAULT_BACKOFF_CAP,
+                        help="longest wait in seconds between attempts to reopen a radio")
+    parser.add_argument("--node-stats-interval", type=float, default=NODE_STATS_INTERVAL.total_seconds(),
+                        help="seconds between snapshots of the per-node link statistics")
+    parser.add_argument("--dedup-window", type=float, default=DEFAULT_WINDOW_SECONDS,
+                        help="seconds a packet id is remembered to drop duplicates (0 disables)")
+    parser.add_argument("--dedup-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="packet ids remembered at most for duplicate suppression")
+    parser.add_argument("--rollup-windows", type=int, nargs='+', default=list(DEFAULT_WINDOWS),
+                        help="rollup window lengths in seconds (0 disables rollups)")
+    parser.add_argument("--rollup-metrics", nargs='+', default=list(DEFAULT_METRICS),
+                        help="metric fields summarized in rollups.db")
+    parser.add_argument("--rollup-lateness", type=float, default=DEFAULT_LATENESS_SECONDS,
+                        help="seconds after its end a rollup window waits for late packets before it is written")
+    parser.add_argument("--http-port", type=int, default=None,
+                        help="serve the live feed (/events, /latest) on this port, e.g. 8080")
+    parser.add_argument("--http-host", default='0.0.0.0',
+                        help="address the live feed listens on")
+    parser.add_argument("--http-buffer", type=int, default=DEFAULT_BUFFER_EVENTS,
+                        help="recent packets kept for live feed clients that fall behind or reconnect")
+    parser.add_argument("--http-max-clients", type=int, default=DEFAULT_MAX_CLIENTS,
+                        help="live feed streams served at the same time")
+    parser.add_argument("--no-alerts", action="store_true",
+                        help="do not evaluate alert rules")
+    parser.add_argument("--alert-rules", default=None,
+                        help="JSON file of alert rules replacing the built-in ones (see alerts.py)")
+    parser.add_argument("--alert-budget-us", type=float, default=DEFAULT_BUDGET_US,
+                        help="microseconds of rule evaluation per packet; the rest waits for the next packets")
+    parser.add_argument("--alert-hook", default=None,
+                        help="URL alerts are POSTed to as JSON")
+    parser.add_argument("--alert-mesh-channel", type=int, default=None,
+                        help="also send alerts as text messages on this mesh channel index")
+    parser.add_argument("--data-dir", default=DATA_FOLDER,
+                        help="folder the data-<datetime>/ sessions are written to, as uploaded by upload_to_gdrive.py")
+    parser.add_argument("--no-storage-governor", action="store_true",
+                        help="never compress or delete data, whatever the free space")
+    parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION_DAYS,
+                        help="days uploaded files are kept (negative: until space runs low)")
+    parser.add_argument("--storage-low-mb", type=float, default=DEFAULT_LOW_FREE_MB,
+                        help="free space under which uploaded files are deleted early, MB")
+    parser.add_argument("--storage-critical-mb", type=float, default=DEFAULT_CRITICAL_FREE_MB,
+                        help="free space under which raw packets are no longer stored, MB")
+    parser.add_argument("--upload-folder", default=None,
+                        help="folder the uploader syncs, whose manifests tell which files were uploaded "
+                             "(default: --data-dir, which upload_to_gdrive.py syncs by default)")
+    parser.add_argument("--schemas", default=None,
+                        help="JSON file adding or replacing telemetry types and their fields (see telemetry_schema.py)")
+    return parser.parse_args(argv)
 
-    # Choose the serial port to listen to
-    if len(sys.argv) < 2:
-        print("Error: No serial port path provided.")
-        exit()
 
-    serial_port = sys.argv[1]
+# Runs every time script is started
+def main():
+    global WRITER, STORE_WRITER, ARCHIVE_WRITER, STORAGE, RAW_LOG, ARCHIVE_COMPRESSION, DEBUG_THREADS, SCHEMAS
+    global NODE_STATS_INTERVAL, DEDUP, RADIOS, RECONNECT, MAIN_WAKEUPS, ROLLUPS, ROLLUP_WRITER, LIVE_FEED
+    global ALERTS, ALERT_WRITER, STORAGE_GOVERNOR, JOURNAL, DATA_ROOT
+    # Choose the serial ports to listen to
+    args = parse_args()
+    DATA_ROOT = args.data_dir
+
+    setup_logging(args.log_level)
+    DEBUG_THREADS = args.debug_threads
+    install_thread_dump_handler(logger, extra=lambda: dict(writer_status(), radios=radio_status(),
+                                                           wakeups=wakeup_status(started)))
+    logger.info("Raspberry Pi Logging Script started")
+    started = datetime.now()
+    if args.schemas:
+        # Fail at startup, not on the first packet, if the file is broken
+        SCHEMAS = SchemaRegistry.from_file(args.schemas)
+        logger.info("Telemetry schemas from %s: %s", args.schemas, ', '.join(SCHEMAS))
+    if not args.no_alerts:
+        # Broken rules fail at startup too
+        rules = load_rules(args.alert_rules) if args.alert_rules else None
+        alert_sinks = [LogAlertSink()]
+        if args.alert_hook:
+            alert_sinks.append(HttpAlertSink(args.alert_hook))
+        if args.alert_mesh_channel is not None:
+            alert_sinks.append(MeshAlertSink(lambda: [radio.interface for radio in RADIOS],
+                                             args.alert_mesh_channel))
+        # Alerts are rare and urgent: no batching delay, no fsync
+        ALERT_WRITER = BatchedWriter(AlertSink(alert_sinks), max_queue=args.max_queue, batch_size=1,
+                                     flush_interval=0.0, fsync_policy=FSYNC_NEVER, name="AlertWriter").start()
+        ALERTS = AlertEngine(rules, args.alert_budget_us, on_alert=ALERT_WRITER.submit)
+        for rule in ALERTS.rules:
+            logger.info("Alert rule %s: %s", rule.name, rule.describe())
+
+    # Put back the rows a power cut left only in the journal, before
+    # anything new is written to their files
+    sink_factory = FileSink
+    file_fsync = args.fsync
+    if not args.no_journal:
+        try:
+            recovered = recover_journal(JOURNAL_DIR)
+            if recovered['journals']:
+                logger.warning("Replayed the journal of the last run: %s", recovered)
+            os.makedirs(JOURNAL_DIR, exist_ok=True)
+            JOURNAL = sink_factory = JournaledSinkFactory(FileSink, JOURNAL_DIR)
+            # Checkpoints empty the journal, so they cannot be turned off
+            if file_fsync == FSYNC_NEVER:
+                file_fsync = FSYNC_INTERVAL
+        except OSError as e:
+            logger.error("Unable to replay the journal in %s, logging without it: %s", JOURNAL_DIR, e)
+
+    # Start the writer thread before any packet can arrive
+    WRITER = ShardedWriter(sink_factory, shards=args.writer_shards, max_queue=args.max_queue,
+                           batch_size=args.batch_size, flush_interval=args.flush_interval,
+                           fsync_policy=file_fsync, fsync_interval=args.fsync_interval,
+                           name="FileWriter").start()
+    STORAGE = args.storage
+    if STORAGE in (STORAGE_SQLITE, STORAGE_BOTH):
+        # One transaction per flush window; WAL makes fsync unnecessary per batch
+        STORE_WRITER = BatchedWriter(SQLiteSink(), max_queue=args.max_queue, batch_size=args.batch_size,
+                                     flush_interval=args.flush_interval, fsync_policy=args.fsync,
+                                     fsync_interval=args.fsync_interval, name="StoreWriter").start()
+    RAW_LOG = args.raw_log
+    ARCHIVE_COMPRESSION = args.archive_compression
+    if RAW_LOG in (RAW_LOG_ARCHIVE, RAW_LOG_BOTH):
+        ARCHIVE_WRITER = BatchedWriter(ArchiveSink(ARCHIVE_COMPRESSION), max_queue=args.max_queue,
+                                       batch_size=args.batch_size, flush_interval=args.flush_interval,
+                                       fsync_policy=args.fsync, fsync_interval=args.fsync_interval,
+                                       name="ArchiveWriter").start()
+    next_stats_time = datetime.now() + WRITER_STATS_INTERVAL
+    NODE_STATS_INTERVAL = timedelta(seconds=args.node_stats_interval)
+    DEDUP = DedupCache(args.dedup_window, args.dedup_size) if args.dedup_window > 0 else None
+    next_node_stats_time = datetime.now() + NODE_STATS_INTERVAL
+    rollup_windows = [window for window in args.rollup_windows if window > 0]
+    if rollup_windows:
+        ROLLUPS = RollupEngine(args.rollup_metrics, rollup_windows, args.rollup_lateness)
+        ROLLUP_WRITER = BatchedWriter(RollupSink(), max_queue=args.max_queue, batch_size=args.batch_size,
+                                      flush_interval=args.flush_interval, fsync_policy=args.fsync,
+                                      fsync_interval=args.fsync_interval, name="RollupWriter").start()
+    next_rollup_time = datetime.now() + ROLLUP_INTERVAL
+    if args.http_port is not None:
+        try:
+            LIVE_FEED = LiveFeed(args.http_buffer, args.http_max_clients, ROLLUPS).start(args.http_host, args.http_port)
+            logger.info("Live feed on http://%s:%d/", args.http_host, LIVE_FEED.port)
+        except OSError as e:
+            # Logging goes on without the feed
+            logger.error("Unable to start the live feed on port %d: %s", args.http_port, e)
 
-    # try to setup meshtastic connection. This will automatically retry every 
-    # 10 seconds if it fails
-    local = setup_meshtastic_connection(serial_port)
+    if not args.no_storage_governor:
+        STORAGE_GOVERNOR = StorageGovernor(DATA_ROOT, args.upload_folder,
+                                           args.retention_days if args.retention_days >= 0 else None,
+                                           args.storage_low_mb, args.storage_critical_mb,
+                                           active_dirs=lambda: {LOG_DIR}).start()
 
-    # Subscribe to the data topic
+    # Subscribe to the data topic once; it stays subscribed across reconnects
     try:
         pub.subscribe(on_receive, "meshtastic.receive")
-        print("Subscribed to meshtastic.receive")
+        pub.subscribe(on_connection_lost, "meshtastic.connection.lost")
+        logger.info("Subscribed to meshtastic.receive")
     except Exception as e:
-        print(f"Unable to subscribe: {e}")
-
-    # Print the current active threads
-    print("----\nAfter subscribing to meshtastic.receive, the thread information is as follows:")
-    print_active_threads()
-    print("----")
-
-    # Keep the script running to listen for messages
+        logger.error("Unable to subscribe: %s", e)
+
+    # Connect every radio in the background. Each waits for its serial port
+    # to appear and retries with backoff if it cannot be opened.
+    RECONNECT = ReconnectManager(SerialInterface, timeout=args.watchdog_timeout,
+                                 backoff_cap=args.reconnect_backoff_cap, on_event=NODE_STATS.record_event)
+    RADIOS = [RECONNECT.add(serial_port) for serial_port in dict.fromkeys(args.serial_ports)]
+    RECONNECT.start()
+    logger.info("Waiting for radios on %s (device watch: %s)", ', '.join(args.serial_ports), RECONNECT.watcher.mode)
+
+    # Log the current active threads
+    log_active_threads(logger)
+
+    # Keep the script running to listen for messages. Packets arrive on the
+    # radio reader threads and the watchdog runs on its own thread, so this
+    # loop only wakes for its timers.
     try:
         while True:
-            sys.stdout.flush()
-            time.sleep(1)  # Sleep to reduce CPU usage (time in seconds)
-            if (datetime.now() >= WDT + timedelta(minutes=1, seconds=10)):
-                WDT = datetime.now()
-                print(f"{WDT} - ERROR -- - ERROR -- - ERROR -- - ERROR --- ERROR -- - ERROR -- - ERROR -- - ERROR -- Watchdog Timer Reset")
-                increment_heard_from_node_counter("WDT ERROR")
-
-                # Unsubscribe from the topic if already subscribed
-                try:
-                    pub.unsubscribe(on_receive, "meshtastic.receive")
-                    print("Unsubscribed from meshtastic.receive")
-                except KeyError:
-                    print("No existing subscription to meshtastic.receive")
-                except Exception as e:
-                    print(f"ERROR: Unexpected error: {e}")
-                    pass  # Ignore unexpected errors silently
-
-                # close the old connection if it was being used
-                try:
-                    local.close()
-                    print("closed old ttyUSB connection")
-                except Exception as e:
-                    print(f"Ignored close() error: {e}")
-
-                time.sleep(2)  # Give OS time to release dev tty port
-
-                # ensure we have a tty connection prior to subscribing again
-                local = setup_meshtastic_connection(serial_port)
-
-                # Subscribe to the topic
-                pub.subscribe(on_receive, "meshtastic.receive")
-
-                print("Subscribed to meshtastic.receive")
-    
+            if datetime.now() >= next_stats_time:
+                next_stats_time = datetime.now() + WRITER_STATS_INTERVAL
+                logger.info("Writer stats %s", writer_status())
+                logger.info("Radios %s", radio_status())
+                logger.info("Wakeups %s", wakeup_status(started))
+                logger.info("Heard from %d nodes: %s", len(NODE_STATS), NODE_STATS.packet_counts())
+                if DEDUP is not None:
+                    logger.info("Duplicates %s by node %s", DEDUP.stats(), DEDUP.duplicate_counts())
+                if ROLLUPS is not None:
+                    logger.info("Rollups %s", ROLLUPS.stats())
+                if LIVE_FEED is not None:
+                    logger.info("Live feed %s", LIVE_FEED.stats())
+                if ALERTS is not None:
+                    logger.info("Alerts %s", ALERTS.stats())
+                if STORAGE_GOVERNOR is not None:
+                    logger.info("Storage %s", STORAGE_GOVERNOR.stats())
+            if datetime.now() >= next_node_stats_time:
+                next_node_stats_time = datetime.now() + NODE_STATS_INTERVAL
+                snapshot_node_stats()
+            if datetime.now() >= next_rollup_time:
+                next_rollup_time = datetime.now() + ROLLUP_INTERVAL
+                write_rollups()
+                check_alerts()
+            sleep_seconds = (min(next_stats_time, next_node_stats_time, next_rollup_time)
+                             - datetime.now()).total_seconds()
+            time.sleep(max(sleep_seconds, 0))
+            MAIN_WAKEUPS += 1
+
     except KeyboardInterrupt:
-        print("Script terminated by user")
-        local.close()
+        logger.info("Script terminated by user")
     except Exception as e:
-        print(f"ERROR: Unexpected error: {e}")
+        logger.exception("Unexpected error: %s", e)
         pass  # Ignore unexpected errors silently
+    finally:
+        # Stop reconnecting and close the radios, then write out anything
+        # still queued before exiting
+        RECONNECT.stop()
+        if LIVE_FEED is not None:
+            LIVE_FEED.close()
+        if STORAGE_GOVERNOR is not None:
+            STORAGE_GOVERNOR.stop()
+        snapshot_node_stats()
+        write_rollups(everything=True)
+        if ALERTS is not None:
+            ALERTS.drain()
+            ALERT_WRITER.close()
+        WRITER.close()
+        if STORE_WRITER is not None:
+            STORE_WRITER.close()
+        if ARCHIVE_WRITER is not None:
+            ARCHIVE_WRITER.close()
+        if ROLLUP_WRITER is not None:
+            ROLLUP_WRITER.close()
+        logger.info("Writers stopped %s", writer_status())
 
 
 if __name__ == "__main__":
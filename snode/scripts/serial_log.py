@@ -1,13 +1,44 @@
 """
 Log Serial Data for Wind Sensor
 
-Command: poetry run python scripts/serial_log.py
+Reads one or more serial ports in a single selector loop. Whatever bytes are
+waiting are read at once (no readline() per line), split into lines,
+decoded, stamped with the time of the read and handed to a parsing stage.
+The writer threads (log_writer.py) write in batches and flush at most every
+--flush-interval seconds, instead of a write and flush per line.
+
+By default lines are parsed into typed wind rows (wind_parser.py), written
+to hourly windSensor_<hour>.csv shards next to the log file and/or a SQLite
+telemetry.db (--storage), with malformed lines going to a reject file.
+--output text keeps the previous "<timestamp> - <line>" log instead, and
+--output both writes the two.
+
+Bytes that cannot be logged are counted per port and reported every
+--stats-interval seconds:
+- dropped: lines longer than --max-line (e.g. noise without newlines),
+  partial lines left when a port closes, and lines the writer could not
+  queue
+- corrupt: bytes that are not valid UTF-8 (removed from the line, as before)
+Parsed and rejected lines are counted by the parser, rejects by reason.
+
+Command: poetry run python scripts/serial_log.py [port ...] [--baud 115200] [--log-file <path>] [--output parsed|text|both]
 from snode directory
 """
 
-import serial
-import time
+import argparse
+import logging
 import os
+import selectors
+import time
+
+import serial
+
+from log_writer import BatchedWriter, FileSink, TXT_RECORD, FSYNC_POLICIES, FSYNC_INTERVAL
+from log_config import setup_logging, LOG_LEVELS
+from sqlite_store import SQLiteSink
+from wind_parser import WindParserStage
+
+logger = logging.getLogger("serial_log")
 
 # Configure serial port parameters
 # CHANGE:
@@ -22,31 +53,314 @@ log_file = '/home/pi/smesh/snode/data/logfile_test1.txt'  # Specify your log fil
 # serial_port = 'COM3'
 # log_file = './data/logfile_test1.txt'
 
-# Open the serial port
-ser = serial.Serial(serial_port, baudrate=baud_rate, timeout=1)
-
-# Check if the directory exists; if not, create it
-log_dir = os.path.dirname(log_file)
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-
-
-with open(log_file, 'a') as file:
-    print(f"Logging data from {serial_port} to {log_file}...")
-    while True:
-        try:
-            # Read a line of data from the serial port
-            # Ignore errors (UnicodeDecodeError: 'utf-8' codec can't decode byte 0x94 in position 0: invalid start byte)
-            data = ser.readline().decode('utf-8', errors='ignore').strip()
-            if data:
-                # Write data to file with timestamp
-                timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-                file.write(f"{timestamp} - {data}\n")
-                file.flush()  # Ensure data is written to file immediately
-        except KeyboardInterrupt:
-            print("Logging stopped.")
-            break
-
-# Close the serial port when done
-ser.close()
\ No newline at end of file
+# Bytes read per call; a read returns early with whatever is waiting
+READ_SIZE = 4096
+# Longest line kept; anything longer is noise (e.g. wrong baud rate)
+MAX_LINE_BYTES = 1024
+# Seconds between attempts to (re)open a port that failed
+REOPEN_SECONDS = 10
+# Windows cannot select() on serial handles; ports are polled this often there
+POLL_SECONDS = 0.05
+
+# What is logged: parsed wind rows (plus rejects), the raw text lines, or both
+OUTPUT_PARSED = 'parsed'
+OUTPUT_TEXT = 'text'
+OUTPUT_BOTH = 'both'
+
+# Where parsed rows go, as --storage of rpi_log_script.py
+STORAGE_CSV = 'csv'
+STORAGE_SQLITE = 'sqlite'
+STORAGE_BOTH = 'both'
+
+
+class Timestamps:
+    """
+    Formats the current time once per second rather than once per line.
+    """
+
+    def __init__(self):
+        self._second = None
+        self._text = None
+
+    def now(self):
+        second = int(time.time())
+        if second != self._second:
+            self._second = second
+            self._text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._text
+
+
+class SerialLineReader:
+    """
+    Reads one serial port without blocking and splits the bytes into lines.
+    """
+
+    def __init__(self, port, baud, log_path, max_line=MAX_LINE_BYTES):
+        """
+        Parameters:
+        - port: str, serial port, e.g. /dev/ttyUSB0
+        - baud: int, baud rate
+        - log_path: str, file the lines of this port are logged to
+        - max_line: int, longest line in bytes; longer lines are dropped
+        """
+        self.port = port
+        self.baud = baud
+        self.log_path = log_path
+        self.max_line = max_line
+        self.serial = None
+        self.next_open = 0.0
+        self._buffer = bytearray()
+        self._discarding = False  # inside a line that was already too long
+        self.bytes_read = 0
+        self.lines = 0
+        self.dropped_bytes = 0
+        self.corrupt_bytes = 0
+        self.corrupt_lines = 0
+        self.errors = 0
+
+    def open(self):
+        # timeout=0: read() returns at once with whatever is waiting
+        self.serial = serial.Serial(self.port, baudrate=self.baud, timeout=0)
+        logger.info("Logging data from %s to %s", self.port, self.log_path)
+
+    def close(self):
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.serial = None
+        self.dropped_bytes += len(self._buffer)
+        self._buffer.clear()
+        self._discarding = False
+
+    def read_lines(self):
+        """
+        Reads the bytes waiting on the port and returns the complete lines,
+        decoded and stripped (empty lines are skipped).
+        """
+        data = self.serial.read(READ_SIZE)
+        self.bytes_read += len(data)
+        buffer = self._buffer
+        buffer += data
+
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            self._check_partial()
+            return []
+        raw_lines = bytes(buffer[:end]).split(b'\n')
+        del buffer[:end + 1]
+        if self._discarding:
+            # rest of a line already dropped for being too long
+            self.dropped_bytes += len(raw_lines.pop(0))
+            self._discarding = False
+
+        lines = []
+        max_line = self.max_line
+        for raw in raw_lines:
+            if len(raw) > max_line:
+                self.dropped_bytes += len(raw)
+                continue
+            try:
+                text = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                # e.g. 'utf-8' codec can't decode byte 0x94: keep the rest of the line
+                text = raw.decode('utf-8', errors='ignore')
+                self.corrupt_lines += 1
+                self.corrupt_bytes += len(raw) - len(text.encode('utf-8'))
+            text = text.strip()
+            if text:
+                lines.append(text)
+        self.lines += len(lines)
+        self._check_partial()
+        return lines
+
+    def _check_partial(self):
+        # A partial line longer than max_line cannot become a valid line
+        if len(self._buffer) > self.max_line:
+            self.dropped_bytes += len(self._buffer)
+            self._buffer.clear()
+            self._discarding = True
+
+    def stats(self):
+        return {'port': self.port, 'open': self.serial is not None, 'bytes': self.bytes_read,
+                'lines': self.lines, 'dropped_bytes': self.dropped_bytes, 'corrupt_bytes': self.corrupt_bytes,
+                'corrupt_lines': self.corrupt_lines, 'errors': self.errors}
+
+
+class LineLogger:
+    """
+    Text stage: logs every line as "<timestamp> - <line>" to the log file of
+    its port (the format before parsing), one writer record per read, not
+    per line.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def __call__(self, reader, timestamp, lines):
+        text = '\n'.join(f"{timestamp} - {line}" for line in lines)
+        if not self.writer.submit((TXT_RECORD, reader.log_path, None, text)):
+            reader.dropped_bytes += len(text)
+
+
+def log_path_for(path, port, n_ports):
+    """
+    Returns the log file of a port: path itself with a single port, else
+    path with the port name added, e.g. logfile_test1_ttyUSB0.txt.
+    """
+    if n_ports == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}_{os.path.basename(port)}{ext}'
+
+
+################################################
+# Selector Loop
+################################################
+
+def _ready(selector, readers, timeout):
+    if selector is not None:
+        return [key.data for key, _ in selector.select(timeout)]
+    ready = [reader for reader in readers if reader.serial is not None and reader.serial.in_waiting]
+    if not ready:
+        time.sleep(min(timeout, POLL_SECONDS))
+    return ready
+
+
+def _open(reader, selector, now):
+    try:
+        reader.open()
+    except (serial.SerialException, OSError) as e:
+        reader.errors += 1
+        reader.next_open = now + REOPEN_SECONDS
+        logger.error("Could not open %s: %s. Retrying in %d seconds", reader.port, e, REOPEN_SECONDS)
+        return
+    if selector is not None:
+        selector.register(reader.serial.fileno(), selectors.EVENT_READ, reader)
+
+
+def _close(reader, selector, now):
+    if selector is not None and reader.serial is not None:
+        selector.unregister(reader.serial.fileno())
+    reader.close()
+    reader.next_open = now + REOPEN_SECONDS
+
+
+def run(readers, stage, stats_interval=600.0, status=None):
+    """
+    Reads every port until interrupted, passing the lines of each read to
+    stage(reader, timestamp, lines). Ports that fail are closed and reopened
+    every REOPEN_SECONDS without disturbing the others.
+
+    Parameters:
+    - readers: list of SerialLineReader
+    - stage: callable, the parsing stage (e.g. LineLogger)
+    - stats_interval: float, seconds between statistics log lines
+    - status: callable returning extra statistics to log (e.g. the writer's)
+    """
+    selector = selectors.DefaultSelector() if os.name == 'posix' else None
+    timestamps = Timestamps()
+    next_stats = time.monotonic() + stats_interval
+    try:
+        while True:
+            now = time.monotonic()
+            for reader in readers:
+                if reader.serial is None and now >= reader.next_open:
+                    _open(reader, selector, now)
+            deadlines = [next_stats] + [reader.next_open for reader in readers if reader.serial is None]
+            for reader in _ready(selector, readers, max(min(deadlines) - now, 0)):
+                try:
+                    lines = reader.read_lines()
+                except (serial.SerialException, OSError) as e:
+                    # e.g. the USB adapter was unplugged
+                    reader.errors += 1
+                    logger.error("Read from %s failed: %s. Reopening in %d seconds", reader.port, e, REOPEN_SECONDS)
+                    _close(reader, selector, time.monotonic())
+                    continue
+                if lines:
+                    stage(reader, timestamps.now(), lines)
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + stats_interval
+                logger.info("Serial stats %s", [reader.stats() for reader in readers])
+                if status is not None:
+                    logger.info("Writer stats %s", status())
+    finally:
+        for reader in readers:
+            if reader.serial is not None:
+                _close(reader, selector, time.monotonic())
+        if selector is not None:
+            selector.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Log lines received on one or more serial ports.")
+    parser.add_argument("ports", nargs='*', default=[serial_port], help=f"serial ports (default: {serial_port})")
+    parser.add_argument("--baud", type=int, default=baud_rate, help="baud rate of every port")
+    parser.add_argument("--log-file", default=log_file,
+                        help="text log file; with several ports the port name is added to it. "
+                             "Parsed output and rejects go to the same directory")
+    parser.add_argument("--output", choices=(OUTPUT_PARSED, OUTPUT_TEXT, OUTPUT_BOTH), default=OUTPUT_PARSED,
+                        help="log parsed wind rows, the raw text lines, or both")
+    parser.add_argument("--storage", choices=(STORAGE_CSV, STORAGE_SQLITE, STORAGE_BOTH), default=STORAGE_CSV,
+                        help="write parsed rows to hourly csv shards, a SQLite telemetry.db, or both")
+    parser.add_argument("--reject-file", default=None,
+                        help="file for lines that cannot be parsed (default: <log file>_rejects.txt)")
+    parser.add_argument("--max-line", type=int, default=MAX_LINE_BYTES, help="longest line in bytes")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="maximum seconds a line waits in memory before being written")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=FSYNC_INTERVAL,
+                        help="when the writer asks the OS to sync the log files to disk")
+    parser.add_argument("--stats-interval", type=float, default=600.0,
+                        help="seconds between logs of the byte, line, dropped and corrupt counters")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default='INFO')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_logging(args.log_level)
+
+    ports = list(dict.fromkeys(args.ports))
+    readers = [SerialLineReader(port, args.baud, log_path_for(args.log_file, port, len(ports)), args.max_line)
+               for port in ports]
+
+    # Check if the directories exist; if not, create them
+    for reader in readers:
+        log_dir = os.path.dirname(reader.log_path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+    writer = BatchedWriter(FileSink(), flush_interval=args.flush_interval, fsync_policy=args.fsync,
+                           name="SerialLogWriter").start()
+    store_writer = None
+    text_stage = LineLogger(writer) if args.output in (OUTPUT_TEXT, OUTPUT_BOTH) else None
+    if args.output == OUTPUT_TEXT:
+        stage = text_stage
+    else:
+        output_dir = os.path.dirname(args.log_file) or '.'
+        if args.storage in (STORAGE_SQLITE, STORAGE_BOTH):
+            store_writer = BatchedWriter(SQLiteSink(), flush_interval=args.flush_interval, fsync_policy=args.fsync,
+                                         name="SerialStoreWriter").start()
+        stage = WindParserStage(writer, output_dir if args.storage in (STORAGE_CSV, STORAGE_BOTH) else None,
+                                args.reject_file or f'{os.path.splitext(args.log_file)[0]}_rejects.txt',
+                                store_writer, os.path.join(output_dir, 'telemetry.db'), text_stage)
+
+    def status():
+        status = {'writer': writer.stats()}
+        if store_writer is not None:
+            status['store_writer'] = store_writer.stats()
+        if isinstance(stage, WindParserStage):
+            status['parser'] = stage.stats()
+        return status
+
+    try:
+        run(readers, stage, args.stats_interval, status=status)
+    except KeyboardInterrupt:
+        logger.info("Logging stopped.")
+    finally:
+        writer.close()
+        if store_writer is not None:
+            store_writer.close()
+        logger.info("Serial stats %s", [reader.stats() for reader in readers])
+        logger.info("Writer stats %s", status())
@@ -0,0 +1,248 @@
+"""
+SQLite Storage Backend for Telemetry
+
+Stores each telemetry type (environmentMetrics, airQualityMetrics, ...) in its
+own typed table inside one database file per logging directory. Meant to be
+used as a sink behind log_writer.BatchedWriter, so that:
+- the database runs in WAL mode (appends to one log instead of rewriting pages)
+- inserts use cached prepared statements (executemany)
+- every writer batch, i.e. every flush window, is a single transaction
+- each table is indexed on (fromNode, datetime) for per-node history queries
+
+The hourly CSV layout written by rpi_log_script.py is still available through
+export_csv().
+
+Command: python scripts/sqlite_store.py <telemetry.db> <output_dir> [--hourly]
+from snode directory
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Columns that hold integers; every other measurement is stored as REAL.
+# datetime, fromNode, the names in the schemaless otherTelemetry table and
+# the wind sensor's reference/status letters are always TEXT.
+TEXT_COLUMNS = {'datetime', 'fromNode', 'telemetryKey', 'field', 'reference', 'status'}
+INTEGER_COLUMNS = {'rxTime', 'rxRssi', 'hopStart', 'hopLimit', 'batteryLevel',
+                   'pm10Standard', 'pm25Standard', 'pm100Standard',
+                   'pm10Environmental', 'pm25Environmental', 'pm100Environmental',
+                   'windDirection', 'windDirectionMin', 'windDirectionMax'}
+
+
+def column_type(column):
+    """
+    Returns the SQLite type used for a telemetry column.
+    """
+    if column in TEXT_COLUMNS:
+        return 'TEXT'
+    if column in INTEGER_COLUMNS:
+        return 'INTEGER'
+    return 'REAL'
+
+
+def connect(db_path):
+    """
+    Opens a database with the settings used for logging on the Pi.
+
+    Parameters:
+    - db_path: str, path to the database file
+
+    Returns:
+    - sqlite3.Connection in autocommit mode (transactions are explicit)
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # NORMAL only syncs the WAL at checkpoints, which is safe in WAL mode
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class SQLiteSink:
+    """
+    log_writer sink that inserts telemetry rows into SQLite.
+
+    Records are tuples of (db_path, telemetry_key, headers, row), where headers
+    and row are the same lists that would be written to the csv file.
+
+    Only the writer thread should call into a sink.
+    """
+
+    def __init__(self):
+        # db_path -> sqlite3.Connection
+        self._connections = {}
+        # (db_path, telemetry_key) -> (headers, insert statement)
+        self._tables = {}
+
+    @staticmethod
+    def record_key(record):
+        """
+        Returns the table a record goes to, for per-output statistics.
+        """
+        return f'{record[0]}:{record[1]}'
+
+    def _connection(self, db_path):
+        conn = self._connections.get(db_path)
+        if conn is None:
+            conn = connect(db_path)
+            self._connections[db_path] = conn
+        return conn
+
+    def _insert_sql(self, conn, db_path, telemetry_key, headers):
+        """
+        Creates the table (or adds new columns) the first time a telemetry
+        type or header layout is seen, and returns the insert statement.
+        """
+        cached = self._tables.get((db_path, telemetry_key))
+        if cached is not None and cached[0] == headers:
+            return cached[1]
+
+        columns = ', '.join(f'"{name}" {column_type(name)}' for name in headers)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{telemetry_key}" ({columns})')
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{telemetry_key}")')}
+        for name in headers:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE "{telemetry_key}" ADD COLUMN "{name}" {column_type(name)}')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{telemetry_key}_node_time" '
+                     f'ON "{telemetry_key}" ("fromNode", "datetime")')
+
+        names = ', '.join(f'"{name}"' for name in headers)
+        placeholders = ', '.join('?' for _ in headers)
+        sql = f'INSERT INTO "{telemetry_key}" ({names}) VALUES ({placeholders})'
+        self._tables[(db_path, telemetry_key)] = (list(headers), sql)
+        return sql
+
+    def write_batch(self, records):
+        """
+        Inserts a batch of records, one transaction per database. A database
+        that fails (e.g. its directory is missing) does not stop the others.
+
+        Returns:
+        - list of the records that could not be written
+        """
+        grouped = {}
+        by_db = {}
+        for record in records:
+            db_path, telemetry_key, headers, row = record
+            grouped.setdefault(db_path, {}).setdefault((telemetry_key, tuple(headers)), []).append(row)
+            by_db.setdefault(db_path, []).append(record)
+
+        failed = []
+        for db_path, tables in grouped.items():
+            conn = None
+            try:
+                conn = self._connection(db_path)
+                conn.execute('BEGIN')
+                for (telemetry_key, headers), rows in tables.items():
+                    sql = self._insert_sql(conn, db_path, telemetry_key, list(headers))
+                    conn.executemany(sql, rows)
+                conn.execute('COMMIT')
+            except Exception as e:
+                logger.error("Could not write %s: %s", db_path, e)
+                failed.extend(by_db[db_path])
+                self._discard(db_path, conn)
+        return failed
+
+    def _discard(self, db_path, conn):
+        """
+        Rolls back and closes a database that failed, so the next batch
+        reconnects (and re-creates its tables) from scratch.
+        """
+        self._connections.pop(db_path, None)
+        for key in [key for key in self._tables if key[0] == db_path]:
+            del self._tables[key]
+        if conn is not None:
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                conn.close()
+            except Exception:
+                pass
+
+    def flush(self, fsync=False):
+        """
+        Batches are committed in write_batch. With fsync, also checkpoint the
+        WAL so the main database file is synced to the SD card.
+        """
+        if fsync:
+            for conn in self._connections.values():
+                conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+        self._connections.clear()
+        self._tables.clear()
+
+
+################################################
+# Export
+################################################
+
+def list_tables(conn):
+    """
+    Returns the telemetry tables in a database.
+    """
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+
+
+def export_csv(db_path, output_dir, hourly=False):
+    """
+    Exports every telemetry table to csv using the same headers as the csv logger.
+
+    Parameters:
+    - db_path: str, path to the database file
+    - output_dir: str, directory to write csv files to
+    - hourly: bool, split into '<telemetry>_<YYYY-MM-DD_HH>-00-00.csv' shards
+      like the logger does, instead of one file per telemetry type
+
+    Returns:
+    - list of written file paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    written = []
+    try:
+        for table in list_tables(conn):
+            cursor = conn.execute(f'SELECT * FROM "{table}" ORDER BY "datetime"')
+            headers = [column[0] for column in cursor.description]
+            current_name, file, writer = None, None, None
+            for row in cursor:
+                name = f'{table}.csv'
+                if hourly:
+                    # datetime is str(datetime.now()), e.g. '2024-12-17 13:07:56.123'
+                    name = f'{table}_{row[0][:10]}_{row[0][11:13]}-00-00.csv'
+                if name != current_name:
+                    if file is not None:
+                        file.close()
+                    current_name = name
+                    path = os.path.join(output_dir, name)
+                    file = open(path, 'w', newline='')
+                    writer = csv.writer(file)
+                    writer.writerow(headers)
+                    written.append(path)
+                writer.writerow(['' if value is None else value for value in row])
+            if file is not None:
+                file.close()
+    finally:
+        conn.close()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a telemetry database to csv files.")
+    parser.add_argument("db_path", help="path to telemetry.db")
+    parser.add_argument("output_dir", help="directory to write csv files to")
+    parser.add_argument("--hourly", action="store_true", help="split into hourly shards like the logger")
+    args = parser.parse_args()
+
+    start = time.time()
+    files = export_csv(args.db_path, args.output_dir, hourly=args.hourly)
+    print(f"Exported {len(files)} files to {args.output_dir} in {time.time() - start:.1f} s")
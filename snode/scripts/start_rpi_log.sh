@@ -2,7 +2,9 @@
 
 # Navigate to the project directory (Neccessary)
 cd ~/smesh/snode
+mkdir -p data
 
-# Run the Python script
-/usr/bin/python3 ~/smesh/snode/scripts/rpi_log_script_v3.py /dev/ttyUSB0 >> ~/smesh/snode/data/rpi_log_script_v3_stdouterr_log.txt 2>&1
+# Run the Python script. Sessions go to data/data-<datetime>/, the folder
+# routine_upload_gdrive.sh uploads
+/usr/bin/python3 ~/smesh/snode/scripts/rpi_log_script.py /dev/ttyUSB0 --data-dir ~/smesh/snode/data >> ~/smesh/snode/data/rpi_log_script_stdouterr_log.txt 2>&1
 
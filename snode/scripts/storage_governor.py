@@ -0,0 +1,446 @@
+"""
+Storage Retention, Rotation and SD-Card Space Governor
+
+The logger opens a new set of csv shards every hour and never deletes
+anything, so a long deployment fills the SD card. StorageGovernor runs on a
+thread of its own in the logger (or once from cron) and, every pass:
+1. measures the free space of the card and the bytes per session
+   directory and kind of file
+2. gzips cold shards (not written for --cold-seconds) that the uploader
+   has not seen yet: csv shards become .csv.gz, which compact_shards.py
+   takes as the same shard as the .csv it replaces and snode.query reads
+   like any csv, and text logs become .txt.gz
+3. deletes files the uploader's sync manifest confirms as uploaded (every
+   byte, same size and content) once they are older than --retention-days
+4. when free space falls under --storage-low-mb, deletes uploaded files
+   oldest first, whatever their age
+5. when it falls under --storage-critical-mb, pauses the raw packet archive
+   (raw_allowed) and deletes raw archives (packets_*.jsonl.gz, logs_*.txt)
+   oldest first, uploaded or not; structured telemetry (csv shards, the
+   SQLite databases) is only ever deleted once uploaded
+
+Only files inside data-*/ session directories are touched, never the
+directories the logger is writing to, and never while the uploader holds
+its lock (unless space is critical). A failed pass is logged and retried on
+the next one; the logger's receive path never waits for the governor.
+
+Command: python scripts/storage_governor.py [<data root>] [--upload-folder <dir>] [--retention-days 30] [--dry-run]
+from snode directory (one pass, e.g. from cron, printing what it did)
+"""
+
+import argparse
+import errno
+import fcntl
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+
+from sync_manifest import SyncManifest, MANIFEST_NAME
+from upload_queue import LocalDirTransport, LOCK_NAME, DATA_FOLDER
+
+logger = logging.getLogger(__name__)
+
+LEVEL_OK = 'ok'
+LEVEL_LOW = 'low'
+LEVEL_CRITICAL = 'critical'
+
+DEFAULT_INTERVAL_SECONDS = 60.0
+DEFAULT_RETENTION_DAYS = 30.0
+DEFAULT_LOW_FREE_MB = 1024
+DEFAULT_CRITICAL_FREE_MB = 256
+# Shards are written for an hour and closed 5 minutes after the last write
+DEFAULT_COLD_SECONDS = 2 * 3600.0
+
+# Manifests of the upload transports (Drive, local directory)
+MANIFEST_NAMES = (MANIFEST_NAME, LocalDirTransport.manifest_name)
+
+SESSION_PATTERN = re.compile(r'^data-\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$')
+
+KIND_RAW = 'raw'
+KIND_TELEMETRY = 'telemetry'
+# Packet archives and text logs: the first to go when space is critical
+RAW_PATTERN = re.compile(r'^(packets_.*\.jsonl(\.gz|\.zst)?|logs_.*\.txt(\.gz)?)$')
+# Plain files that are gzipped once cold
+COMPRESS_SUFFIXES = ('.csv', '.txt')
+# Files being written or owned by SQLite
+SKIP_SUFFIXES = ('.tmp', '-wal', '-shm', '-journal')
+
+
+def _inside(path, directories):
+    return any(path == directory or path.startswith(directory + os.sep) for directory in directories)
+
+
+def kind_of(filename):
+    return KIND_RAW if RAW_PATTERN.match(filename) else KIND_TELEMETRY
+
+
+def gzip_file(path):
+    """
+    Compresses path to path.gz (through a temporary file, keeping the mtime)
+    and removes path.
+
+    Returns:
+    - int, bytes freed, or None if path changed while being compressed
+    """
+    stat = os.stat(path)
+    gz_path = f'{path}.gz'
+    tmp_path = f'{gz_path}.tmp'
+    try:
+        with open(path, 'rb') as source, gzip.open(tmp_path, 'wb', compresslevel=6) as dest:
+            shutil.copyfileobj(source, dest, 1 << 20)
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime) != (stat.st_size, stat.st_mtime):
+            os.remove(tmp_path)
+            return None
+        os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+        os.replace(tmp_path, gz_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(path)
+    return stat.st_size - os.path.getsize(gz_path)
+
+
+class StorageGovernor:
+    """
+    Keeps the data directory within the space of the SD card. run_once()
+    does one pass; start() runs passes every interval on a thread.
+    """
+
+    def __init__(self, data_root=DATA_FOLDER, upload_folder=None, retention_days=DEFAULT_RETENTION_DAYS,
+                 low_free_mb=DEFAULT_LOW_FREE_MB, critical_free_mb=DEFAULT_CRITICAL_FREE_MB,
+                 cold_seconds=DEFAULT_COLD_SECONDS, compress=True, interval=DEFAULT_INTERVAL_SECONDS,
+                 active_dirs=None, disk_usage=shutil.disk_usage, dry_run=False):
+        """
+        Parameters:
+        - data_root: str, directory holding the data-*/ session directories
+        - upload_folder: str, folder the uploader syncs, whose manifests tell
+          what was uploaded (default: data_root)
+        - retention_days: float, uploaded files are kept this long (None = until space is low)
+        - low_free_mb: float, free space under which uploaded files are deleted early
+        - critical_free_mb: float, free space under which raw archives are paused and deleted
+        - cold_seconds: float, files written to more recently are never touched
+        - compress: bool, gzip cold shards that were not uploaded yet
+        - interval: float, seconds between passes of the thread
+        - active_dirs: callable returning the directories being written to
+        - disk_usage: callable(path) returning (total, used, free), as shutil.disk_usage
+        - dry_run: bool, only report what would be done
+        """
+        self.data_root = data_root
+        self.upload_folder = upload_folder or data_root
+        self.retention_seconds = retention_days * 86400 if retention_days is not None else None
+        self.low_free = low_free_mb * 1024 * 1024
+        self.critical_free = critical_free_mb * 1024 * 1024
+        self.cold_seconds = cold_seconds
+        self.compress = compress
+        self.interval = interval
+        self.active_dirs = active_dirs
+        self.disk_usage = disk_usage
+        self.dry_run = dry_run
+
+        self.level = LEVEL_OK
+        # Read by the logger's receive path; False while space is critical,
+        # until free space is back above the low mark
+        self.raw_allowed = True
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._warned_no_manifest = False
+        self.passes = 0
+        self.errors = 0
+        self.compressed = 0
+        self.compressed_saved_bytes = 0
+        self.deleted = Counter()
+        self.deleted_bytes = 0
+        self.last_usage = None
+        self.last_pass_seconds = 0.0
+        self.bytes_by_kind = {}
+
+    ################################################
+    # Scanning
+    ################################################
+
+    def _manifests(self):
+        manifests = []
+        for name in MANIFEST_NAMES:
+            path = os.path.join(self.upload_folder, name)
+            if os.path.exists(path):
+                manifests.append(SyncManifest(path))
+        # Without a manifest nothing counts as uploaded: shards are still
+        # compressed, but nothing is expired or deleted for low space
+        if not manifests and not self._warned_no_manifest:
+            logger.warning("No upload manifest in %s, treating every file as not uploaded "
+                           "(is --upload-folder the folder the uploader syncs?)", self.upload_folder)
+        self._warned_no_manifest = not manifests
+        return manifests
+
+    def _active(self):
+        return {os.path.realpath(path) for path in (self.active_dirs() if self.active_dirs else ()) if path}
+
+    def _scan(self, now):
+        """
+        Returns the cold files of the session directories as dicts, oldest
+        first, and the bytes per kind of every file.
+        """
+        active = self._active()
+        manifests = self._manifests()
+        upload_root = os.path.realpath(self.upload_folder)
+        files = []
+        bytes_by_kind = Counter()
+        for session in sorted(os.listdir(self.data_root)):
+            session_dir = os.path.join(self.data_root, session)
+            if not SESSION_PATTERN.match(session) or not os.path.isdir(session_dir):
+                continue
+            for root, dirs, names in os.walk(session_dir):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                real_root = os.path.realpath(root)
+                in_active = _inside(real_root, active)
+                rel_dir = os.path.relpath(real_root, upload_root).replace(os.sep, '/')
+                for name in names:
+                    if name.startswith('.') or name.endswith(SKIP_SUFFIXES):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    kind = kind_of(name)
+                    bytes_by_kind[kind] += stat.st_size
+                    # The session being written keeps its databases open for
+                    # its whole life; its shards are closed once idle
+                    if now - stat.st_mtime < self.cold_seconds or (in_active and name.endswith('.db')):
+                        continue
+                    rel_path = name if rel_dir == '.' else f'{rel_dir}/{name}'
+                    known = not rel_path.startswith('..') and any(rel_path in manifest.files for manifest in manifests)
+                    uploaded = known and any(manifest.is_delta_synced(rel_path, path, stat)
+                                             or manifest.is_unchanged(rel_path, path, stat)
+                                             for manifest in manifests)
+                    files.append({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'kind': kind,
+                                  'known': known, 'uploaded': uploaded,
+                                  'database': name.endswith('.db')})
+        files.sort(key=lambda entry: entry['mtime'])
+        return files, dict(bytes_by_kind)
+
+    ################################################
+    # Actions
+    ################################################
+
+    def _level(self, free):
+        if free < self.critical_free:
+            return LEVEL_CRITICAL
+        if free < self.low_free:
+            return LEVEL_LOW
+        return LEVEL_OK
+
+    def _free(self):
+        return self.disk_usage(self.data_root)[2]
+
+    def _delete(self, entry, reason):
+        if not self.dry_run:
+            try:
+                os.remove(entry['path'])
+            except FileNotFoundError:
+                return 0
+        self.deleted[reason] += 1
+        self.deleted_bytes += entry['size']
+        logger.info("Deleted %s (%d bytes, %s)", entry['path'], entry['size'], reason)
+        return entry['size']
+
+    def _compress(self, files):
+        for entry in files:
+            if (self._stop.is_set() or entry['known'] or entry['database']
+                    or not entry['path'].endswith(COMPRESS_SUFFIXES)):
+                continue
+            if self.dry_run:
+                self.compressed += 1
+                continue
+            try:
+                saved = gzip_file(entry['path'])
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # No room for the compressed copy; deleting comes next
+                    logger.warning("No space to compress %s", entry['path'])
+                    return
+                logger.error("Could not compress %s: %s", entry['path'], e)
+                continue
+            if saved is not None:
+                self.compressed += 1
+                self.compressed_saved_bytes += saved
+
+    def _remove_empty_dirs(self, active):
+        for session in os.listdir(self.data_root):
+            session_dir = os.path.join(self.data_root, session)
+            if not SESSION_PATTERN.match(session) or not os.path.isdir(session_dir):
+                continue
+            for root, dirs, names in os.walk(session_dir, topdown=False):
+                real_root = os.path.realpath(root)
+                # The logger only creates directories when it starts a session
+                # or sees a new node, so leave those of the session alone
+                if os.listdir(root) or _inside(real_root, active) or any(path.startswith(real_root + os.sep)
+                                                                         for path in active):
+                    continue
+                if not self.dry_run:
+                    try:
+                        os.rmdir(root)
+                    except OSError:
+                        pass
+
+    def run_once(self, now=None):
+        """
+        Runs one pass (see the module docstring).
+
+        Returns:
+        - dict summarizing the pass
+        """
+        start = time.monotonic()
+        now = now if now is not None else time.time()
+        deleted_before = self.deleted_bytes
+        compressed_before = self.compressed
+
+        # Stay out of the uploader's way unless space is critical
+        lock_file = None
+        level = self._level(self._free())
+        try:
+            lock_file = open(os.path.join(self.upload_folder, LOCK_NAME), 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if level != LEVEL_CRITICAL:
+                lock_file.close()
+                logger.info("Upload in progress, skipping this storage pass")
+                return self.stats()
+        except OSError as e:
+            # e.g. no space for the lock file; deleting needs no lock
+            logger.warning("Could not take the upload lock: %s", e)
+        try:
+            files, self.bytes_by_kind = self._scan(now)
+
+            # Retention of uploaded files
+            if self.retention_seconds is not None:
+                for entry in files:
+                    if entry['uploaded'] and now - entry['mtime'] >= self.retention_seconds:
+                        entry['deleted'] = self._delete(entry, 'retention')
+
+            if self.compress:
+                self._compress([entry for entry in files if not entry.get('deleted')])
+
+            # Degrade: uploaded files first, then raw archives
+            free = self._free()
+            if free < self.low_free:
+                for entry in files:
+                    if free >= self.low_free:
+                        break
+                    if entry['uploaded'] and not entry.get('deleted') and os.path.exists(entry['path']):
+                        free += self._delete(entry, 'space')
+                        entry['deleted'] = True
+                free = self._free() if not self.dry_run else free
+            critical = free < self.critical_free
+            if critical:
+                for entry in files:
+                    if free >= self.critical_free:
+                        break
+                    if entry['kind'] == KIND_RAW and not entry.get('deleted') and os.path.exists(entry['path']):
+                        free += self._delete(entry, 'raw')
+                        entry['deleted'] = True
+                free = self._free() if not self.dry_run else free
+
+            level = self._level(free)
+            if level != self.level:
+                (logger.info if level == LEVEL_OK else logger.warning)("Storage %s: %d MB free", level,
+                                                                      free // (1024 * 1024))
+            self.level = level
+            # Paused even if deleting raw archives got back above the
+            # critical mark, or the next archive would fill it again
+            if critical and self.raw_allowed:
+                self.raw_allowed = False
+                logger.error("Storage critical (%d MB free): raw packet archive paused", free // (1024 * 1024))
+            elif self.level == LEVEL_OK and not self.raw_allowed:
+                self.raw_allowed = True
+                logger.warning("Storage recovered (%d MB free): raw packet archive resumed", free // (1024 * 1024))
+
+            self._remove_empty_dirs(self._active())
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+        self.passes += 1
+        self.last_pass_seconds = time.monotonic() - start
+        self.last_usage = tuple(self.disk_usage(self.data_root))
+        summary = self.stats()
+        summary.update(pass_deleted_bytes=self.deleted_bytes - deleted_before,
+                       pass_compressed=self.compressed - compressed_before)
+        return summary
+
+    ################################################
+    # Thread
+    ################################################
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="StorageGovernor", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """
+        Runs the next pass now, e.g. after a write failed for lack of space.
+        """
+        self._wakeup.set()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                # Never let a bad pass kill the thread; try again next time
+                self.errors += 1
+                logger.error("Storage pass failed: %s", e)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stats(self):
+        usage = self.last_usage
+        return {'level': self.level, 'raw_allowed': self.raw_allowed,
+                'free_mb': usage[2] // (1024 * 1024) if usage else None,
+                'used_mb': usage[1] // (1024 * 1024) if usage else None,
+                'bytes_by_kind': self.bytes_by_kind, 'compressed': self.compressed,
+                'compressed_saved_bytes': self.compressed_saved_bytes, 'deleted': dict(self.deleted),
+                'deleted_bytes': self.deleted_bytes, 'passes': self.passes, 'errors': self.errors,
+                'last_pass_ms': round(self.last_pass_seconds * 1000, 1)}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    parser = argparse.ArgumentParser(description="Compress, expire and free space in the logger's data.")
+    parser.add_argument("data_root", nargs='?', default=DATA_FOLDER,
+                        help="directory holding the data-*/ sessions (default: the uploader's folder)")
+    parser.add_argument("--upload-folder", default=None, help="folder the uploader syncs (default: data_root)")
+    parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION_DAYS,
+                        help="keep uploaded files this many days (negative: until space is low)")
+    parser.add_argument("--low-mb", type=float, default=DEFAULT_LOW_FREE_MB, help="free space to keep, MB")
+    parser.add_argument("--critical-mb", type=float, default=DEFAULT_CRITICAL_FREE_MB,
+                        help="free space under which raw archives are deleted, MB")
+    parser.add_argument("--cold-seconds", type=float, default=DEFAULT_COLD_SECONDS,
+                        help="files written to more recently are not touched")
+    parser.add_argument("--no-compress", action="store_true", help="do not gzip cold shards")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    args = parser.parse_args()
+
+    governor = StorageGovernor(args.data_root, args.upload_folder,
+                               args.retention_days if args.retention_days >= 0 else None,
+                               args.low_mb, args.critical_mb, args.cold_seconds, not args.no_compress,
+                               dry_run=args.dry_run)
+    print(governor.run_once())
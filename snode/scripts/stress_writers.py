@@ -0,0 +1,219 @@
+"""
+Stress Test for the Logger's File Writers
+
+Several producer threads (think several radios, or bursts of packets) write
+telemetry rows and heard-from lines as fast as they can through:
+- lock: the v4 design, every row opens, appends and closes its file under one
+  global lock
+- batched: one BatchedWriter thread owning every file
+- sharded: a ShardedWriter with one writer thread per shard of files
+
+For each design it reports the sustained rate (rows on disk per second,
+until every accepted row is written) and checks the files: every accepted
+row must be there, and any dropped row must show up in the writer
+statistics. Producers submit without pause, so with a small --max-queue the
+writers fall behind and drop rows on purpose.
+
+With --failing-every N, every Nth packet also writes a row to a file whose
+directory does not exist, in the same batches as the good rows. Every good
+row must still reach disk, and the failed rows must be charged to the
+failing files only in write_errors_by_output. These checks also run, on a
+smaller load, in tests/test_log_writer.py.
+
+Command: python scripts/stress_writers.py [--producers 4] [--packets 20000] [--shards 4] [--failing-every 10]
+from snode directory
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from log_writer import BatchedWriter, ShardedWriter, FileSink, CSV_RECORD, TXT_RECORD, FSYNC_POLICIES, FSYNC_NEVER
+
+TELEMETRY_TYPES = ['environmentMetrics', 'airQualityMetrics', 'powerMetrics', 'deviceMetrics']
+HEADERS = ['datetime', 'fromNode', 'value']
+DESIGNS = ('lock', 'batched', 'sharded')
+# Directory that is never created, for the failing outputs
+MISSING_DIR = 'missing'
+
+
+def producer_records(producer, n_packets, output_dir, failing_every=0):
+    """
+    Records of one producer: a telemetry row per packet, spread over the
+    telemetry files of its logger, plus a heard-from line, plus (every
+    failing_every packets) a row for a file in a missing directory.
+    """
+    prefix = os.path.join(output_dir, f'logger{producer}')
+    failing = os.path.join(output_dir, MISSING_DIR, f'logger{producer}_failing.csv')
+    for i in range(n_packets):
+        telemetry_key = TELEMETRY_TYPES[i % len(TELEMETRY_TYPES)]
+        yield (CSV_RECORD, f'{prefix}_{telemetry_key}.csv', HEADERS, [f'2024-12-17 13:07:{i % 60:02d}', f'0x{i:08x}', i])
+        yield (TXT_RECORD, f'{prefix}_heard_from_node_counter.txt', None, [i, {'0x1234': i}])
+        if failing_every and i % failing_every == 0:
+            yield (CSV_RECORD, failing, HEADERS, [f'2024-12-17 13:07:{i % 60:02d}', f'0x{i:08x}', i])
+
+
+class GlobalLockWriter:
+    """
+    The v4 write path: open, append and close the file for every row while
+    holding one lock shared by all files. Rows are dropped when the lock
+    cannot be acquired within the timeout.
+    """
+
+    def __init__(self, lock_timeout=5):
+        self.lock = threading.Lock()
+        self.lock_timeout = lock_timeout
+        self.dropped = 0
+        self.submitted = 0
+        self.write_errors_by_output = Counter()
+
+    def start(self):
+        return self
+
+    def submit(self, record):
+        kind, filename, headers, data = record
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            self.dropped += 1
+            return False
+        try:
+            is_new = not os.path.exists(filename)
+            with open(filename, 'a', newline='') as file:
+                if kind == CSV_RECORD:
+                    writer = csv.writer(file)
+                    if is_new:
+                        writer.writerow(headers)
+                    writer.writerow(data)
+                else:
+                    file.write(f"{data}\n")
+            self.submitted += 1
+        except OSError:
+            self.submitted += 1
+            self.write_errors_by_output[filename] += 1
+        finally:
+            self.lock.release()
+        return True
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=10):
+        pass
+
+    def stats(self):
+        return {'submitted': self.submitted, 'dropped': self.dropped, 'dropped_by_output': {},
+                'write_errors_by_output': dict(self.write_errors_by_output)}
+
+
+def make_writer(design, shards, fsync_policy, max_queue):
+    options = {'max_queue': max_queue, 'fsync_policy': fsync_policy}
+    if design == 'lock':
+        return GlobalLockWriter()
+    if design == 'batched':
+        return BatchedWriter(FileSink(), **options).start()
+    return ShardedWriter(FileSink, shards=shards, **options).start()
+
+
+def count_rows(output_dir):
+    """
+    Returns the number of data rows on disk (csv headers not counted).
+    """
+    rows = 0
+    for filename in os.listdir(output_dir):
+        if filename == MISSING_DIR:
+            continue
+        with open(os.path.join(output_dir, filename)) as file:
+            lines = sum(1 for _ in file)
+        rows += lines - 1 if filename.endswith('.csv') else lines
+    return rows
+
+
+def run(design, producers, n_packets, shards=4, fsync_policy=FSYNC_NEVER, max_queue=100000, failing_every=0):
+    """
+    Runs one design and returns its results.
+    """
+    output_dir = tempfile.mkdtemp(prefix=f'stress_{design}_')
+    try:
+        writer = make_writer(design, shards, fsync_policy, max_queue)
+        records = [list(producer_records(p, n_packets, output_dir, failing_every)) for p in range(producers)]
+        accepted = [0] * producers
+        # Accepted rows per failing output
+        accepted_failing = [Counter() for _ in range(producers)]
+        barrier = threading.Barrier(producers + 1)
+
+        def produce(index):
+            barrier.wait()
+            submit = writer.submit
+            failing = accepted_failing[index]
+            for record in records[index]:
+                if submit(record):
+                    accepted[index] += 1
+                    if os.path.basename(os.path.dirname(record[1])) == MISSING_DIR:
+                        failing[record[1]] += 1
+
+        threads = [threading.Thread(target=produce, args=(p,), name=f"producer-{p}") for p in range(producers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        submit_seconds = time.perf_counter() - start
+        writer.flush()
+        total_seconds = time.perf_counter() - start
+        stats = writer.stats()
+        writer.close()
+
+        total = sum(len(r) for r in records)
+        on_disk = count_rows(output_dir)
+        failing = sum(accepted_failing, Counter())
+        errors = stats['write_errors_by_output']
+        return {
+            'design': design,
+            'rows': total,
+            'accepted': sum(accepted),
+            'dropped': stats['dropped'],
+            'dropped_by_output': stats['dropped_by_output'],
+            'on_disk': on_disk,
+            'failing': sum(failing.values()),
+            'lost': sum(accepted) - sum(failing.values()) - on_disk,
+            # Errors charged to good files, or not matching a failing file's rows
+            'misattributed': sum(count for output, count in errors.items() if output not in failing)
+                             + sum(abs(errors.get(output, 0) - count) for output, count in failing.items()),
+            'submit_rate': total / submit_seconds,
+            'sustained_rate': on_disk / total_seconds,
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stress test the logger's file writers with concurrent producers.")
+    parser.add_argument("--producers", type=int, default=4, help="threads submitting rows at the same time")
+    parser.add_argument("--packets", type=int, default=20000, help="packets per producer (2 rows each)")
+    parser.add_argument("--shards", type=int, default=4, help="writer threads of the sharded design")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=FSYNC_NEVER, help="fsync policy of the writers")
+    parser.add_argument("--max-queue", type=int, default=100000, help="rows queued in memory per design (split across shards)")
+    parser.add_argument("--designs", nargs='+', choices=DESIGNS, default=list(DESIGNS), help="designs to run")
+    parser.add_argument("--failing-every", type=int, default=0,
+                        help="also write every Nth packet to a file in a missing directory (0: none)")
+    args = parser.parse_args()
+
+    for name in args.designs:
+        result = run(name, args.producers, args.packets, args.shards, args.fsync, args.max_queue,
+                     args.failing_every)
+        print(f"{name:8s} rows {result['rows']}, accepted {result['accepted']}, dropped {result['dropped']}, "
+              f"on disk {result['on_disk']}, lost {result['lost']} | "
+              f"submit {result['submit_rate']:.0f} rows/s, sustained {result['sustained_rate']:.0f} rows/s")
+        if args.failing_every:
+            print(f"         {result['failing']} rows to failing files, "
+                  f"{result['misattributed']} write errors misattributed")
+        if result['dropped_by_output']:
+            by_kind = Counter()
+            for path, count in result['dropped_by_output'].items():
+                by_kind[os.path.basename(path).split('_', 1)[1]] += count
+            print(f"         dropped by file type: {dict(by_kind)}")
@@ -0,0 +1,264 @@
+"""
+Local Sync Manifest for the Google Drive Uploader
+
+Remembers, for every file that has been uploaded, its mtime, size, content
+hash and Drive file ID, plus the session URI of a resumable upload that was
+interrupted. upload_to_gdrive.py uses it to:
+- skip files that have not changed since the last run
+- reuse Drive file IDs instead of querying Drive for every file
+- continue interrupted uploads instead of starting over
+- remember how many bytes of an append-only file were already shipped as
+  delta parts
+- cache the Drive IDs of the folders that mirror the local directory tree
+
+Each upload_queue.py transport keeps its own manifest. It is a JSON file inside
+the uploaded folder, written atomically (temporary file + rename) so a crash
+or power cut never leaves it half written.
+It is shared by the upload worker threads; every change goes through its lock.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.gdrive_manifest.json'
+MANIFEST_VERSION = 1
+
+
+# Bytes before the last shipped offset that are re-hashed each run to check
+# that an append-only file was appended to rather than rewritten
+TAIL_CHECK_BYTES = 4096
+
+
+def tail_sha256(path, offset):
+    """
+    Returns the hash of the TAIL_CHECK_BYTES bytes before offset.
+    """
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return hashlib.sha256(file.read(offset - start)).hexdigest()
+
+
+def file_sha256(path, size=None, block_size=1 << 20):
+    """
+    Returns the hex SHA-256 of a file, read in blocks.
+
+    Parameters:
+    - path: str, path of the file
+    - size: int, only hash the first size bytes (e.g. the part that was
+      uploaded while the logger keeps appending)
+    """
+    digest = hashlib.sha256()
+    remaining = size
+    with open(path, 'rb') as file:
+        while remaining is None or remaining > 0:
+            block = file.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+class SyncManifest:
+    """
+    Per-folder record of what has been synced to Drive. File entries are keyed
+    by the file path relative to the folder, folder IDs by the relative
+    directory ('' is the uploaded folder itself).
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        - path: str, path of the manifest file
+        """
+        self.path = path
+        self.files = {}
+        self.folders = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        return cls(os.path.join(folder_path, MANIFEST_NAME))
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            # A broken manifest only costs a full re-check, never data
+            logger.warning("Ignoring unreadable manifest %s: %s", self.path, e)
+            return
+        self.files = data.get('files', {})
+        self.folders = data.get('folders', {})
+
+    def save(self):
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.files, 'folders': self.folders},
+                          file, indent=1, sort_keys=True)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+    def entry(self, rel_path):
+        """
+        Returns the manifest entry for a file, creating an empty one.
+        """
+        with self._lock:
+            return self.files.setdefault(rel_path, {})
+
+    def folder_id(self, rel_dir):
+        """
+        Returns the cached Drive ID of a mirrored folder, or None.
+        """
+        return self.folders.get(rel_dir)
+
+    def set_folder_id(self, rel_dir, drive_id):
+        with self._lock:
+            self.folders[rel_dir] = drive_id
+
+    def forget_drive_id(self, rel_path):
+        """
+        Drops a cached Drive file ID, e.g. after the file was deleted on Drive.
+        """
+        with self._lock:
+            self.entry(rel_path).pop('drive_id', None)
+
+    def is_unchanged(self, rel_path, path, stat=None):
+        """
+        Checks whether a file is already synced. mtime and size are compared
+        first; the content hash is only computed when they differ, so touching
+        a file without changing it does not cause a re-upload.
+
+        Parameters:
+        - rel_path: str, manifest key
+        - path: str, path of the local file
+        - stat: os.stat_result, avoids a second stat call
+
+        Returns:
+        - bool
+        """
+        entry = self.files.get(rel_path)
+        if not entry or 'sha256' not in entry or entry.get('resumable_uri'):
+            return False
+        stat = stat or os.stat(path)
+        if entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+            return True
+        if entry.get('size') != stat.st_size:
+            return False
+        if file_sha256(path) == entry['sha256']:
+            entry['mtime'] = stat.st_mtime
+            return True
+        return False
+
+    def mark_synced(self, rel_path, path, drive_id, stat=None, sha256=None):
+        """
+        Records a completed upload and clears any resumable session.
+
+        Pass the stat (and hash) taken before the upload started, so rows the
+        logger appended during the upload are picked up by the next run.
+        """
+        stat = stat or os.stat(path)
+        sha256 = sha256 or file_sha256(path, stat.st_size)
+        with self._lock:
+            entry = self.entry(rel_path)
+            entry.update({
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'sha256': sha256,
+                'drive_id': drive_id,
+            })
+            self.clear_resumable(rel_path)
+
+    def set_resumable(self, rel_path, uri, size, fingerprint):
+        """
+        Records the session of an upload in progress so the next run can
+        resume it, together with the size and a fingerprint (e.g. hash) of
+        the bytes being sent.
+        """
+        with self._lock:
+            entry = self.entry(rel_path)
+            entry['resumable_uri'] = uri
+            entry['resumable_size'] = size
+            entry['resumable_fingerprint'] = fingerprint
+
+    def resumable_session(self, rel_path):
+        """
+        Returns (uri, size, fingerprint) of an interrupted upload, or None.
+        """
+        entry = self.files.get(rel_path) or {}
+        if not entry.get('resumable_uri'):
+            return None
+        return entry['resumable_uri'], entry.get('resumable_size'), entry.get('resumable_fingerprint')
+
+    def clear_resumable(self, rel_path):
+        with self._lock:
+            entry = self.entry(rel_path)
+            for key in ('resumable_uri', 'resumable_size', 'resumable_fingerprint'):
+                entry.pop(key, None)
+
+    def is_delta_synced(self, rel_path, path, stat=None):
+        """
+        Checks whether every byte of an append-only file has been shipped.
+        The size alone is not enough: a file rewritten to the same size (or
+        replaced, e.g. by a new session reusing the name) must differ in the
+        bytes before the shipped offset, so their hash is compared too.
+
+        Parameters:
+        - rel_path: str, manifest key
+        - path: str, path of the local file
+        - stat: os.stat_result, avoids a second stat call
+
+        Returns:
+        - bool
+        """
+        entry = self.files.get(rel_path)
+        if not entry or entry.get('resumable_uri') or 'delta_tail_sha256' not in entry:
+            return False
+        stat = stat or os.stat(path)
+        if entry.get('delta_offset') != stat.st_size:
+            return False
+        try:
+            return tail_sha256(path, stat.st_size) == entry['delta_tail_sha256']
+        except FileNotFoundError:
+            return False
+
+    def reset_delta(self, rel_path):
+        """
+        Forgets the shipped parts of a file that was rewritten instead of appended.
+        """
+        with self._lock:
+            entry = self.entry(rel_path)
+            entry['delta_offset'] = 0
+            entry['delta_parts'] = []
+            self.clear_resumable(rel_path)
+
+    def mark_delta_synced(self, rel_path, generation, offset, tail_sha256, part_id):
+        """
+        Records that an append-only file has been shipped up to offset.
+
+        Parameters:
+        - rel_path: str, manifest key
+        - generation: int, bumped whenever the file was rewritten instead of appended
+        - offset: int, number of bytes shipped
+        - tail_sha256: str, hash of the bytes just before offset, to detect rewrites
+        - part_id: str, Drive file ID of the part just uploaded
+        """
+        with self._lock:
+            entry = self.entry(rel_path)
+            entry['delta_generation'] = generation
+            entry['delta_offset'] = offset
+            entry['delta_tail_sha256'] = tail_sha256
+            entry.setdefault('delta_parts', []).append(part_id)
+            self.clear_resumable(rel_path)
@@ -0,0 +1,178 @@
+"""
+Telemetry Schema Registry
+
+Maps each telemetry type (e.g. 'environmentMetrics') to the metric fields
+logged for it, and builds one row encoder per type when the logger starts.
+An encoder turns a metrics dict plus the packet's signal fields into a row
+with a single pass of dict.get lookups, instead of rebuilding the expected
+key list, testing membership field by field and merging the metrics with
+the signal dict on every packet. Missing fields come out as None.
+
+Schemas can be extended or replaced from a JSON file, so new metrics (e.g.
+extra wind sensor fields) need no code change:
+
+    {
+        "environmentMetrics": ["temperature", "relativeHumidity", "windDirection",
+                               "windSpeed", "windGust", "windLull"],
+        "signal_keys": ["rxSnr", "rxRssi", "rxTime", "hopStart", "hopLimit"]
+    }
+
+Types in the file replace the built-in field list of the same type; other
+built-in types are kept. "signal_keys" (optional) replaces the signal fields
+appended to every row. Changing the fields of a type changes its csv
+columns, so schemas are only read at startup, when the logger opens new
+hourly files anyway.
+
+Sections of a type without a schema are not dropped: other_telemetry_rows()
+turns them into schemaless long-format rows, one per field:
+
+    datetime, fromNode, telemetryKey, field, value
+"""
+
+import json
+
+# Built-in metric fields per telemetry type
+DEFAULT_SCHEMAS = {
+    'environmentMetrics' : ['temperature', 'relativeHumidity', 'barometricPressure', 'gasResistance', 'iaq', 'windDirection', 'windSpeed'],
+    'airQualityMetrics' : ['pm10Standard', 'pm25Standard', 'pm100Standard', 'pm10Environmental', 'pm25Environmental', 'pm100Environmental'],
+    'powerMetrics' : ['ch3Voltage', 'ch3Current'],
+    'deviceMetrics' : ['batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx']
+}
+
+# Signal fields copied from the packet itself onto every row
+DEFAULT_SIGNAL_KEYS = ['rxSnr', 'rxRssi', 'rxTime', 'hopStart', 'hopLimit']
+
+# Columns in front of the metric fields
+ROW_PREFIX = ['datetime', 'fromNode']
+
+SIGNAL_KEYS_ENTRY = 'signal_keys'
+
+# Schemaless output for telemetry sections without a schema
+OTHER_TELEMETRY_KEY = 'otherTelemetry'
+OTHER_TELEMETRY_HEADERS = ROW_PREFIX + ['telemetryKey', 'field', 'value']
+
+
+class TelemetryEncoder:
+    """
+    Builds the rows of one telemetry type. Headers are computed once; a row
+    is [datetime, fromNode, *metric fields, *signal fields].
+    """
+
+    __slots__ = ('telemetry_key', 'fields', 'signal_keys', 'headers')
+
+    def __init__(self, telemetry_key, fields, signal_keys=DEFAULT_SIGNAL_KEYS):
+        """
+        Parameters:
+        - telemetry_key: str, telemetry type, e.g. 'environmentMetrics'
+        - fields: list of str, metric fields in column order
+        - signal_keys: list of str, packet fields appended to every row
+        """
+        self.telemetry_key = telemetry_key
+        self.fields = tuple(fields)
+        self.signal_keys = tuple(signal_keys)
+        self.headers = ROW_PREFIX + list(self.fields) + list(self.signal_keys)
+
+    def row(self, curr_date_time, from_node, metrics, packet):
+        """
+        Returns the row for one packet.
+
+        Parameters:
+        - curr_date_time: str, current date and time
+        - from_node: str, node id
+        - metrics: dict, the telemetry section (e.g. telemetry['environmentMetrics'])
+        - packet: dict, the packet, for the signal fields
+        """
+        row = [curr_date_time, from_node]
+        row += map(metrics.get, self.fields)
+        row += map(packet.get, self.signal_keys)
+        return row
+
+
+class SchemaRegistry:
+    """
+    The encoders of every known telemetry type, in schema order.
+    """
+
+    def __init__(self, schemas=None, signal_keys=None):
+        """
+        Parameters:
+        - schemas: dict, telemetry type -> list of metric fields (default: DEFAULT_SCHEMAS)
+        - signal_keys: list of str, packet fields appended to every row
+        """
+        schemas = DEFAULT_SCHEMAS if schemas is None else schemas
+        signal_keys = DEFAULT_SIGNAL_KEYS if signal_keys is None else signal_keys
+        self.encoders = {key: TelemetryEncoder(key, fields, signal_keys) for key, fields in schemas.items()}
+        self.signal_keys = list(signal_keys)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Builds a registry from the built-in schemas overlaid with a JSON file
+        (see the module docstring).
+        """
+        with open(path) as file:
+            config = json.load(file)
+        if not isinstance(config, dict):
+            raise ValueError(f"{path}: expected a JSON object of telemetry type -> field list")
+
+        signal_keys = config.pop(SIGNAL_KEYS_ENTRY, None)
+        schemas = dict(DEFAULT_SCHEMAS)
+        for key, fields in config.items():
+            if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+                raise ValueError(f"{path}: fields of '{key}' must be a list of strings")
+            schemas[key] = fields
+        return cls(schemas, signal_keys)
+
+    def get(self, telemetry_key):
+        """
+        Returns the encoder of a telemetry type, or None if it is unknown.
+        """
+        return self.encoders.get(telemetry_key)
+
+    def sections(self, telemetry_data):
+        """
+        Routes every metrics section of a packet in one pass over the
+        packet's own keys. Non-dict entries ('time', the protobuf under
+        'raw') are skipped.
+
+        Parameters:
+        - telemetry_data: dict, packet['decoded']['telemetry']
+
+        Yields:
+        - (telemetry_key, encoder or None if the type has no schema, section dict)
+        """
+        encoders = self.encoders
+        for key, section in telemetry_data.items():
+            if isinstance(section, dict):
+                yield key, encoders.get(key), section
+
+    def __contains__(self, telemetry_key):
+        return telemetry_key in self.encoders
+
+    def __iter__(self):
+        return iter(self.encoders)
+
+
+def _flatten(section, prefix=''):
+    for field, value in section.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{field}.')
+        elif isinstance(value, (str, int, float, bool)) or value is None:
+            yield f'{prefix}{field}', value
+        elif isinstance(value, (list, tuple)):
+            yield f'{prefix}{field}', json.dumps(value, default=str)
+
+
+def other_telemetry_rows(curr_date_time, from_node, telemetry_key, section):
+    """
+    Returns the long-format rows (see OTHER_TELEMETRY_HEADERS) of a telemetry
+    section without a schema. Nested fields get dotted names, lists are
+    stored as JSON, and anything else (e.g. protobuf objects) is skipped.
+
+    Parameters:
+    - curr_date_time: str, current date and time
+    - from_node: str, node id
+    - telemetry_key: str, section name, e.g. 'windMetrics'
+    - section: dict, the section
+    """
+    return [[curr_date_time, from_node, telemetry_key, field, value] for field, value in _flatten(section)]
@@ -0,0 +1,568 @@
+"""
+Persistent, Offline-First Upload Queue
+
+Field loggers often have no uplink for hours. Instead of uploading straight
+from a directory walk (and failing when the network is down), each run:
+1. scans the data folder and records every new or changed file in a small
+   SQLite queue inside the folder (.upload_queue.db), so pending work
+   survives reboots and runs that never got a connection
+2. drains the queue through a transport, but only when the transport reports
+   that it can reach its destination
+3. logs the backlog (files and bytes) and the drain rate, and keeps a history
+   of drains so it is easy to check that the queue catches up after an outage
+
+A transport is any object with:
+- name: str, shown in logs
+- manifest_name: str, file name of its SyncManifest inside the folder
+- is_online(): bool, cheap connectivity check
+- is_offline_error(error): bool, True if the error means "try again later"
+- prepare(manifest, rel_dirs): creates the destination directories
+- upload(manifest, rel_path, file_path, stat, append_only): uploads one file
+  (or the bytes appended since the last run) and records it in the manifest,
+  returning the number of bytes sent
+
+upload_to_gdrive.DriveTransport ships to Google Drive. LocalDirTransport
+mirrors the folder into another directory (e.g. a USB stick or a mounted
+share) and stands in for Drive when testing without network or credentials.
+
+Uploads are throttled (--max-rate) and the cron job runs them with
+nice/ionice, so draining a long backlog does not starve the logger.
+
+Command: python scripts/upload_queue.py <folder> --dest <dir> [--delta] [--watch <seconds>]
+         python scripts/upload_queue.py <folder> --status
+from snode directory
+"""
+
+import argparse
+import fcntl
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from log_config import setup_logging, LOG_LEVELS
+from sync_manifest import SyncManifest, tail_sha256
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = '.upload_queue.db'
+LOCK_NAME = '.upload.lock'
+
+# Data folder shared by the logger (which writes its data-<datetime>/
+# sessions in it), the uploader and the storage governor: snode/data
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Files the logger only ever appends to. In delta mode only the bytes added
+# since the last run are uploaded.
+APPEND_ONLY_SUFFIXES = ('.csv', '.txt', '.jsonl.gz', '.jsonl.zst')
+
+# Local files that are never uploaded: temporary files being written,
+# SQLite's WAL/shared-memory/journal side files, and the stdout/stderr logs
+# the start and cron scripts append to in the data folder (they change on
+# every run, so they would be uploaded again every time). Hidden files (the
+# manifest, the queue and its lock) are skipped as well.
+SKIP_SUFFIXES = ('.tmp', '-wal', '-shm', '-journal', '_stdouterr_log.txt', '_stdouterr.txt')
+
+DEFAULT_WORKERS = 4
+
+# Jobs that failed for another reason than being offline (e.g. a file Drive
+# refuses) are retried with exponential backoff, capped at a few hours
+RETRY_BASE_SECONDS = 60.0
+RETRY_MAX_SECONDS = 4 * 3600.0
+
+# Number of past drains shown by --status, and how long drains are remembered
+STATUS_HISTORY = 10
+HISTORY_DAYS = 30
+
+
+def can_connect(host, port, timeout=5.0):
+    """
+    True if a TCP connection to host:port can be opened. Used as a cheap
+    connectivity check before touching any API.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def find_changed_files(folder_path, manifest, delta=False):
+    """
+    Walks folder_path and returns the files that still need uploading.
+
+    Parameters:
+    - folder_path: str, local folder to upload
+    - manifest: SyncManifest of the folder for the transport in use
+    - delta: bool, treat append-only files as deltas
+
+    Returns:
+    - (list of (rel_path, file_path, append_only, pending_bytes), number of unchanged files)
+    """
+    changed = []
+    unchanged = 0
+    for root, dirs, files in os.walk(folder_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        rel_dir = os.path.relpath(root, folder_path)
+        rel_dir = '' if rel_dir == '.' else rel_dir.replace(os.sep, '/')
+        for filename in sorted(files):
+            if filename.startswith('.') or filename.endswith(SKIP_SUFFIXES):
+                continue
+            file_path = os.path.join(root, filename)
+            rel_path = f'{rel_dir}/{filename}' if rel_dir else filename
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue  # removed while walking
+
+            append_only = delta and filename.endswith(APPEND_ONLY_SUFFIXES)
+            if append_only and manifest.is_delta_synced(rel_path, file_path, stat):
+                unchanged += 1
+                continue
+            if not append_only and manifest.is_unchanged(rel_path, file_path, stat):
+                unchanged += 1
+                continue
+            pending = stat.st_size
+            if append_only:
+                pending = max(0, stat.st_size - manifest.entry(rel_path).get('delta_offset', 0))
+            changed.append((rel_path, file_path, append_only, pending))
+    return changed, unchanged
+
+
+################################################
+# Queue
+################################################
+
+class UploadQueue:
+    """
+    SQLite-backed list of files waiting to be uploaded, keyed by their path
+    relative to the folder. Enqueuing a file that is already queued only
+    refreshes it, so the queue never holds more than one job per file.
+
+    Only the thread that created the queue should use it.
+    """
+
+    def __init__(self, db_path):
+        """
+        Parameters:
+        - db_path: str, path of the queue database
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " rel_path TEXT PRIMARY KEY, file_path TEXT NOT NULL, append_only INTEGER NOT NULL,"
+                " pending_bytes INTEGER NOT NULL, enqueued_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0,"
+                " last_error TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS drains ("
+                " started_at REAL NOT NULL, seconds REAL NOT NULL, online INTEGER NOT NULL,"
+                " backlog_files INTEGER NOT NULL, backlog_bytes INTEGER NOT NULL,"
+                " drained_files INTEGER NOT NULL, drained_bytes INTEGER NOT NULL,"
+                " failed INTEGER NOT NULL)")
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        return cls(os.path.join(folder_path, QUEUE_NAME))
+
+    def enqueue(self, jobs, now=None):
+        """
+        Adds or refreshes jobs. A refreshed job keeps its place in the queue.
+
+        Parameters:
+        - jobs: list of (rel_path, file_path, append_only, pending_bytes)
+        """
+        now = now if now is not None else time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO jobs (rel_path, file_path, append_only, pending_bytes, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(rel_path) DO UPDATE SET file_path = excluded.file_path,"
+                " append_only = excluded.append_only, pending_bytes = excluded.pending_bytes",
+                [(rel_path, file_path, int(append_only), pending, now)
+                 for rel_path, file_path, append_only, pending in jobs])
+
+    def due(self, now=None):
+        """
+        Returns the jobs ready to run, oldest first.
+
+        Returns:
+        - list of (rel_path, file_path, append_only, pending_bytes, attempts)
+        """
+        now = now if now is not None else time.time()
+        rows = self.conn.execute(
+            "SELECT rel_path, file_path, append_only, pending_bytes, attempts FROM jobs"
+            " WHERE next_attempt_at <= ? ORDER BY enqueued_at, rel_path", (now,)).fetchall()
+        return [(rel_path, file_path, bool(append_only), pending, attempts)
+                for rel_path, file_path, append_only, pending, attempts in rows]
+
+    def complete(self, rel_path):
+        with self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE rel_path = ?", (rel_path,))
+
+    def fail(self, rel_path, error, retry=True, now=None):
+        """
+        Records a failed attempt.
+
+        Parameters:
+        - rel_path: str, job key
+        - error: exception or str, kept for --status
+        - retry: bool, False if the job failed because the destination was
+          unreachable; it then runs again as soon as the connection is back
+        """
+        now = now if now is not None else time.time()
+        with self.conn:
+            if retry:
+                attempts = self.conn.execute(
+                    "SELECT attempts FROM jobs WHERE rel_path = ?", (rel_path,)).fetchone()
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts[0] if attempts else 0))
+                self.conn.execute(
+                    "UPDATE jobs SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?"
+                    " WHERE rel_path = ?", (now + delay, str(error), rel_path))
+            else:
+                self.conn.execute("UPDATE jobs SET last_error = ? WHERE rel_path = ?", (str(error), rel_path))
+
+    def backlog(self):
+        """
+        Returns (queued files, queued bytes).
+        """
+        files, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(pending_bytes), 0) FROM jobs").fetchone()
+        return files, size
+
+    def record_drain(self, started_at, seconds, online, backlog, drained_files, drained_bytes, failed):
+        with self.conn:
+            self.conn.execute("INSERT INTO drains VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (started_at, seconds, int(online), backlog[0], backlog[1],
+                               drained_files, drained_bytes, failed))
+            self.conn.execute("DELETE FROM drains WHERE started_at < ?", (started_at - HISTORY_DAYS * 86400,))
+
+    def history(self, limit=STATUS_HISTORY):
+        """
+        Returns the last drains, newest first, as dicts.
+        """
+        cursor = self.conn.execute("SELECT * FROM drains ORDER BY started_at DESC LIMIT ?", (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def errors(self):
+        """
+        Returns (rel_path, attempts, last_error) of jobs that failed before.
+        """
+        return self.conn.execute("SELECT rel_path, attempts, last_error FROM jobs"
+                                 " WHERE last_error IS NOT NULL ORDER BY rel_path").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+################################################
+# Local stand-in transport
+################################################
+
+class LocalDirTransport:
+    """
+    Mirrors the folder into another directory. Full files are copied through
+    a temporary file and renamed; append-only files get the new bytes
+    appended, and are rewritten from scratch if the source was rewritten.
+
+    The destination counts as offline while it does not exist, e.g. while a
+    USB stick or network share is not mounted.
+    """
+
+    name = 'local'
+    manifest_name = '.local_manifest.json'
+
+    def __init__(self, dest_dir, block_size=1 << 20):
+        """
+        Parameters:
+        - dest_dir: str, directory to mirror into (must exist to be online)
+        - block_size: int, bytes copied per read
+        """
+        self.dest_dir = dest_dir
+        self.block_size = block_size
+
+    def is_online(self):
+        return os.path.isdir(self.dest_dir)
+
+    def is_offline_error(self, error):
+        return isinstance(error, OSError) and not self.is_online()
+
+    def prepare(self, manifest, rel_dirs):
+        for rel_dir in rel_dirs:
+            os.makedirs(os.path.join(self.dest_dir, rel_dir), exist_ok=True)
+
+    def _copy(self, source, dest, start, end):
+        source.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = source.read(min(self.block_size, remaining))
+            if not block:
+                break
+            dest.write(block)
+            remaining -= len(block)
+        dest.flush()
+        os.fsync(dest.fileno())
+
+    def upload(self, manifest, rel_path, file_path, stat, append_only):
+        dest_path = os.path.join(self.dest_dir, rel_path)
+        end = stat.st_size
+
+        if not append_only:
+            tmp_path = f'{dest_path}.tmp'
+            with open(file_path, 'rb') as source, open(tmp_path, 'wb') as dest:
+                self._copy(source, dest, 0, end)
+            os.replace(tmp_path, dest_path)
+            manifest.mark_synced(rel_path, file_path, dest_path, stat=stat)
+            manifest.save()
+            return end
+
+        entry = manifest.entry(rel_path)
+        generation = entry.get('delta_generation', 0)
+        offset = entry.get('delta_offset', 0)
+        if (offset > end or (offset and tail_sha256(file_path, offset) != entry.get('delta_tail_sha256'))
+                or (not os.path.exists(dest_path) and offset)):
+            logger.info("%s was rewritten, copying it again", rel_path)
+            generation += 1
+            offset = 0
+            manifest.reset_delta(rel_path)
+        if offset == end:
+            return 0
+
+        with open(file_path, 'rb') as source, open(dest_path, 'r+b' if offset else 'wb') as dest:
+            dest.truncate(offset)
+            dest.seek(offset)
+            self._copy(source, dest, offset, end)
+        manifest.mark_delta_synced(rel_path, generation, end, tail_sha256(file_path, end), dest_path)
+        manifest.save()
+        return end - offset
+
+
+################################################
+# Draining
+################################################
+
+def _throttle(committed_bytes, start, max_rate):
+    """
+    Sleeps until sending committed_bytes since start stays under max_rate.
+    """
+    if max_rate:
+        delay = committed_bytes / max_rate - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _run_job(transport, manifest, rel_path, file_path, append_only):
+    """
+    Runs in a worker thread: uploads the current snapshot of one file.
+
+    Returns:
+    - int, bytes sent, or None if there was nothing left to send
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None  # deleted (e.g. by the storage cleanup) since it was queued
+    if append_only and manifest.is_delta_synced(rel_path, file_path, stat):
+        return None
+    if not append_only and manifest.is_unchanged(rel_path, file_path, stat):
+        return None
+    return transport.upload(manifest, rel_path, file_path, stat, append_only)
+
+
+def drain(queue, manifest, transport, workers=DEFAULT_WORKERS, max_rate=None):
+    """
+    Uploads the due jobs of the queue until it is empty or the destination
+    becomes unreachable.
+
+    Parameters:
+    - queue: UploadQueue
+    - manifest: SyncManifest for the transport
+    - transport: see the module docstring
+    - workers: int, files uploaded at the same time
+    - max_rate: float, average bytes per second to stay under (None = unlimited)
+
+    Returns:
+    - dict with online, drained_files, drained_bytes, failed
+    """
+    result = {'online': True, 'drained_files': 0, 'drained_bytes': 0, 'failed': 0}
+    jobs = queue.due()
+    if not jobs:
+        return result
+
+    try:
+        transport.prepare(manifest, sorted({os.path.dirname(job[0]) for job in jobs}))
+    except Exception as e:
+        if not transport.is_offline_error(e):
+            raise
+        logger.warning("%s went offline while preparing: %s", transport.name, e)
+        result['online'] = False
+        return result
+
+    start = time.monotonic()
+    committed = 0
+    pending = iter(jobs)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while result['online'] and len(running) < workers:
+                job = next(pending, None)
+                if job is None:
+                    break
+                rel_path, file_path, append_only, pending_bytes, _ = job
+                _throttle(committed, start, max_rate)
+                committed += pending_bytes
+                future = pool.submit(_run_job, transport, manifest, rel_path, file_path, append_only)
+                running[future] = rel_path
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path = running.pop(future)
+                try:
+                    sent = future.result()
+                except Exception as e:
+                    offline = transport.is_offline_error(e)
+                    queue.fail(rel_path, e, retry=not offline)
+                    result['failed'] += 1
+                    if offline:
+                        # Stop handing out work; jobs already running finish or fail on their own
+                        result['online'] = False
+                        logger.warning("%s went offline uploading %s: %s", transport.name, rel_path, e)
+                    else:
+                        logger.error("Could not upload %s: %s", rel_path, e)
+                    continue
+                queue.complete(rel_path)
+                if sent is not None:
+                    result['drained_files'] += 1
+                    result['drained_bytes'] += sent
+    return result
+
+
+def sync(folder_path, transport, delta=False, workers=DEFAULT_WORKERS, max_rate=None):
+    """
+    Queues the new and changed files of folder_path, then drains the queue
+    if the transport is online. Only one sync runs per folder at a time;
+    a run that finds another one in progress returns None right away.
+
+    Parameters:
+    - folder_path: str, local folder to upload
+    - transport: see the module docstring
+    - delta: bool, upload append-only files as deltas
+    - workers: int, files uploaded at the same time
+    - max_rate: float, average bytes per second to stay under (None = unlimited)
+
+    Returns:
+    - dict summarizing the run, or None if another run holds the lock
+    """
+    with open(os.path.join(folder_path, LOCK_NAME), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another upload is running for %s, skipping this run", folder_path)
+            return None
+
+        started_at = time.time()
+        start = time.monotonic()
+        manifest = SyncManifest(os.path.join(folder_path, transport.manifest_name))
+        queue = UploadQueue.for_folder(folder_path)
+        try:
+            changed, unchanged = find_changed_files(folder_path, manifest, delta)
+            queue.enqueue(changed)
+            # Persist any mtime refreshes from unchanged files
+            manifest.save()
+            backlog = queue.backlog()
+
+            if transport.is_online():
+                result = drain(queue, manifest, transport, workers, max_rate)
+            else:
+                result = {'online': False, 'drained_files': 0, 'drained_bytes': 0, 'failed': 0}
+            seconds = time.monotonic() - start
+            queue.record_drain(started_at, seconds, result['online'], backlog,
+                               result['drained_files'], result['drained_bytes'], result['failed'])
+
+            result.update({'unchanged': unchanged, 'seconds': seconds,
+                           'backlog_before': backlog, 'backlog_after': queue.backlog()})
+            result['rate_bps'] = result['drained_bytes'] / seconds if seconds > 0 else 0.0
+            log_summary(transport, result)
+            return result
+        finally:
+            queue.close()
+
+
+def log_summary(transport, result):
+    files_before, bytes_before = result['backlog_before']
+    files_after, bytes_after = result['backlog_after']
+    if not result['online'] and not result['drained_files']:
+        logger.info("%s offline, %d files (%d bytes) queued", transport.name, files_after, bytes_after)
+        return
+    logger.info("%s: backlog %d files (%d bytes) -> %d files (%d bytes); drained %d files, %d bytes "
+                "in %.1f s (%.1f KB/s), failed %d, unchanged %d",
+                transport.name, files_before, bytes_before, files_after, bytes_after,
+                result['drained_files'], result['drained_bytes'], result['seconds'],
+                result['rate_bps'] / 1024, result['failed'], result['unchanged'])
+
+
+def watch(folder_path, transport, interval, **kwargs):
+    """
+    Runs sync() every interval seconds, forever. While offline each round
+    only costs a directory walk and a connectivity check.
+    """
+    while True:
+        sync(folder_path, transport, **kwargs)
+        time.sleep(interval)
+
+
+def print_status(folder_path):
+    queue = UploadQueue.for_folder(folder_path)
+    try:
+        files, size = queue.backlog()
+        print(f"Backlog: {files} files, {size} bytes")
+        history = queue.history()
+        online = [run for run in history if run['online'] and run['seconds'] > 0]
+        drained = sum(run['drained_bytes'] for run in online)
+        seconds = sum(run['seconds'] for run in online)
+        if drained and seconds:
+            rate = drained / seconds
+            print(f"Drain rate: {rate / 1024:.1f} KB/s over the last {len(online)} online runs, "
+                  f"backlog cleared in about {size / rate / 60:.1f} min of uplink")
+        for run in history:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started_at']))} "
+                  f"{'online ' if run['online'] else 'offline'} backlog {run['backlog_files']} files "
+                  f"({run['backlog_bytes']} bytes), drained {run['drained_files']} files "
+                  f"({run['drained_bytes']} bytes) in {run['seconds']:.1f} s, failed {run['failed']}")
+        for rel_path, attempts, error in queue.errors():
+            print(f"{rel_path}: {attempts} failed attempts, last error: {error}")
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Queue and upload logger data to a local directory.")
+    parser.add_argument("folder", help="local folder to upload")
+    parser.add_argument("--dest", help="directory to mirror the folder into")
+    parser.add_argument("--status", action="store_true", help="print the backlog and recent drains, then exit")
+    parser.add_argument("--delta", action="store_true", help="append only new bytes of csv/log/archive files")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="files uploaded at the same time")
+    parser.add_argument("--max-rate", type=float, default=None, help="average upload rate limit in bytes/s")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="keep running, syncing every SECONDS")
+    parser.add_argument("--log-level", default="INFO", choices=LOG_LEVELS, help="minimum level to log")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    if args.status:
+        print_status(args.folder)
+    elif not args.dest:
+        parser.error("--dest is required unless --status is given")
+    else:
+        local = LocalDirTransport(args.dest)
+        options = {'delta': args.delta, 'workers': args.workers, 'max_rate': args.max_rate}
+        if args.watch:
+            watch(args.folder, local, args.watch, **options)
+        else:
+            sync(args.folder, local, **options)
@@ -1,61 +1,481 @@
+import io
+import json
+import logging
 import os
+import time
+import random
+import argparse
+import mimetypes
+import threading
+import httplib2
+import google_auth_httplib2
+from google.auth.exceptions import TransportError
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import datetime
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from log_config import setup_logging, LOG_LEVELS
+from sync_manifest import MANIFEST_NAME, file_sha256, tail_sha256
+from upload_queue import DATA_FOLDER, DEFAULT_WORKERS, can_connect, sync, watch
+
+logger = logging.getLogger(__name__)
 
 # Define the Google Drive API scopes and service account file path
 SCOPES = ['https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = "/home/pi/smesh/snode/credentials.json" # Replace with the path to your service account file
 
-# Create credentials using the service account file
-credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+# Default local folder and Drive folder (see __main__). The local folder is
+# where the logger writes its sessions (/home/pi/smesh/snode/data on a snode)
+DEFAULT_FOLDER = DATA_FOLDER
+DEFAULT_DRIVE_FOLDER_ID = "1W3gRqD1Szc4eqjIz9ESWps5qM-8NQ2Qj"
+
+# Upload in chunks so an interrupted upload can resume from the last chunk
+# (must be a multiple of 256 KB)
+CHUNK_SIZE = 1024 * 1024
+
+# In delta mode only the bytes added to append-only files since the last run
+# are uploaded (see upload_queue.APPEND_ONLY_SUFFIXES), as
+# '<name>.g<generation>.<offset>.part' files that merge_delta_chunks.py
+# concatenates back into the full file.
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+
+# Host probed before draining the upload queue
+CONNECTIVITY_PROBE = ('www.googleapis.com', 443)
+
+# Retries with exponential backoff (plus jitter) on quota and server errors
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+# The credentials and the Google Drive service are created on first use, not
+# at import, so the script can queue files without network or credentials.
+# The service is shared by all upload threads, but httplib2 connections are
+# not thread-safe, so each thread sends its requests through its own
+# authorized connection.
+_credentials = None
+_service = None
+_service_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def get_service():
+    """
+    Returns the Google Drive service, building it (and the service account
+    credentials) on first use.
+    """
+    global _credentials, _service
+    with _service_lock:
+        if _service is None:
+            _credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            _service = build('drive', 'v3', credentials=_credentials)
+        return _service
+
+
+def thread_http():
+    """
+    Returns this thread's authorized HTTP connection, creating it on first use.
+    """
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        get_service()
+        http = google_auth_httplib2.AuthorizedHttp(_credentials, http=httplib2.Http())
+        _thread_local.http = http
+    return http
+
+
+def is_retryable(error):
+    """
+    True for errors worth retrying: quota/rate limits and server errors.
+    """
+    status = error.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+    return status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+
+def with_backoff(call):
+    """
+    Calls call() and retries retryable HttpErrors with exponential backoff
+    and full jitter, so parallel workers do not retry in lockstep.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except HttpError as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            logger.warning("Drive returned %s, retrying in %.1f s", e.resp.status, delay)
+            time.sleep(delay)
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Read-only view of bytes [start, end) of a file, seen as a file of its own.
+    The logger keeps appending to the current shards, so each upload sends a
+    fixed snapshot and a resumed upload sends exactly the bytes the session
+    was started with.
+    """
+
+    def __init__(self, file, start, end):
+        self._file = file
+        self._start = start
+        self._size = end - start
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        self._pos = max(0, min(self._pos, self._size))
+        return self._pos
+
+    def read(self, n=-1):
+        remaining = self._size - self._pos
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        self._file.seek(self._start + self._pos)
+        data = self._file.read(n)
+        self._pos += len(data)
+        return data
+
+
+def delta_part_name(filename, generation, offset):
+    """
+    Name of the Drive file holding the bytes of filename starting at offset.
+    Zero padding keeps the parts of one file sorted by offset.
+    """
+    return f'{filename}.g{generation:03d}.{offset:012d}.part'
+
+
+def find_drive_file(filename, drive_folder_id=None):
+    """
+    Looks up a file by name on Drive. Only used when the manifest does not
+    know the file ID yet.
+
+    Returns:
+    - str file ID, or None if the file does not exist
+    """
+    # Build the query to search for existing files
+    query = f"mimeType != '{FOLDER_MIMETYPE}' and name = '{filename}' and trashed = false"
+    if drive_folder_id:
+        query += f" and '{drive_folder_id}' in parents"
+
+    # Search for the file
+    request = get_service().files().list(q=query, spaces='drive', fields='files(id, name)')
+    response = with_backoff(lambda: request.execute(http=thread_http()))
+    files = response.get('files', [])
+    return files[0]['id'] if files else None
+
+
+def ensure_drive_folder(manifest, rel_dir, drive_folder_id=None):
+    """
+    Returns the ID of the Drive folder mirroring a local directory, creating
+    it (and its parents) if needed. IDs are cached in the manifest.
+
+    Parameters:
+    - manifest: SyncManifest of the uploaded folder
+    - rel_dir: str, directory relative to the uploaded folder ('' = itself)
+    - drive_folder_id: str, Drive folder the uploaded folder maps to (None = root)
+    """
+    if rel_dir == '':
+        return drive_folder_id
+    cached = manifest.folder_id(rel_dir)
+    if cached:
+        return cached
+
+    parent_id = ensure_drive_folder(manifest, os.path.dirname(rel_dir), drive_folder_id)
+    name = os.path.basename(rel_dir)
+    query = f"mimeType = '{FOLDER_MIMETYPE}' and name = '{name}' and trashed = false"
+    if parent_id:
+        query += f" and '{parent_id}' in parents"
+    request = get_service().files().list(q=query, spaces='drive', fields='files(id, name)')
+    folders = with_backoff(lambda: request.execute(http=thread_http())).get('files', [])
+    if folders:
+        folder_id = folders[0]['id']
+    else:
+        logger.info("Creating Drive folder %s", rel_dir)
+        metadata = {'name': name, 'mimeType': FOLDER_MIMETYPE}
+        if parent_id:
+            metadata['parents'] = [parent_id]
+        request = get_service().files().create(body=metadata, fields='id')
+        folder_id = with_backoff(lambda: request.execute(http=thread_http()))['id']
+
+    manifest.set_folder_id(rel_dir, folder_id)
+    manifest.save()
+    return folder_id
 
-# Build the Google Drive service
-service = build('drive', 'v3', credentials=credentials)
 
-def upload_files(folder_path, drive_folder_id=None):
-    """Upload all files in the specified folder to Google Drive."""
+def _resumable_session(manifest, rel_path, size, fingerprint):
+    """
+    Returns the session URI of an interrupted upload of exactly these bytes,
+    dropping a session that was uploading something else.
+    """
+    session = manifest.resumable_session(rel_path)
+    if session is None:
+        return None
+    if session[1] == size and session[2] == fingerprint:
+        return session[0]
+    manifest.clear_resumable(rel_path)
+    return None
 
-    # If drive_folder_id is None, upload to the root directory.
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            continue
-        file_path = os.path.join(folder_path, filename)
-        if os.path.isfile(file_path):
-            # Build the query to search for existing files
-            query = f"mimeType != 'application/vnd.google-apps.folder' and name = '{filename}' and trashed = false"
+
+def _query_resumable(resume_uri, size):
+    """
+    Asks Drive how much of an interrupted upload it already has: an empty
+    PUT to the session URI with 'Content-Range: bytes */<size>', answered
+    with 308 and a 'Range: bytes=0-<last byte>' header (none if Drive has
+    nothing yet), or with the finished upload's response.
+
+    Returns:
+    - (int, None): bytes Drive has, where the upload continues from
+    - (int, dict): the upload had already finished, with Drive's response
+    """
+    resp, content = thread_http().request(resume_uri, 'PUT', body=b'',
+                                          headers={'Content-Length': '0', 'Content-Range': f'bytes */{size}'})
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=resume_uri)
+    received = resp.get('range')
+    return (int(received.rsplit('-', 1)[1]) + 1 if received else 0), None
+
+
+def _run_resumable(request, manifest, rel_path, resume_uri, size, fingerprint):
+    """
+    Sends a resumable upload chunk by chunk, recording the session in the
+    manifest so the next run can continue it if this one is interrupted.
+
+    Returns:
+    - dict, Drive response of the finished upload
+    """
+    response = None
+    try:
+        if resume_uri:
+            offset, response = with_backoff(lambda: _query_resumable(resume_uri, size))
+            logger.info("Resuming interrupted upload of %s at byte %d of %d", rel_path, offset, size)
+            request.resumable_uri = resume_uri
+            request.resumable_progress = offset
+
+        while response is None:
+            # A failed chunk leaves the request in its error state, so the
+            # retry first asks Drive where to continue from
+            _, response = with_backoff(lambda: request.next_chunk(http=thread_http()))
+            if response is None and request.resumable_uri and request.resumable_uri != resume_uri:
+                resume_uri = request.resumable_uri
+                manifest.set_resumable(rel_path, resume_uri, size, fingerprint)
+                manifest.save()
+    except HttpError as e:
+        if e.resp.status in (404, 410):
+            # The upload session expired (sessions last about a week)
+            # or the Drive file was deleted. Start over next run.
+            manifest.clear_resumable(rel_path)
+            manifest.forget_drive_id(rel_path)
+            manifest.save()
+        raise
+    return response
+
+
+def upload_file(manifest, rel_path, file_path, drive_folder_id=None, stat=None):
+    """
+    Uploads one whole file with a chunked resumable upload, resuming the
+    session recorded in the manifest if the previous run was interrupted.
+
+    Parameters:
+    - manifest: SyncManifest of the folder
+    - rel_path: str, path relative to the uploaded folder (manifest key)
+    - file_path: str, local path of the file
+    - drive_folder_id: str, Drive folder to upload into (None = root)
+    - stat: os.stat_result of the file taken before the upload
+
+    Returns:
+    - str, Drive file ID
+    """
+    filename = os.path.basename(file_path)
+    stat = stat or os.stat(file_path)
+    size = stat.st_size
+    sha256 = file_sha256(file_path, size)
+    resume_uri = _resumable_session(manifest, rel_path, size, sha256)
+
+    file_id = manifest.entry(rel_path).get('drive_id') or find_drive_file(filename, drive_folder_id)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    with open(file_path, 'rb') as file:
+        media = MediaIoBaseUpload(RangeReader(file, 0, size), mimetype=mimetype,
+                                  chunksize=CHUNK_SIZE, resumable=True)
+        if file_id:
+            # File exists, update it
+            logger.info("File %s exists. Updating...", rel_path)
+            request = get_service().files().update(fileId=file_id, media_body=media, fields='id')
+        else:
+            logger.info("Uploading %s...", rel_path)
+            file_metadata = {'name': filename}
             if drive_folder_id:
-                query += f" and '{drive_folder_id}' in parents"
-
-            # Search for the file
-            response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-            files = response.get('files', [])
-
-            media = MediaFileUpload(file_path, resumable=True)
-
-            if files:
-                # File exists, update it
-                file_id = files[0]['id']
-                print(f'[{datetime.datetime.now()}] File {filename} exists. Updating...')
-                updated_file = service.files().update(fileId=file_id, media_body=media).execute()
-                print(f'{filename} updated successfully.')
-            else:
-                print(f'[{datetime.datetime.now()}] Uploading {filename}...')
-                file_metadata = {'name': filename}
-                if drive_folder_id:
-                    file_metadata['parents'] = [drive_folder_id]
-                service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-                print(f'{filename} uploaded successfully.')
+                file_metadata['parents'] = [drive_folder_id]
+            request = get_service().files().create(body=file_metadata, media_body=media, fields='id')
+        response = _run_resumable(request, manifest, rel_path, resume_uri, size, sha256)
 
-if __name__ == '__main__':
-    print(f'[{datetime.datetime.now()}] STARTING UPLOAD PYTHON SCRIPT.')
-    # Replace 'your/local/folder/path' with the path to your local folder
-    folder_to_upload = '/home/pi/smesh/snode/data' # Replace with the path to your data folder
+    manifest.mark_synced(rel_path, file_path, response['id'], stat=stat, sha256=sha256)
+    manifest.save()
+    logger.info("%s uploaded successfully (%d bytes).", rel_path, size)
+    return response['id']
+
+
+def upload_delta(manifest, rel_path, file_path, drive_folder_id=None, stat=None):
+    """
+    Uploads only the bytes appended to a file since the last run, as a new
+    part file next to the earlier parts. If the file was rewritten instead of
+    appended to (it shrank, or the bytes before the last offset changed), a
+    new generation starts from offset 0.
+
+    Parameters:
+    - manifest: SyncManifest of the folder
+    - rel_path: str, path relative to the uploaded folder (manifest key)
+    - file_path: str, local path of the file
+    - drive_folder_id: str, Drive folder to upload into (None = root)
+    - stat: os.stat_result of the file taken before the upload
+
+    Returns:
+    - int, number of bytes uploaded
+    """
+    filename = os.path.basename(file_path)
+    stat = stat or os.stat(file_path)
+    end = stat.st_size
+    entry = manifest.entry(rel_path)
+    generation = entry.get('delta_generation', 0)
+    offset = entry.get('delta_offset', 0)
 
-    # Optionally, specify the Google Drive folder ID where you want to upload the files
-    # If you leave drive_folder_id as None, files will be uploaded to the root directory
-    drive_folder_id = "1W3gRqD1Szc4eqjIz9ESWps5qM-8NQ2Qj"  # Replace with your folder ID if needed
+    if offset > end or (offset and tail_sha256(file_path, offset) != entry.get('delta_tail_sha256')):
+        logger.info("%s was rewritten, starting generation %d", rel_path, generation + 1)
+        generation += 1
+        offset = 0
+        manifest.reset_delta(rel_path)
+    if offset == end:
+        return 0
 
-    upload_files(folder_to_upload, drive_folder_id)
+    part_name = delta_part_name(filename, generation, offset)
+    fingerprint = f'{generation}:{offset}:{tail_sha256(file_path, end)}'
+    resume_uri = _resumable_session(manifest, rel_path, end, fingerprint)
+
+    logger.info("Uploading %d new bytes of %s as %s...", end - offset, rel_path, part_name)
+    with open(file_path, 'rb') as file:
+        media = MediaIoBaseUpload(RangeReader(file, offset, end), mimetype='application/octet-stream',
+                                  chunksize=CHUNK_SIZE, resumable=True)
+        file_metadata = {
+            'name': part_name,
+            'appProperties': {'source': filename, 'generation': str(generation),
+                              'offset': str(offset), 'length': str(end - offset)},
+        }
+        if drive_folder_id:
+            file_metadata['parents'] = [drive_folder_id]
+        request = get_service().files().create(body=file_metadata, media_body=media, fields='id')
+        response = _run_resumable(request, manifest, rel_path, resume_uri, end, fingerprint)
+
+    manifest.mark_delta_synced(rel_path, generation, end, tail_sha256(file_path, end), response['id'])
+    manifest.save()
+    logger.info("%s uploaded successfully.", part_name)
+    return end - offset
+
+
+class DriveTransport:
+    """
+    upload_queue transport that uploads to Google Drive, mirroring the local
+    directory tree (e.g. data-<timestamp>/<nodeid>/) under one Drive folder.
+    """
+
+    name = 'drive'
+    manifest_name = MANIFEST_NAME
+
+    def __init__(self, drive_folder_id=None):
+        """
+        Parameters:
+        - drive_folder_id: str, Drive folder to upload into (None = root)
+        """
+        self.drive_folder_id = drive_folder_id
+        self._folder_ids = {'': drive_folder_id}
+
+    def is_online(self):
+        return can_connect(*CONNECTIVITY_PROBE)
+
+    def is_offline_error(self, error):
+        # Network errors, and quota or server errors that outlasted the backoff
+        if isinstance(error, HttpError):
+            return is_retryable(error)
+        if isinstance(error, FileNotFoundError):
+            return False
+        return isinstance(error, (OSError, httplib2.HttpLib2Error, TransportError))
+
+    def prepare(self, manifest, rel_dirs):
+        # Create the mirrored Drive folders up front, from the draining
+        # thread only, so workers never race to create the same folder twice
+        for rel_dir in rel_dirs:
+            self._folder_ids[rel_dir] = ensure_drive_folder(manifest, rel_dir, self.drive_folder_id)
+
+    def upload(self, manifest, rel_path, file_path, stat, append_only):
+        folder_id = self._folder_ids[os.path.dirname(rel_path)]
+        if append_only:
+            return upload_delta(manifest, rel_path, file_path, folder_id, stat)
+        upload_file(manifest, rel_path, file_path, folder_id, stat)
+        return stat.st_size
+
+
+def upload_files(folder_path, drive_folder_id=None, delta=False, workers=DEFAULT_WORKERS, max_rate=None):
+    """
+    Upload new or changed files under the specified folder to Google Drive,
+    mirroring its directory tree (e.g. data-<timestamp>/<nodeid>/). Files are
+    recorded in the folder's upload queue first, so files that could not be
+    sent (e.g. no uplink) go out on a later run.
+
+    Parameters:
+    - folder_path: str, local folder to upload
+    - drive_folder_id: str, Drive folder to upload into (None = root)
+    - delta: bool, upload append-only files as parts holding only new bytes
+    - workers: int, files uploaded at the same time
+    - max_rate: float, average upload rate limit in bytes/s (None = unlimited)
+
+    Returns:
+    - dict summarizing the run (see upload_queue.sync), or None if another
+      upload of the folder is running
+    """
+    return sync(folder_path, DriveTransport(drive_folder_id), delta=delta, workers=workers, max_rate=max_rate)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Upload logger data to Google Drive.")
+    # Replace the default local folder and Drive folder ID as needed.
+    # If the Drive folder ID is empty, files will be uploaded to the root directory
+    parser.add_argument("--folder", default=DEFAULT_FOLDER, help="local folder to upload")
+    parser.add_argument("--drive-folder-id", default=DEFAULT_DRIVE_FOLDER_ID,
+                        help="Google Drive folder ID to upload into")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="files uploaded at the same time")
+    parser.add_argument("--delta", action="store_true",
+                        help="upload only the bytes appended to csv/log/archive files since the last run")
+    parser.add_argument("--max-rate", type=float, default=None,
+                        help="average upload rate limit in bytes/s, to leave bandwidth and I/O to the logger")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="keep running and upload every SECONDS, draining the queue whenever the uplink is back")
+    parser.add_argument("--log-level", default="INFO", choices=LOG_LEVELS, help="minimum level to log")
+    args = parser.parse_args()
 
+    setup_logging(args.log_level)
+    logger.info("STARTING UPLOAD PYTHON SCRIPT.")
+    drive = DriveTransport(args.drive_folder_id or None)
+    options = {'delta': args.delta, 'workers': args.workers, 'max_rate': args.max_rate}
+    if args.watch:
+        watch(args.folder, drive, args.watch, **options)
+    else:
+        sync(args.folder, drive, **options)
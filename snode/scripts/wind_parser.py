@@ -0,0 +1,282 @@
+"""
+Wind Sensor Line Parser
+
+Turns the text lines of the wind sensor into typed rows, so analyses no
+longer re-parse "<timestamp> - <line>" logs. Two line formats are understood:
+- NMEA 0183 MWV sentences, checksum verified:
+      $WIMWV,283.0,R,2.3,M,A*28
+  (angle, reference R/T, speed, unit K/M/N/S, status A valid / V void)
+- key=value lists, as sent by ultrasonic sensors in ASCII mode, e.g.
+      0R1,Dn=236D,Dm=283D,Dx=031D,Sn=0.0M,Sm=1.0M,Sx=2.2M
+      dir=283 speed=2.3 gust=4.0
+  Keys are matched case-insensitively against KEY_FIELDS; a trailing unit
+  letter converts speeds to m/s, and '#' (invalid reading) makes the value
+  None and the status V.
+
+Rows have the columns of WIND_HEADERS (datetime and fromNode, which is the
+serial port, then the wind fields; speeds in m/s, directions in degrees)
+and go to the same stores as the telemetry: hourly csv shards and/or a
+SQLite table. Lines that cannot be parsed raise ParseError; the serial
+logger writes them with the reason to a reject file.
+
+Command: python scripts/wind_parser.py <logfile>...
+from snode directory (parses "<timestamp> - <line>" logs of serial_log.py
+and prints the rows as csv)
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from log_writer import CSV_RECORD, TXT_RECORD
+from telemetry_schema import ROW_PREFIX
+
+WIND_KEY = 'windSensor'
+WIND_FIELDS = ['windDirection', 'windSpeed', 'windGust', 'windLull',
+               'windDirectionMin', 'windDirectionMax', 'reference', 'status']
+WIND_HEADERS = ROW_PREFIX + WIND_FIELDS
+
+# Speed units to m/s (NMEA unit field, or the letter after a key=value speed)
+SPEED_UNITS = {'M': 1.0, 'K': 1 / 3.6, 'N': 0.514444, 'S': 0.44704}
+
+# key=value keys (lower case) -> wind field
+KEY_FIELDS = {
+    'dm': 'windDirection', 'dir': 'windDirection', 'direction': 'windDirection', 'wd': 'windDirection',
+    'sm': 'windSpeed', 'speed': 'windSpeed', 'ws': 'windSpeed',
+    'sx': 'windGust', 'gust': 'windGust',
+    'sn': 'windLull', 'lull': 'windLull',
+    'dn': 'windDirectionMin', 'dx': 'windDirectionMax',
+}
+SPEED_FIELDS = {'windSpeed', 'windGust', 'windLull'}
+
+KEY_VALUE = re.compile(r'([A-Za-z]+)=([-+]?\d*\.?\d+)?([A-Za-z#]?)')
+
+# Readings outside these ranges are rejected as garbled
+MAX_SPEED = 100.0  # m/s
+MAX_DIRECTION = 360.0
+
+STATUS_VALID = 'A'
+STATUS_VOID = 'V'
+
+
+class ParseError(ValueError):
+    """
+    A line that is not a wind reading; the message is the reject reason.
+    """
+
+
+def _to_mps(speed, factor):
+    # mm/s resolution is plenty and keeps converted values short in csv
+    return speed if factor == 1.0 else round(speed * factor, 3)
+
+
+def _check(fields):
+    for field in SPEED_FIELDS:
+        value = fields.get(field)
+        if value is not None and not 0 <= value <= MAX_SPEED:
+            raise ParseError(f'{field} out of range')
+    for field in ('windDirection', 'windDirectionMin', 'windDirectionMax'):
+        value = fields.get(field)
+        if value is not None and not 0 <= value <= MAX_DIRECTION:
+            raise ParseError(f'{field} out of range')
+    return fields
+
+
+def parse_nmea(line):
+    """
+    Parses an MWV sentence into a dict of wind fields.
+    """
+    star = line.rfind('*')
+    if star < 0:
+        body = line[1:]
+    else:
+        body = line[1:star]
+        checksum = 0
+        for char in body.encode('ascii', errors='replace'):
+            checksum ^= char
+        try:
+            expected = int(line[star + 1:star + 3], 16)
+        except ValueError:
+            raise ParseError('bad checksum field')
+        if checksum != expected:
+            raise ParseError('checksum mismatch')
+
+    parts = body.split(',')
+    if not parts[0].endswith('MWV'):
+        raise ParseError(f'unsupported sentence {parts[0][:8]}')
+    if len(parts) < 6:
+        raise ParseError('truncated sentence')
+    angle, reference, speed, unit, status = parts[1:6]
+    try:
+        fields = {
+            'windDirection': float(angle) if angle else None,
+            'windSpeed': _to_mps(float(speed), SPEED_UNITS[unit]) if speed else None,
+            'reference': reference or None,
+            'status': status or None,
+        }
+    except (ValueError, KeyError):
+        raise ParseError('bad number or unit')
+    return _check(fields)
+
+
+def parse_key_values(line):
+    """
+    Parses a key=value line into a dict of wind fields.
+    """
+    fields = {}
+    void = False
+    for key, value, suffix in KEY_VALUE.findall(line):
+        field = KEY_FIELDS.get(key.lower())
+        if field is None:
+            continue
+        if suffix == '#':
+            fields[field] = None
+            void = True
+            continue
+        if not value:
+            raise ParseError(f'bad value for {key}')
+        number = float(value)
+        if field in SPEED_FIELDS:
+            if suffix:
+                factor = SPEED_UNITS.get(suffix.upper())
+                if factor is None:
+                    raise ParseError(f'unknown speed unit {suffix}')
+                number = _to_mps(number, factor)
+        elif number.is_integer():
+            number = int(number)
+        fields[field] = number
+    if not fields:
+        raise ParseError('no wind fields')
+    fields['status'] = STATUS_VOID if void else STATUS_VALID
+    return _check(fields)
+
+
+def parse_line(line):
+    """
+    Parses one line of the wind sensor.
+
+    Parameters:
+    - line: str, decoded line without the line ending
+
+    Returns:
+    - dict of wind field -> value (fields the line does not carry are absent)
+
+    Raises:
+    - ParseError, with the reason, if the line is not a wind reading
+    """
+    if line.startswith('$'):
+        return parse_nmea(line)
+    if '=' in line:
+        return parse_key_values(line)
+    raise ParseError('unknown format')
+
+
+def wind_row(timestamp, source, fields):
+    """
+    Returns the WIND_HEADERS row of a parsed line.
+    """
+    return [timestamp, source] + [fields.get(field) for field in WIND_FIELDS]
+
+
+################################################
+# serial_log Stage
+################################################
+
+class WindParserStage:
+    """
+    serial_log.py parsing stage: parses the lines of each read and queues
+    the rows for the hourly csv shards and/or the SQLite store, and the
+    malformed lines for the reject file.
+    """
+
+    def __init__(self, writer, output_dir, reject_path, store_writer=None, db_path=None, text_stage=None):
+        """
+        Parameters:
+        - writer: log_writer writer with a FileSink (csv shards and rejects)
+        - output_dir: str, directory of the hourly windSensor_<hour>.csv shards,
+          or None to not write csv
+        - reject_path: str, file for lines that could not be parsed
+        - store_writer: log_writer writer with a SQLiteSink, or None
+        - db_path: str, database of the store_writer
+        - text_stage: callable, also log the raw text (serial_log.LineLogger)
+        """
+        self.writer = writer
+        self.output_dir = output_dir
+        self.reject_path = reject_path
+        self.store_writer = store_writer
+        self.db_path = db_path
+        self.text_stage = text_stage
+        self.parsed = 0
+        self.dropped = 0
+        self.rejects = Counter()
+        self._hour = None
+        self._shard = None
+
+    def _shard_path(self, timestamp):
+        # timestamp is 'YYYY-MM-DD HH:MM:SS'; shards are named like sqlite_store.export_csv(hourly=True)
+        hour = timestamp[:13]
+        if hour != self._hour:
+            self._hour = hour
+            self._shard = os.path.join(self.output_dir, f'{WIND_KEY}_{hour[:10]}_{hour[11:13]}-00-00.csv')
+        return self._shard
+
+    def __call__(self, reader, timestamp, lines):
+        if self.text_stage is not None:
+            self.text_stage(reader, timestamp, lines)
+        source = os.path.basename(reader.port)
+        rejected = []
+        for line in lines:
+            try:
+                fields = parse_line(line)
+            except ParseError as e:
+                self.rejects[str(e)] += 1
+                rejected.append(f"{timestamp} - {source} - {e} - {line}")
+                continue
+            row = wind_row(timestamp, source, fields)
+            self.parsed += 1
+            if self.output_dir is not None:
+                if not self.writer.submit((CSV_RECORD, self._shard_path(timestamp), WIND_HEADERS, row)):
+                    self.dropped += 1
+            if self.store_writer is not None:
+                if not self.store_writer.submit((self.db_path, WIND_KEY, WIND_HEADERS, row)):
+                    self.dropped += 1
+        if rejected and not self.writer.submit((TXT_RECORD, self.reject_path, None, '\n'.join(rejected))):
+            self.dropped += len(rejected)
+
+    def stats(self):
+        return {'parsed': self.parsed, 'rejected': sum(self.rejects.values()),
+                'rejects_by_reason': dict(self.rejects), 'dropped': self.dropped}
+
+
+def iter_log_lines(path):
+    """
+    Yields (timestamp, line) from a "<timestamp> - <line>" log of serial_log.py.
+    """
+    with open(path, errors='replace') as file:
+        for text in file:
+            timestamp, sep, line = text.rstrip('\n').partition(' - ')
+            if sep:
+                yield timestamp, line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse wind sensor text logs into csv rows.")
+    parser.add_argument("logs", nargs='+', help="logfiles written by serial_log.py")
+    parser.add_argument("--source", default='', help="value of the fromNode column (e.g. ttyUSB0)")
+    args = parser.parse_args()
+
+    start = time.time()
+    out = csv.writer(sys.stdout)
+    out.writerow(WIND_HEADERS)
+    rejects = Counter()
+    for log_path in args.logs:
+        for timestamp, line in iter_log_lines(log_path):
+            try:
+                out.writerow(wind_row(timestamp, args.source, parse_line(line)))
+            except ParseError as e:
+                rejects[str(e)] += 1
+    print(f"Parsed in {time.time() - start:.1f} s, rejected {dict(rejects)}", file=sys.stderr)
@@ -0,0 +1,449 @@
+"""
+Query API over Stored Telemetry
+
+Answers "pm25Standard from node X between T1 and T2" without grepping
+through data-*/<nodeid>/airQualityMetrics_*.csv:
+
+    from snode.query import TelemetryStore
+
+    store = TelemetryStore(['data-2024-12-17_13-07-56'])
+    result = store.query('pm25Standard', node='0x1234abcd',
+                         start='2024-12-18 00:00', end='2024-12-19 00:00')
+    times, values = result.to_numpy()   # datetime64 and float64 arrays
+    frame = result.to_frame()           # datetime, fromNode, pm25Standard
+
+The store keeps a shard index: for every hourly csv shard written by the
+logger ('<telemetry>_<YYYY-MM-DD_HH-MM-SS>.csv', also gzipped) and every
+daily file of compact_shards.py ('<telemetry>_<YYYY-MM-DD>.parquet' or
+'.feather'), its columns, first and last datetime and the set of fromNode
+values. A query only opens the files whose columns contain the metric,
+whose time range overlaps the query and whose node set has the node.
+
+The index is saved as .shard_index.json in each data directory (hidden, so
+the uploader skips it). Files are re-scanned only when their size or mtime
+changed, so refreshing it after the logger appended a few rows is cheap.
+Results are lazy: nothing is read until to_numpy(), to_frame() or
+chunks() is called, and the columns read from a file are kept in a small
+cache for repeated (warm) queries.
+
+Point a store at raw data directories or at a compacted directory, not at
+both, or rows are counted twice.
+
+Command: python -m snode.query <data_dir>... --metric <metric> [--node <id>] [--start <t>] [--end <t>]
+from snode directory (prints the matching rows as csv)
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = '.shard_index.json'
+INDEX_VERSION = 1
+
+# Hourly shards of the logger and daily files of compact_shards.py
+SHARD_PATTERN = re.compile(r'^(?P<key>.+)_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.csv(\.gz)?$')
+COMPACTED_PATTERN = re.compile(r'^(?P<key>.+)_\d{4}-\d{2}-\d{2}\.(parquet|feather)$')
+
+# Columns of the files read from each shard, kept for warm queries
+DEFAULT_CACHE_ENTRIES = 256
+
+
+def node_key(node):
+    """
+    Normalizes a node id, so '0x1234abcd', '!1234abcd' and '1234abcd' (and
+    the int) all match. Ids that are not hex (e.g. the wind sensor's serial
+    port) are compared as given.
+    """
+    if isinstance(node, int):
+        return node
+    try:
+        return int(str(node).lstrip('!'), 16)
+    except ValueError:
+        return str(node)
+
+
+def time_key(value):
+    """
+    Returns a time bound in the logger's datetime format (str(datetime)),
+    which sorts like the time itself.
+    """
+    if value is None or isinstance(value, str) and not value:
+        return None
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value)
+    return str(pd.Timestamp(value).to_pydatetime())
+
+
+################################################
+# Shard Index
+################################################
+
+def scan_csv(path):
+    """
+    Reads the index entry of a csv shard: columns, rows, first and last
+    datetime and the fromNode values.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='', errors='replace') as file:
+        reader = csv.reader(file)
+        columns = next(reader, [])
+        time_col = columns.index('datetime') if 'datetime' in columns else None
+        node_col = columns.index('fromNode') if 'fromNode' in columns else None
+        first = last = None
+        nodes = set()
+        rows = 0
+        for row in reader:
+            rows += 1
+            if time_col is not None and len(row) > time_col and row[time_col]:
+                stamp = row[time_col]
+                if first is None or stamp < first:
+                    first = stamp
+                if last is None or stamp > last:
+                    last = stamp
+            if node_col is not None and len(row) > node_col:
+                nodes.add(row[node_col])
+    return {'columns': columns, 'rows': rows, 'start': first, 'end': last, 'nodes': sorted(nodes)}
+
+
+def scan_compacted(path):
+    """
+    Reads the index entry of a Parquet or Feather file.
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        columns = pq.read_schema(path).names
+        frame = pd.read_parquet(path, columns=[name for name in ('datetime', 'fromNode') if name in columns])
+    else:
+        frame = pd.read_feather(path)
+        columns = list(frame.columns)
+    times = frame['datetime'].dropna() if 'datetime' in frame.columns else pd.Series(dtype=object)
+    return {'columns': columns, 'rows': len(frame),
+            'start': str(times.min()) if len(times) else None,
+            'end': str(times.max()) if len(times) else None,
+            'nodes': sorted(str(node) for node in frame['fromNode'].dropna().unique())
+            if 'fromNode' in frame.columns else []}
+
+
+class ShardIndex:
+    """
+    file -> (telemetry type, columns, time range, node set) of one data
+    directory, persisted to <data_dir>/.shard_index.json.
+    """
+
+    def __init__(self, data_dir, persist=True):
+        """
+        Parameters:
+        - data_dir: str, logging directory (or compact_shards.py output)
+        - persist: bool, load and save the index file
+        """
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, INDEX_NAME) if persist else None
+        self.files = {}
+        # rel_path -> set of node_key() of the entry's nodes
+        self._node_keys = {}
+        self.scanned = 0
+        if self.path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            # A broken index only costs a re-scan
+            logger.warning("Ignoring unreadable index %s: %s", self.path, e)
+            return
+        if data.get('version') == INDEX_VERSION:
+            self.files = data.get('files', {})
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump({'version': INDEX_VERSION, 'files': self.files}, file, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Read-only data (e.g. a downloaded archive) still works, only cold
+            logger.warning("Could not save index %s: %s", self.path, e)
+
+    def refresh(self):
+        """
+        Scans new and changed files and forgets deleted ones.
+
+        Returns:
+        - int, number of files scanned
+        """
+        seen = set()
+        scanned = 0
+        for root, dirs, filenames in os.walk(self.data_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in filenames:
+                match = SHARD_PATTERN.match(filename) or COMPACTED_PATTERN.match(filename)
+                if match is None:
+                    continue
+                path = os.path.join(root, filename)
+                rel_path = os.path.relpath(path, self.data_dir)
+                seen.add(rel_path)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entry = self.files.get(rel_path)
+                if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                    continue
+                try:
+                    entry = scan_csv(path) if match.re is SHARD_PATTERN else scan_compacted(path)
+                except (OSError, ValueError, EOFError) as e:
+                    logger.warning("Skipping unreadable shard %s: %s", path, e)
+                    continue
+                entry.update({'telemetry': match['key'], 'size': stat.st_size, 'mtime': stat.st_mtime})
+                self.files[rel_path] = entry
+                self._node_keys.pop(rel_path, None)
+                scanned += 1
+        for rel_path in set(self.files) - seen:
+            del self.files[rel_path]
+            self._node_keys.pop(rel_path, None)
+        if scanned or len(seen) != len(self.files):
+            self.save()
+        self.scanned += scanned
+        return scanned
+
+    def select(self, metric, node=None, start=None, end=None):
+        """
+        Returns the (path, entry) of the files that can hold matching rows,
+        in time order.
+
+        Parameters:
+        - metric: str, column name, e.g. 'pm25Standard'
+        - node: node_key() of the node, or None for every node
+        - start, end: str, time_key() bounds (inclusive), or None
+        """
+        selected = []
+        for rel_path, entry in self.files.items():
+            if metric not in entry['columns'] or entry['start'] is None:
+                continue
+            if (start is not None and entry['end'] < start) or (end is not None and entry['start'] > end):
+                continue
+            if node is not None:
+                keys = self._node_keys.get(rel_path)
+                if keys is None:
+                    keys = self._node_keys[rel_path] = {node_key(name) for name in entry['nodes']}
+                if node not in keys:
+                    continue
+            selected.append((os.path.join(self.data_dir, rel_path), entry))
+        selected.sort(key=lambda item: item[1]['start'])
+        return selected
+
+
+################################################
+# Queries
+################################################
+
+class QueryResult:
+    """
+    The files selected for a query; rows are read when the result is used.
+    """
+
+    def __init__(self, store, metric, shards, node=None, start=None, end=None):
+        self.store = store
+        self.metric = metric
+        self.shards = shards
+        self.node = node
+        self.start = start
+        self.end = end
+
+    @property
+    def paths(self):
+        return [path for path, _ in self.shards]
+
+    def chunks(self):
+        """
+        Yields one DataFrame (datetime, fromNode, metric) per file, filtered
+        to the query, so long ranges can be processed file by file.
+        """
+        start = pd.Timestamp(self.start) if self.start is not None else None
+        end = pd.Timestamp(self.end) if self.end is not None else None
+        for path, entry in self.shards:
+            frame = self.store.read_columns(path, entry, self.metric)
+            mask = np.ones(len(frame), dtype=bool)
+            if start is not None:
+                mask &= (frame['datetime'] >= start).to_numpy(dtype=bool, na_value=False)
+            if end is not None:
+                mask &= (frame['datetime'] <= end).to_numpy(dtype=bool, na_value=False)
+            if self.node is not None:
+                mask &= self.store.node_mask(frame['fromNode'], self.node)
+            if mask.any():
+                yield frame[mask] if not mask.all() else frame
+
+    def to_frame(self):
+        """
+        Returns:
+        - pandas.DataFrame with datetime, fromNode and the metric, sorted by time
+        """
+        frames = list(self.chunks())
+        if not frames:
+            return pd.DataFrame({'datetime': pd.Series(dtype='datetime64[us]'),
+                                 'fromNode': pd.Series(dtype=object),
+                                 self.metric: pd.Series(dtype='float64')})
+        frame = pd.concat(frames, ignore_index=True)
+        return frame.sort_values('datetime', kind='stable', ignore_index=True)
+
+    def to_numpy(self):
+        """
+        Returns:
+        - (datetime64 array of times, float64 array of values), sorted by time
+        """
+        frame = self.to_frame()
+        return (frame['datetime'].to_numpy(dtype='datetime64[us]'),
+                pd.to_numeric(frame[self.metric], errors='coerce').to_numpy(dtype='float64', na_value=np.nan))
+
+
+class TelemetryStore:
+    """
+    Shard indexes of one or more data directories plus a cache of the
+    columns read from them.
+    """
+
+    def __init__(self, data_dirs, persist_index=True, cache_entries=DEFAULT_CACHE_ENTRIES):
+        """
+        Parameters:
+        - data_dirs: str or list of str, logging directories or compacted directories
+        - persist_index: bool, keep the index in <data_dir>/.shard_index.json
+        - cache_entries: int, (file, metric) column sets kept in memory
+        """
+        if isinstance(data_dirs, str):
+            data_dirs = [data_dirs]
+        self.indexes = [ShardIndex(data_dir, persist_index) for data_dir in data_dirs]
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshed = False
+        self.files_read = 0
+        self.cache_hits = 0
+
+    def refresh(self):
+        """
+        Brings the shard indexes up to date; call again to pick up new rows.
+        """
+        scanned = sum(index.refresh() for index in self.indexes)
+        self._refreshed = True
+        return scanned
+
+    def query(self, metric, node=None, start=None, end=None, refresh=False):
+        """
+        Selects the rows of one metric.
+
+        Parameters:
+        - metric: str, column name, e.g. 'pm25Standard' or 'temperature'
+        - node: str or int, fromNode of the sending node, or None for all nodes
+        - start, end: datetime, str or epoch seconds, inclusive bounds, or None
+        - refresh: bool, re-scan changed files first (the first query always does)
+
+        Returns:
+        - QueryResult
+        """
+        if refresh or not self._refreshed:
+            self.refresh()
+        node = node_key(node) if node is not None else None
+        start, end = time_key(start), time_key(end)
+        shards = []
+        for index in self.indexes:
+            shards += index.select(metric, node, start, end)
+        shards.sort(key=lambda item: item[1]['start'])
+        return QueryResult(self, metric, shards, node, start, end)
+
+    def nodes(self, metric=None):
+        """
+        Returns the fromNode values seen, optionally only where metric is logged.
+        """
+        if not self._refreshed:
+            self.refresh()
+        return sorted({node for index in self.indexes for entry in index.files.values()
+                       if metric is None or metric in entry['columns'] for node in entry['nodes']})
+
+    @staticmethod
+    def node_mask(nodes, node):
+        """
+        Returns the rows of a fromNode column that are node (a node_key()).
+        """
+        spellings = [value for value in nodes.dropna().unique() if node_key(value) == node]
+        return nodes.isin(spellings).to_numpy(dtype=bool)
+
+    def read_columns(self, path, entry, metric):
+        """
+        Returns datetime, fromNode and metric of a file, from the cache when
+        the file has not changed since it was read.
+        """
+        key = (path, entry['size'], entry['mtime'], metric)
+        with self._lock:
+            frame = self._cache.get(key)
+            if frame is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return frame
+
+        columns = [name for name in ('datetime', 'fromNode', metric) if name in entry['columns']]
+        if path.endswith('.parquet'):
+            frame = pd.read_parquet(path, columns=columns)
+        elif path.endswith('.feather'):
+            frame = pd.read_feather(path, columns=columns)
+        else:
+            frame = pd.read_csv(path, usecols=columns, dtype={'fromNode': str, 'datetime': str},
+                                on_bad_lines='skip')
+            frame['datetime'] = pd.to_datetime(frame['datetime'], format='ISO8601', errors='coerce')
+            values = frame.get(metric)
+            if values is not None and not pd.api.types.is_numeric_dtype(values):
+                # A garbled value made the column text; keep it text only if
+                # most values are (e.g. a status letter)
+                numbers = pd.to_numeric(values, errors='coerce')
+                if numbers.count() * 2 >= values.count():
+                    frame[metric] = numbers
+        self.files_read += 1
+
+        with self._lock:
+            self._cache[key] = frame
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return frame
+
+    def stats(self):
+        return {'files_indexed': sum(len(index.files) for index in self.indexes),
+                'files_scanned': sum(index.scanned for index in self.indexes),
+                'files_read': self.files_read, 'cache_hits': self.cache_hits,
+                'cached': len(self._cache)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query stored telemetry by metric, node and time.")
+    parser.add_argument("data_dirs", nargs='+', help="logging directories or compacted directories")
+    parser.add_argument("--metric", required=True, help="column to select, e.g. pm25Standard")
+    parser.add_argument("--node", default=None, help="fromNode of the sending node, e.g. 0x1234abcd")
+    parser.add_argument("--start", default=None, help="first time, e.g. '2024-12-17 13:00'")
+    parser.add_argument("--end", default=None, help="last time")
+    args = parser.parse_args()
+
+    begin = time.time()
+    store = TelemetryStore(args.data_dirs)
+    result = store.query(args.metric, args.node, args.start, args.end)
+    frame = result.to_frame()
+    frame.to_csv(sys.stdout, index=False)
+    print(f"{len(frame)} rows from {len(result.shards)} of {store.stats()['files_indexed']} files "
+          f"in {time.time() - begin:.2f} s", file=sys.stderr)
@@ -0,0 +1,118 @@
+"""
+Tests of the alert rules: threshold durations and re-arming, the slope of
+rate rules, late values, and values deferred by the evaluation budget.
+
+Command: python -m pytest tests/test_alerts.py
+from snode directory
+"""
+
+import pytest
+
+from alerts import AlertEngine, SlopeWindow, build_rule
+
+NODE = '0x0a1b2c3d'
+START = 1734400000.0
+
+
+def feed(engine, metric, series, node=NODE, section='environmentMetrics'):
+    """
+    Evaluates (seconds after START, value) pairs and returns the alerts.
+    """
+    alerts = []
+    for offset, value in series:
+        measured = START + offset
+        alerts += engine.evaluate(node, {'time': measured, section: {metric: value}}, {}, now=measured)
+    return alerts
+
+
+def engine_of(*specs, budget_us=float('inf')):
+    return AlertEngine([build_rule(spec) for spec in specs], budget_us=budget_us)
+
+
+################################################
+# Threshold Rules
+################################################
+
+def test_threshold_fires_after_its_duration_once_and_rearms():
+    engine = engine_of({'name': 'pm25-high', 'metric': 'pm25Standard', 'above': 150, 'for': 300})
+    # Over the threshold from 0 s: not yet at 240 s, at 300 s, not again after
+    assert feed(engine, 'pm25Standard', [(0, 160), (120, 170), (240, 180)]) == []
+    alerts = feed(engine, 'pm25Standard', [(300, 190), (360, 200), (600, 210)])
+    assert [alert['value'] for alert in alerts] == [190]
+    assert alerts[0]['rule'] == 'pm25-high'
+    assert alerts[0]['fromNode'] == NODE
+
+    # Cleared, then over again: the duration counts from the new run
+    assert feed(engine, 'pm25Standard', [(660, 100), (720, 160), (960, 160)]) == []
+    assert [alert['value'] for alert in feed(engine, 'pm25Standard', [(1020, 165)])] == [165]
+
+
+def test_threshold_below_and_node_filter():
+    engine = engine_of({'name': 'cold', 'metric': 'temperature', 'below': 0, 'nodes': [NODE]})
+    assert feed(engine, 'temperature', [(0, -1.0)], node='0xffffffff') == []
+    assert [alert['value'] for alert in feed(engine, 'temperature', [(0, -1.0), (60, -2.0)])] == [-1.0]
+
+
+################################################
+# Rate Rules
+################################################
+
+def test_slope_of_a_linear_series():
+    window = SlopeWindow('temperature', 300)
+    # 1.5 degrees per minute, a value every 30 s
+    for offset in range(0, 601, 30):
+        window.update(NODE, 20 + 1.5 * offset / 60, START + offset)
+    assert window.per_minute(NODE) == pytest.approx(1.5)
+
+
+def test_slope_needs_half_a_window():
+    window = SlopeWindow('temperature', 300)
+    for offset in range(0, 121, 30):
+        window.update(NODE, 20 + offset / 60, START + offset)
+    assert window.per_minute(NODE) is None
+
+
+def test_rate_rule_fires_once_while_rising():
+    engine = engine_of({'name': 'rising', 'metric': 'temperature', 'rising': 2.0, 'window': 300})
+    # Flat for 5 minutes, then 3 degrees per minute
+    series = [(offset, 20.0) for offset in range(0, 300, 30)]
+    series += [(offset, 20 + 3 * (offset - 300) / 60) for offset in range(300, 901, 30)]
+    alerts = feed(engine, 'temperature', series)
+    assert len(alerts) == 1
+    assert alerts[0]['rule'] == 'rising'
+
+
+def test_late_value_resets_the_rate_window():
+    window = SlopeWindow('temperature', 300)
+    for offset in range(0, 301, 30):
+        window.update(NODE, 20 + 2 * offset / 60, START + offset)
+    assert window.per_minute(NODE) == pytest.approx(2.0)
+
+    # A packet from a minute ago: no estimate, and it is not fitted
+    window.update(NODE, 100.0, START + 240)
+    assert window.per_minute(NODE) is None
+    window.update(NODE, 20 + 2 * 330 / 60, START + 330)
+    assert window.per_minute(NODE) == pytest.approx(2.0)
+
+
+################################################
+# Evaluation Budget
+################################################
+
+def test_deferred_values_give_the_same_alerts_after_drain():
+    specs = [{'name': 'pm25-high', 'metric': 'pm25Standard', 'above': 150, 'for': 120},
+             {'name': 'pm25-rising', 'metric': 'pm25Standard', 'rising': 5, 'window': 300},
+             {'name': 'pm25-very-high', 'metric': 'pm25Standard', 'above': 250}]
+    series = [(offset, 50 + offset / 6) for offset in range(0, 1801, 30)]
+    series += [(offset, 40.0) for offset in range(1830, 2401, 30)]
+
+    unlimited = engine_of(*specs)
+    expected = feed(unlimited, 'pm25Standard', series) + unlimited.drain()
+    assert {alert['rule'] for alert in expected} == {'pm25-high', 'pm25-rising', 'pm25-very-high'}
+
+    tight = engine_of(*specs, budget_us=0)
+    assert feed(tight, 'pm25Standard', series) == []
+    assert tight.stats()['waiting'] == len(series)
+    assert tight.drain() == expected
+    assert tight.stats()['waiting'] == 0
+    assert tight.stats()['deferred_dropped'] == 0
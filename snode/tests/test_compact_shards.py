@@ -0,0 +1,105 @@
+"""
+Tests of the incremental compaction of hourly csv shards: days whose shards
+were deleted or gzipped by the storage governor keep taking new shards.
+
+Command: python -m pytest tests/test_compact_shards.py
+from snode directory
+"""
+
+import csv
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from compact_shards import compact, read_frame, MANIFEST_NAME  # noqa: E402
+from storage_governor import gzip_file  # noqa: E402
+
+HEADERS = ['datetime', 'fromNode', 'pm25Standard', 'temperature']
+SESSION = 'data-2024-12-17_04-55-00'
+GROUP = f'{SESSION}/a1b2/airQualityMetrics_2024-12-17'
+
+
+def write_shard(node_dir, hour, rows=3):
+    """
+    Writes the shard of one hour and returns its path.
+    """
+    path = os.path.join(node_dir, f'airQualityMetrics_2024-12-17_{hour:02d}-00-00.csv')
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS)
+        for minute in range(rows):
+            writer.writerow([f'2024-12-17 {hour:02d}:{minute:02d}:00.500000', '0x0a1b2c3d',
+                             hour * 10 + minute, 20.5])
+    return path
+
+
+@pytest.fixture
+def session(tmp_path):
+    node_dir = tmp_path / SESSION / 'a1b2'
+    node_dir.mkdir(parents=True)
+    return str(tmp_path / SESSION), str(node_dir), str(tmp_path / 'compacted')
+
+
+def compacted_hours(output_dir):
+    frame = read_frame(os.path.join(output_dir, f'{GROUP}.parquet'))
+    return [timestamp.hour for timestamp in frame['datetime']]
+
+
+def test_unchanged_day_is_not_rewritten(session):
+    data_dir, node_dir, output_dir = session
+    write_shard(node_dir, 5)
+    assert compact([data_dir], output_dir, min_age=0)['written'] == 1
+    result = compact([data_dir], output_dir, min_age=0)
+    assert (result['written'], result['unchanged']) == (0, 1)
+
+
+def test_new_shard_after_a_shard_was_deleted(session):
+    data_dir, node_dir, output_dir = session
+    first = write_shard(node_dir, 5)
+    write_shard(node_dir, 6)
+    compact([data_dir], output_dir, min_age=0)
+
+    # Deleted after upload, then the next hour arrives
+    os.remove(first)
+    write_shard(node_dir, 7)
+    result = compact([data_dir], output_dir, min_age=0)
+    assert (result['written'], result['merged'], result['shards']) == (1, 1, 1)
+    assert compacted_hours(output_dir) == [5] * 3 + [6] * 3 + [7] * 3
+
+    # Nothing new: the file is kept as it is
+    result = compact([data_dir], output_dir, min_age=0)
+    assert (result['written'], result['kept']) == (0, 1)
+    assert compacted_hours(output_dir) == [5] * 3 + [6] * 3 + [7] * 3
+
+
+def test_gzipped_shard_is_the_same_shard(session):
+    data_dir, node_dir, output_dir = session
+    first = write_shard(node_dir, 5)
+    write_shard(node_dir, 6)
+    compact([data_dir], output_dir, min_age=0)
+
+    gzip_file(first)
+    result = compact([data_dir], output_dir, min_age=0)
+    assert (result['written'], result['unchanged']) == (0, 1)
+
+    write_shard(node_dir, 7)
+    result = compact([data_dir], output_dir, min_age=0)
+    assert result['written'] == 1
+    assert compacted_hours(output_dir) == [5] * 3 + [6] * 3 + [7] * 3
+
+
+def test_gzipped_and_deleted_shards(session):
+    data_dir, node_dir, output_dir = session
+    first = write_shard(node_dir, 5)
+    second = write_shard(node_dir, 6)
+    compact([data_dir], output_dir, min_age=0)
+
+    os.remove(first)
+    gzip_file(second)
+    write_shard(node_dir, 7)
+    result = compact([data_dir], output_dir, min_age=0)
+    assert (result['merged'], result['shards']) == (1, 1)
+    assert compacted_hours(output_dir) == [5] * 3 + [6] * 3 + [7] * 3
+    assert os.path.exists(os.path.join(output_dir, MANIFEST_NAME))
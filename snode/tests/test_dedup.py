@@ -0,0 +1,55 @@
+"""
+Tests of the duplicate packet cache: the time window, the size bound, and
+packets without an id.
+
+Command: python -m pytest tests/test_dedup.py
+from snode directory
+"""
+
+from dedup import DedupCache
+
+NODE = 0x0a1b2c3d
+
+
+def test_copies_within_the_window_are_duplicates():
+    cache = DedupCache(window_seconds=60)
+    assert not cache.is_duplicate(NODE, 1, now=0)
+    assert cache.is_duplicate(NODE, 1, now=30)
+    assert cache.is_duplicate(NODE, 1, now=60)
+    # Other sender, other id
+    assert not cache.is_duplicate(NODE + 1, 1, now=30)
+    assert not cache.is_duplicate(NODE, 2, now=30)
+    assert cache.duplicate_counts() == {hex(NODE): 2}
+    assert cache.stats()['duplicates'] == 2
+
+
+def test_ids_expire_after_the_window():
+    cache = DedupCache(window_seconds=60)
+    cache.is_duplicate(NODE, 1, now=0)
+    cache.is_duplicate(NODE, 2, now=50)
+    # A duplicate does not refresh its id
+    assert cache.is_duplicate(NODE, 1, now=55)
+    assert not cache.is_duplicate(NODE, 3, now=100)
+    assert len(cache) == 2
+    # Reused after the window: a new packet
+    assert not cache.is_duplicate(NODE, 1, now=100)
+    assert cache.stats()['evicted'] == 0
+
+
+def test_size_is_bounded():
+    cache = DedupCache(window_seconds=600, max_entries=3)
+    for packet_id in range(1, 6):
+        assert not cache.is_duplicate(NODE, packet_id, now=packet_id)
+    assert len(cache) == 3
+    assert cache.stats()['evicted'] == 2
+    # Evicted ids are forgotten, the newest are kept
+    assert not cache.is_duplicate(NODE, 1, now=10)
+    assert cache.is_duplicate(NODE, 5, now=10)
+
+
+def test_packets_without_an_id_are_never_duplicates():
+    cache = DedupCache()
+    assert not cache.is_duplicate(NODE, 0, now=0)
+    assert not cache.is_duplicate(NODE, 0, now=1)
+    assert not cache.is_duplicate(None, 7, now=1)
+    assert cache.stats()['checked'] == 0
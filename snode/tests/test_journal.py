@@ -0,0 +1,220 @@
+"""
+Tests of the write-ahead journal: a power cut at every byte of the journal,
+files the sink fails to write, and recovery of files that cannot be written.
+
+Command: python -m pytest tests/test_journal.py
+from snode directory
+"""
+
+import csv
+import os
+import random
+
+import pytest
+
+from journal import JournaledSink, recover, read_entries, ENTRY_RECORD, JOURNAL_SUFFIX
+from log_writer import FileSink, CSV_RECORD
+
+HEADERS = ['datetime', 'fromNode', 'pm25Standard', 'temperature']
+
+
+def make_batches(file_paths, n_batches, batch_size, rng, first=0):
+    batches = []
+    for b in range(n_batches):
+        batch = []
+        for i in range(batch_size):
+            n = first + b * batch_size + i
+            row = [f'2024-12-01 00:{n // 60 % 60:02d}:{n % 60:02d}', f'0x{rng.getrandbits(32):08x}',
+                   round(rng.uniform(0, 300), 1), round(rng.uniform(-10, 45), 2)]
+            batch.append((CSV_RECORD, rng.choice(file_paths), HEADERS, row))
+        batches.append(batch)
+    return batches
+
+
+def read_bytes(path):
+    try:
+        with open(path, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def put_bytes(path, data):
+    if data is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def csv_rows(path):
+    """
+    Returns the rows of a csv file ([] if it does not exist), or None if a
+    row is torn.
+    """
+    data = read_bytes(path)
+    if data is None:
+        return []
+    if data and not data.endswith(b'\r\n'):
+        return None
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    if any(len(row) != len(HEADERS) for row in rows):
+        return None
+    return rows
+
+
+def record_rows(records):
+    return [[str(value) for value in record[3]] for record in records]
+
+
+################################################
+# Power Cuts
+################################################
+
+@pytest.fixture(scope='module')
+def journaled_run(tmp_path_factory):
+    """
+    Rows up to a checkpoint, then batches that are only journaled (one of
+    the files is new after the checkpoint). Returns the files and journal
+    after each batch.
+    """
+    work_dir = tmp_path_factory.mktemp('crash')
+    rng = random.Random(0)
+    data_dir = work_dir / 'data'
+    data_dir.mkdir()
+    paths = [str(data_dir / f'telemetry_{i}.csv') for i in range(2)]
+    new_path = str(data_dir / 'telemetry_new.csv')
+    journal_path = str(work_dir / 'journal' / f'files-0{JOURNAL_SUFFIX}')
+
+    sink = JournaledSink(FileSink(), journal_path)
+    for batch in make_batches(paths, 2, 3, rng):
+        sink.write_batch(batch)
+        sink.flush()
+    sink.flush(fsync=True)
+    outputs = paths + [new_path]
+    durable = {path: read_bytes(path) for path in outputs}
+    durable_rows = {path: csv_rows(path) if durable[path] is not None else None for path in outputs}
+    states = [(0, dict(durable))]
+    for batch in make_batches(outputs, 3, 3, rng, first=6):
+        sink.write_batch(batch)
+        sink.flush()
+        states.append((os.path.getsize(journal_path), {path: read_bytes(path) for path in outputs}))
+    return {'outputs': outputs, 'durable': durable, 'durable_rows': durable_rows, 'states': states,
+            'journal': read_bytes(journal_path), 'journal_path': journal_path}
+
+
+@pytest.mark.parametrize('variant', ['checkpoint', 'written', 'torn'])
+def test_power_cut_at_every_byte(journaled_run, variant):
+    """
+    A cut at byte k leaves the journal cut at k and each file anywhere
+    between its checkpoint and its rows of the batches committed before k.
+    Recovery must leave the checkpointed rows followed by every row with a
+    complete journal record, and recovering twice must change nothing.
+    """
+    rng = random.Random(variant)
+    outputs = journaled_run['outputs']
+    durable = journaled_run['durable']
+    journal = journaled_run['journal']
+    journal_path = journaled_run['journal_path']
+    journal_dir = os.path.dirname(journal_path)
+    durable_rows = journaled_run['durable_rows']
+    for k in range(len(journal) + 1):
+        # Rows only reach a file after their batch is committed
+        written = [state for journal_size, state in journaled_run['states'] if journal_size <= k][-1]
+        put_bytes(journal_path, journal[:k])
+        records = [tuple(entry[1]) for entry in read_entries(journal_path)[0] if entry[0] == ENTRY_RECORD]
+        for path in outputs:
+            data = durable[path] if variant == 'checkpoint' else written[path]
+            if variant == 'torn' and data is not None:
+                data = data[:rng.randint(len(durable[path] or b''), len(data))]
+            put_bytes(path, data)
+
+        recover(journal_dir)
+        first = {path: read_bytes(path) for path in outputs}
+        # A power cut during recovery, before the journal was removed
+        put_bytes(journal_path, journal[:k])
+        recover(journal_dir)
+
+        assert not os.path.exists(journal_path)
+        for path in outputs:
+            rows = record_rows(record for record in records if record[1] == path)
+            if durable_rows[path] is None:
+                expected = [HEADERS] + rows if rows else []
+            else:
+                expected = durable_rows[path] + rows
+            assert csv_rows(path) == expected, f"cut at byte {k}"
+            assert read_bytes(path) == first[path], f"cut at byte {k}"
+
+
+################################################
+# Failed Writes
+################################################
+
+def test_failed_records_survive_checkpoint(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    good = str(data_dir / 'good.csv')
+    missing = str(tmp_path / 'missing' / 'x.csv')
+    journal_path = str(tmp_path / 'journal' / f'files-0{JOURNAL_SUFFIX}')
+    batch = make_batches([good, missing], 1, 8, random.Random(1))[0]
+    batch[0] = (CSV_RECORD, missing, HEADERS, batch[0][3])
+    failed_records = [record for record in batch if record[1] == missing]
+
+    sink = JournaledSink(FileSink(), journal_path)
+    assert sink.write_batch(batch) == failed_records
+    sink.flush(fsync=True)
+    # The good file is checkpointed, the failed one stays in the journal
+    entries = read_entries(journal_path)[0]
+    assert [tuple(entry[1]) for entry in entries if entry[0] == ENTRY_RECORD] == failed_records
+    assert sink.stats()['failed_files'] == 1
+
+    # Once its directory is back, the next checkpoint writes it again
+    os.makedirs(os.path.dirname(missing))
+    sink.flush(fsync=True)
+    assert csv_rows(missing) == [HEADERS] + record_rows(failed_records)
+    assert csv_rows(good) == [HEADERS] + record_rows(record for record in batch if record[1] == good)
+    assert os.path.getsize(journal_path) == 0
+    assert sink.stats()['repaired'] == len(failed_records)
+    sink.close()
+    assert not os.path.exists(journal_path)
+
+
+def test_failed_records_replayed_at_recovery(tmp_path):
+    missing = str(tmp_path / 'missing' / 'x.csv')
+    journal_path = str(tmp_path / 'journal' / f'files-0{JOURNAL_SUFFIX}')
+    batch = make_batches([missing], 1, 4, random.Random(2))[0]
+
+    sink = JournaledSink(FileSink(), journal_path)
+    sink.write_batch(batch)
+    sink.close()
+    # Kept for the next start, which finds the directory back
+    assert os.path.exists(journal_path)
+    os.makedirs(os.path.dirname(missing))
+    summary = recover(os.path.dirname(journal_path))
+    assert summary['records'] == len(batch)
+    assert csv_rows(missing) == [HEADERS] + record_rows(batch)
+
+
+def test_recover_skips_unwritable_files(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    good = str(data_dir / 'good.csv')
+    gone = str(tmp_path / 'gone' / 'x.csv')
+    journal_path = str(tmp_path / 'journal' / f'files-0{JOURNAL_SUFFIX}')
+    os.makedirs(os.path.dirname(gone))
+    batch = make_batches([good, gone], 1, 8, random.Random(3))[0]
+
+    sink = JournaledSink(FileSink(), journal_path)
+    sink.write_batch(batch)
+    sink.flush()
+    # Power cut, then the session directory is deleted before the restart
+    os.remove(gone)
+    os.rmdir(os.path.dirname(gone))
+    summary = recover(os.path.dirname(journal_path))
+    skipped = [record for record in batch if record[1] == gone]
+    assert summary['skipped'] == len(skipped)
+    assert summary['records'] == len(batch) - len(skipped)
+    assert csv_rows(good) == [HEADERS] + record_rows(record for record in batch if record[1] == good)
+    assert not os.path.exists(journal_path)
@@ -0,0 +1,128 @@
+"""
+Tests of the live feed's ring buffer: clients behind the ring skip ahead,
+and a reconnect resumes after its Last-Event-ID.
+
+Command: python -m pytest tests/test_live_feed.py
+from snode directory
+"""
+
+import json
+import socket
+import time
+
+import pytest
+
+from live_feed import LiveFeed
+
+NODE = '0x0a1b2c3d'
+
+
+def publish(feed, count):
+    for n in range(count):
+        feed.publish(NODE, {'airQualityMetrics': {'pm25Standard': n}}, curr_date_time=f'2024-12-17 04:55:{n:02d}')
+
+
+def seqs(events):
+    return [entry[0] for entry in events]
+
+
+################################################
+# Ring Buffer
+################################################
+
+def test_events_after_a_sequence_number():
+    feed = LiveFeed(buffer_events=8)
+    assert feed._events_after(0) == ([], 0)
+    publish(feed, 5)
+    events, skipped = feed._events_after(2)
+    assert (seqs(events), skipped) == ([3, 4, 5], 0)
+    assert events[0][1]['sections'] == {'airQualityMetrics': {'pm25Standard': 2}}
+    assert feed._events_after(5) == ([], 0)
+
+
+def test_client_behind_the_ring_skips_ahead():
+    feed = LiveFeed(buffer_events=8)
+    publish(feed, 20)
+    # Events 1-12 left the ring: a client at 3 misses 4-12
+    events, skipped = feed._events_after(3)
+    assert (seqs(events), skipped) == (list(range(13, 21)), 9)
+    assert feed.stats()['buffered'] == 8
+
+
+def test_latest_values_per_node():
+    feed = LiveFeed()
+    publish(feed, 3)
+    feed.publish(NODE, {'environmentMetrics': {'temperature': 21.5}}, curr_date_time='2024-12-17 04:56:00')
+    assert feed.latest() == {NODE: {
+        'airQualityMetrics': {'pm25Standard': 2, 'datetime': '2024-12-17 04:55:02'},
+        'environmentMetrics': {'temperature': 21.5, 'datetime': '2024-12-17 04:56:00'}}}
+
+
+################################################
+# Streams
+################################################
+
+def read_events(sock, count, timeout=5.0):
+    """
+    Reads SSE events from a socket until count have arrived.
+    """
+    data = b''
+    deadline = time.monotonic() + timeout
+    while data.count(b'event: telemetry') < count and time.monotonic() < deadline:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    events = []
+    for block in data.split(b'\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.decode().splitlines() if ': ' in line)
+        if fields.get('event') == 'telemetry':
+            events.append((int(fields['id']), json.loads(fields['data'])))
+    return events
+
+
+@pytest.fixture
+def feed():
+    feed = LiveFeed(buffer_events=8).start(host='127.0.0.1', port=0)
+    yield feed
+    feed.close()
+
+
+def connect(feed, last_id=None):
+    sock = socket.create_connection(('127.0.0.1', feed.port), timeout=5)
+    request = 'GET /events HTTP/1.1\r\nHost: localhost\r\n'
+    if last_id is not None:
+        request += f'Last-Event-ID: {last_id}\r\n'
+    sock.sendall((request + '\r\n').encode())
+    return sock
+
+
+def wait_for_clients(feed, count):
+    deadline = time.monotonic() + 5
+    while feed.stats()['clients'] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_reconnect_resumes_after_last_event_id(feed):
+    publish(feed, 5)
+    with connect(feed, last_id=2) as sock:
+        events = read_events(sock, 3)
+    assert [seq for seq, _ in events] == [3, 4, 5]
+    assert [event['sections']['airQualityMetrics']['pm25Standard'] for _, event in events] == [2, 3, 4]
+
+
+def test_new_client_starts_with_the_next_event(feed):
+    publish(feed, 5)
+    with connect(feed) as sock:
+        wait_for_clients(feed, 1)
+        publish(feed, 2)
+        events = read_events(sock, 2)
+    assert [seq for seq, _ in events] == [6, 7]
+
+
+def test_reconnect_behind_the_ring_is_skipped_ahead(feed):
+    publish(feed, 20)
+    with connect(feed, last_id=3) as sock:
+        events = read_events(sock, 8)
+    assert [seq for seq, _ in events] == list(range(13, 21))
+    assert feed.stats()['skipped'] == 9
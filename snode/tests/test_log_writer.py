@@ -0,0 +1,88 @@
+"""
+Tests of the batched and sharded writers: flush requests, and concurrent
+producers with files that fail in the same batches as good ones (the core
+check of stress_writers.py).
+
+Command: python -m pytest tests/test_log_writer.py
+from snode directory
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from log_writer import BatchedWriter, FileSink, CSV_RECORD, FSYNC_NEVER
+from stress_writers import MISSING_DIR, make_writer, producer_records
+
+
+################################################
+# Flush Requests
+################################################
+
+def test_flush_without_timeout_waits_for_the_writer(tmp_path):
+    path = str(tmp_path / 'x.csv')
+    writer = BatchedWriter(FileSink(), batch_size=100, flush_interval=60).start()
+    writer.submit((CSV_RECORD, path, ['a'], [1]))
+    assert writer.flush()
+    assert writer.stats()['written'] == 1
+    writer.close()
+
+
+def test_flush_with_zero_timeout_never_waits_on_a_full_queue(tmp_path):
+    # Not started: nothing drains the queue
+    writer = BatchedWriter(FileSink(), max_queue=1)
+    assert writer.submit((CSV_RECORD, str(tmp_path / 'x.csv'), ['a'], [1]))
+    start = time.monotonic()
+    assert not writer.flush(timeout=0)
+    assert time.monotonic() - start < 0.5
+
+
+################################################
+# Concurrent Producers
+################################################
+
+def lines_on_disk(path):
+    with open(path) as file:
+        lines = sum(1 for _ in file)
+    return lines - 1 if path.endswith('.csv') else lines
+
+
+@pytest.mark.parametrize('design', ['batched', 'sharded'])
+@pytest.mark.parametrize('failing_every', [0, 1, 7])
+def test_concurrent_producers(tmp_path, design, failing_every):
+    producers, n_packets = 4, 2000
+    records = [list(producer_records(p, n_packets, str(tmp_path), failing_every)) for p in range(producers)]
+    expected = Counter(record[1] for batch in records for record in batch)
+    failing = {path for path in expected if os.path.basename(os.path.dirname(path)) == MISSING_DIR}
+    assert bool(failing) == bool(failing_every)
+
+    writer = make_writer(design, shards=3, fsync_policy=FSYNC_NEVER, max_queue=100000)
+    barrier = threading.Barrier(producers)
+    rejected = Counter()
+
+    def produce(batch):
+        barrier.wait()
+        for record in batch:
+            if not writer.submit(record):
+                rejected[record[1]] += 1
+
+    threads = [threading.Thread(target=produce, args=(batch,)) for batch in records]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.flush(timeout=30)
+    stats = writer.stats()
+    writer.close()
+
+    assert stats['dropped'] == 0
+    assert not rejected
+    # Every row of a healthy file, exactly once
+    for path, count in expected.items():
+        if path not in failing:
+            assert lines_on_disk(path) == count, path
+    # Failures are charged to the failing files only, row for row
+    assert stats['write_errors_by_output'] == {path: expected[path] for path in failing}
@@ -0,0 +1,86 @@
+"""
+Tests of the per-node link statistics: the running (Welford) and recent
+means and variances, and the engine's queries and snapshots.
+
+Command: python -m pytest tests/test_node_stats.py
+from snode directory
+"""
+
+import json
+import random
+import statistics
+
+import pytest
+
+from node_stats import NodeStatsEngine, RunningStat, SNAPSHOT_HEADERS, RECENT_ALPHA
+
+START = 1734400000.0
+
+
+def test_welford_matches_two_pass_statistics():
+    rng = random.Random(0)
+    # A large offset, where a sum of squares would lose precision
+    values = [-1e6 + rng.gauss(-80, 5) for _ in range(1000)]
+    stat = RunningStat()
+    for value in values:
+        stat.add(value)
+    assert stat.count == len(values)
+    assert stat.mean == pytest.approx(statistics.fmean(values), rel=1e-12)
+    assert stat.variance == pytest.approx(statistics.variance(values), rel=1e-9)
+    assert stat.std == pytest.approx(statistics.stdev(values), rel=1e-9)
+    assert (stat.min, stat.max) == (min(values), max(values))
+
+
+def test_one_value_has_no_variance():
+    stat = RunningStat()
+    assert stat.as_dict() is None
+    stat.add(-90)
+    assert (stat.mean, stat.variance, stat.recent_mean) == (-90, 0.0, -90)
+
+
+def test_recent_mean_is_exponentially_weighted():
+    stat = RunningStat()
+    values = [-90, -80, -85, -70]
+    for value in values:
+        stat.add(value)
+    expected = float(values[0])
+    for value in values[1:]:
+        expected += RECENT_ALPHA * (value - expected)
+    assert stat.recent_mean == pytest.approx(expected)
+
+
+def test_node_stats_of_packets():
+    engine = NodeStatsEngine()
+    packets = [{'rxRssi': -90, 'rxSnr': 5.0, 'hopStart': 3, 'hopLimit': 3},
+               {'rxRssi': -80, 'rxSnr': 7.0, 'hopStart': 3, 'hopLimit': 1},
+               {'rxSnr': 6.0}]
+    for offset, packet in zip((0, 30, 90), packets):
+        engine.record('0x0a1b2c3d', packet, now=START + offset)
+    engine.record('0xffffffff', {}, now=START + 10)
+
+    node = engine.node('0x0a1b2c3d', now=START + 100)
+    assert (node['packets'], node['first_seen'], node['seconds_since_seen']) == (3, START, 10)
+    assert (node['rssi']['count'], node['rssi']['mean'], node['rssi']['std']) == (2, -85, pytest.approx(50 ** 0.5))
+    assert node['snr']['mean'] == pytest.approx(6.0)
+    assert (node['hops']['mean'], node['hops']['max']) == (1.0, 2)
+    assert (node['gap']['mean'], node['gap']['max']) == (45, 60)
+    assert engine.node('0xffffffff')['rssi'] is None
+
+    assert [entry['node'] for entry in engine.nodes()] == ['0x0a1b2c3d', '0xffffffff']
+    assert engine.packet_counts() == {'0x0a1b2c3d': 3, '0xffffffff': 1}
+    assert engine.stale(60, now=START + 100) == ['0xffffffff']
+    rows = engine.csv_rows('2024-12-17 04:55:00', now=START + 100)
+    assert all(len(row) == len(SNAPSHOT_HEADERS) for row in rows)
+
+
+def test_snapshot_file(tmp_path):
+    engine = NodeStatsEngine()
+    engine.record('0x0a1b2c3d', {'rxRssi': -90}, now=START)
+    engine.record_event('WDT ERROR')
+    path = tmp_path / 'node_stats.json'
+    engine.write_snapshot(str(path), now=START + 5, extra={'duplicates': {'0x0a1b2c3d': 2}})
+    snapshot = json.loads(path.read_text())
+    assert snapshot['events'] == {'WDT ERROR': 1}
+    assert snapshot['duplicates'] == {'0x0a1b2c3d': 2}
+    assert snapshot['nodes'][0]['seconds_since_seen'] == 5
+    assert not (tmp_path / 'node_stats.json.tmp').exists()
@@ -0,0 +1,124 @@
+"""
+Tests of the query API: shard selection and row filtering by node and time,
+and the shard index following new, changed and deleted files.
+
+Command: python -m pytest tests/test_query.py
+from snode directory
+"""
+
+import csv
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from snode.query import TelemetryStore, ShardIndex, INDEX_NAME
+
+HEADERS = ['datetime', 'fromNode', 'pm25Standard', 'pm10Standard', 'rxSnr']
+NODE_A = '0x0a1b2c3d'
+NODE_B = '0x11223344'
+
+
+def write_shard(node_dir, hour, node, minutes=(0, 20, 40), gz=False):
+    """
+    Writes the airQualityMetrics shard of one hour of 2024-12-17, with
+    pm25Standard = hour * 100 + minute, and returns its path.
+    """
+    os.makedirs(node_dir, exist_ok=True)
+    path = os.path.join(node_dir, f'airQualityMetrics_2024-12-17_{hour:02d}-00-00.csv' + ('.gz' if gz else ''))
+    with (gzip.open if gz else open)(path, 'wt', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS)
+        for minute in minutes:
+            writer.writerow([f'2024-12-17 {hour:02d}:{minute:02d}:00.500000', node, hour * 100 + minute, 1, 6.25])
+    return path
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    session = tmp_path / 'data-2024-12-17_04-55-00'
+    write_shard(str(session / '0a1b2c3d'), 5, NODE_A)
+    write_shard(str(session / '0a1b2c3d'), 6, NODE_A, gz=True)
+    write_shard(str(session / '11223344'), 5, NODE_B)
+    write_shard(str(session / '11223344'), 7, NODE_B)
+    return str(session)
+
+
+def values(result):
+    return result.to_numpy()[1].tolist()
+
+
+################################################
+# Queries
+################################################
+
+def test_node_filter_selects_only_its_shards(data_dir):
+    store = TelemetryStore(data_dir)
+    result = store.query('pm25Standard', node=NODE_A)
+    assert [os.path.basename(path) for path in result.paths] == [
+        'airQualityMetrics_2024-12-17_05-00-00.csv', 'airQualityMetrics_2024-12-17_06-00-00.csv.gz']
+    assert values(result) == [500, 520, 540, 600, 620, 640]
+    # Every spelling of the id is the same node
+    assert values(store.query('pm25Standard', node='!0a1b2c3d')) == values(result)
+    assert values(store.query('pm25Standard', node=0x0a1b2c3d)) == values(result)
+    assert store.query('pm25Standard', node='0xdeadbeef').paths == []
+
+
+def test_time_filter_is_inclusive(data_dir):
+    store = TelemetryStore(data_dir)
+    result = store.query('pm25Standard', start='2024-12-17 05:20:00.500000', end='2024-12-17 06:20:00.500000')
+    # The 07:00 shard is not opened
+    assert len(result.paths) == 3
+    frame = result.to_frame()
+    assert frame['pm25Standard'].tolist() == [520, 520, 540, 540, 600, 620]
+    assert frame['datetime'].is_monotonic_increasing
+    assert store.stats()['files_read'] == 3
+
+
+def test_node_and_time_filter(data_dir):
+    result = TelemetryStore(data_dir).query('pm25Standard', node=NODE_B, start='2024-12-17 06:00')
+    assert values(result) == [700, 720, 740]
+    times = result.to_numpy()[0]
+    assert times.dtype == np.dtype('datetime64[us]')
+    assert times[0] == np.datetime64('2024-12-17T07:00:00.500000')
+
+
+def test_unknown_metric_and_empty_result(data_dir):
+    store = TelemetryStore(data_dir)
+    assert store.query('temperature').paths == []
+    frame = store.query('pm25Standard', start='2024-12-18').to_frame()
+    assert list(frame.columns) == ['datetime', 'fromNode', 'pm25Standard']
+    assert len(frame) == 0
+
+
+################################################
+# Shard Index
+################################################
+
+def test_index_rescans_only_changed_files(data_dir):
+    index = ShardIndex(data_dir)
+    assert index.refresh() == 4
+    assert os.path.exists(os.path.join(data_dir, INDEX_NAME))
+    entry = index.files[os.path.join('11223344', 'airQualityMetrics_2024-12-17_07-00-00.csv')]
+    assert (entry['telemetry'], entry['rows'], entry['nodes']) == ('airQualityMetrics', 3, [NODE_B])
+    assert (entry['start'], entry['end']) == ('2024-12-17 07:00:00.500000', '2024-12-17 07:40:00.500000')
+
+    # Loaded from the index file: nothing to scan
+    index = ShardIndex(data_dir)
+    assert index.refresh() == 0
+
+    write_shard(os.path.join(data_dir, '11223344'), 7, NODE_B, minutes=(0, 20, 40, 59))
+    os.remove(os.path.join(data_dir, '0a1b2c3d', 'airQualityMetrics_2024-12-17_05-00-00.csv'))
+    assert index.refresh() == 1
+    assert len(index.files) == 3
+
+
+def test_store_picks_up_new_rows_on_refresh(data_dir):
+    store = TelemetryStore(data_dir, persist_index=False)
+    assert values(store.query('pm25Standard', node=NODE_B, start='2024-12-17 07:00')) == [700, 720, 740]
+    write_shard(os.path.join(data_dir, '11223344'), 7, NODE_B, minutes=(0, 20, 40, 59))
+    assert values(store.query('pm25Standard', node=NODE_B, start='2024-12-17 07:00')) == [700, 720, 740]
+    assert values(store.query('pm25Standard', node=NODE_B, start='2024-12-17 07:00', refresh=True)) == [
+        700, 720, 740, 759]
+    assert not os.path.exists(os.path.join(data_dir, INDEX_NAME))
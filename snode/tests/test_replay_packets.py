@@ -0,0 +1,70 @@
+"""
+Replays a few packets through rpi_log_script.on_receive with the fake
+interface and checks the csv rows and bytes the logger writes.
+
+Command: python -m pytest tests/test_replay_packets.py
+from snode directory
+"""
+
+import csv
+import glob
+import os
+import time
+
+import pytest
+
+pytest.importorskip('meshtastic')
+pytest.importorskip('pubsub')
+
+from replay_packets import FakeInterface, replay  # noqa: E402
+
+NODE_A = 0x0a1b2c3d
+NODE_B = 0x11223344
+
+
+def packet(node, packet_id, telemetry_key, metrics, hop_limit=3):
+    now = int(time.time())
+    return {'from': node, 'to': 0xFFFFFFFF, 'fromId': f'!{node:08x}', 'toId': '^all', 'id': packet_id,
+            'rxTime': now, 'rxSnr': 6.25, 'rxRssi': -71, 'hopLimit': hop_limit, 'hopStart': 3,
+            'decoded': {'portnum': 'TELEMETRY_APP', 'bitfield': 0,
+                        'telemetry': {'time': now, telemetry_key: metrics}}}
+
+
+def read_csv(path):
+    with open(path, newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def test_replay_writes_rows_and_bytes(tmp_path):
+    first = packet(NODE_A, 1, 'airQualityMetrics', {'pm25Standard': 12, 'pm10Standard': 8})
+    packets = [first,
+               packet(NODE_B, 2, 'environmentMetrics', {'temperature': 21.5, 'relativeHumidity': 40.0}),
+               # A rebroadcast of the first packet is dropped
+               dict(first, hopLimit=2),
+               packet(NODE_A, 3, 'airQualityMetrics', {'pm25Standard': 14}),
+               packet(NODE_A, 4, 'windMetrics', {'windSpeed': 2.3})]
+    output_dir = str(tmp_path)
+    results = replay(packets, output_dir, interface=FakeInterface(0xa1b2c3d4), log_level='WARNING', alerts=False)
+
+    assert results['packets'] == len(packets)
+    assert results['dedup']['duplicates'] == 1
+    writer = results['writer']['writer']
+    assert (writer['written'], writer['dropped'], writer['write_errors']) == (4, 0, 0)
+
+    node_dir, = glob.glob(os.path.join(output_dir, 'data-*', 'c3d4'))
+    air, = glob.glob(os.path.join(node_dir, 'airQualityMetrics_*.csv'))
+    rows = read_csv(air)
+    assert [(row['fromNode'], row['pm25Standard'], row['pm10Standard']) for row in rows] == [
+        (hex(NODE_A), '12', '8'), (hex(NODE_A), '14', '')]
+    assert rows[0]['rxRssi'] == '-71'
+    environment, = glob.glob(os.path.join(node_dir, 'environmentMetrics_*.csv'))
+    assert [(row['fromNode'], row['temperature'], row['barometricPressure'])
+            for row in read_csv(environment)] == [(hex(NODE_B), '21.5', '')]
+    # Sections without a schema are kept in long format
+    other, = glob.glob(os.path.join(node_dir, 'otherTelemetry_*.csv'))
+    assert [(row['telemetryKey'], row['field'], row['value']) for row in read_csv(other)] == [
+        ('windMetrics', 'windSpeed', '2.3')]
+
+    written = [path for path in glob.glob(os.path.join(node_dir, '*')) if os.path.isfile(path)]
+    assert results['data_bytes'] == sum(os.path.getsize(path) for path in written)
+    assert results['data_bytes_per_packet'] == results['data_bytes'] / len(packets)
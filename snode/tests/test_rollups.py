@@ -0,0 +1,91 @@
+"""
+Tests of the streaming rollups: windows by event time, circular means, and
+late packets merged into windows already stored.
+
+Command: python -m pytest tests/test_rollups.py
+from snode directory
+"""
+
+import pytest
+
+from rollups import RollupEngine, RollupSink, read_rollups
+
+NODE = '0x0a1b2c3d'
+# A multiple of 600, so windows start at START
+START = 1734400200.0
+
+
+def add(engine, offset, section, now_offset=None):
+    measured = START + offset
+    now = START + (now_offset if now_offset is not None else offset)
+    engine.add(NODE, {'time': measured, 'environmentMetrics': section}, {}, now=now)
+
+
+def store(sink, db_path, windows):
+    assert sink.write_batch([(db_path,) + window for window in windows]) == []
+
+
+def test_windows_follow_event_time():
+    engine = RollupEngine(metrics=['temperature'], windows=[60, 600], lateness=120)
+    for offset, value in ((0, 20.0), (30, 22.0), (59, 21.0), (60, 30.0)):
+        add(engine, offset, {'temperature': value, 'relativeHumidity': 40})
+    # Done 120 s after its end: only the first minute
+    windows = engine.finalize(now=START + 180)
+    assert [(window[2], window[3]) for window in windows] == [(60, START)]
+    aggregate = windows[0][4]
+    assert (aggregate.count, aggregate.min, aggregate.max, aggregate.last) == (3, 20.0, 22.0, 21.0)
+    assert aggregate.mean == pytest.approx(21.0)
+    rest = engine.finalize(now=START + 600 + 120)
+    assert sorted((window[2], window[4].count) for window in rest) == [(60, 1), (600, 4)]
+
+
+def test_clock_fallback_uses_the_receive_time():
+    engine = RollupEngine(metrics=['temperature'], windows=[60])
+    engine.add(NODE, {'time': 0, 'environmentMetrics': {'temperature': 20.0}}, {}, now=START + 90)
+    window, = engine.finalize(everything=True)
+    assert window[3] == START + 60
+    assert engine.stats()['clock_fallbacks'] == 1
+
+
+def test_wind_direction_mean_is_circular():
+    engine = RollupEngine(metrics=['windDirection'], windows=[60])
+    for offset, value in ((0, 350.0), (10, 20.0)):
+        add(engine, offset, {'windDirection': value})
+    window, = engine.finalize(everything=True)
+    # Not the arithmetic mean, 185
+    assert window[4].mean == pytest.approx(5.0)
+
+
+def test_late_packet_merged_into_stored_window(tmp_path):
+    db_path = str(tmp_path / 'rollups.db')
+    engine = RollupEngine(metrics=['pm25Standard'], windows=[60], lateness=120)
+    sink = RollupSink()
+    for offset, value in ((0, 10), (20, 30), (40, 20)):
+        add(engine, offset, {'pm25Standard': value})
+    store(sink, db_path, engine.finalize(now=START + 180))
+
+    # Measured in the stored window, received 10 minutes later
+    add(engine, 50, {'pm25Standard': 50}, now_offset=650)
+    assert engine.stats()['late_windows'] == 1
+    store(sink, db_path, engine.finalize(now=START + 650))
+    sink.close()
+
+    row, = read_rollups(db_path, node=NODE, metric='pm25Standard', window=60)
+    assert (row['start'], row['count'], row['min'], row['max'], row['sum']) == (START, 4, 10, 50, 110)
+    assert row['mean'] == pytest.approx(27.5)
+    # The late packet is the newest by event time
+    assert (row['last'], row['lastTime']) == (50, START + 50)
+
+
+def test_late_packet_does_not_replace_the_newest_value(tmp_path):
+    db_path = str(tmp_path / 'rollups.db')
+    engine = RollupEngine(metrics=['pm25Standard'], windows=[60], lateness=120)
+    sink = RollupSink()
+    add(engine, 40, {'pm25Standard': 20})
+    store(sink, db_path, engine.finalize(now=START + 180))
+    add(engine, 10, {'pm25Standard': 99}, now_offset=650)
+    store(sink, db_path, engine.finalize(now=START + 650))
+    sink.close()
+
+    row, = read_rollups(db_path)
+    assert (row['count'], row['last'], row['lastTime'], row['max']) == (2, 20, START + 40, 99)
@@ -0,0 +1,94 @@
+"""
+Tests of the serial line reader with a fake port: lines split across
+reads, overlong lines, invalid UTF-8, and the dropped/corrupt counters.
+
+Command: python -m pytest tests/test_serial_log.py
+from snode directory
+"""
+
+import pytest
+
+pytest.importorskip('serial')
+
+from serial_log import SerialLineReader, LineLogger  # noqa: E402
+from log_writer import TXT_RECORD  # noqa: E402
+
+
+class FakeSerial:
+    """
+    Returns one chunk of bytes per read(), then nothing.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def read(self, size):
+        return self.chunks.pop(0)[:size] if self.chunks else b''
+
+    def close(self):
+        self.closed = True
+
+
+def reader_of(*chunks, max_line=64):
+    reader = SerialLineReader('/dev/ttyUSB0', 115200, 'wind.txt', max_line=max_line)
+    reader.serial = FakeSerial(chunks)
+    return reader
+
+
+def read_all(reader, reads):
+    lines = []
+    for _ in range(reads):
+        lines += reader.read_lines()
+    return lines
+
+
+def test_lines_split_across_reads():
+    reader = reader_of(b'dir=283 spe', b'ed=2.3\r\n\r\ndir=284 speed=2.4\n', b'dir=2')
+    assert read_all(reader, 3) == ['dir=283 speed=2.3', 'dir=284 speed=2.4']
+    assert reader.stats()['lines'] == 2
+    # The partial line is dropped when the port closes
+    reader.close()
+    assert reader.serial is None
+    assert reader.dropped_bytes == len(b'dir=2')
+
+
+def test_overlong_line_in_one_read_is_dropped():
+    noise = b'x' * 100
+    reader = reader_of(b'dir=283\n' + noise + b'\ndir=284\n')
+    assert reader.read_lines() == ['dir=283', 'dir=284']
+    assert reader.dropped_bytes == len(noise)
+
+
+def test_overlong_line_across_reads_is_dropped():
+    # No newline for longer than max_line: the buffer is dropped at once
+    # and the rest of the line up to the next newline too
+    reader = reader_of(b'dir=283\n' + b'x' * 70, b'y' * 10 + b'\ndir=284\n')
+    assert read_all(reader, 2) == ['dir=283', 'dir=284']
+    assert reader.dropped_bytes == 80
+    assert len(reader._buffer) == 0
+
+
+def test_invalid_utf8_is_removed_and_counted():
+    reader = reader_of(b'dir=283 \x94speed=2.3\n\xff\xfe\n')
+    assert reader.read_lines() == ['dir=283 speed=2.3']
+    stats = reader.stats()
+    assert (stats['corrupt_lines'], stats['corrupt_bytes']) == (2, 3)
+    assert stats['dropped_bytes'] == 0
+
+
+class FullWriter:
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+        return False
+
+
+def test_lines_the_writer_cannot_queue_are_dropped():
+    reader = reader_of(b'dir=283\n')
+    writer = FullWriter()
+    LineLogger(writer)(reader, '2024-12-17 04:55:00', reader.read_lines())
+    assert writer.records == [(TXT_RECORD, 'wind.txt', None, '2024-12-17 04:55:00 - dir=283')]
+    assert reader.dropped_bytes == len('2024-12-17 04:55:00 - dir=283')
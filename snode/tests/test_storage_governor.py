@@ -0,0 +1,207 @@
+"""
+Tests of the storage governor: retention, low and critical space, what is
+never deleted, and that a pass never blocks or crashes the logger.
+
+Command: python -m pytest tests/test_storage_governor.py
+from snode directory
+"""
+
+import fcntl
+import os
+import time
+
+import pytest
+
+from storage_governor import StorageGovernor, LEVEL_CRITICAL, LEVEL_LOW, LEVEL_OK
+from upload_queue import LocalDirTransport, LOCK_NAME, sync
+
+DAY = 86400
+NOW = 1734400000.0
+SESSION = 'data-2024-12-01_00-00-00'
+
+
+def write_file(path, size, age_days):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(os.urandom(size))
+    mtime = NOW - age_days * DAY
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+@pytest.fixture
+def data_root(tmp_path):
+    root = tmp_path / 'data'
+    root.mkdir()
+    return str(root)
+
+
+def card(data_root, capacity):
+    """
+    disk_usage of a card of capacity bytes holding only data_root.
+    """
+    def disk_usage(path):
+        used = directory_bytes(data_root)
+        return capacity, used, capacity - used
+    return disk_usage
+
+
+def upload(data_root, tmp_path):
+    sync(data_root, LocalDirTransport(str(tmp_path / 'upload')), workers=1)
+
+
+def node_file(data_root, name):
+    return os.path.join(data_root, SESSION, 'a1b2', name)
+
+
+################################################
+# Deletion Rules
+################################################
+
+def test_retention_deletes_only_old_uploaded_files(data_root, tmp_path):
+    old_uploaded = write_file(node_file(data_root, 'old.csv.gz'), 1000, age_days=40)
+    new_uploaded = write_file(node_file(data_root, 'new.csv.gz'), 1000, age_days=5)
+    (tmp_path / 'upload').mkdir()
+    upload(data_root, tmp_path)
+    old_pending = write_file(node_file(data_root, 'pending.csv.gz'), 1000, age_days=40)
+
+    governor = StorageGovernor(data_root, retention_days=30, low_free_mb=0, critical_free_mb=0,
+                               compress=False, disk_usage=card(data_root, 1 << 30))
+    governor.run_once(NOW)
+    assert not os.path.exists(old_uploaded)
+    assert os.path.exists(new_uploaded)
+    assert os.path.exists(old_pending)
+    assert governor.stats()['deleted'] == {'retention': 1}
+
+
+def test_low_space_deletes_uploaded_files_oldest_first(data_root, tmp_path):
+    uploaded = [write_file(node_file(data_root, f'shard_{age}.csv.gz'), 10000, age_days=age)
+                for age in (3, 2, 1)]
+    (tmp_path / 'upload').mkdir()
+    upload(data_root, tmp_path)
+    pending = write_file(node_file(data_root, 'pending.csv.gz'), 10000, age_days=4)
+    capacity = directory_bytes(data_root) + 15000
+
+    governor = StorageGovernor(data_root, retention_days=None, low_free_mb=25000 / (1024 * 1024),
+                               critical_free_mb=0, compress=False, disk_usage=card(data_root, capacity))
+    governor.run_once(NOW)
+    # 15000 free: the oldest uploaded file is enough to reach the low mark
+    assert [os.path.exists(path) for path in uploaded] == [False, True, True]
+    assert os.path.exists(pending)
+    assert governor.level == LEVEL_OK
+    assert governor.raw_allowed
+
+
+def test_low_space_never_deletes_telemetry_that_was_not_uploaded(data_root):
+    shards = [write_file(node_file(data_root, f'shard_{age}.csv.gz'), 10000, age_days=age) for age in (1, 2)]
+    governor = StorageGovernor(data_root, retention_days=None, low_free_mb=1, critical_free_mb=0,
+                               compress=False, disk_usage=card(data_root, directory_bytes(data_root) + 1000))
+    governor.run_once(NOW)
+    assert all(os.path.exists(path) for path in shards)
+    assert governor.level == LEVEL_LOW
+    assert governor.raw_allowed
+
+
+def test_critical_space_drops_raw_archives_and_pauses_them(data_root):
+    raw = write_file(node_file(data_root, 'packets_2024-12-01_00-00-00.jsonl.gz'), 20000, age_days=1)
+    shard = write_file(node_file(data_root, 'environmentMetrics_2024-12-01_00-00-00.csv.gz'), 20000, age_days=2)
+    capacity = directory_bytes(data_root) + 1000
+    governor = StorageGovernor(data_root, retention_days=None, low_free_mb=30000 / (1024 * 1024),
+                               critical_free_mb=10000 / (1024 * 1024), compress=False,
+                               disk_usage=card(data_root, capacity))
+    governor.run_once(NOW)
+    assert not os.path.exists(raw)
+    assert os.path.exists(shard)
+    # Still under the low mark: the archive stays paused until space is back
+    assert governor.level == LEVEL_LOW
+    assert not governor.raw_allowed
+
+    os.remove(shard)
+    governor.run_once(NOW)
+    assert governor.level == LEVEL_OK
+    assert governor.raw_allowed
+
+
+def test_active_and_recent_files_are_never_touched(data_root, tmp_path):
+    recent = write_file(node_file(data_root, 'packets_recent.jsonl.gz'), 20000, age_days=0)
+    active_dir = os.path.join(data_root, 'data-2024-12-02_00-00-00', 'a1b2')
+    active_db = write_file(os.path.join(active_dir, 'telemetry.db'), 20000, age_days=1)
+    active_raw = write_file(os.path.join(active_dir, 'logs_2024-12-02_00-00-00.txt'), 20000, age_days=1)
+    governor = StorageGovernor(data_root, retention_days=None, low_free_mb=1, critical_free_mb=1,
+                               active_dirs=lambda: {os.path.dirname(active_dir)},
+                               disk_usage=card(data_root, directory_bytes(data_root)))
+    governor.run_once(NOW)
+    assert os.path.exists(recent)
+    assert os.path.exists(active_db)
+    # A closed raw log of the active session is cold: dropped at critical space
+    assert not os.path.exists(active_raw)
+    assert governor.level == LEVEL_CRITICAL
+
+
+def test_cold_shards_are_compressed_until_uploaded(data_root):
+    shard = write_file(node_file(data_root, 'environmentMetrics_2024-12-01_00-00-00.csv'), 5000, age_days=1)
+    governor = StorageGovernor(data_root, low_free_mb=0, critical_free_mb=0, disk_usage=card(data_root, 1 << 30))
+    governor.run_once(NOW)
+    assert not os.path.exists(shard)
+    assert os.path.getmtime(shard + '.gz') == NOW - DAY
+
+
+################################################
+# Never Blocking the Logger
+################################################
+
+def test_pass_skipped_while_the_uploader_holds_its_lock(data_root):
+    shard = write_file(node_file(data_root, 'environmentMetrics_2024-12-01_00-00-00.csv'), 5000, age_days=1)
+    governor = StorageGovernor(data_root, low_free_mb=0, critical_free_mb=0, disk_usage=card(data_root, 1 << 30))
+    with open(os.path.join(data_root, LOCK_NAME), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        start = time.monotonic()
+        governor.run_once(NOW)
+        assert time.monotonic() - start < 1.0
+    assert os.path.exists(shard)
+    assert governor.passes == 0
+
+
+def test_critical_pass_does_not_wait_for_the_uploader(data_root):
+    raw = write_file(node_file(data_root, 'packets_2024-12-01_00-00-00.jsonl.gz'), 20000, age_days=1)
+    governor = StorageGovernor(data_root, low_free_mb=1, critical_free_mb=1, compress=False,
+                               disk_usage=card(data_root, directory_bytes(data_root)))
+    with open(os.path.join(data_root, LOCK_NAME), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        governor.run_once(NOW)
+    assert not os.path.exists(raw)
+
+
+def test_failing_pass_does_not_stop_the_thread(data_root):
+    calls = []
+
+    def disk_usage(path):
+        calls.append(path)
+        if len(calls) == 1:
+            raise OSError("card removed")
+        return 1 << 30, 0, 1 << 30
+
+    governor = StorageGovernor(data_root, interval=0.01, disk_usage=disk_usage).start()
+    try:
+        deadline = time.monotonic() + 5
+        while governor.passes < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        governor.stop()
+    assert governor.errors == 1
+    assert governor.passes >= 2
+    # The receive path only ever reads this flag
+    assert governor.raw_allowed
+
+
+def test_wake_and_stop_return_at_once(data_root):
+    governor = StorageGovernor(data_root, interval=3600, disk_usage=card(data_root, 1 << 30)).start()
+    start = time.monotonic()
+    governor.wake()
+    governor.stop()
+    assert time.monotonic() - start < 2.0
@@ -0,0 +1,44 @@
+"""
+Tests of the sync manifest's check that an append-only file was shipped.
+
+Command: python -m pytest tests/test_sync_manifest.py
+from snode directory
+"""
+
+import os
+
+from sync_manifest import SyncManifest, MANIFEST_NAME, tail_sha256
+
+
+def shipped_manifest(tmp_path, data):
+    path = tmp_path / 'shard.csv'
+    path.write_bytes(data)
+    manifest = SyncManifest(str(tmp_path / MANIFEST_NAME))
+    manifest.mark_delta_synced('shard.csv', 0, len(data), tail_sha256(str(path), len(data)), 'part-0')
+    return manifest, str(path)
+
+
+def test_delta_synced_when_every_byte_shipped(tmp_path):
+    manifest, path = shipped_manifest(tmp_path, b'a,b\r\n1,2\r\n')
+    assert manifest.is_delta_synced('shard.csv', path)
+
+
+def test_delta_not_synced_after_append(tmp_path):
+    manifest, path = shipped_manifest(tmp_path, b'a,b\r\n1,2\r\n')
+    with open(path, 'ab') as file:
+        file.write(b'3,4\r\n')
+    assert not manifest.is_delta_synced('shard.csv', path)
+
+
+def test_delta_not_synced_after_same_size_rewrite(tmp_path):
+    manifest, path = shipped_manifest(tmp_path, b'a,b\r\n1,2\r\n')
+    with open(path, 'wb') as file:
+        file.write(b'a,b\r\n9,9\r\n')
+    assert os.path.getsize(path) == manifest.files['shard.csv']['delta_offset']
+    assert not manifest.is_delta_synced('shard.csv', path)
+
+
+def test_delta_not_synced_while_resuming(tmp_path):
+    manifest, path = shipped_manifest(tmp_path, b'a,b\r\n1,2\r\n')
+    manifest.set_resumable('shard.csv', 'https://example.invalid/upload', 10, 'fingerprint')
+    assert not manifest.is_delta_synced('shard.csv', path)
@@ -0,0 +1,96 @@
+"""
+Tests of the telemetry schema registry, its row encoders, and the rows of
+sections without a schema.
+
+Command: python -m pytest tests/test_telemetry_schema.py
+from snode directory
+"""
+
+import json
+
+import pytest
+
+from telemetry_schema import (SchemaRegistry, TelemetryEncoder, DEFAULT_SIGNAL_KEYS, OTHER_TELEMETRY_HEADERS,
+                              other_telemetry_rows)
+
+NOW = '2024-12-17 04:55:00.500000'
+NODE = '0x0a1b2c3d'
+PACKET = {'from': 169552957, 'rxSnr': 6.25, 'rxRssi': -71, 'rxTime': 1734411300, 'hopLimit': 3}
+
+
+################################################
+# Encoders
+################################################
+
+def test_row_in_header_order():
+    encoder = TelemetryEncoder('airQualityMetrics', ['pm10Standard', 'pm25Standard'], ['rxSnr', 'rxRssi'])
+    assert encoder.headers == ['datetime', 'fromNode', 'pm10Standard', 'pm25Standard', 'rxSnr', 'rxRssi']
+    row = encoder.row(NOW, NODE, {'pm25Standard': 12, 'pm10Standard': 8}, PACKET)
+    assert row == [NOW, NODE, 8, 12, 6.25, -71]
+
+
+def test_missing_keys_are_none():
+    encoder = TelemetryEncoder('environmentMetrics', ['temperature', 'relativeHumidity', 'windSpeed'])
+    row = encoder.row(NOW, NODE, {'temperature': 21.5, 'unknownField': 1}, {'rxSnr': 6.25})
+    assert len(row) == len(encoder.headers)
+    assert row == [NOW, NODE, 21.5, None, None, 6.25] + [None] * (len(DEFAULT_SIGNAL_KEYS) - 1)
+
+
+################################################
+# Schema Files
+################################################
+
+def test_schema_file_replaces_types_and_signal_keys(tmp_path):
+    path = tmp_path / 'schemas.json'
+    path.write_text(json.dumps({'environmentMetrics': ['temperature', 'windGust'],
+                                'windMetrics': ['windSpeed'], 'signal_keys': ['rxSnr']}))
+    registry = SchemaRegistry.from_file(str(path))
+    assert registry.get('environmentMetrics').headers == ['datetime', 'fromNode', 'temperature', 'windGust', 'rxSnr']
+    assert registry.get('windMetrics').fields == ('windSpeed',)
+    # Built-in types not in the file are kept
+    assert 'airQualityMetrics' in registry
+    assert registry.get('airQualityMetrics').signal_keys == ('rxSnr',)
+
+
+@pytest.mark.parametrize('config', [['temperature'], {'environmentMetrics': 'temperature'},
+                                    {'environmentMetrics': ['temperature', 3]}])
+def test_bad_schema_file(tmp_path, config):
+    path = tmp_path / 'schemas.json'
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError):
+        SchemaRegistry.from_file(str(path))
+
+
+################################################
+# Sections Without a Schema
+################################################
+
+def test_every_section_of_a_packet_is_routed():
+    registry = SchemaRegistry()
+    telemetry = {'time': 1734411300, 'raw': object(),
+                 'environmentMetrics': {'temperature': 21.5},
+                 'airQualityMetrics': {'pm25Standard': 12},
+                 'windMetrics': {'windSpeed': 2.3}}
+    sections = [(key, encoder.telemetry_key if encoder else None, section)
+                for key, encoder, section in registry.sections(telemetry)]
+    assert sections == [('environmentMetrics', 'environmentMetrics', {'temperature': 21.5}),
+                        ('airQualityMetrics', 'airQualityMetrics', {'pm25Standard': 12}),
+                        ('windMetrics', None, {'windSpeed': 2.3})]
+
+
+def test_other_telemetry_rows():
+    section = {'windSpeed': 2.3, 'status': 'A', 'ok': True, 'missing': None,
+               'gps': {'lat': 37.4, 'fix': {'sats': 7}}, 'samples': [1, 2], 'raw': object()}
+    rows = other_telemetry_rows(NOW, NODE, 'windMetrics', section)
+    assert rows == [[NOW, NODE, 'windMetrics', 'windSpeed', 2.3],
+                    [NOW, NODE, 'windMetrics', 'status', 'A'],
+                    [NOW, NODE, 'windMetrics', 'ok', True],
+                    [NOW, NODE, 'windMetrics', 'missing', None],
+                    [NOW, NODE, 'windMetrics', 'gps.lat', 37.4],
+                    [NOW, NODE, 'windMetrics', 'gps.fix.sats', 7],
+                    [NOW, NODE, 'windMetrics', 'samples', '[1, 2]']]
+    assert all(len(row) == len(OTHER_TELEMETRY_HEADERS) for row in rows)
+
+
+def test_empty_section_has_no_rows():
+    assert other_telemetry_rows(NOW, NODE, 'windMetrics', {}) == []
@@ -0,0 +1,46 @@
+"""
+Tests of the files the upload queue picks up from the data folder.
+
+Command: python -m pytest tests/test_upload_queue.py
+from snode directory
+"""
+
+import os
+
+import pytest
+
+from sync_manifest import SyncManifest
+from upload_queue import LocalDirTransport, find_changed_files, sync
+
+
+@pytest.fixture
+def folder(tmp_path):
+    data = tmp_path / 'data'
+    node_dir = data / 'data-2024-12-17_04-55-00' / 'c3d4'
+    node_dir.mkdir(parents=True)
+    (node_dir / 'airQualityMetrics_2024-12-17_04-55-00.csv').write_text('datetime,fromNode\n')
+    (node_dir / 'telemetry.db-wal').write_bytes(b'wal')
+    for name in ('rpi_log_script_stdouterr_log.txt', 'upload_gdrive_stdouterr_log.txt', 'rpi_stdouterr.txt'):
+        (data / name).write_text('started\n')
+    return str(data)
+
+
+def test_stdout_logs_and_side_files_are_not_uploaded(folder):
+    manifest = SyncManifest(os.path.join(folder, '.local_manifest.json'))
+    changed, unchanged = find_changed_files(folder, manifest, delta=True)
+    assert [entry[0] for entry in changed] == [
+        'data-2024-12-17_04-55-00/c3d4/airQualityMetrics_2024-12-17_04-55-00.csv']
+    assert unchanged == 0
+
+
+def test_next_run_finds_nothing_to_upload(folder, tmp_path):
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    transport = LocalDirTransport(str(dest))
+    assert sync(folder, transport, workers=1)['drained_files'] == 1
+    # The cron job appends to its log on every run
+    with open(os.path.join(folder, 'upload_gdrive_stdouterr_log.txt'), 'a') as file:
+        file.write('uploaded 1 file\n')
+    result = sync(folder, transport, workers=1)
+    assert (result['drained_files'], result['unchanged']) == (0, 1)
+    assert not (dest / 'upload_gdrive_stdouterr_log.txt').exists()
@@ -0,0 +1,126 @@
+"""
+Tests of the wind sensor line parser: NMEA checksums, key=value lines and
+their units, void readings, ranges, and the reasons lines are rejected.
+
+Command: python -m pytest tests/test_wind_parser.py
+from snode directory
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from log_writer import CSV_RECORD, TXT_RECORD
+from wind_parser import ParseError, WindParserStage, WIND_HEADERS, parse_line, wind_row
+
+
+def nmea(body):
+    checksum = 0
+    for char in body.encode('ascii'):
+        checksum ^= char
+    return f'${body}*{checksum:02X}'
+
+
+################################################
+# NMEA
+################################################
+
+def test_nmea_with_checksum():
+    assert nmea('WIMWV,283.0,R,2.3,M,A') == '$WIMWV,283.0,R,2.3,M,A*28'
+    assert parse_line('$WIMWV,283.0,R,2.3,M,A*28') == {
+        'windDirection': 283.0, 'windSpeed': 2.3, 'reference': 'R', 'status': 'A'}
+
+
+def test_nmea_checksum_mismatch():
+    with pytest.raises(ParseError, match='checksum mismatch'):
+        parse_line('$WIMWV,283.0,R,2.3,M,A*2B')
+    with pytest.raises(ParseError, match='bad checksum field'):
+        parse_line('$WIMWV,283.0,R,2.3,M,A*ZZ')
+
+
+def test_nmea_without_checksum():
+    assert parse_line('$WIMWV,90.0,T,10,K,A')['windSpeed'] == pytest.approx(2.778)
+
+
+def test_nmea_void_and_empty_fields():
+    assert parse_line(nmea('WIMWV,,R,,M,V')) == {
+        'windDirection': None, 'windSpeed': None, 'reference': 'R', 'status': 'V'}
+
+
+@pytest.mark.parametrize('line, reason', [
+    (nmea('GPGGA,123519,4807.038,N'), 'unsupported sentence'),
+    (nmea('WIMWV,283.0,R,2.3'), 'truncated sentence'),
+    (nmea('WIMWV,283.0,R,2.3,X,A'), 'bad number or unit'),
+    (nmea('WIMWV,28x,R,2.3,M,A'), 'bad number or unit'),
+])
+def test_nmea_rejects(line, reason):
+    with pytest.raises(ParseError, match=reason):
+        parse_line(line)
+
+
+################################################
+# key=value
+################################################
+
+def test_key_values_with_units():
+    fields = parse_line('0R1,Dn=236D,Dm=283D,Dx=031D,Sn=0.0M,Sm=10.0K,Sx=4.0N')
+    assert fields == {'windDirectionMin': 236, 'windDirection': 283, 'windDirectionMax': 31,
+                      'windLull': 0.0, 'windSpeed': pytest.approx(2.778), 'windGust': pytest.approx(2.058),
+                      'status': 'A'}
+    assert parse_line('dir=283 speed=2.3 gust=4.0') == {
+        'windDirection': 283, 'windSpeed': 2.3, 'windGust': 4.0, 'status': 'A'}
+
+
+def test_hash_makes_the_reading_void():
+    fields = parse_line('0R1,Dm=283D,Sm=#M,Sx=2.2M')
+    assert fields['windSpeed'] is None
+    assert fields['windGust'] == 2.2
+    assert fields['status'] == 'V'
+    fields = parse_line('Dm=#D,Sm=1.0M')
+    assert (fields['windDirection'], fields['status']) == (None, 'V')
+
+
+@pytest.mark.parametrize('line, reason', [
+    ('speed=101', 'windSpeed out of range'),
+    ('gust=-1', 'windGust out of range'),
+    ('dir=361', 'windDirection out of range'),
+    ('Dx=400D,Sm=1.0M', 'windDirectionMax out of range'),
+    (nmea('WIMWV,283.0,R,500,M,A'), 'windSpeed out of range'),
+    ('speed=2.3Q', 'unknown speed unit Q'),
+    ('speed=M', 'bad value for speed'),
+    ('temp=21.5', 'no wind fields'),
+    ('hello', 'unknown format'),
+])
+def test_rejects(line, reason):
+    with pytest.raises(ParseError, match=reason):
+        parse_line(line)
+
+
+################################################
+# serial_log Stage
+################################################
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+        return True
+
+
+def test_stage_writes_rows_and_rejects_with_reasons():
+    writer = ListWriter()
+    stage = WindParserStage(writer, '/data/wind', '/data/wind_rejects.txt')
+    reader = SimpleNamespace(port='/dev/ttyUSB0')
+    stage(reader, '2024-12-17 04:55:00', ['$WIMWV,283.0,R,2.3,M,A*28', '$WIMWV,283.0,R,2.3,M,A*2B', 'hello'])
+
+    rows = [record for record in writer.records if record[0] == CSV_RECORD]
+    assert rows == [(CSV_RECORD, '/data/wind/windSensor_2024-12-17_04-00-00.csv', WIND_HEADERS,
+                     wind_row('2024-12-17 04:55:00', 'ttyUSB0', parse_line('$WIMWV,283.0,R,2.3,M,A*28')))]
+    rejects = [record for record in writer.records if record[0] == TXT_RECORD]
+    assert rejects == [(TXT_RECORD, '/data/wind_rejects.txt', None,
+                        '2024-12-17 04:55:00 - ttyUSB0 - checksum mismatch - $WIMWV,283.0,R,2.3,M,A*2B\n'
+                        '2024-12-17 04:55:00 - ttyUSB0 - unknown format - hello')]
+    assert stage.stats() == {'parsed': 1, 'rejected': 2, 'dropped': 0,
+                             'rejects_by_reason': {'checksum mismatch': 1, 'unknown format': 1}}